@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response
 import os
 import json
 import uuid
@@ -8,85 +8,33 @@ import sys
 import time
 import traceback
 from main import ArchitectureAISystem
+from utils.client_pool import get_client_pool
+from utils.event_bus import get_event_bus
+from utils.rate_limiter import get_rate_limiter_registry
+from utils.latency_tracker import get_latency_tracker
+from utils.json_repair import get_json_repairer
+from utils.session_store import get_session_store
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 # Store active sessions
 sessions = {}
-# Store session output queues
-output_queues = {}
+# Per-session event bus (LLM tokens, stage changes, progress, visualizations)
+event_bus = get_event_bus()
+# Seconds between SSE keep-alive comments
+SSE_HEARTBEAT_INTERVAL = 15
+# Seconds to wait after the last SSE client disconnects before dropping the session's event channel
+SSE_DISCONNECT_GRACE = 300
 
-class OutputCapture:
-    """Capture stdout to intercept terminal output from the system"""
-    def __init__(self, queue):
-        self.queue = queue
-        self.original_stdout = sys.stdout
+def publish_progress(session_id, progress, message):
+    """Report background-task progress to the session's event stream (and the server log)"""
+    print(message)
+    event_bus.publish(session_id, 'progress', {'progress': progress, 'message': message})
         
-    def write(self, text):
-        # Write to the original stdout
-        self.original_stdout.write(text)
-        # Also put in the queue for the web interface
-        if text.strip():  # Ignore empty lines
-            self.queue.put(text)
-            
-    def flush(self):
-        self.original_stdout.flush()
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/api/start', methods=['POST'])
-def start_session():
-    session_id = str(uuid.uuid4())
-    
-    # Create a queue for capturing output
-    output_queue = queue.Queue()
-    output_queues[session_id] = output_queue
-    
-    # Start the system in a background thread
-    def run_system():
-        # Capture system output
-        original_stdout = sys.stdout
-        sys.stdout = OutputCapture(output_queue)
-        
-        try:
-            # Initialize the system
-            system = ArchitectureAISystem()
-            sessions[session_id] = system
-            
-            # Signal that initialization is complete
-            output_queue.put("INIT_COMPLETE")
-        finally:
-            # Restore stdout
-            sys.stdout = original_stdout
-    
-    thread = threading.Thread(target=run_system)
-    thread.daemon = True
-    thread.start()
-    
-    # Wait for initialization to complete
-    try:
-        msg = output_queue.get(timeout=10)  # 10 second timeout
-        if msg == "INIT_COMPLETE":
-            pass  # Initialization completed successfully
-    except queue.Empty:
-        return jsonify({'error': 'Session initialization timed out'}), 500
-    
-    return jsonify({'session_id': session_id})
-
-@app.route('/api/check_visualization_files', methods=['GET'])
-def check_visualization_files():
-    session_id = request.args.get('session_id')
-    
-    if not session_id or session_id not in sessions:
-        return jsonify({'error': '无效的会话ID'}), 400
-    
-    system = sessions[session_id]
+def find_visualization_files(system):
+    """Collect the visualization image URLs that exist for a session"""
     session_dir = system.session_manager.get_session_dir()
     
-    print(f"检查可视化文件夹: {session_dir}")
-    
     files = {}
     
     # 检查特定文件是否存在
@@ -110,36 +58,67 @@ def check_visualization_files():
         files['layout'] = f'/sessions/{os.path.basename(session_dir)}/{layout_files[0]}'
         print(f"找到布局方案: {layout_files[0]}")
     
+    return files
+
+def close_session(session_id):
+    """Forget a session the browser has left and drop its event channel"""
+    if session_id and sessions.pop(session_id, None) is not None:
+        event_bus.close_channel(session_id)
+
+def close_channel_when_idle(session_id):
+    """Drop the session's event channel if no SSE client reconnected during the grace period"""
+    def close():
+        if event_bus.close_channel_if_idle(session_id):
+            print(f"Closed idle event channel of session {session_id}")
+    timer = threading.Timer(SSE_DISCONNECT_GRACE, close)
+    timer.daemon = True
+    timer.start()
+
+def publish_visualization(session_id, system):
+    """Tell the session's event stream that visualization files are ready"""
+    event_bus.publish(session_id, 'visualization', {'files': find_visualization_files(system)})
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/api/start', methods=['POST'])
+def start_session():
+    session_id = str(uuid.uuid4())
+    
+    try:
+        # Initialize the system; LLM output and stage changes go to this session's event channel
+        system = ArchitectureAISystem(event_channel=session_id)
+        sessions[session_id] = system
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'Session initialization failed: {str(e)}'}), 500
+    
+    # The page has left its previous session, if any
+    close_session((request.get_json(silent=True) or {}).get('previous_session_id'))
+    
+    return jsonify({'session_id': session_id})
+
+@app.route('/api/check_visualization_files', methods=['GET'])
+def check_visualization_files():
+    session_id = request.args.get('session_id')
+    
+    if not session_id or session_id not in sessions:
+        return jsonify({'error': '无效的会话ID'}), 400
+    
+    system = sessions[session_id]
+    
+    print(f"检查可视化文件夹: {system.session_manager.get_session_dir()}")
+    
+    files = find_visualization_files(system)
+    
     return jsonify({'files': files if files else None})
 
 @app.route('/api/list_sessions', methods=['GET'])
 def list_sessions():
     """List all available sessions in reverse chronological order (newest first)"""
-    sessions_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions')
-    
-    if not os.path.exists(sessions_dir):
-        return jsonify({'sessions': []})
-    
-    # Get all session directories
-    session_dirs = []
-    for item in os.listdir(sessions_dir):
-        item_path = os.path.join(sessions_dir, item)
-        if os.path.isdir(item_path):
-            # Check if it contains session_record.json to confirm it's a valid session
-            if os.path.exists(os.path.join(item_path, 'session_record.json')):
-                # Get directory creation time for sorting
-                try:
-                    creation_time = os.path.getctime(item_path)
-                    session_dirs.append((item, creation_time))
-                except:
-                    # If can't get creation time, use 0 (will be at the end)
-                    session_dirs.append((item, 0))
-    
-    # Sort by creation time (newest first)
-    session_dirs.sort(key=lambda x: x[1], reverse=True)
-    
-    # Return just the directory names
-    return jsonify({'sessions': [s[0] for s in session_dirs]})
+    # The SQLite store answers from an index; the file store walks the sessions directory
+    return jsonify({'sessions': get_session_store().list_sessions()})
 
 @app.route('/api/resume', methods=['POST'])
 def resume_session():
@@ -161,38 +140,16 @@ def resume_session():
     
     session_id = str(uuid.uuid4())
     
-    # Create a queue for capturing output
-    output_queue = queue.Queue()
-    output_queues[session_id] = output_queue
-    
-    # Start the system in a background thread
-    def run_system():
-        # Capture system output
-        original_stdout = sys.stdout
-        sys.stdout = OutputCapture(output_queue)
-        
-        try:
-            # Initialize the system with resumed session
-            system = ArchitectureAISystem(resume_session_path=full_path)
-            sessions[session_id] = system
-            
-            # Signal that initialization is complete
-            output_queue.put("INIT_COMPLETE")
-        finally:
-            # Restore stdout
-            sys.stdout = original_stdout
-    
-    thread = threading.Thread(target=run_system)
-    thread.daemon = True
-    thread.start()
-    
-    # Wait for initialization to complete
     try:
-        msg = output_queue.get(timeout=10)  # 10 second timeout
-        if msg == "INIT_COMPLETE":
-            pass  # Initialization completed successfully
-    except queue.Empty:
-        return jsonify({'error': 'Session initialization timed out'}), 500
+        # Initialize the system with resumed session
+        system = ArchitectureAISystem(resume_session_path=full_path, event_channel=session_id)
+        sessions[session_id] = system
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'Session initialization failed: {str(e)}'}), 500
+    
+    # The page has left its previous session, if any
+    close_session(data.get('previous_session_id'))
     
     return jsonify({'session_id': session_id})
 
@@ -206,7 +163,6 @@ def chat():
         return jsonify({'error': 'Invalid session'}), 400
     
     system = sessions[session_id]
-    output_queue = output_queues[session_id]
     
     # Get current stage before processing input
     current_stage = system.workflow_manager.get_current_stage()
@@ -268,6 +224,7 @@ def chat():
                             f"constraints_visualization_refined_{system.workflow_manager.current_iteration}.png"
                         )
                     )
+                    publish_visualization(session_id, system)
                     
                     response_queue.put({
                         'response': "Constraints refined based on your feedback.",
@@ -343,21 +300,21 @@ def chat():
             if new_stage == system.workflow_manager.STAGE_CONSTRAINT_GENERATION:
                 # Launch constraint generation in a background thread
                 def generate_constraints():
-                    # Report progress via stdout (which is captured by OutputCapture)
-                    print("Starting constraint generation process...")
+                    # Report progress to the session's event stream
+                    publish_progress(session_id, 10, "Starting constraint generation process...")
                     
                     # Generate constraints
                     try:
                         # Generate constraints
                         system.finalize_constraints()
                         
-                        print("Constraint generation complete! Moving to visualization stage...")
+                        publish_progress(session_id, 70, "Constraint generation complete! Moving to visualization stage...")
                         
                         # Move to visualization stage
                         system.workflow_manager.advance_to_next_stage()
                         
                         # Visualization will happen automatically in the next stage
-                        print("Generating constraint visualizations...")
+                        publish_progress(session_id, 80, "Generating constraint visualizations...")
                         
                         try:
                             # We need to explicitly call visualization here since the main loop won't do it
@@ -367,7 +324,8 @@ def chat():
                                 output_path=output_dir
                             )
                             
-                            print(f"Visualization complete! Files created at: {output_dir}")
+                            publish_progress(session_id, 100, f"Visualization complete! Files created at: {output_dir}")
+                            publish_visualization(session_id, system)
                             
                             # Advance to refinement stage after a delay to allow frontend to update
                             time.sleep(2)
@@ -376,10 +334,12 @@ def chat():
                         except Exception as viz_error:
                             print(f"Error during visualization: {str(viz_error)}")
                             traceback.print_exc()
+                            event_bus.publish(session_id, 'task_error', {'message': f"Error during visualization: {str(viz_error)}"})
                             
                     except Exception as e:
                         print(f"Error in constraint generation: {str(e)}")
                         traceback.print_exc()
+                        event_bus.publish(session_id, 'task_error', {'message': f"Error in constraint generation: {str(e)}"})
                 
                 threading.Thread(target=generate_constraints, daemon=True).start()
             
@@ -387,7 +347,7 @@ def chat():
             elif new_stage == system.workflow_manager.STAGE_SOLUTION_GENERATION:
                 # Launch solution generation in a background thread
                 def generate_solution():
-                    print("Starting solution generation process...")
+                    publish_progress(session_id, 10, "Starting solution generation process...")
                     
                     # Generate solution
                     system.current_solution = system.call_solver(system.constraints_all)
@@ -398,7 +358,7 @@ def chat():
                         {"solution": system.current_solution}
                     )
                     
-                    print("Solution generation complete! Moving to refinement stage...")
+                    publish_progress(session_id, 100, "Solution generation complete! Moving to refinement stage...")
                     
                     # Move to refinement stage
                     system.workflow_manager.advance_to_next_stage()
@@ -420,24 +380,12 @@ def get_state():
     system = sessions[session_id]
     current_stage = system.workflow_manager.get_current_stage()
     
-    # Check for constraint generation progress (simulated in this example)
+    # Latest constraint generation progress reported on the event stream
     constraint_progress = None
     if current_stage == system.workflow_manager.STAGE_CONSTRAINT_GENERATION:
-        # For now, we'll simulate progress. In a real implementation,
-        # you'd need to track this in your main system logic.
-        output_queue = output_queues.get(session_id)
-        if output_queue and not output_queue.empty():
-            # Check if there's any output about generation progress
-            try:
-                while not output_queue.empty():
-                    message = output_queue.get_nowait()
-                    if "generating" in message.lower() or "processing" in message.lower():
-                        constraint_progress = {
-                            'message': message,
-                            'progress': 50  # Simulate 50% progress
-                        }
-            except:
-                pass
+        progress_event = event_bus.last_event(session_id, 'progress')
+        if progress_event:
+            constraint_progress = progress_event['data']
     
     # Determine if all key questions are known
     all_key_questions_known = False
@@ -451,7 +399,9 @@ def get_state():
         'spatial_understanding_record': system.spatial_understanding_record,
         'key_questions': system.key_questions,
         'all_key_questions_known': all_key_questions_known,
-        'constraint_progress': constraint_progress
+        'constraint_progress': constraint_progress,
+        # Prompt-size savings of the bounded conversation context in the latest turn
+        'context_stats': system.unified_processor.context.last_stats
     })
 
 @app.route('/api/visualize', methods=['GET'])
@@ -479,6 +429,78 @@ def get_visualization():
     print(f"找到 {len(visualizations)} 个可视化图片")
     
     return jsonify({'visualizations': visualizations})
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events stream of a session's LLM tokens, stage changes, progress and visualizations"""
+    session_id = request.args.get('session_id')
+    
+    if not session_id or session_id not in sessions:
+        return jsonify({'error': 'Invalid session'}), 400
+    
+    # EventSource sends Last-Event-ID when reconnecting; replay what was missed
+    last_event_id = request.headers.get('Last-Event-ID')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    subscriber = event_bus.subscribe(session_id, last_event_id)
+    
+    def generate():
+        try:
+            # Tell the client where the workflow currently is
+            system = sessions[session_id]
+            yield format_sse('stage', {
+                'current_stage': system.workflow_manager.get_current_stage(),
+                'stage_description': system.workflow_manager.get_stage_description(),
+                'iteration': system.workflow_manager.current_iteration
+            })
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    # Keep-alive comment so proxies don't close the idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_sse(event['type'], event['data'], event['id'])
+        finally:
+            event_bus.unsubscribe(session_id, subscriber)
+            close_channel_when_idle(session_id)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def format_sse(event_type, data, event_id=None):
+    """Format one Server-Sent Events message"""
+    message = ''
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    message += f'event: {event_type}\n'
+    message += f'data: {json.dumps(data, ensure_ascii=False)}\n\n'
+    return message
+
+@app.route('/api/llm_pool_stats', methods=['GET'])
+def get_llm_pool_stats():
+    """Report utilisation of the shared LLM client pool (process-wide, all sessions)"""
+    return jsonify(get_client_pool().get_stats())
+
+@app.route('/api/llm_rate_limits', methods=['GET'])
+def get_llm_rate_limits():
+    """Report per-model rate limiter state: throttling, queue-wait percentiles, circuit breaker"""
+    return jsonify(get_rate_limiter_registry().get_stats())
+
+@app.route('/api/llm_latency', methods=['GET'])
+def get_llm_latency():
+    """Report per-model TTFT/latency percentiles and the current hedge thresholds"""
+    return jsonify(get_latency_tracker().get_stats())
+
+@app.route('/api/json_repair_stats', methods=['GET'])
+def get_json_repair_stats():
+    """Report per-model JSON parse, local repair and re-ask rates"""
+    return jsonify(get_json_repairer().get_stats())
+
 @app.route('/sessions/<path:path>')
 def serve_session_file(path):
     sessions_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions')
@@ -506,23 +528,24 @@ def skip_stage():
     if new_stage == system.workflow_manager.STAGE_CONSTRAINT_GENERATION:
         # Launch constraint generation in a background thread
         def generate_constraints():
-            print("Skip triggered constraint generation...")
+            publish_progress(session_id, 10, "Skip triggered constraint generation...")
             try:
                 system.finalize_constraints()
-                print("Constraint generation complete!")
+                publish_progress(session_id, 70, "Constraint generation complete!")
                 system.workflow_manager.advance_to_next_stage()
                 
                 viz_stage = system.workflow_manager.get_current_stage()
                 print(f"Now in stage: {viz_stage}")
                 
                 # Generate visualization
-                print("Generating visualization...")
+                publish_progress(session_id, 80, "Generating visualization...")
                 output_dir = os.path.join(system.session_manager.get_session_dir(), "constraints_visualization.png")
                 system.constraint_visualization.visualize_constraints(
                     system.constraints_all,
                     output_path=output_dir
                 )
-                print(f"Visualization complete! Files created at: {output_dir}")
+                publish_progress(session_id, 100, f"Visualization complete! Files created at: {output_dir}")
+                publish_visualization(session_id, system)
                 
                 # Wait briefly to allow frontend to update
                 time.sleep(2)
@@ -534,6 +557,7 @@ def skip_stage():
             except Exception as e:
                 print(f"Error in constraint generation after skip: {str(e)}")
                 traceback.print_exc()
+                event_bus.publish(session_id, 'task_error', {'message': f"Error in constraint generation: {str(e)}"})
         
         threading.Thread(target=generate_constraints, daemon=True).start()
     
@@ -541,19 +565,20 @@ def skip_stage():
         # Launch solution generation in a background thread
         def generate_solution():
             try:
-                print("Skip triggered solution generation...")
+                publish_progress(session_id, 10, "Skip triggered solution generation...")
                 system.current_solution = system.call_solver(system.constraints_all)
                 system.session_manager.add_intermediate_state(
                     f"solution_generation_{system.workflow_manager.current_iteration}",
                     {"solution": system.current_solution}
                 )
-                print("Solution generation complete!")
+                publish_progress(session_id, 100, "Solution generation complete!")
                 system.workflow_manager.advance_to_next_stage()
                 refinement_stage = system.workflow_manager.get_current_stage()
                 print(f"Advanced to solution refinement stage: {refinement_stage}")
             except Exception as e:
                 print(f"Error in solution generation after skip: {str(e)}")
                 traceback.print_exc()
+                event_bus.publish(session_id, 'task_error', {'message': f"Error in solution generation: {str(e)}"})
         
         threading.Thread(target=generate_solution, daemon=True).start()
     
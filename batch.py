@@ -0,0 +1,334 @@
+"""
+离线批处理入口：对大量项目的设计需求非交互地执行 统一处理 → 约束条件生成 → 求解器 流程
+
+用法示例：
+    python batch.py --input briefs/ --output results.jsonl --workers 8
+    python batch.py --input briefs.jsonl --output results.jsonl --provider-batch
+
+输入为目录（每个*.json文件一条记录）或JSONL文件（每行一条记录），记录格式与input.json相同：
+{"spatial_info": "...", "user_requirement": "..."}，可选"id"字段作为记录标识。
+结果逐条追加到输出JSONL中；检查点文件记录已完成的记录，中断后重新运行会跳过这些记录。
+重新运行时先整理输出文件：已写入成功结果但未记入检查点的记录补记为已完成，将要重试的记录之前的失败结果被删除，
+每条记录在输出文件中只保留一行。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from main import ArchitectureAISystem
+from config import BATCH_SETTINGS
+from utils.batch_api import BatchCollector
+from utils.event_bus import get_event_bus
+from utils.llm_replay import configure_replay
+
+# 加载环境变量（包括OpenAI API密钥）
+load_dotenv()
+
+
+def load_records(input_path):
+    """加载批处理输入记录
+    
+    Args:
+        input_path (str): 输入目录或JSONL文件路径
+    
+    Returns:
+        list: 记录列表，每项为(记录标识, 记录内容)
+    """
+    records = []
+    if os.path.isdir(input_path):
+        for name in sorted(os.listdir(input_path)):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(input_path, name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            records.append((str(data.get('id') or os.path.splitext(name)[0]), data))
+    else:
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                records.append((str(data.get('id') or line_no), data))
+    return records
+
+
+class BatchCheckpoint:
+    """
+    检查点文件：每行一个已完成的记录标识，追加写入并立即落盘，进程被杀死后也不会丢失已完成的记录
+    """
+    
+    def __init__(self, path):
+        """初始化检查点，读取已完成的记录
+        
+        Args:
+            path (str): 检查点文件路径
+        """
+        self.path = path
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.completed = {line.strip() for line in f if line.strip()}
+        self._lock = threading.Lock()
+    
+    def mark_done(self, record_id):
+        """记录一条已完成的记录
+        
+        Args:
+            record_id (str): 记录标识
+        """
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(record_id + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.completed.add(record_id)
+
+
+class BatchRunner:
+    """
+    批处理执行器：使用线程池并发处理记录，结果逐条写入输出JSONL
+    """
+    
+    def __init__(self, output_path, checkpoint_path, workers, if_rooms_constraints=False, collector=None):
+        """初始化执行器
+        
+        Args:
+            output_path (str): 输出JSONL文件路径
+            checkpoint_path (str): 检查点文件路径
+            workers (int): 工作线程数
+            if_rooms_constraints (bool): 是否使用rooms格式约束条件
+            collector (BatchCollector, optional): 提供商批处理请求收集器
+        """
+        self.output_path = output_path
+        self.checkpoint = BatchCheckpoint(checkpoint_path)
+        self.workers = workers
+        self.if_rooms_constraints = if_rooms_constraints
+        self.collector = collector
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self._output_lock = threading.Lock()
+    
+    def run(self, records):
+        """处理所有未完成的记录
+        
+        Args:
+            records (list): 记录列表，每项为(记录标识, 记录内容)
+        
+        Returns:
+            dict: 统计信息（总数、跳过、成功、失败）
+        """
+        self._reconcile_output(records)
+        pending = [(record_id, data) for record_id, data in records if record_id not in self.checkpoint.completed]
+        stats = {'total': len(records), 'skipped': len(records) - len(pending), 'succeeded': 0, 'failed': 0}
+        print(f"共{stats['total']}条记录，已完成{stats['skipped']}条，待处理{len(pending)}条")
+        
+        if self.collector is not None:
+            for _ in pending:
+                self.collector.begin_record()
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.process_record, record_id, data) for record_id, data in pending]
+            for future in as_completed(futures):
+                result = future.result()
+                stats['succeeded' if result['status'] == 'success' else 'failed'] += 1
+                done = stats['succeeded'] + stats['failed']
+                print(f"[{done}/{len(pending)}] {result['id']}: {result['status']}，耗时{result['timing']['total']}秒")
+        
+        return stats
+    
+    def process_record(self, record_id, data):
+        """处理单条记录并写入结果
+        
+        Args:
+            record_id (str): 记录标识
+            data (dict): 记录内容
+        
+        Returns:
+            dict: 写入输出文件的结果
+        """
+        try:
+            result = self._run_pipeline(record_id, data)
+        finally:
+            if self.collector is not None:
+                self.collector.end_record()
+        
+        self._write_result(result)
+        # 只有成功的记录写入检查点，失败的记录在下次运行时重试
+        if result['status'] == 'success':
+            self.checkpoint.mark_done(record_id)
+        return result
+    
+    def _run_pipeline(self, record_id, data):
+        """非交互地执行 统一处理 → 约束条件生成 → 求解器 流程
+        
+        Args:
+            record_id (str): 记录标识
+            data (dict): 记录内容
+        
+        Returns:
+            dict: 结果，包含约束条件、布局方案和各步骤耗时
+        """
+        timing = {}
+        start = time.perf_counter()
+        result = {'id': record_id, 'status': 'success', 'timing': timing}
+        # LLM输出发布到独立的事件频道，避免多个记录的流式输出在终端中交错
+        event_channel = f"batch-{self.run_id}-{record_id}"
+        try:
+            system = ArchitectureAISystem(
+                input_file=None,
+                if_rooms_constraints=self.if_rooms_constraints,
+                event_channel=event_channel,
+                session_id=f"batch_{self.run_id}_{record_id}"
+            )
+            if self.collector is not None:
+                system.openai_client.set_batch_collector(self.collector)
+            # 批处理在统一处理后立即生成约束条件，后台草稿不会提前完成，只会多占一个线程
+            system.constraint_drafter = None
+            result['session_dir'] = system.session_manager.get_session_dir()
+            
+            # 步骤1：统一处理初始输入，得到空间理解、需求猜测和关键问题
+            user_input = system.format_initial_input(data)
+            system.session_manager.add_user_input(user_input)
+            step_start = time.perf_counter()
+            next_question = system.process_user_input(user_input)
+            system.session_manager.add_system_response(next_question)
+            timing['process'] = round(time.perf_counter() - step_start, 3)
+            
+            # 步骤2：生成约束条件
+            step_start = time.perf_counter()
+            constraints = system.finalize_constraints()
+            timing['constraints'] = round(time.perf_counter() - step_start, 3)
+            
+            # 步骤3：调用求解器
+            step_start = time.perf_counter()
+            solution = system.call_solver(constraints)
+            timing['solver'] = round(time.perf_counter() - step_start, 3)
+            
+            system.session_manager.add_intermediate_state("solution_generation_0", {"solution": solution})
+            system.session_manager.set_final_result({"constraints": constraints, "solution": solution})
+            
+            result.update({
+                'spatial_understanding': system.spatial_understanding_record,
+                'user_requirement_guess': system.user_requirement_guess,
+                'key_questions': system.key_questions,
+                'constraints': constraints,
+                'solution': solution,
+                'tokens_used': system.session_manager.session_record['tokens_used']
+            })
+        except Exception as e:
+            result['status'] = 'error'
+            result['error'] = f"{type(e).__name__}: {str(e)}"
+        finally:
+            get_event_bus().close_channel(event_channel)
+        timing['total'] = round(time.perf_counter() - start, 3)
+        return result
+    
+    def _reconcile_output(self, records):
+        """按记录标识整理上次运行的输出文件，避免重新运行时出现重复的结果行
+        
+        结果写入输出文件后、记入检查点前进程被杀死时，该记录的成功结果已经在输出文件中，补记到检查点而不是重新处理；
+        将要重试的记录之前写入的失败结果删除，重试后只保留新的结果；同一记录的多个成功结果只保留第一个
+        
+        Args:
+            records (list): 本次运行的记录列表，每项为(记录标识, 记录内容)
+        """
+        if not os.path.exists(self.output_path):
+            return
+        rows = []
+        with open(self.output_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 写入中途被杀死留下的不完整的最后一行
+                continue
+        
+        for row in rows:
+            if row.get('status') == 'success' and row.get('id') not in self.checkpoint.completed:
+                self.checkpoint.mark_done(row['id'])
+        retry_ids = {record_id for record_id, _ in records} - self.checkpoint.completed
+        kept = []
+        succeeded = set()
+        for row in rows:
+            if row.get('id') in retry_ids:
+                continue
+            if row.get('status') == 'success':
+                if row.get('id') in succeeded:
+                    continue
+                succeeded.add(row.get('id'))
+            kept.append(row)
+        if len(kept) == len(lines):
+            return
+        
+        tmp_path = f"{self.output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row in kept:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.output_path)
+        print(f"整理输出文件：删除了{len(rows) - len(kept)}条重复或将要重试的结果")
+    
+    def _write_result(self, result):
+        """追加一条结果到输出JSONL并立即落盘
+        
+        Args:
+            result (dict): 结果
+        """
+        line = json.dumps(result, ensure_ascii=False)
+        with self._output_lock:
+            with open(self.output_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='建筑布局设计AI系统 - 离线批处理')
+    parser.add_argument('--input', type=str, required=True, help='输入目录（*.json）或JSONL文件')
+    parser.add_argument('--output', type=str, default='batch_results.jsonl', help='输出JSONL文件路径')
+    parser.add_argument('--checkpoint', type=str, default=None, help='检查点文件路径，默认为输出文件路径加.checkpoint')
+    parser.add_argument('--workers', type=int, default=BATCH_SETTINGS["workers"], help='同时处理的记录数')
+    parser.add_argument('--provider-batch', action='store_true',
+                        help='对支持的模型使用提供商批处理接口（价格更低，但每个步骤需等待整个批次完成）')
+    parser.add_argument('--if_rooms_constraints', type=bool, default=False, help='是否使用rooms格式约束条件')
+    parser.add_argument('--replay', type=str, nargs='+', help='回放录制的LLM调用（会话目录或sessions目录），用于离线基准测试')
+    parser.add_argument('--replay-latency', action='store_true', help='回放时按录制的首token时间和总耗时模拟延迟')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    
+    if args.replay:
+        configure_replay(args.replay, {"simulate_latency": args.replay_latency})
+    
+    records = load_records(args.input)
+    workers = args.workers
+    collector = None
+    if args.provider_batch:
+        collector = BatchCollector()
+        # 每条记录的各步骤依次执行，所有记录同时处理才能让同一步骤的请求合并进同一个批次，
+        # 记录数超过线程数时，未开始的记录会让批次等待到收集窗口结束
+        workers = max(workers, min(len(records), BATCH_SETTINGS["max_batch_size"]))
+    
+    runner = BatchRunner(
+        args.output,
+        args.checkpoint or args.output + '.checkpoint',
+        workers,
+        if_rooms_constraints=args.if_rooms_constraints,
+        collector=collector
+    )
+    stats = runner.run(records)
+    if collector is not None:
+        collector.close()
+    print(f"批处理完成：成功{stats['succeeded']}条，失败{stats['failed']}条，跳过{stats['skipped']}条")
+    sys.exit(1 if stats['failed'] else 0)
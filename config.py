@@ -7,6 +7,9 @@ FORCE_JSON_OUTPUT = True
 RESPONSE_FORMAT = "json"
 
 # 可用的LLM模型配置
+# OpenAI兼容模型可设置"stream_usage": False，用于不支持stream_options参数的接口（此时用本地分词器统计token）
+# rpm/tpm/max_concurrency为该模型的每分钟请求数、每分钟token数和最大并发数，未设置时使用RATE_LIMIT_SETTINGS中的默认值
+# "batch_api": True表示提供商支持批处理接口（OpenAI Batch API / Anthropic Message Batches），批处理模式下可使用
 AVAILABLE_MODELS = {
     # 腾讯云deepseek-v3
     "deepseek-v3": {
@@ -14,7 +17,10 @@ AVAILABLE_MODELS = {
         "model": "deepseek-v3",
         "base_url": "https://api.lkeap.cloud.tencent.com/v1",
         "api_key_env": "TENCENT_DEEPSEEK_API_KEY",
-        "max_tokens": 2000
+        "max_tokens": 2000,
+        "rpm": 60,
+        "tpm": 200000,
+        "max_concurrency": 10
         },
     # 腾讯云deepseek-r1
     "deepseek-r1": {
@@ -23,7 +29,10 @@ AVAILABLE_MODELS = {
         "base_url": "https://api.lkeap.cloud.tencent.com/v1",
         "api_key_env": "TENCENT_DEEPSEEK_API_KEY",
         "max_tokens": 2000,
-        "temperature": 0.7
+        "temperature": 0.7,
+        "rpm": 30,
+        "tpm": 100000,
+        "max_concurrency": 5
     },
     
     # OpenAI模型
@@ -33,7 +42,11 @@ AVAILABLE_MODELS = {
         "base_url": "https://api.openai.com/v1",
         "api_key_env": "OPENAI_API_KEY",
         "max_tokens": 2000,
-        "temperature": 0.7
+        "temperature": 0.7,
+        "rpm": 500,
+        "tpm": 30000,
+        "max_concurrency": 20,
+        "batch_api": True
     },
     "gpt-4-turbo": {
         "type": "openai",
@@ -41,7 +54,11 @@ AVAILABLE_MODELS = {
         "base_url": "https://api.openai.com/v1",
         "api_key_env": "OPENAI_API_KEY",
         "max_tokens": 2000,
-        "temperature": 0.7
+        "temperature": 0.7,
+        "rpm": 500,
+        "tpm": 30000,
+        "max_concurrency": 20,
+        "batch_api": True
     },
     # 其他公司的兼容OpenAI API的模型，例如Claude
     "claude-3-opus": {
@@ -51,10 +68,81 @@ AVAILABLE_MODELS = {
         "api_key_env": "ANTHROPIC_API_KEY",
         "max_tokens": 2000,
         "temperature": 0.7,
-        "api_version": "2023-06-01"
+        "api_version": "2023-06-01",
+        "rpm": 50,
+        "tpm": 40000,
+        "max_concurrency": 10,
+        "batch_api": True
     }
 }
 
+# LLM客户端连接池设置（同一进程内所有ArchitectureAISystem实例共享）
+CLIENT_POOL_SETTINGS = {
+    "max_connections": 100,  # 每个提供商端点的最大连接数
+    "max_keepalive_connections": 20,  # 保持活跃的空闲连接数
+    "keepalive_expiry": 30.0,  # 空闲连接保持时间（秒）
+    "timeout": 120.0,  # 请求超时时间（秒）
+    "connect_timeout": 10.0  # 建立连接的超时时间（秒）
+}
+
+# LLM调用限流默认设置（按模型共享，AVAILABLE_MODELS中的rpm/tpm/max_concurrency优先）
+RATE_LIMIT_SETTINGS = {
+    "rpm": 60,  # 每分钟请求数
+    "tpm": 100000,  # 每分钟token数（提示词 + 生成）
+    "max_concurrency": 8,  # 同一模型的最大并发请求数
+    "acquire_timeout": 120.0,  # 等待调用配额的最长时间（秒）
+    "poll_interval": 0.05,  # 等待并发名额时的轮询间隔（秒）
+    "max_retries": 4,  # 限流、服务端错误、超时的最大重试次数
+    "backoff_base": 1.0,  # 指数退避的基础等待时间（秒）
+    "backoff_max": 30.0,  # 单次退避的最长等待时间（秒）
+    "breaker_failure_threshold": 5,  # 连续失败多少次后熔断
+    "breaker_recovery_timeout": 30.0  # 熔断多少秒后放行试探请求
+}
+
+# 对冲请求设置：主模型迟迟没有首token时，向备用模型发出相同请求，取先响应的一方
+HEDGE_SETTINGS = {
+    "secondary_models": {  # 主模型 -> 备用模型，未配置时自动选择已配置密钥、首token最快的其他模型
+        "deepseek-v3": "gpt-4o"
+    },
+    "percentile": 95,  # 使用主模型首token时间的该分位数作为触发阈值
+    "min_samples": 20,  # 样本数不足时使用默认阈值
+    "default_delay": 3.0,  # 默认触发阈值（秒）
+    "min_delay": 0.5,  # 触发阈值下限（秒）
+    "max_delay": 15.0  # 触发阈值上限（秒）
+}
+
+# LLM响应缓存设置（内存LRU + 磁盘缓存），是否使用缓存由各调用处决定
+LLM_CACHE_SETTINGS = {
+    "enabled": True,
+    "memory_max_entries": 256,  # 内存层最多缓存的响应条数
+    "disk_dir": "cache/llm_responses",  # 磁盘缓存目录（相对项目根目录）
+    "disk_max_bytes": 200 * 1024 * 1024,  # 磁盘缓存总大小上限
+    "ttl_seconds": 7 * 24 * 3600,  # 缓存有效期（秒）
+    "sweep_interval": 100  # 每写入多少条后完整扫描一次磁盘缓存目录
+}
+
+# 离线批处理设置（batch.py）
+BATCH_SETTINGS = {
+    "workers": 4,  # 同时处理的记录数
+    "collect_window": 5.0,  # 使用提供商批处理接口时，收集请求的最长等待时间（秒）
+    "max_batch_size": 1000,  # 单个提供商批次的最大请求数
+    "poll_interval": 30.0,  # 查询批次状态的间隔（秒）
+    "completion_window": "24h",  # OpenAI批次的完成时限
+    "max_wait": 24 * 3600  # 等待批次完成的最长时间（秒）
+}
+
+# LLM回放设置：从已录制的会话（sessions/<id>/llm_outputs/）中按提示词返回响应，无需网络即可复现和压测整个流程
+LLM_REPLAY_SETTINGS = {
+    "sources": [],  # 会话目录、sessions根目录或llm_output.json文件，为空时不回放（也可通过--replay参数指定）
+    "match_model": True,  # 是否要求录制的模型与本次调用一致
+    "fuzzy_threshold": 0.9,  # 没有完全相同的提示词时，相似度不低于该值的录制视为匹配；None表示只做精确匹配
+    "fuzzy_candidates": 8,  # 模糊匹配时最多比较的录制数（固定前缀相同、长度最接近的优先）
+    "fuzzy_cache_size": 1024,  # 缓存模糊匹配结果的提示词数
+    "simulate_latency": False,  # 是否按录制的首token时间和总耗时输出
+    "time_scale": 1.0,  # 模拟延迟的倍率，小于1时加速回放
+    "chunk_chars": 8  # 回放时每个流式片段的字符数
+}
+
 # 为每个模块指定默认模型（可根据需要修改）
 # 默认模型
 DEFAULT_MODEL = "deepseek-v3"
@@ -63,22 +151,119 @@ REQUIREMENT_ANALYSIS_MODEL = DEFAULT_MODEL  # 需求分析模块使用的模型
 QUESTION_GENERATION_MODEL = DEFAULT_MODEL  # 提问生成模块使用的模型
 CONSTRAINT_QUANTIFICATION_MODEL = DEFAULT_MODEL  # 约束量化模块使用的模型
 
+# rooms格式约束条件的分组并行优化：房间较多时按连接/相邻关系把房间分成若干组，各组并行调用LLM优化，
+# 每次调用的输出长度随组的大小而不是房间总数增长，合并后统一整理跨组的关系
+ROOMS_OPTIMIZATION_FANOUT = {
+    "enabled": True,
+    "min_rooms": 10,  # 房间数达到该数量时才分组，否则仍一次优化全部房间
+    "max_rooms_per_cluster": 6,  # 每组最多的房间数
+    "max_workers": 4  # 同时进行的优化调用数
+}
+
 # 每个模块的个性化设置
 SPATIAL_UNDERSTANDING_TEMPERATURE = 0.7
 REQUIREMENT_ANALYSIS_TEMPERATURE = 0.7
 QUESTION_GENERATION_TEMPERATURE = 0.7
 CONSTRAINT_QUANTIFICATION_TEMPERATURE = 0.5  # 约束量化需要更精确，所以温度稍低
 
+# 各模块是否使用LLM响应缓存（相同提示词直接复用结果）
+QUESTION_GENERATION_USE_CACHE = False  # 提问需要随对话变化，不使用缓存
+CONSTRAINT_QUANTIFICATION_USE_CACHE = True  # 约束量化温度较低，相同需求可复用结果
+CONSTRAINT_REFINEMENT_USE_CACHE = True  # 用户重复发送相同反馈时复用结果
+
+# 交互式提问是否启用对冲请求（会额外消耗备用模型的token）
+QUESTION_GENERATION_HEDGE = False
+
+# 统一处理模块的对话上下文：最近几轮问答原样保留，更早的问答在后台滚动压缩为摘要
+CONVERSATION_CONTEXT_SETTINGS = {
+    "recent_turns": 4,  # 原样保留的最近问答轮数（一问一答为一轮）
+    "max_history_tokens": 2000,  # 对话记录部分（摘要 + 问答）的token预算
+    "summary_max_chars": 600,  # 摘要的最大字数
+    "summary_model": DEFAULT_MODEL,  # 生成摘要使用的模型
+    "background": True  # 是否在后台线程中更新摘要（不阻塞当前轮的提问）
+}
+
+# 约束条件草稿：需求收集阶段只剩少量关键问题未知时，在后台根据当前需求猜测提前生成约束条件；
+# 进入约束条件生成阶段时，需求猜测和空间理解没有变化则直接使用草稿，有变化则在草稿基础上按变化优化
+CONSTRAINT_DRAFT_SETTINGS = {
+    "enabled": True,
+    "remaining_questions": 1,  # 未知的关键问题不超过该数量时开始生成草稿
+    "refine_on_change": True,  # 需求有变化时是否在草稿基础上优化（False则丢弃草稿重新生成）
+    "wait_timeout": 180  # 进入约束条件生成阶段时等待进行中的草稿的最长秒数
+}
+
+# 需求收集最后一轮合并约束条件量化：未知的关键问题不超过remaining_questions个时，
+# 统一处理的提示词中附带约束条件模板，模型判断所有问题都已知时在同一次响应中给出约束条件
+# 附带约束条件的调用使用约束量化的模型和温度，且不启用对冲请求；约束条件被截断时按未生成处理，进入约束条件生成阶段时重新生成
+FINAL_TURN_CONSTRAINTS = {
+    "enabled": True,
+    "remaining_questions": 1,
+    "max_tokens": 6000  # 响应中同时包含问答更新和约束条件，需要比默认值更多的生成令牌
+}
+
+# LLM输出的JSON修复：解析失败时先在本地修复（去除代码块标记、删除注释和多余逗号、补全被截断的输出等），
+# 本地修复失败时才带上错误信息重新请求一次
+JSON_REPAIR_SETTINGS = {
+    "enabled": True,
+    "reask": True  # 本地修复失败时是否重新请求一次
+}
+
+# 会话日志的写入方式：对话、调试日志、LLM调用、模块历史和会话记录的新内容逐行追加到同名的.jsonl文件，
+# 每次写入的开销与会话长度无关；追加compact_every条后合并回可读的JSON文件（会话结束时也会合并）
+SESSION_LOG_SETTINGS = {
+    "compact_every": 50  # 0表示只在会话结束时合并
+}
+
+# 会话文件的延迟写入：请求线程只把写操作放入队列，后台线程等待flush_interval秒后把窗口内的操作合并写入，
+# 同一文件连续的整文件写入只执行最后一次；整文件写入先写临时文件再替换，不会留下不完整的JSON
+WRITE_BEHIND_SETTINGS = {
+    "enabled": True,  # False时在调用线程中立即写入
+    "flush_interval": 0.2,
+    "fsync": "never"  # "never"由操作系统决定何时落盘，"batch"每次写入后调用fsync
+}
+
+# 会话存储后端："file"为sessions/<会话ID>/下的JSON文件；"sqlite"把所有会话保存在一个WAL模式的SQLite数据库中，
+# 列出、恢复会话和统计查询都是索引查询（可视化图片等文件仍保存在会话目录中）
+SESSION_STORE_SETTINGS = {
+    "backend": "file",
+    "sqlite_path": "sessions/sessions.db"  # 相对路径相对于项目根目录
+}
+
+# LLM调用记录中提示词的存储：提示词按PROMPT_CACHE_BOUNDARY拆成固定前缀和动态部分，
+# 固定前缀按内容哈希压缩保存一次（文件后端在sessions/prompt_segments，SQLite后端在prompt_segments表），记录中只保存哈希值和动态部分
+PROMPT_STORAGE_SETTINGS = {
+    "dedup": True,  # False时记录中保存完整提示词
+    "min_prefix_chars": 200,  # 固定前缀短于此长度时不拆分
+    "compress_outputs": True  # 文件后端整理后的LLM输出记录压缩保存为llm_outputs/llm_output.json.gz
+}
+
 # 路径设置
-TEMPLATE_CONSTRAINTS_ALL_PATH = r"templates\template_constraints_all.txt"
-TEMPLATE_CONSTRAINTS_ROOMS_PATH = r"templates\template_constraints_rooms.txt"
-PROMPT_TEMPLATE_CONSTRAINTS_ALL_PATH = r"templates\prompt_template_constraints_all.txt"
-PROMPT_TEMPLATE_CONSTRAINTS_ROOMS_PATH = r"templates\prompt_template_constraints_rooms.txt"
+TEMPLATE_CONSTRAINTS_ALL_PATH = "templates/template_constraints_all.txt"
+TEMPLATE_CONSTRAINTS_ROOMS_PATH = "templates/template_constraints_rooms.txt"
+PROMPT_TEMPLATE_CONSTRAINTS_ALL_PATH = "templates/prompt_template_constraints_all.txt"
+PROMPT_TEMPLATE_CONSTRAINTS_ROOMS_PATH = "templates/prompt_template_constraints_rooms.txt"
+CONSTRAINT_BASE_PROMPT_PATH = "templates/constraint_base_prompt.txt"
+
+# 模板文件由提示词注册表统一加载（相对路径相对于项目根目录），每个进程只读取一次，
+# 开启热加载时文件修改后自动重新加载
+PROMPT_REGISTRY_SETTINGS = {
+    "hot_reload": True,
+    "check_interval": 2.0  # 两次检查文件修改时间的最小间隔（秒）
+}
 
 # 强制LLM输出JSON格式的参数设置
 FORCE_JSON_OUTPUT = True  # 是否强制LLM输出JSON格式
 RESPONSE_FORMAT = "json"  # 响应格式，可选值：json, text
 
+# 系统消息，所有模型共用
+SYSTEM_PROMPT = "你是一个专业的建筑设计师助手，帮助用户设计建筑布局。你的回答应该基于专业知识，并考虑用户的个性化需求。"
+
+# 提示词前缀缓存设置
+# 每个提示词分为两部分：缓存边界之前是固定前缀（基础提示词、约束条件基础提示词、模板、任务说明和输出格式），
+# 每次调用逐字节相同，可命中提供商的前缀缓存；边界之后才是每次调用变化的内容（需求猜测、对话记录、用户输入等）
+PROMPT_CACHE_BOUNDARY = "\n\n===== 以下为本次任务的具体信息 =====\n\n"
+PROMPT_CACHE_ENABLED = True  # 是否为Anthropic模型标记cache_control（OpenAI兼容接口的前缀缓存由服务端自动完成）
+
 # 通用基础提示词，用于所有模块
 BASE_PROMPT = """
 你是一个专业的建筑设计师助手，正在协助用户进行建筑布局设计。
@@ -91,16 +276,116 @@ BASE_PROMPT = """
 请确保你的回答专业、准确，并且符合建筑设计的最佳实践。
 """
 
+# 提示词设置 - 统一处理模块（空间理解、需求猜测、关键问题更新和提问）
+UNIFIED_PROCESSING_PROMPT = """{base_prompt}
+
+你的当前任务是处理最新的用户输入，更新空间理解、用户需求猜测、关键问题列表，并生成下一个问题。
+
+请按照以下步骤进行：
+1. 从整体任务上进行思考，分析用户输入的内容，判断是否需要更新空间理解、用户需求猜测或关键问题列表。
+2. 分析用户输入，提取关于建筑边界和环境的信息，更新spatial_understanding，空间理解指的是建筑形状、面积、周围环境信息等。
+3. 分析用户输入，推测用户的建筑设计需求和偏好，更新user_requirements。
+4. 根据用户输入和已有信息，更新key_questions。
+5. 生成下一个问题，引导用户提供更多信息。
+
+请以JSON格式返回以下内容：
+{{
+   "next_question": 下一个问题（如果所有问题的状态都是已知，则为空字符串）,
+   "thinking": 对本次所有内容更新的思考,
+   "user_requirements": {{
+      "updated": (true/false),
+      "edits": [
+        {{"op": "replace", "index": 句子编号, "text": "替换后的句子"}},
+        {{"op": "insert", "after": 句子编号（0表示插入到开头）, "text": "新增的句子"}},
+        {{"op": "delete", "index": 句子编号}}
+      ], //按句修改，句子编号对应当前用户需求猜测中的编号，只列出有变化的句子，list格式
+      "content": "" //只有在需要整体重写时才填写完整的新内容，此时edits为空列表，string格式
+   }},
+   "spatial_understanding": {{
+      "updated": (true/false),
+      "edits": [], //按句修改，格式与user_requirements的edits相同，句子编号对应当前空间理解记录中的编号
+      "content": "" //只有在需要整体重写时才填写完整的新内容，string格式
+   }},
+   "key_questions": {{
+      "updated": (true/false),
+      "changes": [
+        {{
+          "category": "" //问题类别，必须是当前关键问题列表中已有的类别,
+          "status": "" //未知/已知,
+          "details": "" //简要描述}}
+      ], //只列出状态或描述有变化的问题类别，list格式
+      "content": [] //只有在需要整体替换时才填写完整的关键问题列表，格式与changes相同，要包含所有问题类别
+   }}
+}}
+注意：
+- 按上面的字段顺序输出，先给出next_question，再给出thinking和各项更新
+- 下一个问题可以是根据关键问题列表中"未知"状态的问题产生的新问题，也可以是根据上一问答中未能解决或明确的问题继续提问
+- 请确保返回的JSON格式正确，所有字段都必须存在，只返回json内容，不要包含任何解释或注释
+- 如果某项内容没有更新，请将updated设为false，edits和changes返回空列表，content返回空字符串
+- 修改需求猜测和空间理解时优先使用edits，只输出有变化的句子，不要重复未变化的内容；当前内容为空或需要大幅改写时才使用content
+- edits中的句子编号都指向修改前的编号，同一句只能替换或删除一次
+- 哪怕是状态已知的问题，也可以在关键问题列表中更新details，以提供更详细的信息
+- 房间数量和类型：要时刻注意更新调整；生活方式：从用户的日常生活习惯中提取设计可能用到的信息；空间使用偏好：可能涉及到空间的方位、采光、空间关系等；环境应对需求：考虑噪音、与周围环境的交互或排斥关系等。
+""" + PROMPT_CACHE_BOUNDARY + """当前空间理解记录（按句编号）：
+{current_spatial_understanding}
+
+当前用户需求猜测（按句编号）：
+{current_requirement_guess}
+
+当前关键问题列表：
+{key_questions_formatted}
+
+系统与用户的问答记录：
+{conversation_history_formatted}
+
+用户当前输入：
+{user_input}
+{update_notes}"""
+
+# 需求收集最后一轮的附加说明：所有关键问题都已知时，统一处理的同一次响应中直接给出约束条件，省去一次约束条件量化调用
+UNIFIED_FINAL_TURN_INSTRUCTIONS = """
+本轮可能是需求收集的最后一轮。如果本轮更新后关键问题列表中所有问题的状态都是已知，请在返回的JSON中key_questions之后额外包含"constraints"字段，
+内容为根据更新后的用户需求猜测和空间理解记录生成的量化约束条件；如果仍有未知的问题，不要包含constraints字段。
+
+{constraint_base_prompt}
+
+约束条件模板：
+{constraint_template}
+
+生成约束条件时：
+1. 提取用户需求中所有可量化的需求，严格遵循提供的模板结构。
+2. 为未明确提及但设计中必要的部分，根据建筑设计常识补充合理的默认值。
+3. 为每类约束条件分配合理的权重（0.0-1.0），反映其在用户需求中的重要性，无特殊依据的部分可以设置常规权重。
+4. 检测约束条件之间的潜在冲突，确保约束条件的一致性和合理性。
+5. 添加path和entrance作为特殊空间，并确保所有房间可从entrance通过path到达。
+6. 适当添加adjacency约束，表示空间相邻但不直接连通的房间对。
+
+constraints字段的格式如下：
+"constraints": {{
+  "hard_constraints": {{
+    // 房间列表等硬约束
+  }},
+  "soft_constraints": {{
+    // 各类软约束
+  }},
+  "special_spaces": {{
+    "path": true,
+    "entrance": true
+  }}
+}}
+"""
+
+# 需求收集最后一轮的统一处理提示词：固定前缀中加入约束条件的生成说明和模板
+UNIFIED_FINAL_TURN_PROMPT = UNIFIED_PROCESSING_PROMPT.replace(
+    PROMPT_CACHE_BOUNDARY, UNIFIED_FINAL_TURN_INSTRUCTIONS + PROMPT_CACHE_BOUNDARY, 1
+)
+
 # 提示词设置 - 空间理解模块
 SPATIAL_UNDERSTANDING_PROMPT = """
 {base_prompt}\n\n你的当前任务是理解用户描述的建筑边界和环境信息。
-请仔细分析以下用户输入，提取关于建筑边界的形状、面积、周围环境、入口位置等空间信息。
+请仔细分析用户输入，提取关于建筑边界的形状、面积、周围环境、入口位置等空间信息。
 将提取的信息转换为简洁清晰的自然语言描述，作为"空间理解"记录。
 
-用户当前输入: {user_input}
-
-当前空间理解记录: {current_spatial_understanding}
-
 请更新空间理解记录，包含所有相关的空间信息。如果用户输入中没有新的空间信息，请保持原记录不变。
 
 请以JSON格式返回结果，格式如下：
@@ -108,6 +393,9 @@ SPATIAL_UNDERSTANDING_PROMPT = """
   "updated": true/false,  // 是否有更新，true表示有更新，false表示无更新
   "spatial_understanding": "更新后的空间理解记录"  // 如果没有更新，则为空字符串
 }}
+""" + PROMPT_CACHE_BOUNDARY + """用户当前输入: {user_input}
+
+当前空间理解记录: {current_spatial_understanding}
 """
 
 # 提示词设置 - 需求分析模块
@@ -115,11 +403,6 @@ REQUIREMENT_ANALYSIS_PROMPT = """
 {base_prompt}\n\n你的当前任务是分析用户的建筑设计需求和空间信息。
 请根据用户的回答、当前的需求猜测以及空间理解记录，推测用户的设计需求，特别关注用户的个性化需求。同时，评估是否需要更新空间理解记录。
 
-
-当前用户需求猜测: {current_requirement_guess}
-当前空间理解记录: {spatial_understanding}
-用户当前输入: {user_input}
-
 请完成以下任务：
 1. 分析用户输入中的设计需求信息，更新用户需求猜测。
 2. 分析用户输入中的空间信息，判断是否需要更新空间理解记录。
@@ -140,6 +423,9 @@ REQUIREMENT_ANALYSIS_PROMPT = """
   "requirement_updated": true/false,  // 需求猜测是否有更新
   "requirement_guess": "更新后的用户需求猜测",  // 如果没有更新，则返回空字符串
 }}
+""" + PROMPT_CACHE_BOUNDARY + """当前用户需求猜测: {current_requirement_guess}
+当前空间理解记录: {spatial_understanding}
+用户当前输入: {user_input}
 """
 
 # 提示词设置 - 提问生成模块
@@ -147,12 +433,6 @@ QUESTION_GENERATION_PROMPT = """
 {base_prompt}\n\n你的当前任务是通过提问帮助用户明确设计需求，并同时评估关键问题类别的状态。
 请根据当前的用户需求猜测和关键问题列表，生成下一个问题，并更新关键问题列表。
 
-当前用户需求猜测：
-{current_requirement_guess}
-
-关键问题列表（按类别）：
-{key_questions_formatted}
-
 请完成以下两个任务：
 
 任务1：根据用户需求猜测，判断每个类别的问题是否已经得到回答，更新关键问题列表中各问题的状态。
@@ -184,15 +464,38 @@ QUESTION_GENERATION_PROMPT = """
   "question": "生成的问题",
   "explanation": "选择这个问题和判断关键问题类别状态的思考过程"
 }}
+""" + PROMPT_CACHE_BOUNDARY + """当前用户需求猜测：
+{current_requirement_guess}
+
+关键问题列表（按类别）：
+{key_questions_formatted}
 """
 
 
 # 提示词设置 - 优化rooms格式约束条件
 CONSTRAINT_ROOMS_OPTIMIZATION_PROMPT = """
 你的当前任务是优化和完善房间约束条件。
-请根据用户需求猜测和空间理解记录，优化以下房间约束条件。
+请根据用户需求猜测和空间理解记录，优化给出的房间约束条件。
 
-用户需求猜测：
+房间约束条件模板格式参考：
+{template_rooms_with_comments}
+
+请完成以下任务：
+1. 分析用户需求猜测，检查当前房间约束条件是否完整反映了用户需求。
+2. 优化和完善房间约束条件，确保每个房间的约束条件合理且符合用户需求。
+3. 检查房间之间的连接关系是否合理，确保空间布局的流畅性。
+4. 确保所有房间的面积、朝向、窗户需求等约束条件都符合用户需求和建筑设计常识。有些房间的某些约束条件可以是空的。
+5. 返回优化后的完整房间约束条件JSON。
+
+请以JSON格式返回结果，格式如下：
+{{
+  "constraints": {{
+        "rooms":{{
+        // 房间约束条件，完整JSON,严格按照约束条件模板格式
+        }}
+    }}
+}}
+""" + PROMPT_CACHE_BOUNDARY + """用户需求猜测：
 {user_requirement_guess}
 
 空间理解记录：
@@ -200,36 +503,81 @@ CONSTRAINT_ROOMS_OPTIMIZATION_PROMPT = """
 
 当前房间约束条件：
 {constraints_rooms}
+"""
+
+# 按房间分组并行优化rooms格式约束条件的提示词：每组只返回本组房间，与其他组房间的关系由合并时统一处理
+CONSTRAINT_ROOMS_CLUSTER_OPTIMIZATION_PROMPT = """
+你的当前任务是优化和完善一组房间的约束条件。
+整套房间被分成若干组并行优化，你只负责"当前房间约束条件"中列出的房间，其他组的房间只作为参考。
 
 房间约束条件模板格式参考：
 {template_rooms_with_comments}
 
 请完成以下任务：
-1. 分析用户需求猜测，检查当前房间约束条件是否完整反映了用户需求。
-2. 优化和完善房间约束条件，确保每个房间的约束条件合理且符合用户需求。
-3. 检查房间之间的连接关系是否合理，确保空间布局的流畅性。
-4. 确保所有房间的面积、朝向、窗户需求等约束条件都符合用户需求和建筑设计常识。有些房间的某些约束条件可以是空的。
-5. 返回优化后的完整房间约束条件JSON。
+1. 分析用户需求猜测，检查本组房间的约束条件是否完整反映了用户需求。
+2. 优化和完善本组每个房间的约束条件，确保合理且符合用户需求。
+3. connection、adjacency和repulsion中可以引用其他组的房间，但只能使用"全部房间"中已有的房间名。
+4. 确保本组房间的面积、朝向、窗户需求等约束条件都符合用户需求和建筑设计常识。有些房间的某些约束条件可以是空的。
+5. 只返回本组房间的约束条件，不要返回其他组的房间。
 
 请以JSON格式返回结果，格式如下：
 {{
   "constraints": {{
         "rooms":{{
-        // 房间约束条件，完整JSON,严格按照约束条件模板格式
+        // 本组房间的约束条件，严格按照约束条件模板格式
         }}
     }}
 }}
+""" + PROMPT_CACHE_BOUNDARY + """用户需求猜测：
+{user_requirement_guess}
+
+空间理解记录：
+{spatial_understanding}
+
+全部房间：
+{all_rooms}
+
+当前房间约束条件：
+{constraints_rooms}
+"""
+
+# 对话摘要提示词
+CONVERSATION_SUMMARY_PROMPT = """
+{base_prompt}
+
+你的当前任务是将系统与用户的早期问答记录压缩为简洁的摘要，供后续对话参考。
+
+要求：
+1. 保留用户明确表达的需求、偏好和否定意见（如"不要开放式厨房"），以及面积、人数、房间数量等数字信息。
+2. 保留系统提出但用户尚未回答的问题。
+3. 删除寒暄和重复内容；后面的回答与前面矛盾时，以后面的回答为准。
+4. 将已有摘要与新增的问答记录合并，使用第三人称陈述句按主题分条列出，总长度不超过{max_chars}字。
+
+请以JSON格式返回结果，格式如下：
+{{
+  "summary": "合并后的摘要"
+}}
+""" + PROMPT_CACHE_BOUNDARY + """已有摘要：
+{previous_summary}
+
+新增的问答记录：
+{new_history}
+"""
+
+# JSON修复的重新请求提示词：只要求模型改正格式，不重新完成任务
+JSON_REPAIR_PROMPT = """
+你之前的回答应该是一个合法的JSON对象，但无法解析，错误信息为：{error}
+
+请修正格式错误后重新输出完整的JSON对象，不要修改其中的内容，不要添加任何解释、注释或Markdown代码块标记。
+{expected_keys}
+之前的回答：
+{response}
 """
 
 # 检查问题是否已回答的提示词
 CHECK_QUESTION_ANSWERED_PROMPT = """
 {base_prompt}\n\n你的当前任务是判断一个问题是否已经在用户需求猜测中得到了回答。
 
-问题：{question}
-
-用户需求猜测：
-{requirement_guess}
-
 请判断这个问题是否已经在用户需求猜测中得到了明确或隐含的回答。
 只返回"是"或"否"。
 
@@ -237,6 +585,10 @@ CHECK_QUESTION_ANSWERED_PROMPT = """
 {{
   "answered": true/false  // true表示已回答，false表示未回答
 }}
+""" + PROMPT_CACHE_BOUNDARY + """问题：{question}
+
+用户需求猜测：
+{requirement_guess}
 """
 
 # 更新约束条件相关的提示词，集成constraint_base_prompt
@@ -251,12 +603,6 @@ CONSTRAINT_QUANTIFICATION_PROMPT = """
 
 {constraint_base_prompt}
 
-用户需求猜测：
-{user_requirement_guess}
-
-空间理解记录：
-{spatial_understanding}
-
 约束条件模板：
 {constraint_template}
 
@@ -286,6 +632,55 @@ CONSTRAINT_QUANTIFICATION_PROMPT = """
     }}
   }}
 }}
+""" + PROMPT_CACHE_BOUNDARY + """用户需求猜测：
+{user_requirement_guess}
+
+空间理解记录：
+{spatial_understanding}
+"""
+
+# 约束条件优化和布局方案优化共用的要求及输出格式
+REFINEMENT_OUTPUT_FORMAT = """请以JSON格式返回优化后的约束条件，格式如下：
+{
+  "refined_constraints": {
+    "hard_constraints": {
+      // 房间列表等硬约束
+    },
+    "soft_constraints": {
+      // 各类软约束
+    },
+    "special_spaces": {
+      "path": true,
+      "entrance": true
+    }
+  }
+}
+"""
+
+# 约束条件的紧凑格式：提示词中的当前约束条件和LLM返回的约束条件都使用逐行的表格，
+# 不再重复每条约束的字段名，减少优化时的输入和输出token
+CONSTRAINT_COMPACT_ENCODING = True
+
+REFINEMENT_COMPACT_OUTPUT_FORMAT = """约束条件使用紧凑的逐行格式表示，规则如下：
+- "@room_list"行列出所有房间，用逗号分隔。
+- 每类软约束以表头行开始，格式为"@类别 权重 | 列名"，之后每行一条约束，按列名顺序用逗号分隔各列的值。
+  connection和adjacency的room1、room2即JSON格式中的"room pair"。
+- 单元格为空表示没有该字段；包含逗号或引号的值、以及与数字同形的房间名用双引号括起来。
+- 以"+ "开头的行是不符合列定义的约束，内容为该约束的JSON对象。
+- "@special_spaces"和"@extra"行的内容为JSON，请原样保留。
+
+请以JSON格式返回优化后的约束条件，refined_constraints为紧凑格式的各行组成的列表，格式如下：
+{
+  "refined_constraints": [
+    "@room_list 客厅, 主卧, 厨房",
+    "@connection 0.8 | room1, room2, room_weight",
+    "客厅, 主卧, 0.9",
+    "@area 0.6 | room, min, max, room_weight",
+    "客厅, 20, 30, 0.7",
+    "@special_spaces {\"path\": true, \"entrance\": true}"
+  ]
+}
+即使某类约束没有变化，也要返回完整的约束条件，不要省略任何一行。
 """
 
 # 更新约束条件优化提示词
@@ -296,15 +691,6 @@ CONSTRAINT_REFINEMENT_PROMPT = """
 
 {constraint_base_prompt}
 
-当前约束条件：
-{current_constraints}
-
-空间理解记录：
-{spatial_understanding}
-
-用户反馈：
-{user_feedback}
-
 请完成以下任务：
 1. 分析用户反馈，找出用户希望修改的约束条件部分。
 2. 根据用户反馈调整相应的约束条件，包括但不限于：
@@ -322,41 +708,22 @@ CONSTRAINT_REFINEMENT_PROMPT = """
 3. 确保优化后的约束条件仍然满足基本建筑设计原则。
 4. 保持path和entrance作为特殊空间，不要将它们添加到房间列表中。
 
-请以JSON格式返回优化后的约束条件，格式如下：
-{{
-  "refined_constraints": {{
-    "hard_constraints": {{
-      // 房间列表等硬约束
-    }},
-    "soft_constraints": {{
-      // 各类软约束
-    }},
-    "special_spaces": {{
-      "path": true,
-      "entrance": true
-    }}
-  }}
-}}
-"""
-
-# 更新布局方案优化提示词
-SOLUTION_REFINEMENT_PROMPT = """
-{base_prompt}
-
-你的当前任务是根据用户对布局方案的反馈，优化约束条件以生成更满意的方案。
-{constraint_base_prompt}
-当前约束条件：
+{output_format}""" + PROMPT_CACHE_BOUNDARY + """当前约束条件：
 {current_constraints}
 
-当前布局方案：
-{current_solution}
-
 空间理解记录：
 {spatial_understanding}
 
 用户反馈：
 {user_feedback}
+"""
 
+# 更新布局方案优化提示词
+SOLUTION_REFINEMENT_PROMPT = """
+{base_prompt}
+
+你的当前任务是根据用户对布局方案的反馈，优化约束条件以生成更满意的方案。
+{constraint_base_prompt}
 请完成以下任务：
 1. 分析用户对布局方案的反馈，找出用户不满意的方面。
 2. 根据用户反馈调整相应的约束条件，包括但不限于：
@@ -374,19 +741,15 @@ SOLUTION_REFINEMENT_PROMPT = """
 4. 确保优化后的约束条件仍然满足基本建筑设计原则。
 5. 保持path和entrance作为特殊空间，不要将它们添加到房间列表中。
 
-请以JSON格式返回优化后的约束条件，格式如下：
-{{
-  "refined_constraints": {{
-    "hard_constraints": {{
-      // 房间列表等硬约束
-    }},
-    "soft_constraints": {{
-      // 各类软约束
-    }},
-    "special_spaces": {{
-      "path": true,
-      "entrance": true
-    }}
-  }}
-}}
-"""
\ No newline at end of file
+{output_format}""" + PROMPT_CACHE_BOUNDARY + """当前约束条件：
+{current_constraints}
+
+当前布局方案：
+{current_solution}
+
+空间理解记录：
+{spatial_understanding}
+
+用户反馈：
+{user_feedback}
+"""
@@ -1,17 +1,23 @@
 import os
 import sys
 import json
+import asyncio
 import argparse
 from dotenv import load_dotenv
 from models.constraint_quantification import ConstraintQuantification
 from models.constraint_visualization import ConstraintVisualization
 from models.constraint_refinement import ConstraintRefinement
 from models.solution_refinement import SolutionRefinement
+from models.constraint_draft import ConstraintDrafter
 from utils.openai_client import OpenAIClient
 from utils.json_handler import JsonHandler
 from utils.converter import ConstraintConverter
 from utils.session_manager import SessionManager
 from utils.workflow_manager import WorkflowManager
+from utils.llm_replay import configure_replay
+from utils.state_patch import StatePatcher, StatePatchError
+from utils.prompt_registry import get_prompt_registry
+from config import FINAL_TURN_CONSTRAINTS, TEMPLATE_CONSTRAINTS_ALL_PATH, TEMPLATE_CONSTRAINTS_ROOMS_PATH
 from models.unified_processor import UnifiedProcessor
 
 # 加载环境变量（包括OpenAI API密钥）
@@ -20,35 +26,40 @@ load_dotenv()
 class ArchitectureAISystem:
     """建筑布局设计AI系统的主类，控制整个交互流程"""
     
-    def __init__(self, resume_session_path=None, input_file="input.json", if_rooms_constraints=False):
+    def __init__(self, resume_session_path=None, input_file="input.json", if_rooms_constraints=False, event_channel=None,
+                 session_id=None):
         """初始化系统各组件
         
         Args:
             resume_session_path (str, optional): 恢复会话的路径。如果提供，将从该路径恢复会话状态。
+            event_channel (str, optional): 事件频道（Web会话ID）。设置后LLM输出片段和阶段变化发布到事件总线。
+            session_id (str, optional): 会话记录目录名，默认使用当前时间。
         """
         self.input_file = input_file
         self.if_rooms_constraints = if_rooms_constraints
         # 初始化会话记录管理器
-        self.session_manager = SessionManager()
+        self.session_manager = SessionManager(session_id)
         
         # 初始化OpenAI客户端
         self.openai_client = OpenAIClient()
         
         # 设置会话记录管理器到OpenAI客户端
         self.openai_client.set_session_manager(self.session_manager)
+        self.openai_client.set_event_channel(event_channel)
         
         # 初始化各功能模块
         self.constraint_quantification = ConstraintQuantification(self.openai_client)
         
-        # 初始化统一处理模块
+        # 初始化统一处理模块及其增量更新的应用工具
         self.unified_processor = UnifiedProcessor(self.openai_client)
+        self.state_patcher = StatePatcher()
 
         # 初始化JSON处理工具和转换工具
         self.json_handler = JsonHandler()
         self.converter = ConstraintConverter()
         
         # 初始化工作流程管理器
-        self.workflow_manager = WorkflowManager(self.session_manager)
+        self.workflow_manager = WorkflowManager(self.session_manager, event_channel)
         
         # 初始化约束条件可视化模块
         self.constraint_visualization = ConstraintVisualization()
@@ -56,6 +67,11 @@ class ArchitectureAISystem:
         # 初始化约束条件优化模块
         self.constraint_refinement = ConstraintRefinement(self.openai_client)
         
+        # 初始化约束条件草稿生成器，需求收集接近完成时在后台提前生成约束条件
+        self.constraint_drafter = ConstraintDrafter(self.openai_client, if_rooms_constraints)
+        # 最后一轮问答附带的约束条件（所有关键问题都已知时由统一处理模块一并给出）
+        self.final_turn_constraints = None
+        
         # 初始化布局方案优化模块
         self.solution_refinement = SolutionRefinement(self.openai_client)
         
@@ -86,8 +102,8 @@ class ArchitectureAISystem:
             self.conversation_history = []
             
             # 初始化约束条件（空）
-            self.constraints_all = self.load_template("templates/template_constraints_all.txt")
-            self.constraints_rooms = self.load_template("templates/template_constraints_rooms.txt")
+            self.constraints_all = self.load_template(TEMPLATE_CONSTRAINTS_ALL_PATH)
+            self.constraints_rooms = self.load_template(TEMPLATE_CONSTRAINTS_ROOMS_PATH)
             
             # 初始化布局方案（空）
             self.current_solution = {"status": "not_generated", "message": "布局方案尚未生成"}
@@ -98,18 +114,17 @@ class ArchitectureAISystem:
         Args:
             session_path (str): 会话目录路径
         """
-        current_state_path = os.path.join(session_path, 'current_state.json')
+        # 只读取当前状态，历史记录在需要时才从恢复的会话中读取
+        resumed_session = self.session_manager.store.load_session(session_path)
         
-        if not os.path.exists(current_state_path):
-            print(f"错误：无法找到会话状态文件 {current_state_path}")
+        if resumed_session is None:
+            print(f"错误：无法找到会话状态 {session_path}")
             # 初始化为默认状态
             self.initialize_system_state()
             return
         
         try:
-            # 读取当前状态文件
-            with open(current_state_path, 'r', encoding='utf-8') as f:
-                current_state = json.load(f)
+            current_state = resumed_session.current_state
             
             print(f"正在从会话 {session_path} 恢复状态...")
             
@@ -139,14 +154,14 @@ class ArchitectureAISystem:
                 self.constraints_all = constraints['all']
                 print("已恢复all格式约束条件")
             else:
-                self.constraints_all = self.load_template("templates/template_constraints_all.txt")
+                self.constraints_all = self.load_template(TEMPLATE_CONSTRAINTS_ALL_PATH)
                 print("使用默认all格式约束条件模板")
                 
             if 'rooms' in constraints:
                 self.constraints_rooms = constraints['rooms']
                 print("已恢复rooms格式约束条件")
             else:
-                self.constraints_rooms = self.load_template("templates/template_constraints_rooms.txt")
+                self.constraints_rooms = self.load_template(TEMPLATE_CONSTRAINTS_ROOMS_PATH)
                 print("使用默认rooms格式约束条件模板")
             
             # 恢复布局方案
@@ -170,6 +185,9 @@ class ArchitectureAISystem:
             # 确定应该进入哪个阶段
             self._determine_workflow_stage()
             
+            # 对话和模块历史在首次读取（如下一轮构建对话上下文）时才从恢复的会话中加载
+            self.session_manager.attach_resumed_session(resumed_session)
+            
             print(f"会话状态恢复完成，当前阶段：{self.workflow_manager.get_current_stage()}")
             
         except Exception as e:
@@ -252,10 +270,9 @@ class ArchitectureAISystem:
         self.workflow_manager.set_key_questions_status(resolved_questions, total_questions)
     
     def load_template(self, template_name):
-        """加载约束条件模板"""
+        """加载约束条件模板，模板文件由进程级注册表只读取一次"""
         try:
-            with open(template_name, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return get_prompt_registry().json(template_name)
         except FileNotFoundError:
             # 如果文件不存在，返回一个空的模板
             if "template_constraints_all.txt" in template_name:
@@ -291,6 +308,17 @@ class ArchitectureAISystem:
             print(f"加载初始输入文件失败: {e}")
             return None
     
+    def format_initial_input(self, input_data):
+        """将初始输入数据合并为首次用户输入
+        
+        Args:
+            input_data (dict): 包含spatial_info和user_requirement的字典
+        
+        Returns:
+            str: 首次用户输入
+        """
+        return f"空间信息：{input_data['spatial_info']}\n\n用户需求：{input_data['user_requirement']}"
+    
     def process_llm_result(self, result, user_input=None):
         """处理LLM返回的结果，更新系统状态
         
@@ -303,43 +331,149 @@ class ArchitectureAISystem:
         """
         # 更新用户需求猜测
         if result["user_requirements"]["updated"]:
-            self.user_requirement_guess = result["user_requirements"]["content"]
-            if user_input:
-                self.session_manager.update_user_requirements(
-                    {"content": self.user_requirement_guess},
-                    user_input
-                )
-            print("用户需求已更新。")
+            content = self._apply_text_update("user_requirements", self.user_requirement_guess, result["user_requirements"])
+            if content is not None:
+                self.user_requirement_guess = content
+                if user_input:
+                    self.session_manager.update_user_requirements(
+                        {"content": self.user_requirement_guess},
+                        user_input
+                    )
+                print("用户需求已更新。")
         
         # 更新空间理解记录
         if result["spatial_understanding"]["updated"]:
-            self.spatial_understanding_record = result["spatial_understanding"]["content"]
-            if user_input:
-                self.session_manager.update_spatial_understanding(
-                    {"content": self.spatial_understanding_record},
-                    user_input
-                )
-            print("空间理解已更新。")
+            content = self._apply_text_update("spatial_understanding", self.spatial_understanding_record, result["spatial_understanding"])
+            if content is not None:
+                self.spatial_understanding_record = content
+                if user_input:
+                    self.session_manager.update_spatial_understanding(
+                        {"content": self.spatial_understanding_record},
+                        user_input
+                    )
+                print("空间理解已更新。")
         
         # 更新关键问题列表
         if result["key_questions"]["updated"]:
-            self.key_questions = result["key_questions"]["content"]
-            if user_input:
-                self.session_manager.update_key_questions(
-                    {"questions": self.key_questions},
-                    user_input
-                )
-            
-            # 更新工作流程管理器中的关键问题状态
-            resolved_questions = sum(1 for q in self.key_questions if q["status"] == "已知")
-            total_questions = len(self.key_questions)
-            self.workflow_manager.set_key_questions_status(resolved_questions, total_questions)
+            key_questions = self._apply_key_question_update(result["key_questions"])
+            if key_questions is not None:
+                self.key_questions = key_questions
+                if user_input:
+                    self.session_manager.update_key_questions(
+                        {"questions": self.key_questions},
+                        user_input
+                    )
+                
+                # 更新工作流程管理器中的关键问题状态
+                resolved_questions = sum(1 for q in self.key_questions if q["status"] == "已知")
+                total_questions = len(self.key_questions)
+                self.workflow_manager.set_key_questions_status(resolved_questions, total_questions)
+        
+        # 最后一轮的响应中附带了约束条件：所有关键问题都已知时保留，进入约束条件生成阶段时直接使用
+        if result.get("constraints") and self.key_questions and all(q.get("status") == "已知" for q in self.key_questions):
+            self.final_turn_constraints = {
+                "user_requirement_guess": self.user_requirement_guess,
+                "spatial_understanding": self.spatial_understanding_record,
+                "constraints": result["constraints"]
+            }
+            self.session_manager.add_intermediate_state('final_turn_constraints', {'constraints': result["constraints"]})
+            print("最后一轮问答已同时生成约束条件。")
+        
+        # 只剩少量关键问题未知时，在后台提前生成约束条件草稿
+        self._schedule_constraint_draft()
         
         # 获取下一个问题
         next_question = result.get("next_question", "还有其他需求吗？")
         
         return next_question
     
+    def _apply_text_update(self, field, current, update):
+        """把LLM返回的需求猜测或空间理解更新应用到当前内容
+        
+        优先按句应用edits；修改无法应用时使用content中的完整内容，也没有完整内容时保持原内容，并要求下一轮返回完整内容
+        
+        Args:
+            field (str): 字段名，'user_requirements'或'spatial_understanding'
+            current (str): 当前内容
+            update (dict): LLM返回的更新，包含edits和content
+        
+        Returns:
+            str: 更新后的内容，无法更新时返回None
+        """
+        edits = update.get("edits")
+        content = update.get("content")
+        if edits:
+            try:
+                return self.state_patcher.apply_text_edits(current or "", edits)
+            except StatePatchError as e:
+                self._record_patch_failure(field, edits, e, bool(content))
+        if isinstance(content, str) and content.strip():
+            return content
+        if not edits:
+            return None
+        self.unified_processor.request_full_content(field)
+        return None
+    
+    def _apply_key_question_update(self, update):
+        """把LLM返回的关键问题更新应用到当前关键问题列表
+        
+        优先应用changes中有变化的问题类别；无法应用时使用content中的完整列表，也没有完整列表时保持原列表，并要求下一轮返回完整列表
+        
+        Args:
+            update (dict): LLM返回的更新，包含changes和content
+        
+        Returns:
+            list: 更新后的关键问题列表，无法更新时返回None
+        """
+        changes = update.get("changes")
+        content = update.get("content")
+        if changes:
+            try:
+                return self.state_patcher.apply_key_question_changes(self.key_questions, changes)
+            except StatePatchError as e:
+                self._record_patch_failure("key_questions", changes, e, bool(content))
+        if isinstance(content, list) and content:
+            return content
+        if not changes:
+            return None
+        self.unified_processor.request_full_content("key_questions")
+        return None
+    
+    def _is_final_turn(self):
+        """判断本轮是否可能是需求收集的最后一轮（未知的关键问题不超过设置的数量）"""
+        if not FINAL_TURN_CONSTRAINTS["enabled"] or not self.key_questions:
+            return False
+        if self.workflow_manager.get_current_stage() != self.workflow_manager.STAGE_REQUIREMENT_GATHERING:
+            return False
+        remaining = sum(1 for q in self.key_questions if q.get("status") != "已知")
+        return 0 < remaining <= FINAL_TURN_CONSTRAINTS["remaining_questions"]
+    
+    def _schedule_constraint_draft(self):
+        """需求收集阶段只剩少量关键问题未知时，按当前需求猜测在后台生成约束条件草稿
+        
+        下一轮会在问答响应中附带约束条件时不再生成草稿，避免同一轮重复量化约束条件
+        """
+        if self.constraint_drafter is None:
+            return
+        if self.workflow_manager.get_current_stage() != self.workflow_manager.STAGE_REQUIREMENT_GATHERING:
+            return
+        if self._is_final_turn():
+            return
+        remaining = self.workflow_manager.total_key_questions - self.workflow_manager.resolved_key_questions
+        if 0 < remaining <= self.constraint_drafter.settings["remaining_questions"]:
+            self.constraint_drafter.schedule(self.user_requirement_guess, self.spatial_understanding_record)
+    
+    def _record_patch_failure(self, field, patch, error, has_full_content):
+        """记录无法应用的修改"""
+        fallback = "使用完整内容" if has_full_content else "保持原内容"
+        print(f"{field}的修改无法应用（{error}），{fallback}")
+        self.session_manager.add_intermediate_state('增量更新失败', {
+            'field': field,
+            'patch': patch,
+            'error': str(error),
+            'fallback': fallback
+        }, field)
+    
     def start_interaction(self):
         """开始交互流程"""
         print("欢迎使用建筑布局设计AI系统！")
@@ -353,7 +487,7 @@ class ArchitectureAISystem:
                 print("已从input.json加载初始输入数据。")
                 
                 # 合并空间信息和用户需求作为首次输入
-                user_input = f"空间信息：{input_data['spatial_info']}\n\n用户需求：{input_data['user_requirement']}"
+                user_input = self.format_initial_input(input_data)
                 
                 # 记录用户输入
                 self.session_manager.add_user_input(user_input)
@@ -656,14 +790,46 @@ class ArchitectureAISystem:
             self.spatial_understanding_record,
             self.user_requirement_guess,
             self.key_questions,
-            conversation_history
+            conversation_history,
+            final_turn=self._is_final_turn()
         )
         
+        # 记录本轮对话上下文节省的token
+        if self.unified_processor.context.last_stats:
+            self.session_manager.add_context_stats(self.unified_processor.context.last_stats)
+        
         # 使用统一的后处理函数处理LLM返回的结果
         next_question = self.process_llm_result(unified_result, user_input)
         
         return next_question
     
+    async def aprocess_user_input(self, user_input):
+        """process_user_input的asyncio版本，LLM调用不占用线程
+        
+        对话历史从内存中的会话记录读取，会话记录的写入由后台写线程完成，都不会阻塞事件循环；
+        提示词构建中的模板读取放到工作线程中执行（见UnifiedProcessor.aprocess）
+        """
+        
+        # 获取当前对话历史
+        conversation_history = self.session_manager.get_conversation_history()
+        
+        # 使用统一处理模块处理用户输入
+        unified_result = await self.unified_processor.aprocess(
+            user_input,
+            self.spatial_understanding_record,
+            self.user_requirement_guess,
+            self.key_questions,
+            conversation_history,
+            final_turn=self._is_final_turn()
+        )
+        
+        # 记录本轮对话上下文节省的token
+        if self.unified_processor.context.last_stats:
+            self.session_manager.add_context_stats(self.unified_processor.context.last_stats)
+        
+        # 使用统一的后处理函数处理LLM返回的结果
+        return self.process_llm_result(unified_result, user_input)
+    
     def all_key_questions_resolved(self):
         """检查是否所有关键问题都已解决""" 
         # self.key_questions 是一个列表，每个元素是一个dict，包含category, status, details
@@ -745,12 +911,110 @@ class ArchitectureAISystem:
         }
     
     def finalize_constraints(self):
-        """生成最终的约束条件"""
-        # 使用约束条件量化模块将用户需求猜测转化为约束条件
-        constraints_all = self.constraint_quantification.generate_constraints(
-            self.user_requirement_guess, self.spatial_understanding_record, self.if_rooms_constraints
-        )
+        """生成最终的约束条件，优先使用最后一轮问答附带的约束条件，其次使用后台生成的草稿"""
+        constraints_all = self._take_final_turn_constraints()
+        if constraints_all is not None:
+            if self.if_rooms_constraints:
+                constraints_all = self.constraint_quantification.optimize_rooms(
+                    self.user_requirement_guess, self.spatial_understanding_record, constraints_all
+                )
+            return self._apply_final_constraints(constraints_all)
+        
+        draft, draft_matches = self._take_constraint_draft()
+        if draft is not None and draft_matches:
+            constraints_all = draft["constraints"]
+        elif draft is not None:
+            # 需求在草稿生成后有变化：按变化优化草稿，比重新生成少一次或两次完整的量化调用
+            feedback = self.constraint_drafter.describe_changes(
+                draft, self.user_requirement_guess, self.spatial_understanding_record
+            )
+            constraints_all, _ = self.constraint_refinement.refine_constraints(
+                draft["constraints"], feedback, self.spatial_understanding_record
+            )
+        else:
+            # 使用约束条件量化模块将用户需求猜测转化为约束条件
+            constraints_all = self.constraint_quantification.generate_constraints(
+                self.user_requirement_guess, self.spatial_understanding_record, self.if_rooms_constraints
+            )
+        
+        return self._apply_final_constraints(constraints_all)
+    
+    async def afinalize_constraints(self):
+        """finalize_constraints的asyncio版本"""
+        constraints_all = self._take_final_turn_constraints()
+        if constraints_all is not None:
+            if self.if_rooms_constraints:
+                constraints_all = await self.constraint_quantification.aoptimize_rooms(
+                    self.user_requirement_guess, self.spatial_understanding_record, constraints_all
+                )
+            return self._apply_final_constraints(constraints_all)
+        
+        draft, draft_matches = await asyncio.to_thread(self._take_constraint_draft)
+        if draft is not None and draft_matches:
+            constraints_all = draft["constraints"]
+        elif draft is not None:
+            feedback = self.constraint_drafter.describe_changes(
+                draft, self.user_requirement_guess, self.spatial_understanding_record
+            )
+            constraints_all, _ = await self.constraint_refinement.arefine_constraints(
+                draft["constraints"], feedback, self.spatial_understanding_record
+            )
+        else:
+            constraints_all = await self.constraint_quantification.agenerate_constraints(
+                self.user_requirement_guess, self.spatial_understanding_record, self.if_rooms_constraints
+            )
+        
+        return self._apply_final_constraints(constraints_all)
+    
+    def _take_final_turn_constraints(self):
+        """取出最后一轮问答附带的约束条件
+        
+        Returns:
+            dict: all格式约束条件，没有或之后需求又有变化时返回None
+        """
+        final_turn_constraints, self.final_turn_constraints = self.final_turn_constraints, None
+        if final_turn_constraints is None:
+            return None
+        if (final_turn_constraints["user_requirement_guess"] != self.user_requirement_guess or
+                final_turn_constraints["spatial_understanding"] != self.spatial_understanding_record):
+            return None
+        # 已有约束条件，后台的草稿不再需要
+        if self.constraint_drafter is not None:
+            self.constraint_drafter.discard()
+        print("使用最后一轮问答附带的约束条件")
+        return final_turn_constraints["constraints"]
+    
+    def _take_constraint_draft(self):
+        """取出后台生成的约束条件草稿
+        
+        Returns:
+            tuple: (草稿, 是否与当前需求一致)，没有可用的草稿或需求变化后不允许优化草稿时草稿为None
+        """
+        if self.constraint_drafter is None:
+            return None, False
+        draft, draft_matches = self.constraint_drafter.take(self.user_requirement_guess, self.spatial_understanding_record)
+        if draft is None:
+            return None, False
+        if not draft_matches and not self.constraint_drafter.settings["refine_on_change"]:
+            return None, False
+        
+        usage = "直接使用" if draft_matches else "按需求变化优化"
+        print(f"使用后台生成的约束条件草稿（{usage}）")
+        self.session_manager.add_intermediate_state('constraint_draft', {
+            'usage': usage,
+            'draft_key': draft['key']
+        })
+        return draft, draft_matches
+    
+    def _apply_final_constraints(self, constraints_all):
+        """校验并保存生成的约束条件
         
+        Args:
+            constraints_all (dict): all格式的约束条件
+        
+        Returns:
+            dict: 补全path和entrance后的约束条件
+        """
         # 检查并添加path和entrance
         from utils.constraint_validator import ConstraintValidator
         validator = ConstraintValidator()
@@ -784,12 +1048,17 @@ def parse_args():
     parser.add_argument('--resume', type=str, help='恢复会话的路径')
     parser.add_argument('--input', type=str, default='input.json', help='初始输入文件路径')
     parser.add_argument('--if_rooms_constraints', type=bool, default=False, help='是否使用rooms格式约束条件')
+    parser.add_argument('--replay', type=str, nargs='+', help='回放录制的LLM调用（会话目录或sessions目录），不访问网络')
     return parser.parse_args()
 
 if __name__ == "__main__":
     # 解析命令行参数
     args = parse_args()
     
+    # 回放模式：所有LLM调用从录制的会话中返回
+    if args.replay:
+        configure_replay(args.replay)
+    
     # 初始化系统，如果提供了会话路径则从会话恢复
     system = ArchitectureAISystem(resume_session_path=args.resume, input_file=args.input, if_rooms_constraints=args.if_rooms_constraints)
     system.start_interaction()
\ No newline at end of file
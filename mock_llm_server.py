@@ -0,0 +1,492 @@
+"""
+本地模拟LLM服务，兼容OpenAI chat completions（含流式输出）和Anthropic messages接口，用于压测和吞吐量测试
+
+按提示词类型（统一处理、约束条件量化、rooms格式优化、约束条件优化）返回符合格式的JSON，
+首token时间、生成速度和错误率可通过命令行参数调整。
+
+用法示例：
+    python mock_llm_server.py --port 8765 --ttft 0.8 --tps 40 --error-rate 0.02
+
+然后将config.py中AVAILABLE_MODELS各模型的base_url指向该服务：
+    OpenAI兼容模型："http://127.0.0.1:8765/v1"
+    Anthropic模型："http://127.0.0.1:8765/v1/messages"
+API密钥环境变量需要存在，但取值不会被校验。
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import PROMPT_CACHE_BOUNDARY
+from utils.converter import ConstraintConverter
+
+# 按提示词哈希选择房间组合，同一需求每次得到相同的约束条件
+ROOM_SETS = [
+    ["living_room", "kitchen", "master_bedroom", "bathroom"],
+    ["living_room", "dining_room", "kitchen", "master_bedroom", "bedroom2", "bathroom"],
+    ["living_room", "dining_room", "kitchen", "master_bedroom", "bedroom2", "study", "bathroom", "balcony"]
+]
+
+ROOM_AREAS = {
+    "living_room": (20, 35),
+    "dining_room": (10, 16),
+    "kitchen": (6, 12),
+    "master_bedroom": (14, 22),
+    "bedroom2": (10, 15),
+    "study": (8, 12),
+    "bathroom": (4, 8),
+    "balcony": (4, 8)
+}
+
+MOCK_QUESTIONS = [
+    "家里常住几口人？是否有老人或小孩需要单独的房间？",
+    "您希望客厅和餐厅是开放式的还是相对独立？",
+    "厨房需要做成开放式还是封闭式？",
+    "卧室对朝向和采光有什么要求？",
+    "是否需要书房或其他功能空间？"
+]
+
+
+def estimate_tokens(text):
+    """粗略估算token数（中英文混合文本约每2个字符1个token）"""
+    return max(1, len(text) // 2)
+
+
+def extract_json_after(prompt, marker):
+    """从提示词中提取某个标题之后的JSON
+    
+    Args:
+        prompt (str): 提示词
+        marker (str): 标题，如"当前约束条件："
+    
+    Returns:
+        dict: 解析得到的JSON，找不到或解析失败时返回None
+    """
+    start = prompt.find(marker)
+    if start == -1:
+        return None
+    start = prompt.find('{', start)
+    if start == -1:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(prompt[start:])
+        return value
+    except json.JSONDecodeError:
+        return None
+
+
+def build_constraints(rooms):
+    """生成all格式的约束条件
+    
+    Args:
+        rooms (list): 房间名称列表
+    
+    Returns:
+        dict: all格式的约束条件
+    """
+    others = [room for room in rooms if room != "living_room"]
+    return {
+        "hard_constraints": {"room_list": list(rooms)},
+        "soft_constraints": {
+            "connection": {
+                "weight": 0.8,
+                "constraints": [{"room pair": ["living_room", room], "room_weight": 0.8} for room in others]
+            },
+            "adjacency": {
+                "weight": 0.5,
+                "constraints": [{"room pair": ["kitchen", "living_room"], "room_weight": 0.6}]
+            },
+            "area": {
+                "weight": 0.7,
+                "constraints": [
+                    {"room": room, "min": ROOM_AREAS[room][0], "max": ROOM_AREAS[room][1], "room_weight": 0.7}
+                    for room in rooms
+                ]
+            },
+            "orientation": {
+                "weight": 0.6,
+                "constraints": [
+                    {"room": "living_room", "direction": "south", "room_weight": 0.9},
+                    {"room": "master_bedroom", "direction": "south", "room_weight": 0.7}
+                ]
+            },
+            "window_access": {
+                "weight": 0.5,
+                "constraints": [{"room": room, "room_weight": 0.6} for room in rooms if room != "bathroom"]
+            },
+            "aspect_ratio": {
+                "weight": 0.3,
+                "constraints": [{"room": room, "min": 0.5, "max": 2.0, "room_weight": 0.5} for room in rooms]
+            },
+            "repulsion": {
+                "weight": 0.3,
+                "constraints": [{"room1": "master_bedroom", "room2": "kitchen", "min_distance": 3, "room_weight": 0.5}]
+            }
+        },
+        "special_spaces": {"path": True, "entrance": True}
+    }
+
+
+def mock_reply(prompt):
+    """按提示词类型生成符合格式的响应
+    
+    Args:
+        prompt (str): 提示词（不含系统消息）
+    
+    Returns:
+        str: JSON格式的响应文本
+    """
+    seed = int(hashlib.md5(prompt.encode('utf-8')).hexdigest(), 16)
+    rooms = ROOM_SETS[seed % len(ROOM_SETS)]
+    # 约束条件与统一处理给出的需求猜测保持一致：优先使用需求中已列出全部房间的组合
+    task = prompt.split(PROMPT_CACHE_BOUNDARY, 1)[-1]
+    mentioned = [room_set for room_set in ROOM_SETS if all(room in task for room in room_set)]
+    if mentioned:
+        rooms = max(mentioned, key=len)
+    
+    if '"next_question"' in prompt:
+        # 统一处理：按句修改需求猜测，只返回有变化的关键问题，并给出下一个问题
+        requirement = f"用户需要包含{'、'.join(rooms)}的住宅，重视客厅采光和动静分区。"
+        if "当前用户需求猜测（按句编号）：\n[1]" in task and "返回完整内容" not in task:
+            user_requirements = {"updated": True, "edits": [{"op": "replace", "index": 1, "text": requirement}], "content": ""}
+        else:
+            user_requirements = {"updated": True, "edits": [], "content": requirement}
+        result = {
+            "thinking": "根据用户输入更新需求猜测和关键问题列表。",
+            "user_requirements": user_requirements,
+            "spatial_understanding": {"updated": False, "edits": [], "content": ""},
+            "key_questions": {
+                "updated": True,
+                "changes": [
+                    {"category": "房间数量和类型", "status": "已知", "details": f"{len(rooms)}个房间"}
+                ]
+            },
+            "next_question": MOCK_QUESTIONS[seed % len(MOCK_QUESTIONS)]
+        }
+        if "本轮可能是需求收集的最后一轮" in prompt:
+            # 最后一轮：所有关键问题都标记为已知，同一响应中给出约束条件
+            categories = re.findall(r'^(.+?): (?:已知|未知), ', task.split("当前关键问题列表：", 1)[-1], re.M)
+            result["key_questions"]["changes"] = [
+                {"category": category, "status": "已知", "details": "已确认"} for category in categories
+            ]
+            result["next_question"] = ""
+            result["constraints"] = build_constraints(rooms)
+    elif '"refined_constraints"' in prompt:
+        # 约束条件优化/布局方案优化：沿用提示词中的当前约束条件
+        current = extract_json_after(prompt, "当前约束条件：") or build_constraints(rooms)
+        result = {"refined_constraints": current}
+    elif '"answered"' in prompt:
+        result = {"answered": True}
+    elif '"summary"' in prompt:
+        # 对话摘要：取新增问答中用户的回答
+        answers = [line[len("用户: "):] for line in task.splitlines() if line.startswith("用户: ")]
+        result = {"summary": "；".join(answers)[:200] or "用户尚未提供信息。"}
+    elif "当前房间约束条件：" in prompt:
+        # rooms格式优化：沿用提示词中的rooms格式约束条件
+        current = extract_json_after(prompt, "当前房间约束条件：")
+        if current is None:
+            current = ConstraintConverter().all_to_rooms(build_constraints(rooms))
+        result = {"constraints": {"rooms": current.get("rooms", {})}}
+    elif "room_list" in prompt:
+        # 约束条件量化
+        result = {"constraints": build_constraints(rooms)}
+    else:
+        result = {"content": "模拟响应"}
+    return json.dumps(result, ensure_ascii=False)
+
+
+class MockStats:
+    """
+    模拟服务的请求统计，通过GET /stats查看
+    """
+    
+    def __init__(self):
+        """初始化统计"""
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "streamed": 0, "errors": 0, "active": 0, "max_active": 0}
+        # 见过的提示词前缀（缓存边界之前的部分），再次出现时报告为命中前缀缓存
+        self._prefixes = set()
+    
+    def begin(self):
+        """登记一个请求"""
+        with self._lock:
+            self.counts["requests"] += 1
+            self.counts["active"] += 1
+            self.counts["max_active"] = max(self.counts["max_active"], self.counts["active"])
+    
+    def end(self):
+        """登记一个请求结束"""
+        with self._lock:
+            self.counts["active"] -= 1
+    
+    def add(self, name):
+        """增加一项计数"""
+        with self._lock:
+            self.counts[name] += 1
+    
+    def cached_tokens(self, prompt):
+        """模拟提供商的前缀缓存：同一前缀第二次出现时按前缀长度报告缓存命中的token数"""
+        if PROMPT_CACHE_BOUNDARY not in prompt:
+            return 0
+        prefix = prompt.split(PROMPT_CACHE_BOUNDARY, 1)[0]
+        key = hashlib.sha256(prefix.encode('utf-8')).hexdigest()
+        with self._lock:
+            if key in self._prefixes:
+                return estimate_tokens(prefix)
+            self._prefixes.add(key)
+        return 0
+    
+    def snapshot(self):
+        """获取统计快照"""
+        with self._lock:
+            return dict(self.counts)
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """
+    请求处理：POST */chat/completions（OpenAI兼容）和 POST */messages（Anthropic）
+    """
+    
+    protocol_version = "HTTP/1.1"
+    # 由MockLLMServer设置
+    options = None
+    stats = None
+    
+    def log_message(self, format, *args):
+        """关闭每个请求的访问日志"""
+        pass
+    
+    def do_GET(self):
+        """健康检查和统计"""
+        if self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, self.stats.snapshot())
+        else:
+            self._send_json(200, {"status": "ok"})
+    
+    def do_POST(self):
+        """处理补全请求"""
+        self.stats.begin()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            
+            if random.random() < self.options.error_rate:
+                self.stats.add("errors")
+                self._send_error(random.choice(self.options.error_codes))
+                return
+            
+            if self.path.rstrip('/').endswith('/chat/completions'):
+                self._handle_openai(body)
+            elif self.path.rstrip('/').endswith('/messages'):
+                self._handle_anthropic(body)
+            else:
+                self._send_json(404, {"error": {"message": f"未知接口: {self.path}", "type": "not_found"}})
+        finally:
+            self.stats.end()
+    
+    def _prompt_text(self, messages):
+        """取出最后一条用户消息的文本（Anthropic消息可能是多个内容块）"""
+        content = messages[-1].get("content", "") if messages else ""
+        if isinstance(content, list):
+            return "".join(block.get("text", "") for block in content)
+        return content
+    
+    def _timing(self, reply):
+        """计算首token时间和每个片段的间隔
+        
+        Returns:
+            tuple: (首token等待秒数, 片段列表, 每个片段的间隔秒数)
+        """
+        ttft = max(0.0, random.gauss(self.options.ttft, self.options.ttft_jitter))
+        size = self.options.chunk_chars
+        chunks = [reply[i:i + size] for i in range(0, len(reply), size)]
+        interval = estimate_tokens(reply) / self.options.tps / len(chunks) if self.options.tps > 0 else 0.0
+        return ttft, chunks, interval
+    
+    def _handle_openai(self, body):
+        """OpenAI chat completions接口"""
+        messages = body.get("messages", [])
+        prompt = self._prompt_text(messages)
+        reply = mock_reply(prompt)
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+        completion_tokens = estimate_tokens(reply)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": self.stats.cached_tokens(prompt)}
+        }
+        model = body.get("model", "mock")
+        created = int(time.time())
+        ttft, chunks, interval = self._timing(reply)
+        
+        if not body.get("stream"):
+            time.sleep(ttft + interval * len(chunks))
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+        
+        self.stats.add("streamed")
+        self._start_stream()
+        time.sleep(ttft)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(interval)
+            self._send_event({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}]
+            })
+        self._send_event({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        })
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": usage
+            })
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._end_stream()
+    
+    def _handle_anthropic(self, body):
+        """Anthropic messages接口"""
+        prompt = self._prompt_text(body.get("messages", []))
+        reply = mock_reply(prompt)
+        cached = self.stats.cached_tokens(prompt)
+        input_tokens = estimate_tokens(str(body.get("system", ""))) + estimate_tokens(prompt) - cached
+        usage = {
+            "input_tokens": input_tokens,
+            "output_tokens": estimate_tokens(reply),
+            "cache_read_input_tokens": cached,
+            "cache_creation_input_tokens": 0
+        }
+        model = body.get("model", "mock")
+        ttft, chunks, interval = self._timing(reply)
+        
+        if not body.get("stream"):
+            time.sleep(ttft + interval * len(chunks))
+            self._send_json(200, {
+                "id": "msg_mock",
+                "type": "message",
+                "role": "assistant",
+                "model": model,
+                "content": [{"type": "text", "text": reply}],
+                "stop_reason": "end_turn",
+                "usage": usage
+            })
+            return
+        
+        self.stats.add("streamed")
+        self._start_stream()
+        time.sleep(ttft)
+        self._send_event({"type": "message_start", "message": {
+            "id": "msg_mock", "type": "message", "role": "assistant", "model": model, "content": [],
+            "usage": dict(usage, output_tokens=0)
+        }}, "message_start")
+        self._send_event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                         "content_block_start")
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(interval)
+            self._send_event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}},
+                             "content_block_delta")
+        self._send_event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        self._send_event({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                          "usage": {"output_tokens": usage["output_tokens"]}}, "message_delta")
+        self._send_event({"type": "message_stop"}, "message_stop")
+        self._end_stream()
+    
+    def _send_json(self, status, data):
+        """发送JSON响应"""
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _send_error(self, status):
+        """按提供商的格式返回错误"""
+        error_types = {429: "rate_limit_error", 500: "api_error", 503: "overloaded_error"}
+        self._send_json(status, {
+            "type": "error",
+            "error": {"type": error_types.get(status, "api_error"), "message": f"模拟错误 {status}"}
+        })
+    
+    def _start_stream(self):
+        """开始SSE流式响应（分块传输以保持长连接）"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+    
+    def _send_chunk(self, data):
+        """发送一个HTTP分块"""
+        self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        self.wfile.flush()
+    
+    def _send_event(self, data, event=None):
+        """发送一个SSE事件"""
+        text = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        if event:
+            text = f"event: {event}\n" + text
+        self._send_chunk(text.encode('utf-8'))
+    
+    def _end_stream(self):
+        """结束分块传输"""
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='本地模拟LLM服务（OpenAI兼容 / Anthropic）')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--ttft', type=float, default=0.5, help='平均首token时间（秒）')
+    parser.add_argument('--ttft-jitter', type=float, default=0.1, help='首token时间的标准差（秒）')
+    parser.add_argument('--tps', type=float, default=50.0, help='每个请求的生成速度（token/秒），0表示不限速')
+    parser.add_argument('--chunk-chars', type=int, default=8, help='每个流式片段的字符数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回错误的请求比例（0~1）')
+    parser.add_argument('--error-codes', type=int, nargs='+', default=[429, 500, 503], help='随机返回的错误状态码')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    
+    MockLLMHandler.options = args
+    MockLLMHandler.stats = MockStats()
+    server = ThreadingHTTPServer((args.host, args.port), MockLLMHandler)
+    server.daemon_threads = True
+    print(f"模拟LLM服务已启动: http://{args.host}:{args.port}/v1 "
+          f"(ttft={args.ttft}s, tps={args.tps}, error_rate={args.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
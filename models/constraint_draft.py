@@ -0,0 +1,189 @@
+"""
+约束条件草稿模块：需求收集接近完成时在后台提前生成约束条件，进入约束条件生成阶段时直接使用或在此基础上优化
+"""
+import sys
+import os
+import re
+import json
+import hashlib
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import CONSTRAINT_DRAFT_SETTINGS
+from models.constraint_quantification import ConstraintQuantification
+from utils.state_patch import StatePatcher
+
+class ConstraintDrafter:
+    """
+    约束条件草稿生成器，每个会话一个实例
+    
+    草稿以需求猜测和空间理解的哈希值为键。同一时间只生成一份草稿，生成期间需求又有变化时，
+    完成后按最新的需求再生成一次，中间的变化不会各自触发一次生成。
+    """
+    
+    def __init__(self, openai_client, if_rooms_constraints=False, settings=None):
+        """初始化约束条件草稿生成器
+        
+        Args:
+            openai_client (OpenAIClient): 会话的LLM客户端，草稿调用沿用其会话记录
+            if_rooms_constraints (bool): 是否生成并优化rooms格式约束条件
+            settings (dict, optional): 草稿设置，默认使用config.py中的CONSTRAINT_DRAFT_SETTINGS
+        """
+        self.settings = dict(CONSTRAINT_DRAFT_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self.openai_client = openai_client
+        self.if_rooms_constraints = if_rooms_constraints
+        self.patcher = StatePatcher()
+        self._client = None
+        self._lock = threading.Lock()
+        self._thread = None
+        # 正在生成的草稿的键，以及生成期间收到的最新需求
+        self._running_key = None
+        self._pending = None
+        # 每次丢弃草稿加一，丢弃之前开始的生成完成后不再保存草稿
+        self._epoch = 0
+        # 最近一次生成完成的草稿：键、需求猜测、空间理解和约束条件
+        self.draft = None
+    
+    def draft_key(self, user_requirement_guess, spatial_understanding):
+        """计算草稿的键，忽略空白字符的差异
+        
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+        
+        Returns:
+            str: 草稿的键
+        """
+        payload = json.dumps([
+            re.sub(r'\s+', ' ', user_requirement_guess or '').strip(),
+            re.sub(r'\s+', ' ', spatial_understanding or '').strip(),
+            self.if_rooms_constraints
+        ], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def schedule(self, user_requirement_guess, spatial_understanding):
+        """按当前需求在后台生成草稿，已有相同需求的草稿时不重复生成
+        
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+        
+        Returns:
+            bool: 是否开始或排队生成
+        """
+        if not self.settings["enabled"] or not user_requirement_guess:
+            return False
+        key = self.draft_key(user_requirement_guess, spatial_understanding)
+        with self._lock:
+            if self._running_key is not None:
+                # 正在生成：需求有变化则记下最新需求，完成后再生成一次
+                self._pending = None if key == self._running_key else (user_requirement_guess, spatial_understanding)
+                return self._pending is not None
+            if self.draft is not None and self.draft["key"] == key:
+                return False
+            self._running_key = key
+            self._thread = threading.Thread(
+                target=self._run, args=(user_requirement_guess, spatial_understanding, key, self._epoch),
+                name="constraint-draft", daemon=True
+            )
+            self._thread.start()
+        print("已开始在后台生成约束条件草稿")
+        return True
+    
+    def take(self, user_requirement_guess, spatial_understanding):
+        """取出草稿，正在生成时等待其完成
+        
+        Args:
+            user_requirement_guess (str): 当前的用户需求猜测
+            spatial_understanding (str): 当前的空间理解记录
+        
+        Returns:
+            tuple: (草稿, 是否与当前需求一致)，没有可用的草稿时草稿为None
+        """
+        with self._lock:
+            # 不再需要按更新的需求排队生成
+            self._pending = None
+            thread = self._thread
+        if thread is not None:
+            thread.join(self.settings["wait_timeout"])
+        with self._lock:
+            draft = self.draft
+        if draft is None:
+            return None, False
+        draft = json.loads(json.dumps(draft, ensure_ascii=False))
+        return draft, draft["key"] == self.draft_key(user_requirement_guess, spatial_understanding)
+    
+    def discard(self):
+        """丢弃草稿和排队中的需求，已不需要草稿时调用；进行中的生成完成后丢弃结果并结束"""
+        with self._lock:
+            self._pending = None
+            self.draft = None
+            self._epoch += 1
+    
+    def describe_changes(self, draft, user_requirement_guess, spatial_understanding):
+        """描述草稿生成之后需求的变化，作为在草稿基础上优化的反馈意见
+        
+        Args:
+            draft (dict): 草稿
+            user_requirement_guess (str): 当前的用户需求猜测
+            spatial_understanding (str): 当前的空间理解记录
+        
+        Returns:
+            str: 反馈意见
+        """
+        parts = ["当前约束条件是根据较早的需求猜测生成的，此后需求有以下变化，请据此调整约束条件，未涉及的部分保持不变。"]
+        for name, old_text, new_text in [
+            ("用户需求", draft["user_requirement_guess"], user_requirement_guess),
+            ("空间理解", draft["spatial_understanding"], spatial_understanding)
+        ]:
+            old_sentences = [s.strip() for s in self.patcher.split_sentences(old_text) if s.strip()]
+            new_sentences = [s.strip() for s in self.patcher.split_sentences(new_text) if s.strip()]
+            added = [s for s in new_sentences if s not in old_sentences]
+            removed = [s for s in old_sentences if s not in new_sentences]
+            if added:
+                parts.append(f"{name}新增或修改：\n" + "\n".join(f"- {s}" for s in added))
+            if removed:
+                parts.append(f"{name}删除或被替换：\n" + "\n".join(f"- {s}" for s in removed))
+        return "\n\n".join(parts)
+    
+    def _run(self, user_requirement_guess, spatial_understanding, key, epoch):
+        """生成草稿，生成期间需求有变化时按最新需求继续生成；开始生成后调用过discard时不保存结果"""
+        while True:
+            constraints = None
+            try:
+                quantification = ConstraintQuantification(self._get_client())
+                constraints = quantification.generate_constraints(
+                    user_requirement_guess, spatial_understanding, self.if_rooms_constraints
+                )
+            except Exception as e:
+                print(f"生成约束条件草稿时出错: {str(e)}")
+            finally:
+                if self._client is not None:
+                    self._client.event_bus.close_channel(self._client.event_channel)
+            
+            with self._lock:
+                # 只保存包含房间的草稿，调用失败时返回的空模板不作为草稿
+                if epoch == self._epoch and constraints and constraints.get("hard_constraints", {}).get("room_list"):
+                    self.draft = {
+                        "key": key,
+                        "user_requirement_guess": user_requirement_guess,
+                        "spatial_understanding": spatial_understanding,
+                        "constraints": constraints
+                    }
+                pending, self._pending = self._pending, None
+                if pending is None:
+                    self._running_key = None
+                    self._thread = None
+                    return
+                user_requirement_guess, spatial_understanding = pending
+                key = self.draft_key(user_requirement_guess, spatial_understanding)
+                self._running_key = key
+                epoch = self._epoch
+    
+    def _get_client(self):
+        """获取生成草稿用的LLM客户端，每次生成时按会话客户端当前的设置创建"""
+        self._client = self.openai_client.fork(f"constraint-draft-{id(self)}")
+        return self._client
@@ -4,12 +4,23 @@
 import sys
 import os
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import CONSTRAINT_QUANTIFICATION_PROMPT, CONSTRAINT_QUANTIFICATION_TEMPERATURE, CONSTRAINT_ROOMS_OPTIMIZATION_PROMPT
 from config import BASE_PROMPT, TEMPLATE_CONSTRAINTS_ALL_PATH, TEMPLATE_CONSTRAINTS_ROOMS_PATH, PROMPT_TEMPLATE_CONSTRAINTS_ALL_PATH, PROMPT_TEMPLATE_CONSTRAINTS_ROOMS_PATH
-from config import CONSTRAINT_QUANTIFICATION_MODEL
+from config import CONSTRAINT_QUANTIFICATION_MODEL, CONSTRAINT_QUANTIFICATION_USE_CACHE
+from config import CONSTRAINT_ROOMS_CLUSTER_OPTIMIZATION_PROMPT, ROOMS_OPTIMIZATION_FANOUT, CONSTRAINT_BASE_PROMPT_PATH
+from utils.prompt_registry import get_prompt_registry
+
+# 流式输出中逐个发布的房间条目（兼容多出的"constraints"嵌套层）
+ALL_STREAM_FIELDS = ["hard_constraints.room_list.*", "constraints.hard_constraints.room_list.*"]
+ROOMS_STREAM_FIELDS = ["rooms.*", "constraints.rooms.*"]
+
+# all格式响应的顶层字段，JSON修复时用于去除多余的包装层（rooms格式的包装层由解析处理）
+ALL_RESPONSE_KEYS = ["hard_constraints", "soft_constraints"]
 
 class ConstraintQuantification:
     """
@@ -23,6 +34,8 @@ class ConstraintQuantification:
             openai_client: OpenAI API客户端实例
         """
         self.openai_client = openai_client
+        # 模板文件和提示词的固定部分由进程级注册表加载一次
+        self.prompts = get_prompt_registry()
     
     def generate_constraints(self, user_requirement_guess, spatial_understanding, if_rooms_constraints):
         """生成约束条件
@@ -42,34 +55,179 @@ class ConstraintQuantification:
             return constraint_template_all
         
         # 步骤1: 生成all格式的约束条件
-        # 准备提示词，使用带注释的模板
-        with open(PROMPT_TEMPLATE_CONSTRAINTS_ALL_PATH, 'r', encoding='utf-8') as f:
-            template_all_with_comments = f.read()
-        
-        # 读取约束条件基础提示词
-        with open('templates/constraint_base_prompt.txt', 'r', encoding='utf-8') as f:
-            CONSTRAINT_BASE_PROMPT = f.read()
-
-        prompt_all = CONSTRAINT_QUANTIFICATION_PROMPT.format(
-            base_prompt=BASE_PROMPT,
-            constraint_base_prompt=CONSTRAINT_BASE_PROMPT,
-            user_requirement_guess=user_requirement_guess,
-            spatial_understanding=spatial_understanding,
-            constraint_template=template_all_with_comments
-        )
+        prompt_all = self._build_all_prompt(user_requirement_guess, spatial_understanding)
         
         # 调用API生成all格式约束条件
         response_all = self.openai_client.generate_completion(
             prompt=prompt_all,
             model_name=CONSTRAINT_QUANTIFICATION_MODEL,
-            temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE
+            temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE,
+            use_cache=CONSTRAINT_QUANTIFICATION_USE_CACHE,
+            stream_fields=ALL_STREAM_FIELDS,
+            json_keys=ALL_RESPONSE_KEYS
         )
         
         # 如果API调用失败或返回为空，则返回空约束条件
         if not response_all:
             return constraint_template_all
         
-        # 处理API返回的JSON响应
+        constraints_all = self._parse_all_response(response_all, constraint_template_all)
+        if not if_rooms_constraints:
+            return constraints_all
+        
+        # 步骤2-4: 转换为rooms格式、优化后同步回all格式
+        return self.optimize_rooms(user_requirement_guess, spatial_understanding, constraints_all)
+    
+    def optimize_rooms(self, user_requirement_guess, spatial_understanding, constraints_all):
+        """将all格式约束条件转换为rooms格式，由LLM优化后再同步回all格式
+        
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+            constraints_all (dict): all格式约束条件
+        
+        Returns:
+            dict: 优化后的all格式约束条件
+        """
+        # 步骤2: 将all格式转换为rooms格式
+        from utils.converter import ConstraintConverter
+        converter = ConstraintConverter()
+        constraints_rooms = converter.all_to_rooms(constraints_all)
+        
+        # 步骤3: 优化rooms格式的约束条件，房间较多时分组并行优化
+        groups = self._split_room_groups(converter, constraints_rooms)
+        if groups:
+            with ThreadPoolExecutor(max_workers=ROOMS_OPTIMIZATION_FANOUT["max_workers"]) as executor:
+                optimized_groups = list(executor.map(
+                    lambda group: self._optimize_room_group(user_requirement_guess, spatial_understanding, constraints_rooms, group),
+                    groups
+                ))
+            optimized_constraints_rooms = converter.merge_rooms(constraints_rooms, optimized_groups)
+        else:
+            prompt_rooms = self._build_rooms_prompt(user_requirement_guess, spatial_understanding, constraints_rooms)
+            
+            # 调用API优化rooms格式约束条件
+            response_rooms = self.openai_client.generate_completion(
+                prompt=prompt_rooms,
+                model_name=CONSTRAINT_QUANTIFICATION_MODEL,
+                temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE,
+                use_cache=CONSTRAINT_QUANTIFICATION_USE_CACHE,
+                stream_fields=ROOMS_STREAM_FIELDS
+            )
+            optimized_constraints_rooms = self._parse_rooms_response(response_rooms, constraints_rooms)
+        
+        # 步骤4: 将优化后的rooms格式同步回all格式
+        final_constraints_all = converter.rooms_to_all(optimized_constraints_rooms, constraints_all)
+        
+        return final_constraints_all
+    
+    async def agenerate_constraints(self, user_requirement_guess, spatial_understanding, if_rooms_constraints):
+        """generate_constraints的asyncio版本，参数和返回值与generate_constraints一致
+        
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+        
+        Returns:
+            dict: 生成的约束条件（JSON格式）
+        """
+        # 模板文件的读取和检查放到工作线程中，不阻塞事件循环
+        constraint_template_all = await asyncio.to_thread(self._load_constraint_template, TEMPLATE_CONSTRAINTS_ALL_PATH)
+        
+        if not user_requirement_guess or user_requirement_guess == "目前没有关于用户需求的猜测。":
+            return constraint_template_all
+        
+        # 步骤1: 生成all格式的约束条件
+        prompt_all = await asyncio.to_thread(self._build_all_prompt, user_requirement_guess, spatial_understanding)
+        response_all = await self.openai_client.agenerate_completion(
+            prompt=prompt_all,
+            model_name=CONSTRAINT_QUANTIFICATION_MODEL,
+            temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE,
+            use_cache=CONSTRAINT_QUANTIFICATION_USE_CACHE,
+            stream_fields=ALL_STREAM_FIELDS,
+            json_keys=ALL_RESPONSE_KEYS
+        )
+        if not response_all:
+            return constraint_template_all
+        
+        constraints_all = self._parse_all_response(response_all, constraint_template_all)
+        if not if_rooms_constraints:
+            return constraints_all
+        
+        # 步骤2-4: 转换为rooms格式、优化后同步回all格式
+        return await self.aoptimize_rooms(user_requirement_guess, spatial_understanding, constraints_all)
+    
+    async def aoptimize_rooms(self, user_requirement_guess, spatial_understanding, constraints_all):
+        """optimize_rooms的asyncio版本，参数和返回值与optimize_rooms一致
+        
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+            constraints_all (dict): all格式约束条件
+        
+        Returns:
+            dict: 优化后的all格式约束条件
+        """
+        from utils.converter import ConstraintConverter
+        converter = ConstraintConverter()
+        constraints_rooms = converter.all_to_rooms(constraints_all)
+        
+        groups = self._split_room_groups(converter, constraints_rooms)
+        if groups:
+            semaphore = asyncio.Semaphore(ROOMS_OPTIMIZATION_FANOUT["max_workers"])
+            
+            async def optimize(group):
+                async with semaphore:
+                    return await self._aoptimize_room_group(user_requirement_guess, spatial_understanding, constraints_rooms, group)
+            
+            optimized_groups = await asyncio.gather(*(optimize(group) for group in groups))
+            optimized_constraints_rooms = converter.merge_rooms(constraints_rooms, optimized_groups)
+        else:
+            prompt_rooms = await asyncio.to_thread(self._build_rooms_prompt, user_requirement_guess, spatial_understanding, constraints_rooms)
+            response_rooms = await self.openai_client.agenerate_completion(
+                prompt=prompt_rooms,
+                model_name=CONSTRAINT_QUANTIFICATION_MODEL,
+                temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE,
+                use_cache=CONSTRAINT_QUANTIFICATION_USE_CACHE,
+                stream_fields=ROOMS_STREAM_FIELDS
+            )
+            optimized_constraints_rooms = self._parse_rooms_response(response_rooms, constraints_rooms)
+        
+        return converter.rooms_to_all(optimized_constraints_rooms, constraints_all)
+    
+    def _build_all_prompt(self, user_requirement_guess, spatial_understanding):
+        """准备生成all格式约束条件的提示词，使用带注释的模板
+        
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+        
+        Returns:
+            str: 提示词
+        """
+        template = self.prompts.template(
+            "constraint_quantification", CONSTRAINT_QUANTIFICATION_PROMPT,
+            assets={
+                "constraint_base_prompt": CONSTRAINT_BASE_PROMPT_PATH,
+                "constraint_template": PROMPT_TEMPLATE_CONSTRAINTS_ALL_PATH
+            },
+            base_prompt=BASE_PROMPT
+        )
+        return template.format(
+            user_requirement_guess=user_requirement_guess,
+            spatial_understanding=spatial_understanding
+        )
+    
+    def _parse_all_response(self, response_all, constraint_template_all):
+        """处理生成all格式约束条件的API响应
+        
+        Args:
+            response_all (str): API返回的文本
+            constraint_template_all (dict): 解析失败时使用的空模板
+        
+        Returns:
+            dict: all格式约束条件
+        """
         try:
             result_all = json.loads(response_all)
             # 处理多出的"constraints"嵌套层问题
@@ -80,54 +238,154 @@ class ConstraintQuantification:
         except (json.JSONDecodeError, TypeError):
             # 如果解析失败，使用空模板
             constraints_all = constraint_template_all
-        if not if_rooms_constraints:
-            return constraints_all
+        return constraints_all
     
-        # 步骤2: 将all格式转换为rooms格式
-        from utils.converter import ConstraintConverter
-        converter = ConstraintConverter()
-        constraints_rooms = converter.all_to_rooms(constraints_all)
+    def _build_rooms_prompt(self, user_requirement_guess, spatial_understanding, constraints_rooms):
+        """准备优化rooms格式约束条件的提示词，使用带注释的模板
         
-        # 步骤3: 优化rooms格式的约束条件
-        # 准备提示词，使用带注释的模板
-        with open(PROMPT_TEMPLATE_CONSTRAINTS_ROOMS_PATH, 'r', encoding='utf-8') as f:
-            template_rooms_with_comments = f.read()
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+            constraints_rooms (dict): 待优化的rooms格式约束条件
         
+        Returns:
+            str: 提示词
+        """
         # 使用config中定义的优化rooms格式的提示词
-        prompt_rooms = CONSTRAINT_ROOMS_OPTIMIZATION_PROMPT.format(
+        template = self.prompts.template(
+            "constraint_rooms_optimization", CONSTRAINT_ROOMS_OPTIMIZATION_PROMPT,
+            assets={"template_rooms_with_comments": PROMPT_TEMPLATE_CONSTRAINTS_ROOMS_PATH}
+        )
+        return template.format(
             user_requirement_guess=user_requirement_guess,
             spatial_understanding=spatial_understanding,
-            constraints_rooms=json.dumps(constraints_rooms, ensure_ascii=False, indent=2),
-            template_rooms_with_comments=template_rooms_with_comments
+            constraints_rooms=json.dumps(constraints_rooms, ensure_ascii=False, indent=2)
         )
+    
+    def _split_room_groups(self, converter, constraints_rooms):
+        """房间较多时按连接和相邻关系分组
+        
+        Args:
+            converter (ConstraintConverter): 约束条件格式转换工具
+            constraints_rooms (dict): rooms格式的约束条件
+        
+        Returns:
+            list: 分组结果，每组为房间名列表；不需要分组时返回None
+        """
+        if not ROOMS_OPTIMIZATION_FANOUT["enabled"] or len(constraints_rooms.get("rooms", {})) < ROOMS_OPTIMIZATION_FANOUT["min_rooms"]:
+            return None
+        groups = converter.split_rooms(constraints_rooms, ROOMS_OPTIMIZATION_FANOUT["max_rooms_per_cluster"])
+        if len(groups) < 2:
+            return None
+        print(f"{len(constraints_rooms['rooms'])}个房间分为{len(groups)}组并行优化")
+        return groups
+    
+    def _optimize_room_group(self, user_requirement_guess, spatial_understanding, constraints_rooms, group):
+        """优化一组房间的rooms格式约束条件
         
-        # 调用API优化rooms格式约束条件
-        response_rooms = self.openai_client.generate_completion(
-            prompt=prompt_rooms,
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+            constraints_rooms (dict): 全部房间的rooms格式约束条件
+            group (list): 本组的房间名
+        
+        Returns:
+            dict: 本组房间优化后的约束条件{房间名: 约束条件}，调用或解析失败时为原约束条件
+        """
+        group_rooms = {room: constraints_rooms["rooms"][room] for room in group}
+        prompt = self._build_rooms_cluster_prompt(user_requirement_guess, spatial_understanding, constraints_rooms, group_rooms)
+        response = self.openai_client.generate_completion(
+            prompt=prompt,
             model_name=CONSTRAINT_QUANTIFICATION_MODEL,
-            temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE
+            temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE,
+            use_cache=CONSTRAINT_QUANTIFICATION_USE_CACHE,
+            stream_fields=ROOMS_STREAM_FIELDS
+        )
+        return self._parse_room_group_response(response, constraints_rooms, group_rooms)
+    
+    async def _aoptimize_room_group(self, user_requirement_guess, spatial_understanding, constraints_rooms, group):
+        """_optimize_room_group的asyncio版本，参数和返回值与_optimize_room_group一致"""
+        group_rooms = {room: constraints_rooms["rooms"][room] for room in group}
+        prompt = await asyncio.to_thread(
+            self._build_rooms_cluster_prompt, user_requirement_guess, spatial_understanding, constraints_rooms, group_rooms
+        )
+        response = await self.openai_client.agenerate_completion(
+            prompt=prompt,
+            model_name=CONSTRAINT_QUANTIFICATION_MODEL,
+            temperature=CONSTRAINT_QUANTIFICATION_TEMPERATURE,
+            use_cache=CONSTRAINT_QUANTIFICATION_USE_CACHE,
+            stream_fields=ROOMS_STREAM_FIELDS
+        )
+        return self._parse_room_group_response(response, constraints_rooms, group_rooms)
+    
+    def _build_rooms_cluster_prompt(self, user_requirement_guess, spatial_understanding, constraints_rooms, group_rooms):
+        """准备优化一组房间的提示词
+        
+        Args:
+            user_requirement_guess (str): 用户需求猜测
+            spatial_understanding (str): 空间理解记录
+            constraints_rooms (dict): 全部房间的rooms格式约束条件
+            group_rooms (dict): 本组房间的约束条件
+        
+        Returns:
+            str: 提示词
+        """
+        template = self.prompts.template(
+            "constraint_rooms_cluster_optimization", CONSTRAINT_ROOMS_CLUSTER_OPTIMIZATION_PROMPT,
+            assets={"template_rooms_with_comments": PROMPT_TEMPLATE_CONSTRAINTS_ROOMS_PATH}
         )
+        return template.format(
+            user_requirement_guess=user_requirement_guess,
+            spatial_understanding=spatial_understanding,
+            all_rooms="、".join(constraints_rooms["rooms"].keys()),
+            constraints_rooms=json.dumps({"rooms": group_rooms}, ensure_ascii=False, indent=2)
+        )
+    
+    def _parse_room_group_response(self, response, constraints_rooms, group_rooms):
+        """处理优化一组房间的API响应，只保留本组房间和新增的房间
+        
+        Args:
+            response (str): API返回的文本
+            constraints_rooms (dict): 全部房间的rooms格式约束条件
+            group_rooms (dict): 本组房间的约束条件，调用或解析失败时原样返回
+        
+        Returns:
+            dict: 本组房间优化后的约束条件{房间名: 约束条件}
+        """
+        parsed = self._parse_rooms_response(response, {"rooms": group_rooms})
+        rooms = parsed.get("rooms") if isinstance(parsed, dict) else None
+        if not isinstance(rooms, dict):
+            return group_rooms
+        return {
+            room: room_constraints for room, room_constraints in rooms.items()
+            if room in group_rooms or room not in constraints_rooms["rooms"]
+        }
+    
+    def _parse_rooms_response(self, response_rooms, constraints_rooms):
+        """处理优化rooms格式约束条件的API响应
+        
+        Args:
+            response_rooms (str): API返回的文本
+            constraints_rooms (dict): 调用失败或解析失败时使用的rooms格式约束条件
         
+        Returns:
+            dict: 优化后的rooms格式约束条件
+        """
         # 如果API调用失败或返回为空，则使用转换得到的rooms格式
         if not response_rooms:
-            optimized_constraints_rooms = constraints_rooms
-        else:
-            # 处理API返回的JSON响应
-            try:
-                result_rooms = json.loads(response_rooms)
-                # 处理多出的"constraints"嵌套层问题
-                if "constraints" in result_rooms and "rooms" in result_rooms["constraints"]:
-                    optimized_constraints_rooms = {"rooms": result_rooms["constraints"]["rooms"]}
-                else:
-                    optimized_constraints_rooms = result_rooms.get("constraints", constraints_rooms)
-            except (json.JSONDecodeError, TypeError):
-                # 如果解析失败，使用转换得到的rooms格式
-                optimized_constraints_rooms = constraints_rooms
-        
-        # 步骤4: 将优化后的rooms格式同步回all格式
-        final_constraints_all = converter.rooms_to_all(optimized_constraints_rooms, constraints_all)
+            return constraints_rooms
         
-        return final_constraints_all
+        # 处理API返回的JSON响应
+        try:
+            result_rooms = json.loads(response_rooms)
+            # 处理多出的"constraints"嵌套层问题
+            if "constraints" in result_rooms and "rooms" in result_rooms["constraints"]:
+                return {"rooms": result_rooms["constraints"]["rooms"]}
+            else:
+                return result_rooms.get("constraints", constraints_rooms)
+        except (json.JSONDecodeError, TypeError):
+            # 如果解析失败，使用转换得到的rooms格式
+            return constraints_rooms
     
     def _load_constraint_template(self, template_path):
         """加载约束条件模板
@@ -139,8 +397,7 @@ class ConstraintQuantification:
             dict: 约束条件模板
         """
         try:
-            with open(template_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return self.prompts.json(template_path)
         except (FileNotFoundError, json.JSONDecodeError):
             # 如果文件不存在或解析失败，返回一个空的模板
             if template_path == TEMPLATE_CONSTRAINTS_ALL_PATH:
@@ -157,30 +414,3 @@ class ConstraintQuantification:
                 }
             else:  # TEMPLATE_CONSTRAINTS_ROOMS_PATH
                 return {"rooms": {}}
-    
-    def _extract_json(self, text):
-        """从文本中提取JSON部分
-        
-        Args:
-            text (str): 包含JSON的文本
-        
-        Returns:
-            str: 提取的JSON字符串
-        """
-        # 尝试找到JSON的开始和结束位置
-        start_idx = text.find('{')
-        if start_idx == -1:
-            return "{}"
-        
-        # 计算括号的嵌套深度，找到对应的结束括号
-        depth = 0
-        for i in range(start_idx, len(text)):
-            if text[i] == '{':
-                depth += 1
-            elif text[i] == '}':
-                depth -= 1
-                if depth == 0:
-                    return text[start_idx:i+1]
-        
-        # 如果没有找到匹配的结束括号，返回空JSON
-        return "{}"
\ No newline at end of file
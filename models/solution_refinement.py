@@ -4,10 +4,15 @@
 import sys
 import os
 import json
+import asyncio
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import SOLUTION_REFINEMENT_PROMPT, CONSTRAINT_QUANTIFICATION_MODEL, BASE_PROMPT
+from config import SOLUTION_REFINEMENT_PROMPT, CONSTRAINT_QUANTIFICATION_MODEL, BASE_PROMPT, CONSTRAINT_REFINEMENT_USE_CACHE
+from config import CONSTRAINT_BASE_PROMPT_PATH, CONSTRAINT_COMPACT_ENCODING, REFINEMENT_OUTPUT_FORMAT, REFINEMENT_COMPACT_OUTPUT_FORMAT
+from utils.prompt_registry import get_prompt_registry
+from utils.converter import ConstraintConverter
+from utils.token_counter import get_token_counter
 
 class SolutionRefinement:
     """
@@ -21,6 +26,11 @@ class SolutionRefinement:
             openai_client: OpenAI API客户端实例
         """
         self.openai_client = openai_client
+        # 模板文件和提示词的固定部分由进程级注册表加载一次
+        self.prompts = get_prompt_registry()
+        # 提示词和响应中的约束条件使用紧凑格式，不再重复每条约束的字段名
+        self.compact = CONSTRAINT_COMPACT_ENCODING
+        self.converter = ConstraintConverter()
     
     def refine_solution(self, constraints, current_solution, user_feedback, spatial_understanding, model_name=None):
         """根据用户反馈优化布局方案
@@ -43,33 +53,89 @@ class SolutionRefinement:
         if not model_name:
             model_name = CONSTRAINT_QUANTIFICATION_MODEL
             
-        # 读取约束条件基础提示词
-        from config import BASE_PROMPT
+        # 准备提示词
+        prompt = self._build_prompt(constraints, current_solution, user_feedback, spatial_understanding)
             
-        # 读取约束条件基础提示词
-        try:
-            with open('templates/constraint_base_prompt.txt', 'r', encoding='utf-8') as f:
-                CONSTRAINT_BASE_PROMPT = f.read()
-        except:
-            CONSTRAINT_BASE_PROMPT = ""
+        # 调用API优化约束条件
+        response = self.openai_client.generate_completion(
+            prompt=prompt,
+            model_name=model_name,
+            temperature=0.5,  # 使用较低温度以获得更精确的结果
+            use_cache=CONSTRAINT_REFINEMENT_USE_CACHE,
+            json_keys=["refined_constraints"]
+        )
             
-        # 准备提示词
-        prompt = SOLUTION_REFINEMENT_PROMPT.format(
+        return self._process_response(response, constraints, original_constraints)
+    
+    async def arefine_solution(self, constraints, current_solution, user_feedback, spatial_understanding, model_name=None):
+        """refine_solution的asyncio版本，参数和返回值与refine_solution一致
+        
+        Args:
+            constraints (dict): 当前的约束条件（all格式）
+            current_solution (dict): 当前的布局方案
+            user_feedback (str): 用户的反馈意见
+            spatial_understanding (str): 空间理解记录
+            model_name (str, optional): 使用的模型名称
+        
+        Returns:
+            dict: 优化后的约束条件（调整约束，而不是直接修改布局方案）
+            list: 约束条件变化对比
+        """
+        original_constraints = json.loads(json.dumps(constraints))
+        
+        if not model_name:
+            model_name = CONSTRAINT_QUANTIFICATION_MODEL
+        
+        # 模板文件的读取和检查放到工作线程中，不阻塞事件循环
+        prompt = await asyncio.to_thread(self._build_prompt, constraints, current_solution, user_feedback, spatial_understanding)
+        
+        response = await self.openai_client.agenerate_completion(
+            prompt=prompt,
+            model_name=model_name,
+            temperature=0.5,  # 使用较低温度以获得更精确的结果
+            use_cache=CONSTRAINT_REFINEMENT_USE_CACHE,
+            json_keys=["refined_constraints"]
+        )
+        
+        return self._process_response(response, constraints, original_constraints)
+    
+    def _build_prompt(self, constraints, current_solution, user_feedback, spatial_understanding):
+        """准备布局方案优化的提示词
+        
+        Args:
+            constraints (dict): 当前的约束条件（all格式）
+            current_solution (dict): 当前的布局方案
+            user_feedback (str): 用户的反馈意见
+            spatial_understanding (str): 空间理解记录
+        
+        Returns:
+            str: 提示词
+        """
+        template = self.prompts.template(
+            "solution_refinement_compact" if self.compact else "solution_refinement", SOLUTION_REFINEMENT_PROMPT,
+            assets={"constraint_base_prompt": CONSTRAINT_BASE_PROMPT_PATH},
             base_prompt=BASE_PROMPT,
-            constraint_base_prompt=CONSTRAINT_BASE_PROMPT,
-            current_constraints=json.dumps(constraints, ensure_ascii=False, indent=2),
+            output_format=REFINEMENT_COMPACT_OUTPUT_FORMAT if self.compact else REFINEMENT_OUTPUT_FORMAT
+        )
+        return template.format(
+            current_constraints=self._encode_constraints(constraints),
             current_solution=json.dumps(current_solution, ensure_ascii=False, indent=2),
             user_feedback=user_feedback,
             spatial_understanding=spatial_understanding
         )
         
-        # 调用API优化约束条件
-        response = self.openai_client.generate_completion(
-            prompt=prompt,
-            model_name=model_name,
-            temperature=0.5  # 使用较低温度以获得更精确的结果
-        )
+    def _process_response(self, response, constraints, original_constraints):
+        """解析API响应，验证并补全约束条件，生成变化对比
         
+        Args:
+            response (str): API返回的文本
+            constraints (dict): 当前的约束条件，调用或解析失败时原样返回
+            original_constraints (dict): 原始约束条件的副本，用于比较
+        
+        Returns:
+            dict: 优化后的约束条件
+            list: 约束条件变化对比
+        """
         # 如果API调用失败或返回为空，则返回原约束条件
         if not response:
             return constraints, None
@@ -84,6 +150,12 @@ class SolutionRefinement:
             else:
                 refined_constraints = result
             
+            # 紧凑格式的响应（文本或按行拆分的列表）解码为all格式
+            if isinstance(refined_constraints, (str, list)):
+                compact_response = refined_constraints
+                refined_constraints = self.converter.compact_to_all(compact_response)
+                self._record_encoding_stats(original_constraints, compact_response, refined_constraints)
+            
             # 检查refined_constraints的格式是否符合预期
             if not self._validate_constraints(refined_constraints):
                 print("优化后的约束条件格式不符合预期，将使用原约束条件。")
@@ -109,10 +181,45 @@ class SolutionRefinement:
             
             return refined_constraints, diff_table
         
-        except (json.JSONDecodeError, TypeError) as e:
+        except (ValueError, TypeError) as e:
+            # ValueError包括JSON和紧凑格式的解析错误
             print(f"解析优化后的约束条件时出错: {str(e)}")
             return constraints, None
     
+    def _encode_constraints(self, constraints):
+        """按设置把当前约束条件编码为紧凑格式或缩进的JSON
+        
+        Args:
+            constraints (dict): all格式的约束条件
+        
+        Returns:
+            str: 提示词中的约束条件
+        """
+        if self.compact:
+            return self.converter.all_to_compact(constraints)
+        return json.dumps(constraints, ensure_ascii=False, indent=2)
+    
+    def _record_encoding_stats(self, constraints, compact_response, refined_constraints):
+        """统计本次调用使用紧凑格式节省的输入和输出token，记录到会话中
+        
+        Args:
+            constraints (dict): 提示词中的当前约束条件
+            compact_response (str | list): 响应中紧凑格式的约束条件
+            refined_constraints (dict): 解码后的约束条件
+        """
+        counter = get_token_counter()
+        stats = {
+            "prompt_json_tokens": counter.count(json.dumps(constraints, ensure_ascii=False, indent=2)),
+            "prompt_compact_tokens": counter.count(self.converter.all_to_compact(constraints)),
+            "completion_json_tokens": counter.count(json.dumps({"refined_constraints": refined_constraints}, ensure_ascii=False, indent=2)),
+            "completion_compact_tokens": counter.count(json.dumps({"refined_constraints": compact_response}, ensure_ascii=False, indent=2))
+        }
+        saved = stats["prompt_json_tokens"] + stats["completion_json_tokens"] - stats["prompt_compact_tokens"] - stats["completion_compact_tokens"]
+        stats["saved_tokens"] = saved
+        print(f"约束条件紧凑格式节省约{saved}个token")
+        if self.openai_client.session_manager:
+            self.openai_client.session_manager.add_intermediate_state("constraint_encoding", stats)
+    
     def _validate_constraints(self, constraints):
         """验证约束条件的格式是否符合预期
         
@@ -2,10 +2,33 @@
 import sys
 import os
 import json
+import asyncio
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import BASE_PROMPT, DEFAULT_MODEL
+from config import BASE_PROMPT, UNIFIED_PROCESSING_PROMPT, UNIFIED_FINAL_TURN_PROMPT, DEFAULT_MODEL, QUESTION_GENERATION_USE_CACHE, QUESTION_GENERATION_HEDGE
+from config import CONSTRAINT_QUANTIFICATION_MODEL, CONSTRAINT_QUANTIFICATION_TEMPERATURE, FINAL_TURN_CONSTRAINTS
+from config import PROMPT_TEMPLATE_CONSTRAINTS_ALL_PATH, CONSTRAINT_BASE_PROMPT_PATH
+from utils.conversation_context import ConversationContext
+from utils.state_patch import StatePatcher
+from utils.prompt_registry import get_prompt_registry
+
+# 流式输出中提前发布的字段：下一个问题在思考过程等长字段生成完之前即可展示
+STREAM_FIELDS = ["next_question"]
+
+# 响应的顶层字段，JSON修复时用于恢复字段
+RESPONSE_KEYS = ["next_question", "thinking", "user_requirements", "spatial_understanding", "key_questions"]
+
+# 最后一轮的响应中附带约束条件，约束条件不允许截断补全
+FINAL_TURN_RESPONSE_KEYS = RESPONSE_KEYS + ["constraints"]
+FINAL_TURN_COMPLETE_KEYS = ["constraints"]
+
+# 增量更新的字段及其在提示词中的名称
+UPDATE_FIELD_NAMES = {
+    "user_requirements": "用户需求猜测",
+    "spatial_understanding": "空间理解记录",
+    "key_questions": "关键问题列表"
+}
 
 class UnifiedProcessor:
     """
@@ -19,9 +42,17 @@ class UnifiedProcessor:
             openai_client: OpenAI API客户端实例
         """
         self.openai_client = openai_client
+        # 模板文件和提示词的固定部分由进程级注册表加载一次
+        self.prompts = get_prompt_registry()
+        # 对话记录按token预算构建，早期问答在后台滚动压缩为摘要
+        self.context = ConversationContext(openai_client)
+        # 需求猜测和空间理解按句编号，LLM只返回有变化的句子
+        self.patcher = StatePatcher()
+        # 上一轮修改未能应用的字段，本轮要求LLM返回完整内容
+        self.full_content_fields = set()
     
     def process(self, user_input, current_spatial_understanding, current_requirement_guess, 
-                current_key_questions, conversation_history):
+                current_key_questions, conversation_history, final_turn=False):
         """处理用户输入，更新空间理解、用户需求猜测、关键问题列表，并生成下一个问题
         
         Args:
@@ -30,40 +61,159 @@ class UnifiedProcessor:
             current_requirement_guess (str): 当前的用户需求猜测
             current_key_questions (list): 当前的关键问题列表
             conversation_history (list): 系统与用户的问答记录
+            final_turn (bool, optional): 是否可能是需求收集的最后一轮，是则所有问题都已知时同一响应中附带约束条件
+        
+        Returns:
+            dict: 包含更新后的空间理解、用户需求猜测、关键问题列表和下一个问题的JSON对象
+        """
+        prompt, current_spatial_understanding, current_requirement_guess = self._build_request(
+            user_input, current_spatial_understanding, current_requirement_guess,
+            current_key_questions, conversation_history, final_turn
+        )
+        
+        # 调用OpenAI API获取更新后的信息
+        response = self.openai_client.generate_completion(
+            prompt=prompt,
+            use_cache=QUESTION_GENERATION_USE_CACHE,
+            stream_fields=STREAM_FIELDS,
+            **self._call_settings(final_turn)
+        )
+        
+        return self._parse_response(response, current_spatial_understanding, current_requirement_guess, current_key_questions)
+    
+    async def aprocess(self, user_input, current_spatial_understanding, current_requirement_guess, 
+                       current_key_questions, conversation_history, final_turn=False):
+        """process的asyncio版本，参数和返回值与process一致
+        
+        Args:
+            user_input (str): 用户输入的文本
+            current_spatial_understanding (str): 当前的空间理解记录
+            current_requirement_guess (str): 当前的用户需求猜测
+            current_key_questions (list): 当前的关键问题列表
+            conversation_history (list): 系统与用户的问答记录
+            final_turn (bool, optional): 是否可能是需求收集的最后一轮，是则所有问题都已知时同一响应中附带约束条件
         
         Returns:
             dict: 包含更新后的空间理解、用户需求猜测、关键问题列表和下一个问题的JSON对象
         """
-        # 如果当前没有空间理解记录，则初始化为空字符串
+        # 模板文件的读取和对话记录的token统计放到工作线程中，不阻塞事件循环
+        prompt, current_spatial_understanding, current_requirement_guess = await asyncio.to_thread(
+            self._build_request, user_input, current_spatial_understanding, current_requirement_guess,
+            current_key_questions, conversation_history, final_turn
+        )
+        
+        response = await self.openai_client.agenerate_completion(
+            prompt=prompt,
+            use_cache=QUESTION_GENERATION_USE_CACHE,
+            stream_fields=STREAM_FIELDS,
+            **self._call_settings(final_turn)
+        )
+        
+        return self._parse_response(response, current_spatial_understanding, current_requirement_guess, current_key_questions)
+    
+    def _call_settings(self, final_turn):
+        """获取本轮调用的模型参数
+        
+        最后一轮的响应中附带约束条件：使用约束量化的模型和温度、更大的生成令牌数，不启用对冲请求（备用模型的约束条件质量不同）；
+        约束条件被截断时整个去掉，由约束条件生成阶段重新生成
+        
+        Args:
+            final_turn (bool): 是否使用附带约束条件生成说明的提示词
+        
+        Returns:
+            dict: generate_completion的模型参数
+        """
+        if final_turn:
+            return {
+                "model_name": CONSTRAINT_QUANTIFICATION_MODEL,
+                "temperature": CONSTRAINT_QUANTIFICATION_TEMPERATURE,
+                "max_tokens": FINAL_TURN_CONSTRAINTS["max_tokens"],
+                "hedge": False,
+                "json_keys": FINAL_TURN_RESPONSE_KEYS,
+                "complete_keys": FINAL_TURN_COMPLETE_KEYS
+            }
+        return {
+            "model_name": DEFAULT_MODEL,
+            "temperature": 0.7,
+            "hedge": QUESTION_GENERATION_HEDGE,
+            "json_keys": RESPONSE_KEYS
+        }
+    
+    def _build_request(self, user_input, current_spatial_understanding, current_requirement_guess, 
+                       current_key_questions, conversation_history, final_turn=False):
+        """补全默认记录并准备提示词
+        
+        Args:
+            user_input (str): 用户输入的文本
+            current_spatial_understanding (str): 当前的空间理解记录
+            current_requirement_guess (str): 当前的用户需求猜测
+            current_key_questions (list): 当前的关键问题列表
+            conversation_history (list): 系统与用户的问答记录
+            final_turn (bool, optional): 是否使用附带约束条件生成说明的提示词
+        
+        Returns:
+            tuple: (提示词, 空间理解记录, 用户需求猜测)
+        """
+        # 如果当前没有空间理解记录，则初始化为空字符串；已有记录按句编号，供LLM按编号修改
         if not current_spatial_understanding:
             current_spatial_understanding = "目前没有关于建筑边界和环境的信息。"
+            spatial_understanding_formatted = current_spatial_understanding
+        else:
+            spatial_understanding_formatted = self.patcher.format_numbered(current_spatial_understanding)
         
         # 如果当前没有用户需求猜测，则初始化为空字符串
         if not current_requirement_guess:
             current_requirement_guess = "目前没有关于用户需求的猜测。"
+            requirement_guess_formatted = current_requirement_guess
+        else:
+            requirement_guess_formatted = self.patcher.format_numbered(current_requirement_guess)
         
         # 格式化关键问题列表，便于提供给LLM
         key_questions_formatted = self._format_key_questions(current_key_questions)
         
         # 格式化对话历史
-        conversation_history_formatted = self._format_conversation_history(conversation_history)
+        conversation_history_formatted = self.context.build(conversation_history)
+        
+        # 上一轮修改未能应用的字段，要求本轮返回完整内容
+        update_notes = ""
+        if self.full_content_fields:
+            names = "、".join(UPDATE_FIELD_NAMES[field] for field in UPDATE_FIELD_NAMES if field in self.full_content_fields)
+            update_notes = f"\n注意：上一轮对{names}的修改未能应用，本轮请在对应字段的content中返回完整内容，不要使用edits或changes。\n"
+            self.full_content_fields = set()
         
         # 准备提示词
         prompt = self._prepare_prompt(
             user_input=user_input,
-            current_spatial_understanding=current_spatial_understanding,
-            current_requirement_guess=current_requirement_guess,
+            current_spatial_understanding=spatial_understanding_formatted,
+            current_requirement_guess=requirement_guess_formatted,
             key_questions_formatted=key_questions_formatted,
-            conversation_history_formatted=conversation_history_formatted
+            conversation_history_formatted=conversation_history_formatted,
+            update_notes=update_notes,
+            final_turn=final_turn
         )
         
-        # 调用OpenAI API获取更新后的信息
-        response = self.openai_client.generate_completion(
-            prompt=prompt,
-            model_name=DEFAULT_MODEL,
-            temperature=0.7
-        )
+        return prompt, current_spatial_understanding, current_requirement_guess
+    
+    def request_full_content(self, field):
+        """要求下一轮对某个字段返回完整内容，用于修改无法应用到当前状态时
+        
+        Args:
+            field (str): 字段名，如'user_requirements'、'spatial_understanding'、'key_questions'
+        """
+        self.full_content_fields.add(field)
+    
+    def _parse_response(self, response, current_spatial_understanding, current_requirement_guess, current_key_questions):
+        """解析LLM返回的结果，解析失败时保持原记录不变
+        
+        Args:
+            response (str): LLM返回的文本
+            current_spatial_understanding (str): 当前的空间理解记录
+            current_requirement_guess (str): 当前的用户需求猜测
+            current_key_questions (list): 当前的关键问题列表
         
+        Returns:
+            dict: 包含更新后的空间理解、用户需求猜测、关键问题列表和下一个问题的JSON对象
+        """
         # 如果API调用失败或返回为空，则保持原记录不变
         if not response:
             return {
@@ -90,37 +240,45 @@ class UnifiedProcessor:
             # 提取思考内容
             thinking = result.get("thinking", "")
             
-            # 提取用户需求猜测更新
-            user_requirements_updated = result.get("user_requirements", {}).get("updated", False)
-            user_requirements_content = result.get("user_requirements", {}).get("content", current_requirement_guess)
+            # 提取用户需求猜测更新：按句修改，或整体重写的完整内容
+            user_requirements = result.get("user_requirements", {})
             
             # 提取空间理解更新
-            spatial_understanding_updated = result.get("spatial_understanding", {}).get("updated", False)
-            spatial_understanding_content = result.get("spatial_understanding", {}).get("content", current_spatial_understanding)
+            spatial_understanding = result.get("spatial_understanding", {})
             
-            # 提取关键问题列表更新
-            key_questions_updated = result.get("key_questions", {}).get("updated", False)
-            key_questions_content = result.get("key_questions", {}).get("content", current_key_questions)
+            # 提取关键问题列表更新：有变化的问题类别，或完整的关键问题列表
+            key_questions = result.get("key_questions", {})
             
             # 提取下一个问题
             next_question = result.get("next_question", "能否再详细描述一下您对这个建筑设计的期望和需求？")
             
-            return {
+            # 提取最后一轮附带的约束条件（处理多出的"constraints"嵌套层）
+            constraints = result.get("constraints")
+            if isinstance(constraints, dict) and isinstance(constraints.get("constraints"), dict):
+                constraints = constraints["constraints"]
+            
+            parsed = {
                 "thinking": thinking,
                 "user_requirements": {
-                    "updated": user_requirements_updated,
-                    "content": user_requirements_content
+                    "updated": user_requirements.get("updated", False),
+                    "edits": user_requirements.get("edits") or [],
+                    "content": user_requirements.get("content", "")
                 },
                 "spatial_understanding": {
-                    "updated": spatial_understanding_updated,
-                    "content": spatial_understanding_content
+                    "updated": spatial_understanding.get("updated", False),
+                    "edits": spatial_understanding.get("edits") or [],
+                    "content": spatial_understanding.get("content", "")
                 },
                 "key_questions": {
-                    "updated": key_questions_updated,
-                    "content": key_questions_content
+                    "updated": key_questions.get("updated", False),
+                    "changes": key_questions.get("changes") or [],
+                    "content": key_questions.get("content", [])
                 },
                 "next_question": next_question
             }
+            if isinstance(constraints, dict) and constraints.get("hard_constraints"):
+                parsed["constraints"] = constraints
+            return parsed
         except json.JSONDecodeError:
             # 如果JSON解析失败，返回原记录
             return {
@@ -152,36 +310,14 @@ class UnifiedProcessor:
         formatted_questions = ""
         
         for question in key_questions:
-            formatted_questions += f"{question["category"]}: {question["status"]}, {question["details"]}"
+            formatted_questions += f"{question['category']}: {question['status']}, {question['details']}"
             formatted_questions += "\n"
         
         return formatted_questions
     
-    def _format_conversation_history(self, conversation_history):
-        """格式化对话历史，便于提供给LLM
-        
-        Args:
-            conversation_history (list): 对话历史
-        
-        Returns:
-            str: 格式化后的对话历史
-        """
-        formatted_history = ""
-        
-        for entry in conversation_history:
-            role = entry.get('role', '')
-            content = entry.get('content', '')
-            
-            if role == 'user':
-                formatted_history += f"用户: {content}\n\n"
-            elif role == 'system':
-                formatted_history += f"系统: {content}\n\n"
-        
-        return formatted_history
-    
     def _prepare_prompt(self, user_input, current_spatial_understanding, 
                        current_requirement_guess, key_questions_formatted, 
-                       conversation_history_formatted):
+                       conversation_history_formatted, update_notes="", final_turn=False):
         """准备提示词
         
         Args:
@@ -190,64 +326,33 @@ class UnifiedProcessor:
             current_requirement_guess (str): 当前的用户需求猜测
             key_questions_formatted (str): 格式化后的关键问题列表
             conversation_history_formatted (str): 格式化后的对话历史
+            update_notes (str, optional): 对本轮更新方式的补充说明
+            final_turn (bool, optional): 是否使用附带约束条件生成说明的提示词
         
         Returns:
             str: 准备好的提示词
         """
-        prompt = f"""{BASE_PROMPT}
-
-你的当前任务是处理最新的用户输入，更新空间理解、用户需求猜测、关键问题列表，并生成下一个问题。
-
-请按照以下步骤进行：
-1. 从整体任务上进行思考，分析用户输入的内容，判断是否需要更新空间理解、用户需求猜测或关键问题列表。
-2. 分析用户输入，提取关于建筑边界和环境的信息，更新spatial_understanding，空间理解指的是建筑形状、面积、周围环境信息等。
-3. 分析用户输入，推测用户的建筑设计需求和偏好，更新user_requirements。
-4. 根据用户输入和已有信息，更新key_questions。
-5. 生成下一个问题，引导用户提供更多信息。
-
-当前空间理解记录：
-{current_spatial_understanding}
-
-当前用户需求猜测：
-{current_requirement_guess}
-
-当前关键问题列表：
-{key_questions_formatted}
-
-系统与用户的问答记录：
-{conversation_history_formatted}
-
-用户当前输入：
-{user_input}
-
-请以JSON格式返回以下内容：
-{{
-   "thinking": 对本次所有内容更新的思考,
-   "user_requirements": {{
-      "updated": (true/false),
-      "content": "" //更新后的内容，string格式
-   }},
-   "spatial_understanding": {{
-      "updated": (true/false),
-      "content": "" //更新后的内容，string格式
-   }},
-   "key_questions": {{
-      "updated": (true/false),
-      "content": [
-        {{
-          "category": "" //问题类别,
-          "status": "" //未知/已知,
-          "details": "" //简要描述}}
-      ] //更新的内容，格式严格按照关键问题列表的格式，list格式，要包含所有问题类别
-   }},
-   "next_question": 下一个问题（如果所有问题的状态都是已知，则为空字符串）
-}}
-注意：
-- 下一个问题可以是根据关键问题列表中"未知"状态的问题产生的新问题，也可以是根据上一问答中未能解决或明确的问题继续提问
-- 请确保返回的JSON格式正确，所有字段都必须存在，只返回json内容，不要包含任何解释或注释
-- 如果某项内容没有更新，请保持原内容不变，并将updated设为false，content返回空字符串
-- 哪怕是状态已知的问题，也可以在关键问题列表中更新details，以提供更详细的信息
-- 房间数量和类型：要时刻注意更新调整；生活方式：从用户的日常生活习惯中提取设计可能用到的信息；空间使用偏好：可能涉及到空间的方位、采光、空间关系等；环境应对需求：考虑噪音、与周围环境的交互或排斥关系等。
-"""
+        if final_turn:
+            # 约束条件模板属于固定前缀，最后一轮的提示词同样可以命中前缀缓存
+            template = self.prompts.template(
+                "unified_final_turn", UNIFIED_FINAL_TURN_PROMPT,
+                assets={
+                    "constraint_base_prompt": CONSTRAINT_BASE_PROMPT_PATH,
+                    "constraint_template": PROMPT_TEMPLATE_CONSTRAINTS_ALL_PATH
+                },
+                base_prompt=BASE_PROMPT
+            )
+        else:
+            template = self.prompts.template("unified_processing", UNIFIED_PROCESSING_PROMPT, base_prompt=BASE_PROMPT)
+        
+        # 固定的任务说明和输出格式在前，每轮变化的记录和输入在后，便于命中提供商的前缀缓存
+        prompt = template.format(
+            current_spatial_understanding=current_spatial_understanding,
+            current_requirement_guess=current_requirement_guess,
+            key_questions_formatted=key_questions_formatted,
+            conversation_history_formatted=conversation_history_formatted,
+            user_input=user_input,
+            update_notes=update_notes
+        )
         
         return prompt
\ No newline at end of file
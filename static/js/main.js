@@ -1,6 +1,7 @@
 // Global variables
 let currentSessionId = null;
 let currentStage = null;
+let eventSource = null;
 const stages = [
     'STAGE_REQUIREMENT_GATHERING',
     'STAGE_CONSTRAINT_GENERATION',
@@ -129,7 +130,12 @@ function startNewSession() {
     addSystemMessage("Starting new session...");
     
     fetch('/api/start', {
-        method: 'POST'
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        // Let the server release the session this page is leaving
+        body: JSON.stringify({ previous_session_id: currentSessionId })
     })
     .then(response => response.json())
     .then(data => {
@@ -139,6 +145,7 @@ function startNewSession() {
         }
         
         currentSessionId = data.session_id;
+        openEventStream();
         addSystemMessage('Welcome to the Architecture AI Design System! Please describe your building project and requirements.');
         updateUIState(true);
         refreshState();
@@ -236,7 +243,7 @@ function resumeSession() {
         headers: {
             'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ session_path: sessionPath })
+        body: JSON.stringify({ session_path: sessionPath, previous_session_id: currentSessionId })
     })
     .then(response => response.json())
     .then(data => {
@@ -246,6 +253,7 @@ function resumeSession() {
         }
         
         currentSessionId = data.session_id;
+        openEventStream();
         addSystemMessage('Session resumed. You can continue from where you left off.');
         updateUIState(true);
         refreshState();
@@ -256,6 +264,94 @@ function resumeSession() {
     });
 }
 
+// Subscribe to the session's server-sent events (LLM tokens, stage changes, progress, visualizations)
+function openEventStream() {
+    closeEventStream();
+    if (!currentSessionId) return;
+    
+    eventSource = new EventSource(`/api/stream?session_id=${currentSessionId}`);
+    
+    // A new LLM call started: open a live preview under the loading message
+    eventSource.addEventListener('llm_start', () => {
+        const loadingMessage = document.querySelector('#chatHistory .loading-message');
+        if (!loadingMessage) return;
+        let preview = loadingMessage.querySelector('.stream-preview');
+        if (!preview) {
+            preview = document.createElement('pre');
+            preview.className = 'stream-preview';
+            loadingMessage.appendChild(preview);
+        }
+        preview.textContent = '';
+    });
+    
+    // Streamed LLM output
+    eventSource.addEventListener('token', event => {
+        const preview = document.querySelector('#chatHistory .loading-message .stream-preview');
+        if (!preview) return;
+        preview.textContent += JSON.parse(event.data).text;
+        preview.scrollTop = preview.scrollHeight;
+        const chatHistory = document.getElementById('chatHistory');
+        chatHistory.scrollTop = chatHistory.scrollHeight;
+    });
+    
+    // Structured fields parsed from the stream before the LLM call finishes
+    eventSource.addEventListener('field', event => {
+        const data = JSON.parse(event.data);
+        if (data.path === 'next_question') {
+            // Show the next question while the rest of the response is still generating
+            const loadingMessage = document.querySelector('#chatHistory .loading-message');
+            if (!loadingMessage) return;
+            let question = loadingMessage.querySelector('.early-question');
+            if (!question) {
+                question = document.createElement('div');
+                question.className = 'early-question';
+                loadingMessage.appendChild(question);
+            }
+            question.textContent = data.value;
+            return;
+        }
+        // Room entries of generated constraints, reported as each one completes
+        const status = document.querySelector('.constraint-generation-status');
+        if (status) {
+            const room = typeof data.value === 'string' ? data.value : data.path.split('.').pop();
+            status.textContent = `Generated room: ${room}`;
+        }
+    });
+    
+    // Stage changes (and key-question counts) pushed by the workflow manager
+    eventSource.addEventListener('stage', event => {
+        const data = JSON.parse(event.data);
+        document.getElementById('stageDescription').textContent = data.stage_description;
+        if (data.current_stage !== currentStage) {
+            // refreshState detects the change and runs the stage transition handling
+            refreshState();
+        }
+    });
+    
+    // Background constraint/solution generation progress
+    eventSource.addEventListener('progress', event => {
+        updateConstraintGenerationProgress(JSON.parse(event.data));
+    });
+    
+    // Visualization files have been written
+    eventSource.addEventListener('visualization', () => {
+        refreshVisualizations();
+    });
+    
+    // Errors from background tasks
+    eventSource.addEventListener('task_error', event => {
+        addSystemMessage('Error: ' + JSON.parse(event.data).message);
+    });
+}
+
+// Close the current event stream
+function closeEventStream() {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+}
+
 // Send a message to the backend
 function sendMessage() {
     if (!currentSessionId) {
@@ -525,20 +621,8 @@ function refreshState() {
                 
                 console.log("检测到已进入可视化阶段，立即刷新可视化...");
                 
-                // 立即刷新一次
+                // 立即刷新一次，图片生成完成后服务器会推送visualization事件再次刷新
                 refreshVisualizations();
-                
-                // 然后每秒刷新一次，持续10秒钟，以确保图片加载
-                let refreshCount = 0;
-                const refreshInterval = setInterval(() => {
-                    refreshCount++;
-                    console.log(`第 ${refreshCount} 次刷新可视化...`);
-                    refreshVisualizations();
-                    
-                    if (refreshCount >= 10) {
-                        clearInterval(refreshInterval);
-                    }
-                }, 1000);
             }
             
             // 如果是从约束生成阶段到后面任何阶段
@@ -826,39 +910,3 @@ function updateConstraintGenerationProgress(progress) {
     
     return progressElement;
 }
-
-// Poll for state changes when in certain stages
-function pollForStateChanges() {
-    if (!currentSessionId) return;
-    
-    // Only poll when in processing-heavy stages
-    const pollingStages = [
-        'STAGE_CONSTRAINT_GENERATION',
-        'STAGE_SOLUTION_GENERATION'
-    ];
-    
-    if (pollingStages.includes(currentStage)) {
-        refreshState();
-        
-        // Add or update constraint generation progress
-        if (currentStage === 'STAGE_CONSTRAINT_GENERATION') {
-            updateConstraintGenerationProgress();
-        }
-        
-        // Continue polling every 2 seconds
-        setTimeout(pollForStateChanges, 2000);
-    }
-}
-
-// Initialize periodic state refresh with varied frequencies
-setInterval(() => {
-    if (currentSessionId) {
-        refreshState();
-        
-        // If in constraint generation or solution generation, poll more frequently
-        if (currentStage === 'STAGE_CONSTRAINT_GENERATION' || 
-            currentStage === 'STAGE_SOLUTION_GENERATION') {
-            pollForStateChanges();
-        }
-    }
-}, 5000); // Regular refresh every 5 seconds
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+异步调用路径的测试
+"""
+import os
+import sys
+import json
+import asyncio
+import threading
+import contextlib
+from types import SimpleNamespace
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.client_pool import ClientPool
+from utils.openai_client import OpenAIClient
+from models.unified_processor import UnifiedProcessor
+
+
+class FakeStream:
+    """按块返回文本的异步流式响应"""
+    
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        if not self.chunks:
+            raise StopAsyncIteration
+        text = self.chunks.pop(0)
+        delta = SimpleNamespace(content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+def make_client(monkeypatch, chunks):
+    client = OpenAIClient()
+    
+    async def create(**params):
+        return FakeStream(chunks)
+    
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(client.client_pool, "get_async_openai_client", lambda base_url, api_key: (fake, "fake"))
+    monkeypatch.setattr(client.client_pool, "track", lambda key: contextlib.nullcontext())
+    return client
+
+
+def test_async_stream_prints_to_terminal_without_event_channel(monkeypatch, capsys):
+    client = make_client(monkeypatch, ['{"a": ', '"你好"}'])
+    model_config = {"model": "fake-model", "type": "openai"}
+    content = asyncio.run(client._acall_openai_api("提示词", model_config, 0.5, 100))
+    assert content == '{"a": "你好"}'
+    assert '系统: {"a": "你好"}' in capsys.readouterr().out
+
+
+def test_async_stream_publishes_to_event_channel(monkeypatch, capsys):
+    client = make_client(monkeypatch, ['{"a": ', '1}'])
+    client.set_event_channel("test-async-channel")
+    events = []
+    monkeypatch.setattr(client.event_bus, "publish", lambda channel, event_type, data: events.append((event_type, data)))
+    asyncio.run(client._acall_openai_api("提示词", {"model": "fake-model"}, 0.5, 100))
+    assert [data["text"] for event_type, data in events if event_type == "token"] == ['{"a": ', '1}']
+    assert '{"a"' not in capsys.readouterr().out
+
+
+def test_aprocess_builds_prompt_off_the_event_loop(monkeypatch):
+    threads = {}
+    
+    class Client:
+        async def agenerate_completion(self, prompt, **kwargs):
+            threads["loop"] = threading.get_ident()
+            return json.dumps({"next_question": "？"}, ensure_ascii=False)
+    
+    processor = UnifiedProcessor(Client())
+    build_request = processor._build_request
+    
+    def recording_build_request(*args):
+        threads["build"] = threading.get_ident()
+        return build_request(*args)
+    
+    monkeypatch.setattr(processor, "_build_request", recording_build_request)
+    result = asyncio.run(processor.aprocess("你好", "", "", [], []))
+    assert result["next_question"] == "？"
+    assert threads["build"] != threads["loop"]
+
+
+async def get_pooled_clients(pool):
+    client, key = pool.get_async_openai_client("http://localhost:1", "key")
+    assert pool.get_async_openai_client("http://localhost:1", "key") == (client, key)
+    http_client, _ = pool.get_async_http_client("zhipu", "http://localhost:1", "key")
+    return client, http_client
+
+
+def test_async_clients_closed_when_loop_ends():
+    pool = ClientPool()
+    clients = [asyncio.run(get_pooled_clients(pool)) for _ in range(20)]
+    # 每次asyncio.run都得到新的客户端，退出时关闭并从连接池移除
+    assert len({id(client) for client, _ in clients}) == 20
+    assert all(client.is_closed() and http_client.is_closed for client, http_client in clients)
+    assert len(pool._async_clients) == 0
+    assert pool.get_stats()["clients"] == []
+
+
+def test_close_releases_async_clients():
+    pool = ClientPool()
+    loop = asyncio.new_event_loop()
+    try:
+        client, http_client = loop.run_until_complete(get_pooled_clients(pool))
+        pool.close()
+        assert client.is_closed() and http_client.is_closed
+        assert len(pool._async_clients) == 0
+    finally:
+        loop.close()
+
+
+def test_closed_loop_entries_are_evicted():
+    pool = ClientPool()
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(get_pooled_clients(pool))
+    # 不经过asyncio.run直接关闭的事件循环，在下一个事件循环创建客户端时被清理
+    loop.close()
+    asyncio.run(get_pooled_clients(pool))
+    assert loop not in pool._async_clients
+
@@ -0,0 +1,141 @@
+"""
+离线批处理的检查点续跑和提供商批次收集的测试
+"""
+import os
+import sys
+import json
+import time
+import threading
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import BatchCheckpoint, BatchRunner
+from utils.batch_api import BatchCollector
+
+
+RECORDS = [("a", {}), ("b", {}), ("c", {})]
+
+
+def make_runner(tmp_path, failing=()):
+    runner = BatchRunner(str(tmp_path / "out.jsonl"), str(tmp_path / "out.jsonl.checkpoint"), workers=2)
+    processed = []
+    
+    def run_pipeline(record_id, data):
+        processed.append(record_id)
+        status = "error" if record_id in failing else "success"
+        return {"id": record_id, "status": status, "timing": {"total": 0}}
+    
+    runner._run_pipeline = run_pipeline
+    return runner, processed
+
+
+def read_rows(tmp_path):
+    with open(tmp_path / "out.jsonl", "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_checkpoint_survives_restart(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    checkpoint = BatchCheckpoint(path)
+    checkpoint.mark_done("a")
+    checkpoint.mark_done("b")
+    assert BatchCheckpoint(path).completed == {"a", "b"}
+
+
+def test_rerun_skips_completed_and_retries_failed(tmp_path):
+    runner, processed = make_runner(tmp_path, failing={"b"})
+    assert runner.run(RECORDS) == {"total": 3, "skipped": 0, "succeeded": 2, "failed": 1}
+    runner, processed = make_runner(tmp_path)
+    assert runner.run(RECORDS) == {"total": 3, "skipped": 2, "succeeded": 1, "failed": 0}
+    assert processed == ["b"]
+    # 失败的结果被重试后的结果替换
+    rows = read_rows(tmp_path)
+    assert sorted(row["id"] for row in rows) == ["a", "b", "c"]
+    assert all(row["status"] == "success" for row in rows)
+
+
+def test_repeated_failures_keep_one_row(tmp_path):
+    for _ in range(3):
+        runner, _ = make_runner(tmp_path, failing={"b"})
+        runner.run(RECORDS)
+    assert sorted(row["id"] for row in read_rows(tmp_path)) == ["a", "b", "c"]
+
+
+def test_kill_after_write_does_not_duplicate(tmp_path, monkeypatch):
+    runner, _ = make_runner(tmp_path)
+    
+    def killed(record_id):
+        raise KeyboardInterrupt
+    
+    monkeypatch.setattr(runner.checkpoint, "mark_done", killed)
+    with pytest.raises(KeyboardInterrupt):
+        runner.process_record("a", {})
+    # 不完整的最后一行也被清理
+    with open(tmp_path / "out.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"id": "b", "sta')
+    runner, processed = make_runner(tmp_path)
+    assert runner.run(RECORDS)["skipped"] == 1
+    assert sorted(processed) == ["b", "c"]
+    assert sorted(row["id"] for row in read_rows(tmp_path)) == ["a", "b", "c"]
+    assert BatchCheckpoint(str(tmp_path / "out.jsonl.checkpoint")).completed == {"a", "b", "c"}
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    batches = []
+    
+    def run_batch(self, model_name, model_config, requests):
+        batches.append(len(requests))
+        for request in requests:
+            request.result = {"id": request.custom_id}
+            request.done.set()
+    
+    monkeypatch.setattr(BatchCollector, "_run_batch", run_batch)
+    collector = BatchCollector({"collect_window": 60, "max_batch_size": 10})
+    collector.batches = batches
+    yield collector
+    collector.close()
+
+
+def submit_in_thread(collector, results):
+    thread = threading.Thread(target=lambda: results.append(collector.submit("m", {"type": "openai"}, {})))
+    thread.start()
+    return thread
+
+
+def test_batch_waits_until_all_active_records_are_waiting(collector):
+    for _ in range(3):
+        collector.begin_record()
+    results = []
+    threads = [submit_in_thread(collector, results) for _ in range(2)]
+    time.sleep(0.2)
+    # 还有一条记录在处理中，请求继续等待
+    assert collector.batches == [] and results == []
+    threads.append(submit_in_thread(collector, results))
+    for thread in threads:
+        thread.join(5)
+    assert collector.batches == [3] and len(results) == 3
+
+
+def test_finished_record_releases_waiting_requests(collector):
+    collector.begin_record()
+    collector.begin_record()
+    results = []
+    thread = submit_in_thread(collector, results)
+    time.sleep(0.2)
+    assert results == []
+    collector.end_record()
+    thread.join(5)
+    assert collector.batches == [1] and len(results) == 1
+
+
+def test_full_batch_is_submitted_without_waiting(collector):
+    collector.settings["max_batch_size"] = 2
+    for _ in range(5):
+        collector.begin_record()
+    results = []
+    threads = [submit_in_thread(collector, results) for _ in range(2)]
+    for thread in threads:
+        thread.join(5)
+    assert collector.batches == [2] and len(results) == 2
@@ -0,0 +1,88 @@
+"""
+约束条件紧凑格式编码的测试
+"""
+import os
+import sys
+import json
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TEMPLATE_CONSTRAINTS_ALL_PATH
+from utils.converter import ConstraintConverter, CompactFormatError
+
+
+CONSTRAINTS = {
+    "hard_constraints": {"room_list": ["客厅", "主卧", "厨房", "卫生间"]},
+    "soft_constraints": {
+        "connection": {"weight": 0.8, "constraints": [
+            {"room pair": ["客厅", "主卧"], "room_weight": 0.9},
+            {"room pair": ["客厅", "厨房"]}
+        ]},
+        "area": {"weight": 0.6, "constraints": [
+            {"room": "客厅", "min": 20, "max": 30, "room_weight": 0.7},
+            {"room": "卫生间", "max": 6}
+        ]},
+        "orientation": {"weight": 0.5, "constraints": [
+            {"room": "主卧", "direction": "south", "room_weight": 1.0}
+        ]},
+        "repulsion": {"weight": 0.3, "constraints": [
+            {"room pair": ["厨房", "主卧"], "min_distance": 3}
+        ]}
+    },
+    "special_spaces": {"path": True, "entrance": True}
+}
+
+
+@pytest.fixture
+def converter():
+    return ConstraintConverter()
+
+
+def test_round_trip(converter):
+    compact = converter.all_to_compact(CONSTRAINTS)
+    assert converter.compact_to_all(compact) == CONSTRAINTS
+    assert converter.compact_to_all(compact.splitlines()) == CONSTRAINTS
+
+
+def test_compact_text_is_shorter_than_json(converter):
+    compact = converter.all_to_compact(CONSTRAINTS)
+    assert "@connection 0.8 | room1, room2, room_weight" in compact.splitlines()
+    assert "客厅, 主卧, 0.9" in compact.splitlines()
+    assert len(compact) < len(json.dumps(CONSTRAINTS, ensure_ascii=False))
+
+
+def test_template_round_trip(converter):
+    with open(TEMPLATE_CONSTRAINTS_ALL_PATH, "r", encoding="utf-8") as f:
+        template = json.load(f)
+    assert converter.compact_to_all(converter.all_to_compact(template)) == template
+
+
+@pytest.mark.parametrize("constraints", [
+    # 需要加引号的房间名
+    {"hard_constraints": {"room_list": ["客厅, 餐厅", "123", "true", "@阳台", " 书房"]}},
+    # 不符合列定义的约束和额外字段
+    {"soft_constraints": {"area": {"weight": 0.5, "note": "备注", "constraints": [
+        {"room": "客厅", "min": 20, "unit": "m2"}, {"room": ["客厅", "餐厅"]}
+    ]}}},
+    {"soft_constraints": {"custom": {"constraints": [{"room": "客厅"}]}}},
+    {"hard_constraints": {"room_list": ["客厅"], "total_area": 90}, "version": 2},
+    {"hard_constraints": {"room_list": [{"name": "客厅"}]}},
+    {}
+])
+def test_round_trip_preserves_unusual_entries(converter, constraints):
+    assert converter.compact_to_all(converter.all_to_compact(constraints)) == constraints
+
+
+@pytest.mark.parametrize("compact", [
+    "客厅, 主卧",
+    "@area 0.5 | room, direction",
+    "@connection 0.5 | room1, room2, room_weight\n客厅",
+    "@area 0.5 | room, min, max, room_weight\n客厅, 1, 2, 3, 4",
+    "@custom 0.5\n客厅",
+    "@extra [1]",
+    123
+])
+def test_invalid_compact_text_raises(converter, compact):
+    with pytest.raises(CompactFormatError):
+        converter.compact_to_all(compact)
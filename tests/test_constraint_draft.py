@@ -0,0 +1,74 @@
+"""
+约束条件草稿生成器的测试
+"""
+import os
+import sys
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models.constraint_draft as constraint_draft
+from models.constraint_draft import ConstraintDrafter
+
+
+CONSTRAINTS = {"hard_constraints": {"room_list": ["客厅", "卧室"]}}
+
+
+class BlockingQuantification:
+    """等待放行后才返回约束条件的量化模块"""
+    
+    release = None
+    started = None
+    
+    def __init__(self, openai_client):
+        pass
+    
+    def generate_constraints(self, user_requirement_guess, spatial_understanding, if_rooms_constraints):
+        BlockingQuantification.started.set()
+        BlockingQuantification.release.wait(5)
+        return CONSTRAINTS
+
+
+def make_drafter(monkeypatch):
+    BlockingQuantification.release = threading.Event()
+    BlockingQuantification.started = threading.Event()
+    monkeypatch.setattr(constraint_draft, "ConstraintQuantification", BlockingQuantification)
+    drafter = ConstraintDrafter(openai_client=None, settings={"enabled": True, "wait_timeout": 5})
+    monkeypatch.setattr(drafter, "_get_client", lambda: None)
+    return drafter
+
+
+def test_draft_is_stored(monkeypatch):
+    drafter = make_drafter(monkeypatch)
+    assert drafter.schedule("需求", "空间")
+    BlockingQuantification.release.set()
+    draft, matches = drafter.take("需求", "空间")
+    assert matches
+    assert draft["constraints"] == CONSTRAINTS
+
+
+def test_discard_during_generation_drops_result(monkeypatch):
+    drafter = make_drafter(monkeypatch)
+    drafter.schedule("需求", "空间")
+    assert BlockingQuantification.started.wait(5)
+    drafter.discard()
+    BlockingQuantification.release.set()
+    draft, _ = drafter.take("需求", "空间")
+    assert draft is None
+    assert drafter.draft is None
+
+
+def test_schedule_after_discard_stores_new_draft(monkeypatch):
+    drafter = make_drafter(monkeypatch)
+    drafter.schedule("需求", "空间")
+    assert BlockingQuantification.started.wait(5)
+    drafter.discard()
+    # 生成期间按新需求排队，完成后按新需求生成的草稿应保存
+    drafter.schedule("新的需求", "空间")
+    thread = drafter._thread
+    BlockingQuantification.release.set()
+    # take会取消排队中的需求，等排队的生成完成后再取
+    thread.join(5)
+    draft, matches = drafter.take("新的需求", "空间")
+    assert matches
+    assert draft["user_requirement_guess"] == "新的需求"
@@ -0,0 +1,80 @@
+"""
+有token预算的对话上下文的测试
+"""
+import os
+import sys
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.conversation_context import ConversationContext
+from utils.openai_client import OpenAIClient
+
+
+def make_history(turns):
+    history = []
+    for i in range(turns):
+        history.append({"role": "system", "content": f"第{i}个问题：" + "房间的朝向和采光要求是什么" * 5})
+        history.append({"role": "user", "content": f"第{i}个回答：" + "主卧朝南，客厅需要大窗户" * 5})
+    return history
+
+
+def make_context(monkeypatch, max_history_tokens):
+    context = ConversationContext(None, {"recent_turns": 1, "max_history_tokens": max_history_tokens})
+    scheduled = []
+    monkeypatch.setattr(context, "_schedule_summary", lambda messages, start, end: scheduled.append((start, end)))
+    return context, scheduled
+
+
+def test_short_history_is_kept_verbatim(monkeypatch):
+    context, scheduled = make_context(monkeypatch, 100000)
+    history = make_history(3)
+    text = context.build(history)
+    assert all(entry["content"] in text for entry in history)
+    assert context.last_stats["omitted_messages"] == 0
+    assert context.last_stats["omitted_tokens"] == 0
+    # 移出最近几轮的问答在后台并入摘要
+    assert scheduled == [(0, 4)]
+
+
+def test_pending_messages_over_budget_are_recorded(monkeypatch):
+    context, _ = make_context(monkeypatch, 1)
+    history = make_history(3)
+    text = context.build(history)
+    # 最近一轮总是原样保留，超出预算的较早问答只留占位说明
+    assert history[-1]["content"] in text and history[-2]["content"] in text
+    assert history[0]["content"] not in text
+    assert "另有4条较早的问答记录正在整理为摘要" in text
+    stats = context.last_stats
+    assert stats["omitted_messages"] == 4
+    assert stats["omitted_tokens"] == sum(context._message_tokens[:4]) > 0
+    assert stats["verbatim_messages"] == 2
+
+
+def test_summary_replaces_summarized_messages(monkeypatch):
+    context, _ = make_context(monkeypatch, 100000)
+    history = make_history(3)
+    context.summary = "用户需要朝南的主卧"
+    context.summarized_upto = 4
+    text = context.build(history)
+    assert text.startswith("早期对话摘要：\n用户需要朝南的主卧")
+    assert history[0]["content"] not in text
+    assert context.last_stats["summarized_messages"] == 4
+
+
+def test_summary_client_follows_session_client():
+    client = OpenAIClient()
+    context = ConversationContext(client)
+    session_manager, replay_store = object(), object()
+    client.set_session_manager(session_manager)
+    client.set_replay_store(replay_store)
+    client.set_event_channel("session")
+    client.set_batch_collector(object())
+    summary_client = context._get_summary_client()
+    assert summary_client is not client
+    assert (summary_client.session_manager, summary_client.replay_store) == (session_manager, replay_store)
+    assert summary_client.event_channel == f"conversation-summary-{id(context)}"
+    assert summary_client.batch_collector is None
+    assert client.event_channel == "session"
+    # 会话客户端之后的设置在下一次摘要时生效
+    client.set_replay_store(None)
+    assert context._get_summary_client().replay_store is None
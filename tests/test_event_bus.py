@@ -0,0 +1,58 @@
+"""
+会话事件总线和网页会话频道清理的测试
+"""
+import os
+import sys
+import time
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.event_bus import EventBus
+
+
+def test_subscriber_receives_events_and_replay():
+    bus = EventBus()
+    bus.publish("s1", "token", {"text": "a"})
+    q = bus.subscribe("s1", last_event_id=0)
+    bus.publish("s1", "token", {"text": "b"})
+    events = [q.get_nowait(), q.get_nowait()]
+    assert [event["data"]["text"] for event in events] == ["a", "b"]
+    assert [event["id"] for event in events] == [1, 2]
+    assert bus.last_event("s1", "token")["data"] == {"text": "b"}
+
+
+def test_close_channel_if_idle_keeps_subscribed_channel():
+    bus = EventBus()
+    q = bus.subscribe("s1")
+    bus.publish("s1", "stage", {"current_stage": 1})
+    assert not bus.close_channel_if_idle("s1")
+    assert bus.last_event("s1", "stage") is not None
+    bus.unsubscribe("s1", q)
+    assert bus.close_channel_if_idle("s1")
+    assert bus.last_event("s1", "stage") is None
+    # 关闭后重新发布的事件编号从头开始
+    assert bus.publish("s1", "stage")["id"] == 1
+
+
+def test_web_sessions_release_their_channels(monkeypatch):
+    import app
+    app.sessions["left"] = object()
+    app.event_bus.publish("left", "token", {"text": "x"})
+    app.close_session("left")
+    assert "left" not in app.sessions
+    assert app.event_bus.last_event("left", "token") is None
+    # 未知的会话ID不受影响
+    app.close_session(None)
+    app.close_session("unknown")
+    
+    monkeypatch.setattr(app, "SSE_DISCONNECT_GRACE", 0.01)
+    app.event_bus.publish("idle", "token", {"text": "y"})
+    app.close_channel_when_idle("idle")
+    q = app.event_bus.subscribe("busy")
+    app.event_bus.publish("busy", "token", {"text": "z"})
+    app.close_channel_when_idle("busy")
+    time.sleep(0.2)
+    assert app.event_bus.last_event("idle", "token") is None
+    assert app.event_bus.last_event("busy", "token") is not None
+    app.event_bus.unsubscribe("busy", q)
+    app.event_bus.close_channel("busy")
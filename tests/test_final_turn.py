@@ -0,0 +1,139 @@
+"""
+需求收集最后一轮附带约束条件的测试
+"""
+import os
+import sys
+import json
+import asyncio
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import CONSTRAINT_QUANTIFICATION_MODEL, CONSTRAINT_QUANTIFICATION_TEMPERATURE, FINAL_TURN_CONSTRAINTS
+from models.unified_processor import UnifiedProcessor
+from utils.json_repair import JSONRepairer
+
+
+RESPONSE = {
+    "next_question": "还有其他需求吗？",
+    "thinking": "",
+    "user_requirements": {"updated": False},
+    "spatial_understanding": {"updated": False},
+    "key_questions": {"updated": False},
+    "constraints": {"hard_constraints": [{"room": "客厅", "area": [20, 30]}]}
+}
+
+
+class RecordingClient:
+    """记录调用参数并返回固定响应的客户端"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    def generate_completion(self, prompt, **kwargs):
+        self.calls.append(kwargs)
+        return json.dumps(RESPONSE, ensure_ascii=False)
+    
+    async def agenerate_completion(self, prompt, **kwargs):
+        return self.generate_completion(prompt, **kwargs)
+
+
+def process(final_turn, use_async=False):
+    client = RecordingClient()
+    processor = UnifiedProcessor(client)
+    args = ("就这些", "空间理解", "需求猜测", [{"category": "功能", "status": "未知", "details": ""}], [])
+    if use_async:
+        result = asyncio.run(processor.aprocess(*args, final_turn=final_turn))
+    else:
+        result = processor.process(*args, final_turn=final_turn)
+    return client.calls[0], result
+
+
+def test_final_turn_uses_constraint_quantification_settings():
+    for use_async in (False, True):
+        call, result = process(True, use_async)
+        assert call["model_name"] == CONSTRAINT_QUANTIFICATION_MODEL
+        assert call["temperature"] == CONSTRAINT_QUANTIFICATION_TEMPERATURE
+        assert call["max_tokens"] == FINAL_TURN_CONSTRAINTS["max_tokens"]
+        assert call["hedge"] is False
+        assert "constraints" in call["json_keys"]
+        assert call["complete_keys"] == ["constraints"]
+        assert result["constraints"] == RESPONSE["constraints"]
+
+
+def test_regular_turn_keeps_question_settings():
+    call, _ = process(False)
+    assert call["temperature"] == 0.7
+    assert "max_tokens" not in call
+    assert not call.get("complete_keys")
+
+
+def test_truncated_constraints_are_dropped():
+    text = ('{"next_question": "还有吗？", "key_questions": {"updated": false}, '
+            '"constraints": {"hard_constraints": [{"room": "客厅"}, {"room": "卧')
+    result, steps = JSONRepairer().parse(text, complete_keys=["constraints"])
+    assert "constraints" not in result
+    assert result["next_question"] == "还有吗？"
+    assert "truncation" in steps and "incomplete_key" in steps
+
+
+def test_truncation_after_complete_constraints_keeps_them():
+    text = ('{"constraints": {"hard_constraints": [{"room": "客厅"}]}, '
+            '"next_question": "还有')
+    result, steps = JSONRepairer().parse(text, complete_keys=["constraints"])
+    assert result["constraints"] == {"hard_constraints": [{"room": "客厅"}]}
+    assert "incomplete_key" not in steps
+
+
+def test_truncated_constraints_kept_without_complete_keys():
+    text = '{"next_question": "还有吗？", "constraints": {"hard_constraints": [{"room": "客厅"}, {"room": "卧'
+    result, steps = JSONRepairer().parse(text)
+    assert "constraints" in result
+    assert "incomplete_key" not in steps
+
+
+class FakeWorkflow:
+    STAGE_REQUIREMENT_GATHERING = "requirement_gathering"
+    
+    def __init__(self, resolved, total):
+        self.resolved_key_questions = resolved
+        self.total_key_questions = total
+    
+    def get_current_stage(self):
+        return self.STAGE_REQUIREMENT_GATHERING
+
+
+class FakeDrafter:
+    settings = {"remaining_questions": 1}
+    
+    def __init__(self):
+        self.scheduled = 0
+    
+    def schedule(self, requirement_guess, spatial_understanding):
+        self.scheduled += 1
+
+
+def make_system(final_turn_enabled, monkeypatch):
+    import main
+    monkeypatch.setitem(main.FINAL_TURN_CONSTRAINTS, "enabled", final_turn_enabled)
+    system = main.ArchitectureAISystem.__new__(main.ArchitectureAISystem)
+    system.key_questions = [
+        {"category": "功能", "status": "已知", "details": ""},
+        {"category": "朝向", "status": "未知", "details": ""}
+    ]
+    system.workflow_manager = FakeWorkflow(1, 2)
+    system.constraint_drafter = FakeDrafter()
+    system.user_requirement_guess = "需求猜测"
+    system.spatial_understanding_record = "空间理解"
+    return system
+
+
+def test_draft_skipped_when_next_turn_carries_constraints(monkeypatch):
+    system = make_system(True, monkeypatch)
+    system._schedule_constraint_draft()
+    assert system.constraint_drafter.scheduled == 0
+
+
+def test_draft_scheduled_without_final_turn_constraints(monkeypatch):
+    system = make_system(False, monkeypatch)
+    system._schedule_constraint_draft()
+    assert system.constraint_drafter.scheduled == 1
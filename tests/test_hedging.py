@@ -0,0 +1,204 @@
+"""
+对冲请求和延迟统计的测试
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RATE_LIMIT_SETTINGS
+from utils.hedging import HedgeRace, HedgeCancelled
+from utils.latency_tracker import LatencyHistogram, LatencyTracker
+from utils.rate_limiter import RateLimiterRegistry, ModelRateLimiter
+from utils.openai_client import OpenAIClient
+
+PRIMARY = "deepseek-v3"
+SECONDARY = "gpt-4o"
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for value in range(1, 101):
+        histogram.record(value / 10)
+    assert histogram.percentile(50) == pytest.approx(5.0, rel=0.15)
+    assert histogram.percentile(99) == pytest.approx(9.9, rel=0.15)
+    assert histogram.summary()["censored"] == 0
+
+
+def test_cancelled_requests_keep_slow_tail_in_hedge_delay():
+    tracker = LatencyTracker({"min_samples": 10, "min_delay": 0.0, "max_delay": 100.0})
+    for _ in range(18):
+        tracker.record(PRIMARY, {"ttft": 1.0, "latency": 2.0})
+    # 两次慢请求都被对冲的备用模型抢先：只记录获胜方时阈值停留在1秒
+    assert tracker.hedge_delay(PRIMARY) == pytest.approx(1.0, rel=0.15)
+    tracker.record_cancelled(PRIMARY, 8.0)
+    tracker.record_cancelled(PRIMARY, 9.0)
+    assert tracker.hedge_delay(PRIMARY) >= 8.0
+    stats = tracker.get_stats()[PRIMARY]
+    assert stats["ttft"]["censored"] == 2
+    assert stats["latency"]["count"] == 18
+
+
+def test_ticket_claim_and_lost():
+    race = HedgeRace()
+    primary, secondary = race.ticket(PRIMARY), race.ticket(SECONDARY)
+    secondary.claim()
+    assert primary.lost() and not secondary.lost()
+    with pytest.raises(HedgeCancelled):
+        primary.claim()
+
+
+@pytest.fixture
+def client():
+    client = OpenAIClient()
+    client.rate_limiters = RateLimiterRegistry()
+    for name in (PRIMARY, SECONDARY):
+        client.rate_limiters._limiters[name] = ModelRateLimiter(name, RATE_LIMIT_SETTINGS)
+    client.latency_tracker = LatencyTracker({"default_delay": 0.05, "min_delay": 0.0})
+    return client
+
+
+def test_async_loser_recorded_as_censored_sample(client, monkeypatch):
+    async def dispatch(prompt, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        if model_config["model"] == PRIMARY:
+            await asyncio.sleep(5)
+        ticket.claim()
+        call_info["ttft"] = 0.01
+        return "{}"
+    
+    monkeypatch.setattr(client, "_adispatch", dispatch)
+    content, winner = asyncio.run(client._ahedged_completion("提示词", PRIMARY, SECONDARY, 0.5, 100, {}))
+    assert (content, winner) == ("{}", SECONDARY)
+    primary_ttft = client.latency_tracker.get_stats()[PRIMARY]["ttft"]
+    assert primary_ttft["count"] == 1 and primary_ttft["censored"] == 1
+    assert primary_ttft["max"] >= 0.03
+    assert client.latency_tracker.get_stats()[SECONDARY]["ttft"]["censored"] == 0
+
+
+def test_sync_loser_recorded_when_it_reaches_first_token(client, monkeypatch):
+    loser_done = threading.Event()
+    
+    def dispatch(prompt, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        if model_config["model"] == PRIMARY:
+            time.sleep(0.3)
+            try:
+                ticket.claim()
+            finally:
+                loser_done.set()
+        else:
+            ticket.claim()
+        call_info["ttft"] = 0.01
+        return "{}"
+    
+    monkeypatch.setattr(client, "_dispatch", dispatch)
+    content, winner = client._hedged_completion("提示词", PRIMARY, SECONDARY, 0.5, 100, {})
+    assert winner == SECONDARY
+    assert loser_done.wait(5)
+    time.sleep(0.05)
+    primary_ttft = client.latency_tracker.get_stats()[PRIMARY]["ttft"]
+    assert primary_ttft["censored"] == 1
+    assert primary_ttft["max"] >= 0.25
+
+
+def test_primary_cancelled_before_dispatch_is_not_recorded(client):
+    race = HedgeRace()
+    ticket = race.ticket(PRIMARY)
+    race.claim(SECONDARY)
+    config = client._get_model_config(PRIMARY)
+    with pytest.raises(HedgeCancelled):
+        client._complete_once("提示词", PRIMARY, config, 0.5, 100, {}, ticket)
+    assert PRIMARY not in client.latency_tracker.get_stats()
+
+
+def run_with_timeout(target, timeout=5):
+    """在独立线程中运行，超时说明调用卡住"""
+    result = {}
+    
+    def runner():
+        try:
+            result["value"] = target()
+        except BaseException as e:
+            result["error"] = e
+    
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "对冲调用没有返回"
+    return result
+
+
+@pytest.fixture
+def slow_notify(monkeypatch):
+    """唤醒等待方之后再停顿一会儿，放大唤醒与调用结束之间的时间窗口"""
+    notify = HedgeRace.notify
+    
+    def delayed(self):
+        notify(self)
+        time.sleep(0.05)
+    
+    monkeypatch.setattr(HedgeRace, "notify", delayed)
+
+
+def test_sync_hedge_returns_when_both_fail(client, monkeypatch, slow_notify):
+    def dispatch(prompt, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        if model_config["model"] == PRIMARY:
+            time.sleep(0.2)
+        raise ValueError(model_config["model"])
+    
+    monkeypatch.setattr(client, "_dispatch", dispatch)
+    for _ in range(3):
+        result = run_with_timeout(lambda: client._hedged_completion("提示词", PRIMARY, SECONDARY, 0.5, 100, {}))
+        assert str(result["error"]) == PRIMARY
+
+
+def test_sync_hedge_not_started_after_primary_failed(client, monkeypatch, slow_notify):
+    dispatched = []
+    
+    def dispatch(prompt, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        dispatched.append(model_config["model"])
+        raise ValueError(model_config["model"])
+    
+    monkeypatch.setattr(client, "_dispatch", dispatch)
+    client.latency_tracker = LatencyTracker({"default_delay": 1.0, "min_delay": 0.0})
+    start = time.perf_counter()
+    result = run_with_timeout(lambda: client._hedged_completion("提示词", PRIMARY, SECONDARY, 0.5, 100, {}))
+    assert isinstance(result["error"], ValueError)
+    assert dispatched == [PRIMARY]
+    assert time.perf_counter() - start < 0.5
+
+
+def test_loser_stream_closed_when_race_is_won():
+    race = HedgeRace()
+    closed = []
+    race.ticket(PRIMARY).on_lost(lambda: closed.append(PRIMARY))
+    race.ticket(SECONDARY).on_lost(lambda: closed.append(SECONDARY))
+    race.ticket(SECONDARY).claim()
+    assert closed == [PRIMARY]
+    # 落败后登记的回调立即调用，获胜方的回调不会被调用
+    race.ticket(PRIMARY).on_lost(lambda: closed.append("late"))
+    race.ticket(SECONDARY).on_lost(lambda: closed.append("winner"))
+    assert closed == [PRIMARY, "late"]
+
+
+def test_sync_loser_released_without_waiting_for_next_chunk(client, monkeypatch):
+    loser_released = threading.Event()
+    
+    def dispatch(prompt, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        if model_config["model"] == PRIMARY:
+            # 模拟阻塞在读取下一个片段上的流式响应，关闭连接时读取中止
+            stream_closed = threading.Event()
+            ticket.on_lost(stream_closed.set)
+            stream_closed.wait(10)
+            loser_released.set()
+            ticket.check()
+        ticket.claim()
+        return "{}"
+    
+    monkeypatch.setattr(client, "_dispatch", dispatch)
+    content, winner = client._hedged_completion("提示词", PRIMARY, SECONDARY, 0.5, 100, {})
+    assert winner == SECONDARY
+    assert loser_released.wait(1)
@@ -0,0 +1,98 @@
+"""
+LLM输出JSON修复的测试
+"""
+import os
+import sys
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.json_repair import JSONRepairer, JSONRepairError
+
+
+@pytest.fixture
+def repairer():
+    return JSONRepairer()
+
+
+def test_valid_json_needs_no_steps(repairer):
+    assert repairer.parse('{"a": 1}') == ({"a": 1}, [])
+
+
+def test_code_fence_comments_and_trailing_commas(repairer):
+    text = '说明如下：\n```json\n{\n  "a": [1, 2,], // 注释\n  "b": "多\n行",\n}\n```'
+    result, steps = repairer.parse(text)
+    assert result == {"a": [1, 2], "b": "多\n行"}
+    assert "code_fence" in steps and "cleanup" in steps
+
+
+def test_truncation_drops_partial_array_element(repairer):
+    result, steps = repairer.parse('{"key_questions":[{"q":1},{"q"')
+    assert result == {"key_questions": [{"q": 1}]}
+    assert steps == ["truncation", "drop_partial"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a":[1,2,{"b":[3,{"c"', {"a": [1, 2, {"b": [3]}]}),
+    ('{"a":["x","y', {"a": ["x"]}),
+    ('{"a":[{"q":1},{"q":2, "r":"te', {"a": [{"q": 1}]}),
+])
+def test_truncation_drops_innermost_partial_element(repairer, text, expected):
+    result, steps = repairer.parse(text)
+    assert result == expected
+    assert "drop_partial" in steps
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a":[{"q":1},{"q":2}', {"a": [{"q": 1}, {"q": 2}]}),
+    ('{"a":["x","y"', {"a": ["x", "y"]}),
+    ('{"a":[1,', {"a": [1]}),
+    ('{"a":"xy', {"a": "xy"}),
+    ('{"a":1,"b"', {"a": 1}),
+])
+def test_truncation_keeps_complete_elements(repairer, text, expected):
+    result, steps = repairer.parse(text)
+    assert result == expected
+    assert steps == ["truncation"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": tru', {}),
+    ('{"a":1,"b":fals', {"a": 1}),
+    ('{"a":{"b":nul', {"a": {}}),
+])
+def test_truncated_literal_drops_partial_key(repairer, text, expected):
+    assert repairer.parse(text) == (expected, ["truncation"])
+
+
+@pytest.mark.parametrize("text, steps", [
+    ('```json\n{"a":1,}\n```', ["code_fence", "cleanup"]),
+    ('{"a":1, /* 注释 */}', ["cleanup"]),
+    ('结果：{"a":1,}', ["extract", "cleanup"]),
+    ('{"a":1,} 以上', ["extract", "cleanup"]),
+])
+def test_extract_only_when_text_surrounds_value(repairer, text, steps):
+    assert repairer.parse(text) == ({"a": 1}, steps)
+
+
+def test_keys_are_recovered(repairer):
+    result, steps = repairer.parse('{"result": {"next_question": "?", "thinking": ""}}', ["next_question", "thinking"])
+    assert result == {"next_question": "?", "thinking": ""}
+    assert steps == ["keys"]
+    result, _ = repairer.parse('{"Next Question": "?"}', ["next_question"])
+    assert result == {"next_question": "?"}
+
+
+def test_unrepairable_text_raises(repairer):
+    with pytest.raises(JSONRepairError):
+        repairer.parse("无法回答")
+
+
+def test_stats_count_steps_per_source(repairer):
+    repairer.parse('{"a": 1}', source="m")
+    repairer.parse('{"a":[{"q":1},{"q"', source="m")
+    with pytest.raises(JSONRepairError):
+        repairer.parse("", source="m")
+    stats = repairer.get_stats()["m"]
+    assert (stats["total"], stats["parsed"], stats["repaired"], stats["failed"]) == (3, 1, 1, 1)
+    assert stats["steps"] == {"truncation": 1, "drop_partial": 1}
@@ -0,0 +1,131 @@
+"""
+LLM响应缓存的测试
+"""
+import os
+import sys
+import time
+import asyncio
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.llm_cache import LLMResponseCache
+from utils.openai_client import OpenAIClient
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    def make(**settings):
+        settings.setdefault("disk_dir", str(tmp_path / "llm_responses"))
+        return LLMResponseCache(settings)
+    return make
+
+
+def test_key_covers_all_parameters(make_cache):
+    cache = make_cache()
+    key = cache.make_key("m", 0.5, 100, "system", "prompt")
+    assert key == cache.make_key("m", 0.5, 100, "system", "prompt")
+    assert key != cache.make_key("m", 0.7, 100, "system", "prompt")
+    assert key != cache.make_key("m", 0.5, 200, "system", "prompt")
+    assert key != cache.make_key("m", 0.5, 100, "", "prompt")
+
+
+def test_memory_then_disk_hits(make_cache):
+    cache = make_cache()
+    key = cache.make_key("m", 0.5, 100, "", "prompt")
+    assert cache.get(key) == (None, None)
+    cache.put(key, "响应", "m")
+    assert cache.get(key) == ("响应", "memory")
+    # 新实例只能从磁盘读取
+    assert make_cache().get(key) == ("响应", "disk")
+
+
+def test_memory_lru_eviction(make_cache):
+    cache = make_cache(memory_max_entries=2)
+    keys = [cache.make_key("m", 0, 1, "", str(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, key)
+    assert keys[0] not in cache._memory
+    assert cache.get(keys[0]) == (keys[0], "disk")
+    assert cache.stats["evictions"] >= 1
+
+
+def test_expired_entries_are_missed(make_cache):
+    cache = make_cache(ttl_seconds=0.05)
+    key = cache.make_key("m", 0, 1, "", "prompt")
+    cache.put(key, "响应")
+    time.sleep(0.1)
+    assert cache.get(key) == (None, None)
+    assert not os.path.exists(cache._disk_path(key))
+
+
+def test_disk_size_limit_evicts_oldest(make_cache):
+    cache = make_cache(disk_max_bytes=400, sweep_interval=1)
+    keys = [cache.make_key("m", 0, 1, "", str(i)) for i in range(5)]
+    now = time.time()
+    for index, key in enumerate(keys):
+        cache.put(key, "x" * 100)
+        # 修改时间（最近访问时间）决定淘汰顺序
+        mtime = now - len(keys) + index
+        os.utime(cache._disk_path(key), (mtime, mtime))
+    cache._evict_disk()
+    assert not os.path.exists(cache._disk_path(keys[0]))
+    assert os.path.exists(cache._disk_path(keys[-1]))
+
+
+def test_disabled_cache_stores_nothing(make_cache):
+    cache = make_cache(enabled=False)
+    key = cache.make_key("m", 0, 1, "", "prompt")
+    cache.put(key, "响应")
+    assert cache.get(key) == (None, None)
+    assert not os.path.exists(cache.disk_dir)
+
+
+@pytest.fixture
+def make_client(make_cache, monkeypatch):
+    def make(responses):
+        client = OpenAIClient()
+        client.replay_store = None
+        client.response_cache = make_cache()
+        responses = list(responses)
+        
+        def complete_once(*args, **kwargs):
+            return responses.pop(0)
+        
+        async def acomplete_once(*args, **kwargs):
+            return responses.pop(0)
+        
+        monkeypatch.setattr(client, "_complete_once", complete_once)
+        monkeypatch.setattr(client, "_acomplete_once", acomplete_once)
+        return client
+    return make
+
+
+def cached_responses(client):
+    return [response for _, response in client.response_cache._memory.values()]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_repaired_response_is_cached(make_client, use_async):
+    client = make_client(['{"a": [1, 2],}'])
+    if use_async:
+        content = asyncio.run(client.agenerate_completion("提示词", use_cache=True))
+    else:
+        content = client.generate_completion("提示词", use_cache=True)
+    assert content == '{"a": [1, 2]}'
+    assert cached_responses(client) == ['{"a": [1, 2]}']
+    # 缓存命中时不再修复
+    assert client.generate_completion("提示词", use_cache=True) == '{"a": [1, 2]}'
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_unparseable_response_is_not_cached(make_client, use_async):
+    client = make_client(["无法回答", '{"a": 1}'])
+    if use_async:
+        content = asyncio.run(client.agenerate_completion("提示词", use_cache=True))
+    else:
+        content = client.generate_completion("提示词", use_cache=True)
+    # 重新请求得到的结果返回给调用处，但原提示词的缓存中没有损坏的响应
+    assert content == '{"a": 1}'
+    assert cached_responses(client) == []
+
@@ -0,0 +1,141 @@
+"""
+LLM调用回放的测试
+"""
+import os
+import sys
+import json
+import time
+import threading
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PROMPT_CACHE_BOUNDARY
+from utils.llm_replay import LLMReplayStore
+from utils.prompt_segments import PromptSegments
+from utils.session_log import SegmentedLog
+from utils.session_store import FileSessionStore
+from utils.write_behind import WriteBehindWriter
+
+
+PROMPT = "请根据以下对话提出下一个问题：用户需要三室两厅，客厅朝南。"
+
+
+def record(response, prompt=PROMPT, model="m", timestamp="2026-01-01T12:00:00", **extra):
+    return dict({"model": model, "prompt": prompt, "response": response, "timestamp": timestamp}, **extra)
+
+
+def write_session(sessions_dir, session_id, records):
+    output_dir = sessions_dir / session_id / "llm_outputs"
+    output_dir.mkdir(parents=True)
+    with open(output_dir / "llm_output.json", "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+
+
+def make_store(tmp_path, records, **settings):
+    write_session(tmp_path, "20260101_120000", records)
+    return LLMReplayStore([str(tmp_path)], dict({"simulate_latency": False}, **settings))
+
+
+def test_repeated_prompt_replays_in_recorded_order(tmp_path):
+    store = make_store(tmp_path, [
+        record("第二次", timestamp="2026-01-01T12:00:02"),
+        record("第一次", timestamp="2026-01-01T12:00:01")
+    ])
+    responses = [store.lookup("m", PROMPT)[0]["response"] for _ in range(3)]
+    assert responses == ["第一次", "第二次", "第二次"]
+    _, match = store.lookup("m", PROMPT)
+    assert match == {"replay_match": "exact", "replay_origin": "20260101_120000"}
+
+
+def test_similar_prompt_matches_fuzzily(tmp_path):
+    store = make_store(tmp_path, [record("回答")])
+    found, match = store.lookup("m", PROMPT.replace("朝南", "朝东"))
+    assert found["response"] == "回答"
+    assert match["replay_match"] == "fuzzy" and match["replay_similarity"] >= 0.9
+
+
+def test_misses(tmp_path):
+    store = make_store(tmp_path, [record("回答")], fuzzy_threshold=None)
+    assert store.lookup("m", PROMPT + "。") == (None, None)
+    assert store.lookup("other", PROMPT) == (None, None)
+    assert store.get_stats() == {"records": 1, "exact": 0, "fuzzy": 0, "misses": 2}
+
+
+def test_model_ignored_when_not_matched(tmp_path):
+    store = make_store(tmp_path, [record("回答")], match_model=False)
+    assert store.lookup("other", PROMPT)[0]["response"] == "回答"
+
+
+def test_deduplicated_prompts_are_expanded(tmp_path):
+    prefix = "通用说明" * 100 + PROMPT_CACHE_BOUNDARY
+    writer = WriteBehindWriter({"flush_interval": 60})
+    packed = PromptSegments(FileSessionStore(str(tmp_path), writer=writer)).pack(prefix + "用户输入")
+    writer.flush()
+    store = make_store(tmp_path, [dict(packed, model="m", response="回答", timestamp="2026-01-01T12:00:00")])
+    assert store.lookup("m", prefix + "用户输入")[0]["response"] == "回答"
+
+
+@pytest.mark.parametrize("simulate_latency, expected", [
+    (False, [(0.0, "abcd"), (0.0, "efgh"), (0.0, "ij")]),
+    (True, [(0.5, "abcd"), (0.2, "efgh"), (0.1, "ij")]),
+])
+def test_plan_splits_recorded_latency(simulate_latency, expected):
+    store = LLMReplayStore([], {"simulate_latency": simulate_latency, "chunk_chars": 4, "time_scale": 0.5})
+    steps = store.plan(record("abcdefghij", ttft=1.0, latency=2.0))
+    assert [(round(delay, 6), chunk) for delay, chunk in steps] == expected
+
+
+def family_prompt(index, words=("客厅", "卧室", "厨房", "书房")):
+    # 同一模块的提示词共享数KB的固定前缀，只有动态部分不同
+    prefix = "".join(f"第{line}条通用说明：输出JSON，字段含义如下。" for line in range(400)) + PROMPT_CACHE_BOUNDARY
+    return prefix + f"对话记录{index}：" + "".join(words[(index + n) % len(words)] for n in range(50))
+
+
+def test_fuzzy_miss_against_large_corpus_is_fast(tmp_path):
+    records = [record(f"回答{index}", prompt=family_prompt(index)) for index in range(200)]
+    store = make_store(tmp_path, records, fuzzy_threshold=0.999)
+    start = time.perf_counter()
+    found, _ = store.lookup("m", family_prompt(0, words=("阳台", "车库")))
+    assert found is None
+    assert time.perf_counter() - start < 1.0
+    # 相同提示词的模糊匹配结果被缓存
+    found, match = store.lookup("m", family_prompt(3)[:-1] + "X")
+    assert found["response"] == "回答3" and match["replay_match"] == "fuzzy"
+    assert store._fuzzy_cache
+
+
+def test_fuzzy_match_does_not_block_other_lookups(tmp_path, monkeypatch):
+    store = make_store(tmp_path, [record("回答")])
+    started, release = threading.Event(), threading.Event()
+    fuzzy_match = store._fuzzy_match
+    
+    def slow_match(prompt, candidates):
+        started.set()
+        release.wait(5)
+        return fuzzy_match(prompt, candidates)
+    
+    monkeypatch.setattr(store, "_fuzzy_match", slow_match)
+    thread = threading.Thread(target=store.lookup, args=("m", PROMPT.replace("朝南", "朝东")))
+    thread.start()
+    assert started.wait(5)
+    # 模糊匹配计算期间，精确匹配的调用不用等待
+    assert store.lookup("m", PROMPT)[0]["response"] == "回答"
+    release.set()
+    thread.join(5)
+    assert store.get_stats()["fuzzy"] == 1
+
+
+def test_compressed_outputs_are_found(tmp_path):
+    writer = WriteBehindWriter({"flush_interval": 60})
+    log = SegmentedLog(str(tmp_path / "20260101_120000" / "llm_outputs" / "llm_output.json"),
+                       compact_every=0, writer=writer, compress=True)
+    os.makedirs(os.path.dirname(log.json_path))
+    log.create()
+    log.append(record("回答"))
+    log.compact()
+    writer.flush()
+    assert sorted(os.listdir(os.path.dirname(log.json_path))) == ["llm_output.json.gz", "llm_output.jsonl"]
+    for source in (str(tmp_path), log.compressed_path):
+        store = LLMReplayStore([source], {"simulate_latency": False})
+        assert store.lookup("m", PROMPT)[0]["response"] == "回答"
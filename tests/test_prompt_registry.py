@@ -0,0 +1,97 @@
+"""
+提示词注册表和预编译模板的测试
+"""
+import os
+import sys
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import UNIFIED_PROCESSING_PROMPT
+from utils.prompt_registry import PromptRegistry, PromptTemplate
+
+
+def write(path, text, mtime):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def registry():
+    return PromptRegistry({"hot_reload": True, "check_interval": 0})
+
+
+@pytest.mark.parametrize("template, fixed, values", [
+    ("{base}\n{question}", {"base": "说明"}, {"question": "问题"}),
+    ("{a}{b!r}{c:>5}{{原样}}{d[0]}", {"a": 1, "d": ["x"]}, {"b": "值", "c": 7}),
+    ("没有字段", {}, {}),
+])
+def test_template_matches_str_format(template, fixed, values):
+    compiled = PromptTemplate(template, fixed)
+    assert compiled.format(**values) == template.format(**fixed, **values)
+    assert set(compiled.fields) == set(values)
+
+
+def test_prefix_covers_fixed_fields():
+    compiled = PromptTemplate("{base}说明{{x}}\n{question}", {"base": "通用"})
+    assert compiled.prefix == "通用说明{x}\n"
+    with pytest.raises(KeyError):
+        compiled.format()
+
+
+def test_unified_prompt_compiles_to_same_text():
+    fields = {name: f"<{name}>" for name in PromptTemplate(UNIFIED_PROCESSING_PROMPT, {}).fields}
+    compiled = PromptTemplate(UNIFIED_PROCESSING_PROMPT, {})
+    assert compiled.format(**fields) == UNIFIED_PROCESSING_PROMPT.format(**fields)
+
+
+def test_text_is_loaded_once_and_reloaded_on_change(registry, tmp_path):
+    path = str(tmp_path / "prompt.txt")
+    write(path, "v1", 1000)
+    assert registry.text(path) == "v1"
+    assert registry.text(path) == "v1"
+    assert registry.get_stats()["loads"] == 1
+    write(path, "v2", 2000)
+    assert registry.text(path) == "v2"
+    assert registry.get_stats()["reloads"] == 1
+
+
+def test_changes_ignored_without_hot_reload(tmp_path):
+    registry = PromptRegistry({"hot_reload": False})
+    path = str(tmp_path / "prompt.txt")
+    write(path, "v1", 1000)
+    registry.text(path)
+    write(path, "v2", 2000)
+    assert registry.text(path) == "v1"
+
+
+def test_template_recompiled_when_asset_changes(registry, tmp_path):
+    path = str(tmp_path / "base.txt")
+    write(path, "旧说明", 1000)
+    first = registry.template("t", "{base}|{question}", assets={"base": path})
+    assert registry.template("t", "{base}|{question}", assets={"base": path}) is first
+    write(path, "新说明", 2000)
+    assert registry.template("t", "{base}|{question}", assets={"base": path}).format(question="?") == "新说明|?"
+    assert registry.get_stats()["compiles"] == 2
+
+
+def test_missing_asset_uses_default(registry, tmp_path):
+    path = str(tmp_path / "missing.txt")
+    with pytest.raises(FileNotFoundError):
+        registry.text(path)
+    assert registry.text(path, default="") == ""
+    assert registry.template("t", "{base}{q}", assets={"base": path}).format(q="?") == "?"
+
+
+def test_json_returns_independent_copies(registry, tmp_path):
+    path = str(tmp_path / "template.json")
+    write(path, '{"room_list": []}', 1000)
+    first = registry.json(path)
+    first["room_list"].append("客厅")
+    assert registry.json(path) == {"room_list": []}
+
+
+def test_windows_style_paths_resolve(registry):
+    assert registry.resolve("templates\\a.txt") == registry.resolve("templates/a.txt")
+    assert os.path.isabs(registry.resolve("templates/a.txt"))
@@ -0,0 +1,129 @@
+"""
+提示词片段去重存储的测试
+"""
+import os
+import sys
+import json
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PROMPT_CACHE_BOUNDARY
+from utils.prompt_segments import PromptSegments, split_prompt
+from utils.session_store import FileSessionStore
+from utils.write_behind import WriteBehindWriter
+
+
+PREFIX = "通用说明" * 100 + PROMPT_CACHE_BOUNDARY
+
+
+class MemoryStore:
+    """在内存中保存片段并记录写入次数的存储后端"""
+    
+    def __init__(self):
+        self.segments = {}
+        self.saves = 0
+    
+    def save_segment(self, digest, text):
+        self.saves += 1
+        self.segments[digest] = text
+    
+    def load_segment(self, digest):
+        return self.segments.get(digest)
+
+
+@pytest.fixture
+def store():
+    return MemoryStore()
+
+
+def test_split_prompt_keeps_boundary_in_prefix():
+    assert split_prompt(PREFIX + "用户输入") == (PREFIX, "用户输入")
+    assert split_prompt("没有边界") == ("", "没有边界")
+
+
+def test_same_prefix_is_saved_once(store):
+    segments = PromptSegments(store)
+    first = segments.pack(PREFIX + "第一轮")
+    second = segments.pack(PREFIX + "第二轮")
+    assert first["prompt_prefix"] == second["prompt_prefix"]
+    assert (first["prompt_suffix"], second["prompt_suffix"]) == ("第一轮", "第二轮")
+    assert store.saves == 1
+    stats = segments.get_stats()
+    assert (stats["packed"], stats["new_segments"], stats["saved_chars"]) == (2, 1, 2 * len(PREFIX))
+
+
+def test_records_are_restored_by_a_new_instance(store):
+    record = PromptSegments(store).pack(PREFIX + "第一轮")
+    segments = PromptSegments(store)
+    assert segments.unpack(record) == PREFIX + "第一轮"
+    assert segments.expand(dict(record, model="m")) == {"model": "m", "prompt": PREFIX + "第一轮"}
+
+
+def test_short_or_unsplit_prompts_are_kept_whole(store):
+    segments = PromptSegments(store)
+    for prompt in ("没有边界", "短" + PROMPT_CACHE_BOUNDARY + "用户输入"):
+        record = segments.pack(prompt)
+        assert record == {"prompt": prompt}
+        assert segments.expand(record) is record
+    assert PromptSegments(store, {"dedup": False}).pack(PREFIX + "x") == {"prompt": PREFIX + "x"}
+    assert store.saves == 0
+
+
+def test_missing_segment_unpacks_to_none(store):
+    assert PromptSegments(store).unpack({"prompt_prefix": "0" * 64, "prompt_suffix": "x"}) is None
+
+
+def test_file_store_round_trip(tmp_path):
+    store = FileSessionStore(str(tmp_path), writer=WriteBehindWriter({"flush_interval": 60}))
+    record = PromptSegments(store).pack(PREFIX + "第一轮")
+    PromptSegments(store).pack(PREFIX + "第二轮")
+    assert PromptSegments(store).unpack(record) == PREFIX + "第一轮"
+    digest = record["prompt_prefix"]
+    assert os.listdir(tmp_path / "prompt_segments" / digest[:2]) == [f"{digest}.txt.gz"]
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def session_calls(turns):
+    # 与实际会话相近：数KB的固定说明，动态部分是逐轮增长的对话记录和当前状态，回应为JSON
+    prefix = "".join(f"第{line}条规则：房间约束按JSON输出，面积单位为平方米，朝向取东南西北。" for line in range(150))
+    prefix += PROMPT_CACHE_BOUNDARY
+    rooms = ["客厅", "餐厅", "厨房", "主卧", "次卧", "书房", "卫生间", "阳台"]
+    history = []
+    for turn in range(turns):
+        history.append(f"用户：{rooms[turn % len(rooms)]}希望朝南，面积约{12 + turn}平方米，与{rooms[(turn + 3) % len(rooms)]}相邻。")
+        state = {room: {"area": {"min": 8 + index + turn % 3}, "adjacency": rooms[index - 1:index]} for index, room in enumerate(rooms)}
+        suffix = "对话记录：\n" + "\n".join(history) + "\n当前约束：" + json.dumps(state, ensure_ascii=False)
+        response = json.dumps({"rooms": state, "question": f"第{turn}轮：{rooms[turn % len(rooms)]}需要窗户吗？"}, ensure_ascii=False)
+        yield prefix + suffix, response
+
+
+def test_file_session_size_reduction(tmp_path, capsys):
+    writer = WriteBehindWriter({"enabled": True, "flush_interval": 60, "fsync": "never"})
+    store = FileSessionStore(str(tmp_path), writer=writer)
+    record = {"session_id": "s", "api_calls": [], "conversation_history": []}
+    (tmp_path / "s").mkdir()
+    session = store.open_session("s", str(tmp_path / "s"), record, {})
+    segments = PromptSegments(store)
+    full_records = []
+    for prompt, response in session_calls(40):
+        call = {"timestamp": "2026-01-01T12:00:00", "model": "m", "response": response, "tokens": {"total": 1000}}
+        full_records.append(dict(call, prompt=prompt))
+        call.update(segments.pack(prompt))
+        record["api_calls"].append(call)
+        session.save_record(record, [("append", "api_calls", call)])
+    session.compact(record)
+    writer.flush()
+    # 原有布局中每次调用的完整提示词和回应同时保存在session_record.json和llm_output.json中
+    baseline = 2 * len(json.dumps(full_records, ensure_ascii=False, indent=2).encode("utf-8"))
+    stored = directory_size(tmp_path)
+    with capsys.disabled():
+        print(f"\n会话文件大小：原有布局{baseline}字节，现在{stored}字节，缩小为1/{baseline / stored:.1f}")
+    assert baseline / stored >= 10
+    # 完整的调用记录仍可还原
+    outputs = [segments.expand(item) for item in session.read_llm_outputs()]
+    assert [(item["prompt"], item["response"]) for item in outputs] == \
+        [(item["prompt"], item["response"]) for item in full_records]
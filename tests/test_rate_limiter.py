@@ -0,0 +1,150 @@
+"""
+限流器和熔断器的测试
+"""
+import os
+import sys
+import asyncio
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RATE_LIMIT_SETTINGS
+from utils.rate_limiter import (
+    CircuitBreaker, CircuitOpenError, ModelRateLimiter, RateLimiterRegistry, TokenBucket, is_retryable_error
+)
+from utils.openai_client import OpenAIClient
+
+
+class StatusError(Exception):
+    """带HTTP状态码的接口错误"""
+    
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def make_limiter(**overrides):
+    settings = dict(RATE_LIMIT_SETTINGS, breaker_failure_threshold=1, breaker_recovery_timeout=0.0)
+    settings.update(overrides)
+    return ModelRateLimiter("test-model", settings)
+
+
+def open_breaker(limiter):
+    """让熔断器打开；冷却期为0，下一次调用即为半开状态下的试探"""
+    limiter.record_failure()
+    assert limiter.breaker.state == CircuitBreaker.OPEN
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(60, now) == 0.0
+    bucket.consume(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    bucket.refund(30)
+    assert bucket.wait_time(30, now) == 0.0
+
+
+def test_breaker_allows_single_probe_after_recovery():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10.0)
+    breaker.record_failure(0.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure(0.0)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow(5.0)
+    assert breaker.allow(10.0)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow(10.0)
+    breaker.record_success()
+    assert breaker.allow(11.0)
+
+
+def test_slot_marks_probe():
+    limiter = make_limiter()
+    with limiter.slot(10) as slot:
+        assert slot["probe"] is False
+    open_breaker(limiter)
+    with limiter.slot(10) as slot:
+        assert slot["probe"] is True
+        with pytest.raises(CircuitOpenError):
+            limiter.acquire(10)
+
+
+def test_is_retryable_error():
+    assert is_retryable_error(StatusError(429))
+    assert is_retryable_error(StatusError(503))
+    assert not is_retryable_error(StatusError(400))
+    assert not is_retryable_error(CircuitOpenError("open"))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = OpenAIClient()
+    limiter = make_limiter()
+    registry = RateLimiterRegistry()
+    registry._limiters["test-model"] = limiter
+    client.rate_limiters = registry
+    return client, limiter
+
+
+def complete_once(client, error=None):
+    def dispatch(*args, **kwargs):
+        if error is not None:
+            raise error
+        return "ok"
+    client._dispatch = dispatch
+    return client._complete_once("prompt", "test-model", {"model": "gpt-4o"}, 0.0, 10, {})
+
+
+@pytest.mark.parametrize("error", [StatusError(400), ValueError("解析失败")])
+def test_half_open_probe_with_non_retryable_error_releases_probe(client, error):
+    client, limiter = client
+    open_breaker(limiter)
+    with pytest.raises(type(error)):
+        complete_once(client, error)
+    # 试探名额已释放，下一次调用被放行并关闭熔断器
+    assert complete_once(client) == "ok"
+    assert limiter.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe_with_retryable_error_reopens(client):
+    client, limiter = client
+    limiter.breaker.recovery_timeout = 60.0
+    limiter.breaker.state = CircuitBreaker.HALF_OPEN
+    with pytest.raises(StatusError):
+        complete_once(client, StatusError(503))
+    assert limiter.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        complete_once(client)
+
+
+def test_rejected_call_does_not_release_other_probe(client):
+    client, limiter = client
+    open_breaker(limiter)
+    with limiter.slot(10) as slot:
+        assert slot["probe"]
+        with pytest.raises(CircuitOpenError):
+            complete_once(client)
+        # 被拒绝的调用不能释放正在进行的试探
+        assert limiter.breaker._probe_in_flight
+
+
+def test_async_probe_cancelled_releases_probe(client):
+    client, limiter = client
+    open_breaker(limiter)
+    
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(10)
+    client._adispatch = hang
+    
+    async def run():
+        task = asyncio.ensure_future(
+            client._acomplete_once("prompt", "test-model", {"model": "gpt-4o"}, 0.0, 10, {})
+        )
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(run())
+    assert not limiter.breaker._probe_in_flight
+    assert limiter.breaker.allow(limiter.breaker.opened_at)
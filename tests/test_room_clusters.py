@@ -0,0 +1,95 @@
+"""
+房间分组优化中分组与合并的测试
+"""
+import os
+import sys
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.converter import ConstraintConverter
+
+
+def room(connection=(), adjacency=(), repulsion=(), **fields):
+    return dict({
+        "connection": list(connection),
+        "adjacency": list(adjacency),
+        "area": {},
+        "orientation": "",
+        "window_access": False,
+        "aspect_ratio": {},
+        "repulsion": list(repulsion)
+    }, **fields)
+
+
+def make_rooms(edges, repulsion=(), isolated=()):
+    rooms = {}
+    for a, b in edges:
+        rooms.setdefault(a, room())["connection"].append(b)
+        rooms.setdefault(b, room())["connection"].append(a)
+    for a, b in repulsion:
+        rooms.setdefault(a, room())["repulsion"].append(b)
+        rooms.setdefault(b, room())["repulsion"].append(a)
+    for name in isolated:
+        rooms.setdefault(name, room())
+    return {"rooms": rooms, "special_spaces": {"path": True}}
+
+
+@pytest.fixture
+def converter():
+    return ConstraintConverter()
+
+
+def test_split_keeps_connected_rooms_together(converter):
+    # 两组关系紧密的房间之间只有一条连接
+    constraints = make_rooms([
+        ("客厅", "餐厅"), ("餐厅", "厨房"), ("厨房", "客厅"),
+        ("主卧", "主卫"), ("主卫", "衣帽间"), ("衣帽间", "主卧"),
+        ("客厅", "主卧")
+    ])
+    groups = converter.split_rooms(constraints, 3)
+    assert sorted(sorted(group) for group in groups) == [sorted(["主卧", "主卫", "衣帽间"]), sorted(["客厅", "餐厅", "厨房"])]
+
+
+def test_split_merges_small_groups(converter):
+    constraints = make_rooms([("客厅", "餐厅")], isolated=["储藏室", "阳台"])
+    groups = converter.split_rooms(constraints, 4)
+    assert len(groups) == 1
+    assert sorted(groups[0]) == sorted(["客厅", "餐厅", "储藏室", "阳台"])
+
+
+def test_merge_removal_from_either_side_is_authoritative(converter):
+    constraints = make_rooms([("客厅", "主卧"), ("客厅", "餐厅")], repulsion=[("厨房", "主卧")])
+    constraints["rooms"]["厨房"]["connection"] = []
+    # 客厅一组删除了与主卧的跨组连接，主卧一组仍保留；主卧一组删除了与厨房的排斥
+    optimized = [
+        {"客厅": room(connection=["餐厅"]), "餐厅": room(connection=["客厅"]), "厨房": room(repulsion=["主卧"])},
+        {"主卧": room(connection=["客厅"])}
+    ]
+    merged = converter.merge_rooms(constraints, optimized)["rooms"]
+    assert merged["客厅"]["connection"] == ["餐厅"]
+    assert merged["主卧"]["connection"] == []
+    assert merged["厨房"]["repulsion"] == [] and merged["主卧"]["repulsion"] == []
+
+
+def test_merge_keeps_added_relations_in_both_directions(converter):
+    constraints = make_rooms([("客厅", "餐厅")], isolated=["主卧"])
+    optimized = [
+        {"客厅": room(connection=["餐厅"], adjacency=["主卧", "不存在的房间"]), "餐厅": room(connection=["客厅"])},
+        {"主卧": room(area={"min": 12})}
+    ]
+    result = converter.merge_rooms(constraints, optimized)
+    merged = result["rooms"]
+    assert merged["客厅"]["adjacency"] == ["主卧"]
+    assert merged["主卧"]["adjacency"] == ["客厅"]
+    assert merged["主卧"]["area"] == {"min": 12}
+    assert result["special_spaces"] == {"path": True}
+
+
+def test_group_without_result_keeps_original_rooms(converter):
+    constraints = make_rooms([("客厅", "主卧")])
+    # 主卧一组调用失败没有返回结果，只有客厅一侧的删除生效
+    merged = converter.merge_rooms(constraints, [{"客厅": room()}, {}])["rooms"]
+    assert merged["主卧"]["connection"] == [] and merged["客厅"]["connection"] == []
+    merged = converter.merge_rooms(constraints, [{}, {}])["rooms"]
+    assert merged["主卧"]["connection"] == ["客厅"] and merged["客厅"]["connection"] == ["主卧"]
@@ -0,0 +1,111 @@
+"""
+会话日志追加写入和整理的测试
+"""
+import os
+import sys
+import json
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.session_log import SegmentedLog, RecordJournal, load_session_record, write_json_atomic
+from utils.write_behind import WriteBehindWriter
+
+
+@pytest.fixture
+def writer():
+    # 时间窗口足够长，排队的操作只在读取或flush()时写入
+    return WriteBehindWriter({"enabled": True, "flush_interval": 60, "fsync": "never"})
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_appends_go_to_segment_until_compacted(writer, tmp_path):
+    log = SegmentedLog(str(tmp_path / "conversation.json"), compact_every=0, writer=writer)
+    log.create()
+    for index in range(3):
+        log.append({"index": index})
+    assert log.read() == [{"index": 0}, {"index": 1}, {"index": 2}]
+    assert load(log.json_path) == []
+    log.compact()
+    writer.flush()
+    assert load(log.json_path) == [{"index": 0}, {"index": 1}, {"index": 2}]
+    assert os.path.getsize(log.segment_path) == 0
+    log.append({"index": 3})
+    assert [item["index"] for item in log.read()] == [0, 1, 2, 3]
+
+
+def test_compacts_every_n_appends(writer, tmp_path):
+    log = SegmentedLog(str(tmp_path / "debug_log.json"), compact_every=2, writer=writer)
+    log.create()
+    for index in range(5):
+        log.append({"index": index})
+    writer.flush()
+    assert [item["index"] for item in load(log.json_path)] == [0, 1, 2, 3]
+    assert [item["index"] for item in log.read()] == [0, 1, 2, 3, 4]
+
+
+def test_torn_last_line_is_skipped(writer, tmp_path):
+    log = SegmentedLog(str(tmp_path / "conversation.json"), compact_every=0, writer=writer)
+    log.create()
+    log.append({"index": 0})
+    writer.flush()
+    with open(log.segment_path, "a", encoding="utf-8") as f:
+        f.write('{"index": 1')
+    assert log.read() == [{"index": 0}]
+
+
+def test_record_journal_replays_changes(writer, tmp_path):
+    journal = RecordJournal(str(tmp_path / "session_record.json"), compact_every=0, writer=writer)
+    record = {"session_id": "s", "conversation_history": []}
+    write_json_atomic(journal.json_path, record)
+    record["conversation_history"].append({"content": "你好"})
+    journal.record(record, [("append", "conversation_history", {"content": "你好"})])
+    record["end_time"] = "2026-01-01T12:00:00"
+    journal.record(record, [("set", "end_time", "2026-01-01T12:00:00")])
+    writer.flush()
+    assert load_session_record(str(tmp_path)) == record
+    # 整理后完整记录写入JSON文件，变更日志清空
+    journal.compact(record)
+    writer.flush()
+    assert load(journal.json_path) == record
+    assert load_session_record(str(tmp_path)) == record
+
+
+def test_missing_session_record(tmp_path):
+    assert load_session_record(str(tmp_path)) is None
+
+
+def test_compressed_log_replaces_json_on_compaction(writer, tmp_path):
+    log = SegmentedLog(str(tmp_path / "llm_output.json"), compact_every=2, writer=writer, compress=True)
+    log.create()
+    for index in range(3):
+        log.append({"index": index})
+    writer.flush()
+    assert not os.path.exists(log.json_path)
+    assert os.path.exists(log.compressed_path)
+    assert [item["index"] for item in log.read()] == [0, 1, 2]
+    # 未压缩的实例也能读取压缩后的记录
+    assert SegmentedLog(log.json_path, compact_every=0, writer=writer).read() == log.read()
+    log.create()
+    assert log.read() == [] and not os.path.exists(log.compressed_path)
+
+
+def test_record_journal_omits_stored_fields(writer, tmp_path):
+    journal = RecordJournal(str(tmp_path / "session_record.json"), compact_every=0, writer=writer,
+                            omit={"api_calls": ("prompt", "response")})
+    record = {"session_id": "s", "api_calls": []}
+    write_json_atomic(journal.json_path, record)
+    call = {"model": "m", "prompt": "提示词", "response": "回应", "tokens": {"total": 3}}
+    record["api_calls"].append(call)
+    journal.record(record, [("append", "api_calls", call), ("set", "end_time", "t")])
+    writer.flush()
+    assert load_session_record(str(tmp_path))["api_calls"] == [{"model": "m", "tokens": {"total": 3}}]
+    journal.compact(record)
+    writer.flush()
+    assert load(journal.json_path)["api_calls"] == [{"model": "m", "tokens": {"total": 3}}]
+    # 内存中的会话记录不受影响
+    assert record["api_calls"][0]["response"] == "回应"
@@ -0,0 +1,131 @@
+"""
+文件和SQLite两种会话存储后端的一致性测试
+"""
+import os
+import sys
+import json
+import threading
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.session_manager import SessionManager
+from utils.session_store import FileSessionStore, SQLiteSessionStore
+from utils.write_behind import WriteBehindWriter
+
+
+SESSION_ID = "20260101_120000"
+CURRENT_STATE = {"spatial_understanding": {}, "user_requirements": {}, "key_questions": {}, "constraints": {}}
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    # 时间窗口足够长，排队的写入只在读取前的flush()时执行
+    writer = WriteBehindWriter({"enabled": True, "flush_interval": 60, "fsync": "never"})
+    if request.param == "file":
+        yield FileSessionStore(str(tmp_path), writer=writer)
+    else:
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"), writer=writer)
+        yield store
+        store._conn.close()
+
+
+def open_session(store, tmp_path, session_id=SESSION_ID, start_time="2026-01-01T12:00:00"):
+    session_dir = tmp_path / session_id
+    session_dir.mkdir(exist_ok=True)
+    record = {"session_id": session_id, "start_time": start_time, "conversation_history": [], "api_calls": []}
+    return store.open_session(session_id, str(session_dir), record, CURRENT_STATE), record
+
+
+def test_session_round_trip(store, tmp_path):
+    session, record = open_session(store, tmp_path)
+    messages = [
+        {"role": "user", "content": "三室两厅", "timestamp": "2026-01-01T12:00:01"},
+        {"role": "system", "content": "客厅朝南吗？", "timestamp": "2026-01-01T12:00:02"}
+    ]
+    call = {"model": "m", "timestamp": "2026-01-01T12:00:02", "tokens": {"prompt": 10, "completion": 5}}
+    for message in messages:
+        record["conversation_history"].append(message)
+        session.save_record(record, [("append", "conversation_history", message)])
+    record["api_calls"].append(call)
+    session.save_record(record, [("append", "api_calls", call)])
+    for version in ("v1", "v2"):
+        session.append_history("user_requirements", {"content": version, "timestamp": "2026-01-01T12:00:03"})
+    session.append_debug({"action_type": "用户输入", "timestamp": "2026-01-01T12:00:01"})
+    state = dict(CURRENT_STATE, user_requirements={"content": "v2"})
+    session.save_current_state(lambda: json.dumps(state, ensure_ascii=False))
+    session.compact(record)
+    
+    stored = store.load_session(str(tmp_path / SESSION_ID))
+    assert stored.get_module_current_state("user_requirements") == {"content": "v2"}
+    assert stored.get_conversation_history() == messages
+    assert [item["content"] for item in stored.get_module_history("user_requirements")] == ["v1", "v2"]
+    assert stored.get_module_history("constraints") == []
+    assert session.read_llm_outputs() == [call]
+    assert session.read_debug_log() == [{"action_type": "用户输入", "timestamp": "2026-01-01T12:00:01"}]
+
+
+def test_missing_session_is_not_loaded(store, tmp_path):
+    assert store.load_session(str(tmp_path / "missing")) is None
+
+
+def test_sessions_are_listed(store, tmp_path):
+    assert store.list_sessions() == []
+    open_session(store, tmp_path)
+    assert store.list_sessions() == [SESSION_ID]
+
+
+def test_prompt_segments_are_stored_once(store):
+    assert store.load_segment("ab" * 32) is None
+    store.save_segment("ab" * 32, "固定前缀")
+    store.save_segment("ab" * 32, "固定前缀")
+    assert store.load_segment("ab" * 32) == "固定前缀"
+
+
+def test_sqlite_sessions_listed_newest_first(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), writer=WriteBehindWriter({"flush_interval": 60}))
+    open_session(store, tmp_path, "20260101_120000", "2026-01-01T12:00:00")
+    open_session(store, tmp_path, "20260102_120000", "2026-01-02T12:00:00")
+    assert store.list_sessions() == ["20260102_120000", "20260101_120000"]
+    store._conn.close()
+
+
+class CountingStoredSession:
+    """记录从存储中加载次数的恢复会话"""
+    
+    def __init__(self):
+        self.loads = 0
+    
+    def get_conversation_history(self):
+        self.loads += 1
+        return [{"role": "user", "content": "上次的对话"}]
+    
+    def get_module_history(self, module_name):
+        self.loads += 1
+        return [{"content": "上次的记录"}]
+
+
+def make_manager():
+    manager = SessionManager.__new__(SessionManager)
+    manager._lock = threading.RLock()
+    manager.resumed_session = None
+    manager.session_record = {"conversation_history": [{"role": "user", "content": "本次的对话"}]}
+    manager.module_histories = {"user_requirements": [{"content": "本次的记录"}]}
+    return manager
+
+
+def test_conversation_history_is_a_copy():
+    manager = make_manager()
+    history = manager.get_conversation_history()
+    manager.session_record["conversation_history"].append({"role": "system", "content": "新消息"})
+    assert history == [{"role": "user", "content": "本次的对话"}]
+
+
+def test_resumed_history_read_on_first_access():
+    manager = make_manager()
+    resumed = CountingStoredSession()
+    manager.attach_resumed_session(resumed)
+    assert resumed.loads == 0
+    assert [item["content"] for item in manager.get_conversation_history()] == ["上次的对话", "本次的对话"]
+    assert [item["content"] for item in manager.get_module_history("user_requirements")] == ["上次的记录", "本次的记录"]
+    assert resumed.loads == 2
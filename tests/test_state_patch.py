@@ -0,0 +1,68 @@
+"""
+需求猜测、空间理解和关键问题增量更新的测试
+"""
+import os
+import sys
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.state_patch import StatePatcher, StatePatchError
+
+TEXT = "需要三个卧室。客厅朝南！\n厨房靠近餐厅；书房安静。"
+
+
+@pytest.fixture
+def patcher():
+    return StatePatcher()
+
+
+def test_split_sentences_round_trips(patcher):
+    sentences = patcher.split_sentences(TEXT)
+    assert "".join(sentences) == TEXT
+    assert sentences == ["需要三个卧室。", "客厅朝南！\n", "厨房靠近餐厅；", "书房安静。"]
+    assert patcher.format_numbered(TEXT).splitlines()[1] == "[2] 客厅朝南！"
+
+
+def test_apply_text_edits(patcher):
+    edits = [
+        {"op": "replace", "index": 1, "text": "需要四个卧室。"},
+        {"op": "insert", "after": 2, "text": "主卧带卫生间。"},
+        {"op": "delete", "index": 4},
+        {"op": "insert", "after": 0, "text": "两层住宅。"}
+    ]
+    result = patcher.apply_text_edits(TEXT, edits)
+    # 插入的句子留在原句的段落中，删除不影响其他句子
+    assert result == "两层住宅。需要四个卧室。客厅朝南！主卧带卫生间。\n厨房靠近餐厅；"
+
+
+def test_indexes_refer_to_original_sentences(patcher):
+    edits = [{"op": "delete", "index": 1}, {"op": "replace", "index": 2, "text": "客厅朝东。"}]
+    assert patcher.apply_text_edits(TEXT, edits) == "客厅朝东。\n厨房靠近餐厅；书房安静。"
+
+
+@pytest.mark.parametrize("edits", [
+    [{"op": "replace", "index": 5, "text": "越界"}],
+    [{"op": "delete", "index": 1}, {"op": "replace", "index": 1, "text": "重复"}],
+    [{"op": "replace", "index": 1, "text": " "}],
+    [{"op": "move", "index": 1}],
+    [{"op": "delete", "index": True}],
+    "不是列表",
+])
+def test_invalid_edits_raise(patcher, edits):
+    with pytest.raises(StatePatchError):
+        patcher.apply_text_edits(TEXT, edits)
+
+
+def test_apply_key_question_changes(patcher):
+    questions = [
+        {"category": "房间数量和类型", "status": "未知", "details": ""},
+        {"category": "生活方式", "status": "未知", "details": ""}
+    ]
+    updated = patcher.apply_key_question_changes(questions, [{"category": "生活方式", "status": "已知", "details": "居家办公"}])
+    assert updated[1] == {"category": "生活方式", "status": "已知", "details": "居家办公"}
+    assert questions[1]["status"] == "未知"
+    with pytest.raises(StatePatchError):
+        patcher.apply_key_question_changes(questions, [{"category": "不存在", "status": "已知"}])
+    with pytest.raises(StatePatchError):
+        patcher.apply_key_question_changes(questions, [{"category": "生活方式", "status": "部分已知"}])
@@ -0,0 +1,58 @@
+"""
+增量JSON解析器的测试
+"""
+import os
+import sys
+import json
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import UNIFIED_PROCESSING_PROMPT, UNIFIED_FINAL_TURN_PROMPT
+from utils.streaming_json import StreamingJSONParser
+
+
+RESPONSE = {
+    "next_question": "客厅需要朝南吗？\"是\"或\"否\"",
+    "thinking": "用户补充了卧室数量" * 20,
+    "constraints": {"hard_constraints": {"room_list": ["客厅", "卧室", "厨房"]}}
+}
+
+
+def feed_in_chunks(parser, text, size):
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return events
+
+
+def test_field_published_before_rest_of_response():
+    text = json.dumps(RESPONSE, ensure_ascii=False)
+    parser = StreamingJSONParser(["next_question"])
+    end_of_question = text.index('"thinking"')
+    events = parser.feed(text[:end_of_question])
+    assert events == [("next_question", RESPONSE["next_question"])]
+    assert parser.feed(text[end_of_question:]) == []
+    assert parser.done
+
+
+def test_chunk_boundaries_do_not_change_result():
+    text = "```json\n" + json.dumps(RESPONSE, ensure_ascii=False, indent=2) + "\n```"
+    paths = ["next_question", "constraints.hard_constraints.room_list.*"]
+    expected = feed_in_chunks(StreamingJSONParser(paths), text, len(text))
+    for size in (1, 2, 3, 7, 64):
+        assert feed_in_chunks(StreamingJSONParser(paths), text, size) == expected
+    assert ("constraints.hard_constraints.room_list.1", "卧室") in expected
+
+
+def test_callback_receives_each_field_once():
+    seen = []
+    parser = StreamingJSONParser(["next_question"], on_field=lambda path, value: seen.append(path))
+    feed_in_chunks(parser, json.dumps(RESPONSE, ensure_ascii=False), 5)
+    assert seen == ["next_question"]
+    assert parser.fields["next_question"] == RESPONSE["next_question"]
+
+
+def test_next_question_comes_first_in_unified_schemas():
+    for prompt in (UNIFIED_PROCESSING_PROMPT, UNIFIED_FINAL_TURN_PROMPT):
+        schema = prompt[prompt.index("请以JSON格式返回以下内容"):]
+        assert schema.index('"next_question"') < schema.index('"thinking"')
@@ -0,0 +1,89 @@
+"""
+会话文件延迟写入队列的测试
+"""
+import os
+import sys
+import pytest
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.write_behind import WriteBehindWriter
+
+
+@pytest.fixture
+def writer():
+    # 时间窗口足够长，排队的操作只在测试调用flush()时写入
+    return WriteBehindWriter({"enabled": True, "flush_interval": 60, "fsync": "never"})
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_nothing_written_before_flush(writer, tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    writer.append("a", path, "1\n")
+    assert not os.path.exists(path)
+    assert writer.get_stats()["pending"] == 1
+    writer.flush()
+    assert read(path) == "1\n"
+    assert writer.get_stats()["pending"] == 0
+
+
+def test_consecutive_appends_are_coalesced(writer, tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    for line in ("1\n", "2\n", "3\n"):
+        writer.append("a", path, line)
+    writer.flush()
+    assert read(path) == "1\n2\n3\n"
+    stats = writer.get_stats()
+    assert (stats["operations"], stats["writes"], stats["coalesced"]) == (3, 1, 2)
+
+
+def test_only_last_write_is_applied(writer, tmp_path):
+    path = str(tmp_path / "session.json")
+    calls = []
+    for version in range(3):
+        writer.write("a", path, lambda version=version: calls.append(version) or str(version))
+    writer.flush()
+    assert read(path) == "2"
+    assert calls == [2]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_operations_on_same_key_keep_submission_order(writer, tmp_path):
+    log_path = str(tmp_path / "log.jsonl")
+    state_path = str(tmp_path / "session.json")
+    order = []
+    writer.append("a", log_path, "1\n")
+    writer.write("a", state_path, lambda: order.append("write") or "v1")
+    # 任务应看到之前的追加和写入已经完成
+    writer.submit("a", lambda: order.append(("task", read(log_path), read(state_path))))
+    writer.append("a", log_path, "2\n")
+    writer.write("a", state_path, lambda: order.append("write") or "v2")
+    writer.flush()
+    assert order == ["write", ("task", "1\n", "v1"), "write"]
+    assert read(log_path) == "1\n2\n"
+    assert read(state_path) == "v2"
+
+
+def test_error_on_one_key_does_not_block_others(writer, tmp_path):
+    writer.append("bad", str(tmp_path / "missing" / "log.jsonl"), "1\n")
+    writer.append("good", str(tmp_path / "log.jsonl"), "1\n")
+    writer.flush()
+    assert read(str(tmp_path / "log.jsonl")) == "1\n"
+    assert writer.get_stats()["errors"] == 1
+
+
+def test_disabled_writer_writes_immediately(tmp_path):
+    writer = WriteBehindWriter({"enabled": False})
+    path = str(tmp_path / "session.json")
+    writer.write("a", path, lambda: "v1")
+    assert read(path) == "v1"
+    assert writer._thread is None
+
+
+def test_unknown_fsync_policy_is_rejected():
+    with pytest.raises(ValueError):
+        WriteBehindWriter({"fsync": "always"})
@@ -0,0 +1,296 @@
+"""
+提供商批处理接口（OpenAI Batch API、Anthropic Message Batches）的请求收集器，
+将多个工作线程各自发出的LLM请求合并为批次提交，批次完成后把结果分发回各线程
+"""
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BATCH_SETTINGS
+from utils.client_pool import get_client_pool
+
+
+class BatchRequestError(Exception):
+    """批次中的单个请求失败，或批次未能完成"""
+    pass
+
+
+class _PendingRequest:
+    """
+    等待提交或等待结果的单个请求
+    """
+    
+    def __init__(self, custom_id, body):
+        """初始化请求
+        
+        Args:
+            custom_id (str): 批次内的请求标识
+            body (dict): 请求体（OpenAI为chat.completions参数，Anthropic为messages参数）
+        """
+        self.custom_id = custom_id
+        self.body = body
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.batch_id = None
+
+
+class BatchCollector:
+    """
+    批处理请求收集器。工作线程调用submit后阻塞，收集器在以下任一条件满足时将同一模型的请求提交为一个批次：
+    所有处理中的记录都在等待、请求数达到批次上限、最早的请求已等待超过收集窗口
+    """
+    
+    SUPPORTED_TYPES = ("openai", "anthropic")
+    
+    def __init__(self, settings=None):
+        """初始化收集器
+        
+        Args:
+            settings (dict, optional): 批处理设置，默认使用config.py中的BATCH_SETTINGS
+        """
+        self.settings = dict(BATCH_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self.client_pool = get_client_pool()
+        self._cond = threading.Condition()
+        # 模型名称 -> (模型配置, 等待提交的请求列表)
+        self._pending = {}
+        self._active_records = 0
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="batch-collector", daemon=True)
+        self._flusher.start()
+    
+    def supports(self, model_config):
+        """判断模型是否可以使用批处理接口
+        
+        Args:
+            model_config (dict): 模型配置
+        
+        Returns:
+            bool: 是否支持
+        """
+        return model_config.get("batch_api", False) and model_config.get("type") in self.SUPPORTED_TYPES
+    
+    def begin_record(self):
+        """登记一条处理中的记录（应在工作线程开始前登记，避免先启动的线程单独成批）"""
+        with self._cond:
+            self._active_records += 1
+    
+    def end_record(self):
+        """登记一条记录处理结束，剩余记录可能因此全部处于等待状态"""
+        with self._cond:
+            self._active_records = max(0, self._active_records - 1)
+            self._cond.notify_all()
+    
+    def submit(self, model_name, model_config, body):
+        """提交一个请求并阻塞等待批次结果
+        
+        Args:
+            model_name (str): 模型名称
+            model_config (dict): 模型配置
+            body (dict): 请求体
+        
+        Returns:
+            tuple: (响应体, 批次ID)，OpenAI为chat.completion对象，Anthropic为message对象
+        
+        Raises:
+            BatchRequestError: 请求失败或批次未能完成
+        """
+        request = _PendingRequest(f"req-{next(self._ids)}", body)
+        with self._cond:
+            self._pending.setdefault(model_name, (model_config, []))[1].append(request)
+            self._cond.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise BatchRequestError(request.error)
+        return request.result, request.batch_id
+    
+    def close(self):
+        """停止收集线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+    
+    def _flush_loop(self):
+        """收集线程：检查提交条件，将就绪的请求交给独立线程提交"""
+        with self._cond:
+            while not self._closed:
+                waiting = sum(len(requests) for _, requests in self._pending.values())
+                now = time.monotonic()
+                for model_name in list(self._pending):
+                    model_config, requests = self._pending[model_name]
+                    ready = (
+                        waiting >= self._active_records
+                        or len(requests) >= self.settings["max_batch_size"]
+                        or now - requests[0].created_at >= self.settings["collect_window"]
+                    )
+                    if ready:
+                        del self._pending[model_name]
+                        for start in range(0, len(requests), self.settings["max_batch_size"]):
+                            chunk = requests[start:start + self.settings["max_batch_size"]]
+                            threading.Thread(
+                                target=self._run_batch, args=(model_name, model_config, chunk), daemon=True
+                            ).start()
+                self._cond.wait(timeout=0.5 if self._pending else None)
+    
+    def _run_batch(self, model_name, model_config, requests):
+        """提交一个批次并等待完成，将结果分发给各请求
+        
+        Args:
+            model_name (str): 模型名称
+            model_config (dict): 模型配置
+            requests (list): 批次中的请求
+        """
+        print(f"向{model_name}提交批次，共{len(requests)}个请求")
+        try:
+            if model_config.get("type") == "anthropic":
+                batch_id, results = self._run_anthropic_batch(model_config, requests)
+            else:
+                batch_id, results = self._run_openai_batch(model_config, requests)
+            print(f"{model_name}批次{batch_id}已完成")
+            for request in requests:
+                request.batch_id = batch_id
+                result, error = results.get(request.custom_id, (None, "批次结果中没有该请求"))
+                request.result = result
+                request.error = error
+        except Exception as e:
+            print(f"{model_name}批次处理失败: {str(e)}")
+            for request in requests:
+                request.error = str(e)
+        finally:
+            for request in requests:
+                request.done.set()
+    
+    def _wait_for_batch(self, retrieve, is_finished):
+        """轮询批次状态直到结束
+        
+        Args:
+            retrieve (callable): 获取批次最新状态的函数
+            is_finished (callable): 判断批次是否结束的函数
+        
+        Returns:
+            批次的最终状态
+        """
+        deadline = time.monotonic() + self.settings["max_wait"]
+        while True:
+            batch = retrieve()
+            if is_finished(batch):
+                return batch
+            if time.monotonic() > deadline:
+                raise BatchRequestError(f"等待批次完成超过{self.settings['max_wait']}秒")
+            time.sleep(self.settings["poll_interval"])
+    
+    def _run_openai_batch(self, model_config, requests):
+        """通过OpenAI Batch API提交批次：上传JSONL输入文件、创建批次、轮询、下载结果文件
+        
+        Args:
+            model_config (dict): 模型配置
+            requests (list): 批次中的请求
+        
+        Returns:
+            tuple: (批次ID, {请求标识: (响应体, 错误信息)})
+        """
+        base_url = model_config.get("base_url", "https://api.openai.com/v1")
+        api_key = os.environ.get(model_config.get("api_key_env", "OPENAI_API_KEY"), "")
+        client, _ = self.client_pool.get_openai_client(base_url, api_key)
+        
+        lines = [
+            json.dumps({
+                "custom_id": request.custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": request.body
+            }, ensure_ascii=False)
+            for request in requests
+        ]
+        input_file = client.files.create(
+            file=("batch_input.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.settings["completion_window"]
+        )
+        batch = self._wait_for_batch(
+            lambda: client.batches.retrieve(batch.id),
+            lambda b: b.status in ("completed", "failed", "expired", "cancelled")
+        )
+        
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[item["custom_id"]] = (response.get("body"), None)
+                else:
+                    error = item.get("error") or response.get("body")
+                    results[item["custom_id"]] = (None, f"批次请求失败: {error}")
+        if batch.status != "completed" and not results:
+            raise BatchRequestError(f"批次{batch.id}状态为{batch.status}")
+        return batch.id, results
+    
+    def _run_anthropic_batch(self, model_config, requests):
+        """通过Anthropic Message Batches提交批次：创建批次、轮询、下载结果
+        
+        Args:
+            model_config (dict): 模型配置
+            requests (list): 批次中的请求
+        
+        Returns:
+            tuple: (批次ID, {请求标识: (响应体, 错误信息)})
+        """
+        messages_url = model_config.get("base_url", "https://api.anthropic.com/v1/messages")
+        batches_url = messages_url.rstrip("/") + "/batches"
+        api_key = os.environ.get(model_config.get("api_key_env", "ANTHROPIC_API_KEY"))
+        headers = {
+            "x-api-key": api_key,
+            "anthropic-version": model_config.get("api_version", "2023-06-01"),
+            "content-type": "application/json"
+        }
+        session, _ = self.client_pool.get_http_session("anthropic", messages_url, api_key)
+        timeout = self.client_pool.settings["timeout"]
+        
+        response = session.post(
+            batches_url,
+            headers=headers,
+            json={"requests": [{"custom_id": r.custom_id, "params": r.body} for r in requests]},
+            timeout=timeout
+        )
+        if response.status_code != 200:
+            raise BatchRequestError(f"Anthropic批次创建失败: {response.status_code}, {response.text}")
+        batch_id = response.json()["id"]
+        
+        def retrieve():
+            status = session.get(f"{batches_url}/{batch_id}", headers=headers, timeout=timeout)
+            if status.status_code != 200:
+                raise BatchRequestError(f"Anthropic批次查询失败: {status.status_code}, {status.text}")
+            return status.json()
+        
+        batch = self._wait_for_batch(retrieve, lambda b: b.get("processing_status") == "ended")
+        
+        results = {}
+        output = session.get(batch["results_url"], headers=headers, timeout=timeout)
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            result = item.get("result") or {}
+            if result.get("type") == "succeeded":
+                results[item["custom_id"]] = (result.get("message"), None)
+            else:
+                results[item["custom_id"]] = (None, f"批次请求{result.get('type')}: {result.get('error')}")
+        return batch_id, results
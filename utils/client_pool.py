@@ -0,0 +1,380 @@
+"""
+LLM客户端连接池，按(提供商类型, base_url, api_key)复用长连接客户端
+"""
+import os
+import sys
+import time
+import asyncio
+import weakref
+import hashlib
+import itertools
+import threading
+from contextlib import contextmanager
+
+import httpx
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import CLIENT_POOL_SETTINGS
+
+
+class ClientPool:
+    """
+    进程级LLM客户端注册表，保存长期存活的SDK客户端和requests.Session，
+    避免每次调用都重新进行TCP+TLS握手
+    """
+    
+    def __init__(self, settings=None):
+        """初始化客户端连接池
+        
+        Args:
+            settings (dict, optional): 连接池设置，默认使用config.py中的CLIENT_POOL_SETTINGS
+        """
+        self.settings = dict(CLIENT_POOL_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        
+        self._lock = threading.Lock()
+        # key -> 客户端对象
+        self._openai_clients = {}
+        self._http_sessions = {}
+        # 异步客户端绑定到具体的事件循环：事件循环 -> {"token", "clients", "guard"}，
+        # 事件循环结束（asyncio.run退出）时关闭其客户端并移除
+        self._async_clients = weakref.WeakKeyDictionary()
+        # 事件循环的序号，用作统计键的一部分，不会像id()那样在事件循环回收后被复用
+        self._loop_tokens = itertools.count(1)
+        # key -> 使用统计
+        self._stats = {}
+    
+    def _make_key(self, provider_type, base_url, api_key):
+        """生成注册表键，API密钥只保留哈希值，避免明文出现在统计信息中
+        
+        Args:
+            provider_type (str): 提供商类型，如openai、anthropic、zhipu
+            base_url (str): 端点地址
+            api_key (str): API密钥
+        
+        Returns:
+            tuple: 注册表键
+        """
+        key_hash = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:12]
+        return (provider_type, base_url or "", key_hash)
+    
+    def _init_stats(self, key, kind):
+        """初始化某个客户端的使用统计"""
+        self._stats[key] = {
+            'kind': kind,
+            'created_at': time.time(),
+            'requests': 0,
+            'errors': 0,
+            'in_flight': 0,
+            'peak_in_flight': 0,
+            'last_used': None
+        }
+    
+    def _httpx_limits(self):
+        """根据设置创建httpx连接池限制"""
+        return httpx.Limits(
+            max_connections=self.settings["max_connections"],
+            max_keepalive_connections=self.settings["max_keepalive_connections"],
+            keepalive_expiry=self.settings["keepalive_expiry"]
+        )
+    
+    def _httpx_timeout(self):
+        """根据设置创建httpx超时配置"""
+        return httpx.Timeout(self.settings["timeout"], connect=self.settings["connect_timeout"])
+    
+    def get_openai_client(self, base_url, api_key):
+        """获取（或创建）OpenAI兼容端点的共享客户端
+        
+        Args:
+            base_url (str): API基础URL
+            api_key (str): API密钥
+        
+        Returns:
+            tuple: (openai.OpenAI客户端, 注册表键)
+        """
+        key = self._make_key("openai", base_url, api_key)
+        with self._lock:
+            client = self._openai_clients.get(key)
+            if client is None:
+                http_client = openai.DefaultHttpxClient(
+                    limits=self._httpx_limits(),
+                    timeout=self._httpx_timeout()
+                )
+                client = openai.OpenAI(
+                    api_key=api_key,
+                    base_url=base_url or None,
+                    http_client=http_client,
+                    # 重试由限流器统一负责（带抖动的指数退避和熔断），SDK内部不再重试
+                    max_retries=0
+                )
+                self._openai_clients[key] = client
+                self._init_stats(key, 'openai_sdk')
+        return client, key
+    
+    def get_http_session(self, provider_type, base_url, api_key):
+        """获取（或创建）基于requests的共享会话，用于Anthropic、智谱等HTTP接口
+        
+        Args:
+            provider_type (str): 提供商类型
+            base_url (str): 端点地址
+            api_key (str): API密钥
+        
+        Returns:
+            tuple: (requests.Session, 注册表键)
+        """
+        key = self._make_key(provider_type, base_url, api_key)
+        with self._lock:
+            session = self._http_sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self.settings["max_keepalive_connections"],
+                    pool_maxsize=self.settings["max_connections"],
+                    pool_block=False
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._http_sessions[key] = session
+                self._init_stats(key, 'requests_session')
+        return session, key
+    
+    def _loop_entry(self, loop):
+        """获取（或创建）事件循环的异步客户端记录，调用方持有锁
+        
+        首次创建时在事件循环中登记一个异步生成器：asyncio.run退出前会关闭所有异步生成器，
+        此时在同一事件循环中关闭该循环的客户端。同时清理已经关闭、未经过asyncio.run退出的事件循环留下的记录。
+        """
+        entry = self._async_clients.get(loop)
+        if entry is not None:
+            return entry
+        for closed_loop in [other for other in self._async_clients.keys() if other.is_closed()]:
+            # 事件循环已关闭，连接无法再正常关闭，只释放引用
+            self._evict_loop(closed_loop)
+        guard = self._loop_guard(weakref.ref(loop))
+        entry = {"token": next(self._loop_tokens), "clients": {}, "guard": guard}
+        self._async_clients[loop] = entry
+        # asend会在当前事件循环中登记异步生成器，随后由任务执行到yield处
+        asyncio.ensure_future(guard.asend(None), loop=loop)
+        return entry
+    
+    async def _loop_guard(self, loop_ref):
+        """事件循环结束时关闭该循环的异步客户端"""
+        try:
+            yield
+        finally:
+            loop = loop_ref()
+            if loop is not None:
+                with self._lock:
+                    clients = self._evict_loop(loop)
+                await self._aclose_clients(clients)
+    
+    def _evict_loop(self, loop):
+        """移除事件循环的客户端记录和统计，调用方持有锁
+        
+        Returns:
+            list: 被移除的客户端
+        """
+        entry = self._async_clients.pop(loop, None)
+        if entry is None:
+            return []
+        for key in entry["clients"]:
+            self._stats.pop(key, None)
+        return list(entry["clients"].values())
+    
+    async def _aclose_clients(self, clients):
+        """在当前事件循环中关闭异步客户端"""
+        for client in clients:
+            try:
+                await (client.aclose() if hasattr(client, 'aclose') else client.close())
+            except Exception as e:
+                print(f"关闭异步客户端时出错: {str(e)}")
+    
+    def _get_async_client(self, key, kind, factory):
+        """获取（或创建）当前事件循环下的异步客户端
+        
+        Args:
+            key (tuple): 不含事件循环的注册表键
+            kind (str): 统计中的客户端类型
+            factory (callable): 创建客户端的函数
+        
+        Returns:
+            tuple: (客户端, 包含事件循环序号的注册表键)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._loop_entry(loop)
+            key = key + (entry["token"],)
+            client = entry["clients"].get(key)
+            if client is None:
+                client = factory()
+                entry["clients"][key] = client
+                self._init_stats(key, kind)
+        return client, key
+    
+    def get_async_openai_client(self, base_url, api_key):
+        """获取（或创建）当前事件循环下OpenAI兼容端点的共享异步客户端，事件循环结束时自动关闭
+        
+        Args:
+            base_url (str): API基础URL
+            api_key (str): API密钥
+        
+        Returns:
+            tuple: (openai.AsyncOpenAI客户端, 注册表键)
+        """
+        def create():
+            http_client = openai.DefaultAsyncHttpxClient(
+                limits=self._httpx_limits(),
+                timeout=self._httpx_timeout()
+            )
+            return openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url or None,
+                http_client=http_client,
+                # 重试由限流器统一负责（带抖动的指数退避和熔断），SDK内部不再重试
+                max_retries=0
+            )
+        
+        return self._get_async_client(self._make_key("openai_async", base_url, api_key), 'openai_sdk_async', create)
+    
+    def get_async_http_client(self, provider_type, base_url, api_key):
+        """获取（或创建）当前事件循环下的共享httpx.AsyncClient，用于Anthropic、智谱等HTTP接口，事件循环结束时自动关闭
+        
+        Args:
+            provider_type (str): 提供商类型
+            base_url (str): 端点地址
+            api_key (str): API密钥
+        
+        Returns:
+            tuple: (httpx.AsyncClient, 注册表键)
+        """
+        return self._get_async_client(
+            self._make_key(provider_type + "_async", base_url, api_key), 'httpx_async',
+            lambda: httpx.AsyncClient(limits=self._httpx_limits(), timeout=self._httpx_timeout())
+        )
+    
+    @contextmanager
+    def track(self, key):
+        """统计一次请求的并发数和成功/失败次数
+        
+        Args:
+            key (tuple): 注册表键
+        """
+        with self._lock:
+            stats = self._stats[key]
+            stats['requests'] += 1
+            stats['in_flight'] += 1
+            stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+            stats['last_used'] = time.time()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                stats['in_flight'] -= 1
+    
+    def _session_pool_info(self, session):
+        """读取requests.Session底层urllib3连接池的使用情况"""
+        open_connections = 0
+        host_pools = 0
+        for adapter in session.adapters.values():
+            poolmanager = getattr(adapter, 'poolmanager', None)
+            if poolmanager is None:
+                continue
+            for pool_key in list(poolmanager.pools.keys()):
+                pool = poolmanager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                host_pools += 1
+                open_connections += pool.num_connections
+        return {'host_pools': host_pools, 'connections_opened': open_connections}
+    
+    def get_stats(self):
+        """获取连接池使用统计
+        
+        Returns:
+            dict: 每个客户端的请求数、并发数、峰值并发以及连接池利用率
+        """
+        max_connections = self.settings["max_connections"]
+        result = {'settings': dict(self.settings), 'clients': []}
+        with self._lock:
+            for key, stats in self._stats.items():
+                provider_type, base_url, key_hash = key[:3]
+                entry = dict(stats)
+                entry.update({
+                    'provider_type': provider_type,
+                    'base_url': base_url,
+                    'api_key_hash': key_hash,
+                    'utilisation': stats['in_flight'] / max_connections if max_connections else 0.0,
+                    'peak_utilisation': stats['peak_in_flight'] / max_connections if max_connections else 0.0
+                })
+                session = self._http_sessions.get(key)
+                if session is not None:
+                    entry.update(self._session_pool_info(session))
+                result['clients'].append(entry)
+        return result
+    
+    def close(self):
+        """关闭所有客户端，释放连接；异步客户端在各自的事件循环中关闭"""
+        with self._lock:
+            for client in self._openai_clients.values():
+                client.close()
+            for session in self._http_sessions.values():
+                session.close()
+            self._openai_clients.clear()
+            self._http_sessions.clear()
+            async_clients = [(loop, self._evict_loop(loop)) for loop in list(self._async_clients.keys())]
+            self._stats.clear()
+        for loop, clients in async_clients:
+            self._close_loop_clients(loop, clients)
+    
+    def _close_loop_clients(self, loop, clients):
+        """在客户端所属的事件循环中关闭异步客户端
+        
+        Args:
+            loop (asyncio.AbstractEventLoop): 客户端所属的事件循环
+            clients (list): 异步客户端
+        """
+        if not clients:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        try:
+            if loop is running_loop:
+                # 在该事件循环中调用，不能阻塞等待
+                loop.create_task(self._aclose_clients(clients))
+            elif loop.is_running():
+                asyncio.run_coroutine_threadsafe(self._aclose_clients(clients), loop).result(self.settings["connect_timeout"])
+            elif not loop.is_closed():
+                loop.run_until_complete(self._aclose_clients(clients))
+            # 已关闭的事件循环中的连接无法再正常关闭，只释放引用
+        except Exception as e:
+            print(f"关闭异步客户端时出错: {str(e)}")
+
+
+# 进程级共享实例
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_client_pool():
+    """获取进程级共享的客户端连接池
+    
+    Returns:
+        ClientPool: 共享的连接池实例
+    """
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ClientPool()
+    return _default_pool
@@ -0,0 +1,192 @@
+"""
+对话上下文构建：最近几轮问答原样保留，更早的问答在后台滚动压缩为摘要，使统一处理的提示词长度不随对话轮数无限增长
+"""
+import os
+import sys
+import json
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import CONVERSATION_CONTEXT_SETTINGS, CONVERSATION_SUMMARY_PROMPT, BASE_PROMPT
+from utils.token_counter import get_token_counter
+
+
+def format_message(entry):
+    """格式化一条问答记录
+    
+    Args:
+        entry (dict): 对话历史中的一条记录
+    
+    Returns:
+        str: 格式化后的文本，非用户/系统消息返回空字符串
+    """
+    role = entry.get('role', '')
+    content = entry.get('content', '')
+    if role == 'user':
+        return f"用户: {content}\n\n"
+    if role == 'system':
+        return f"系统: {content}\n\n"
+    return ""
+
+
+class ConversationContext:
+    """
+    有token预算的对话上下文。每个会话一个实例，对话历史只追加不修改
+    
+    构建的上下文由三部分组成：早期问答的摘要、尚未并入摘要的较早问答（预算内从新到旧保留）、最近几轮问答（总是原样保留）。
+    每次构建后，如果有新的问答移出最近几轮，就在后台把它们并入摘要。摘要完成前这些问答在剩余预算内原样出现在上下文中，
+    超出预算的部分暂时只以一行占位说明代替，条数和token数记录在last_stats的omitted_messages和omitted_tokens中。
+    """
+    
+    def __init__(self, openai_client, settings=None):
+        """初始化对话上下文
+        
+        Args:
+            openai_client (OpenAIClient): 会话的LLM客户端，摘要调用沿用其会话记录
+            settings (dict, optional): 上下文设置，默认使用config.py中的CONVERSATION_CONTEXT_SETTINGS
+        """
+        self.settings = dict(CONVERSATION_CONTEXT_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self.openai_client = openai_client
+        self.token_counter = get_token_counter()
+        self._summary_client = None
+        self._lock = threading.Lock()
+        # 摘要及其覆盖的问答条数（对话历史的前summarized_upto条）
+        self.summary = ""
+        self.summarized_upto = 0
+        self._summarizing = False
+        # 每条问答格式化后的token数，与对话历史一一对应
+        self._message_tokens = []
+        # 最近一次构建的统计
+        self.last_stats = None
+    
+    def build(self, conversation_history):
+        """构建本轮提示词中的对话记录部分
+        
+        Args:
+            conversation_history (list): 完整的对话历史
+        
+        Returns:
+            str: 格式化后的对话记录，尚未并入摘要且超出预算的较早问答不包含在内
+        """
+        model = self.settings["summary_model"]
+        self._count_messages(conversation_history, model)
+        
+        recent_count = self.settings["recent_turns"] * 2
+        cutoff = max(0, len(conversation_history) - recent_count)
+        with self._lock:
+            # 对话历史比摘要覆盖的范围还短，说明换了会话，摘要作废
+            if self.summarized_upto > len(conversation_history):
+                self.summary = ""
+                self.summarized_upto = 0
+            summary = self.summary
+            start = min(self.summarized_upto, cutoff)
+        
+        # 最近几轮总是保留；尚未并入摘要的较早问答在剩余预算内从新到旧保留
+        summary_tokens = self.token_counter.count(summary, model) if summary else 0
+        budget = self.settings["max_history_tokens"] - summary_tokens - sum(self._message_tokens[cutoff:])
+        kept_from = cutoff
+        while kept_from > start and self._message_tokens[kept_from - 1] <= budget:
+            budget -= self._message_tokens[kept_from - 1]
+            kept_from -= 1
+        dropped = kept_from - start
+        dropped_tokens = sum(self._message_tokens[start:kept_from])
+        
+        parts = []
+        if summary:
+            parts.append(f"早期对话摘要：\n{summary}\n\n")
+        if dropped:
+            print(f"对话记录超出token预算，{dropped}条尚未并入摘要的较早问答（{dropped_tokens} tokens）本轮未发送")
+            parts.append(f"（另有{dropped}条较早的问答记录正在整理为摘要）\n\n")
+        parts.extend(format_message(entry) for entry in conversation_history[kept_from:])
+        context = "".join(parts)
+        
+        full_tokens = sum(self._message_tokens)
+        context_tokens = self.token_counter.count(context, model) if context else 0
+        self.last_stats = {
+            'messages': len(conversation_history),
+            'verbatim_messages': len(conversation_history) - kept_from,
+            'summarized_messages': start,
+            'omitted_messages': dropped,
+            'omitted_tokens': dropped_tokens,
+            'full_tokens': full_tokens,
+            'context_tokens': context_tokens,
+            'saved_tokens': full_tokens - context_tokens
+        }
+        
+        if cutoff > start:
+            self._schedule_summary(conversation_history[start:cutoff], start, cutoff)
+        return context
+    
+    def _count_messages(self, conversation_history, model):
+        """统计新增问答的token数，已统计的问答不再重复计算"""
+        if len(self._message_tokens) > len(conversation_history):
+            self._message_tokens = []
+        for entry in conversation_history[len(self._message_tokens):]:
+            text = format_message(entry)
+            self._message_tokens.append(self.token_counter.count(text, model) if text else 0)
+    
+    def _schedule_summary(self, messages, start, end):
+        """把移出最近几轮的问答并入摘要，同一时间只进行一次
+        
+        Args:
+            messages (list): 待并入摘要的问答
+            start (int): 这些问答在对话历史中的起始位置
+            end (int): 这些问答在对话历史中的结束位置（不含）
+        """
+        with self._lock:
+            if self._summarizing or start != self.summarized_upto:
+                return
+            self._summarizing = True
+            previous_summary = self.summary
+        
+        if self.settings["background"]:
+            threading.Thread(
+                target=self._summarize, args=(previous_summary, messages, end), name="conversation-summary", daemon=True
+            ).start()
+        else:
+            self._summarize(previous_summary, messages, end)
+    
+    def _summarize(self, previous_summary, messages, end):
+        """调用LLM合并摘要，失败时保留原摘要，相应的问答下次继续尝试
+        
+        Args:
+            previous_summary (str): 已有摘要
+            messages (list): 待并入摘要的问答
+            end (int): 并入后摘要覆盖的问答条数
+        """
+        try:
+            prompt = CONVERSATION_SUMMARY_PROMPT.format(
+                base_prompt=BASE_PROMPT,
+                max_chars=self.settings["summary_max_chars"],
+                previous_summary=previous_summary or "（无）",
+                new_history="".join(format_message(entry) for entry in messages)
+            )
+            response = self._get_summary_client().generate_completion(
+                prompt=prompt,
+                model_name=self.settings["summary_model"],
+                temperature=0.3,
+                json_keys=["summary"]
+            )
+            summary = json.loads(response).get("summary", "") if response else ""
+            if isinstance(summary, list):
+                summary = "\n".join(str(item) for item in summary)
+            if summary:
+                with self._lock:
+                    if self.summarized_upto < end:
+                        self.summary = summary.strip()
+                        self.summarized_upto = end
+        except Exception as e:
+            print(f"更新对话摘要时出错: {str(e)}")
+        finally:
+            if self._summary_client is not None:
+                self._summary_client.event_bus.close_channel(self._summary_client.event_channel)
+            with self._lock:
+                self._summarizing = False
+    
+    def _get_summary_client(self):
+        """获取生成摘要用的LLM客户端，每次摘要时按会话客户端当前的设置创建"""
+        self._summary_client = self.openai_client.fork(f"conversation-summary-{id(self)}")
+        return self._summary_client
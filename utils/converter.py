@@ -10,6 +10,30 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 #from config import CONSTRAINT_CONVERTER_PROMPT
 from config import CONSTRAINT_QUANTIFICATION_MODEL  # 使用约束量化模块的模型
 
+# 紧凑格式中各类软约束每行的列，connection和adjacency的room1/room2对应"room pair"
+COMPACT_COLUMNS = {
+    "connection": ["room1", "room2", "room_weight"],
+    "adjacency": ["room1", "room2", "room_weight"],
+    "area": ["room", "min", "max", "room_weight"],
+    "orientation": ["room", "direction", "room_weight"],
+    "window_access": ["room", "room_weight"],
+    "aspect_ratio": ["room", "min", "max", "room_weight"],
+    "repulsion": ["room1", "room2", "min_distance", "room_weight"]
+}
+COMPACT_PAIR_TYPES = ("connection", "adjacency")
+
+# 紧凑格式中需要加引号的字符，以及不能作为行首的字符
+COMPACT_RESERVED_CHARS = set(',|"\n\r')
+COMPACT_RESERVED_PREFIXES = ("@", "+", "#")
+
+# 单元格为空表示该字段不存在
+_MISSING = object()
+
+
+class CompactFormatError(ValueError):
+    """紧凑格式的约束条件无法解析"""
+    pass
+
 class ConstraintConverter:
     """
     约束条件格式转换工具类，用于在all格式和rooms格式之间转换
@@ -122,7 +146,7 @@ class ConstraintConverter:
                         constraints_rooms["rooms"][room2]["repulsion"].append(room1)
         
         return constraints_rooms
-   
+    
     def rooms_to_all(self, constraints_rooms, original_all=None):
         """将rooms格式的约束条件转换为all格式
         
@@ -184,8 +208,9 @@ class ConstraintConverter:
         room_list = list(constraints_rooms["rooms"].keys())
         constraints_all["hard_constraints"]["room_list"] = room_list
         
-        # 处理已处理的connection对，避免重复
+        # 处理已处理的connection和adjacency对，避免重复
         processed_connections = set()
+        processed_adjacencies = set()
         
         # 转换各类约束条件
         for room, room_constraints in constraints_rooms["rooms"].items():
@@ -204,7 +229,6 @@ class ConstraintConverter:
             
             # 转换adjacency约束
             if "adjacency" in room_constraints:
-                processed_adjacencies = set()
                 for adjacent_room in room_constraints["adjacency"]:
                     # 创建房间对的标识符（按字母顺序排序以确保唯一性）
                     adjacency_pair = tuple(sorted([room, adjacent_room]))
@@ -288,4 +312,319 @@ class ConstraintConverter:
                     "room_weight": 1.0  # 最高权重，表示必要连接
                 })
         
-        return constraints_all
\ No newline at end of file
+        return constraints_all
+    
+    def split_rooms(self, constraints_rooms, max_rooms):
+        """按连接和相邻关系把房间分组，关系紧密的房间尽量分在同一组
+        
+        每次从未分组房间中与其他未分组房间关系最多的房间开始，依次加入与本组关系最多的房间，直到达到组的大小上限；
+        最后把过小的组合并，减少组数
+        
+        Args:
+            constraints_rooms (dict): rooms格式的约束条件
+            max_rooms (int): 每组最多的房间数
+        
+        Returns:
+            list: 分组结果，每组为房间名列表
+        """
+        rooms = list(constraints_rooms.get("rooms", {}).keys())
+        neighbours = {room: set() for room in rooms}
+        for room, room_constraints in constraints_rooms.get("rooms", {}).items():
+            for other in list(room_constraints.get("connection", [])) + list(room_constraints.get("adjacency", [])):
+                if other in neighbours and other != room:
+                    neighbours[room].add(other)
+                    neighbours[other].add(room)
+        
+        unassigned = list(rooms)
+        clusters = []
+        while unassigned:
+            remaining = set(unassigned)
+            seed = max(unassigned, key=lambda room: len(neighbours[room] & remaining))
+            cluster = [seed]
+            remaining.discard(seed)
+            while len(cluster) < max_rooms:
+                candidates = [room for room in unassigned if room in remaining and neighbours[room] & set(cluster)]
+                if not candidates:
+                    break
+                best = max(candidates, key=lambda room: len(neighbours[room] & set(cluster)))
+                cluster.append(best)
+                remaining.discard(best)
+            clusters.append(cluster)
+            unassigned = [room for room in unassigned if room in remaining]
+        
+        # 合并过小的组（如没有任何关系的单个房间）
+        merged = []
+        for cluster in sorted(clusters, key=len, reverse=True):
+            target = next((group for group in merged if len(group) + len(cluster) <= max_rooms), None)
+            if target is not None and len(cluster) < max_rooms / 2:
+                target.extend(cluster)
+            else:
+                merged.append(list(cluster))
+        return merged
+    
+    def merge_rooms(self, constraints_rooms, optimized_groups):
+        """合并各组分别优化后的房间约束条件，并整理跨组的关系
+        
+        connection、adjacency和repulsion只保留指向已有房间的关系，并补全为双向。
+        跨组的关系两组各自只能看到自己的一侧：优化前存在的关系，只要有一侧的房间删除了它，两侧都删除；
+        新增的关系由补全为双向保留
+        
+        Args:
+            constraints_rooms (dict): 分组前的rooms格式约束条件，某组没有返回结果时使用其中的房间
+            optimized_groups (list): 各组优化后的房间约束条件，每项为{房间名: 约束条件}
+        
+        Returns:
+            dict: 合并后的rooms格式约束条件
+        """
+        original = constraints_rooms.get("rooms", {})
+        merged = json.loads(json.dumps(original, ensure_ascii=False))
+        # 有优化结果的房间，只有这些房间的关系列表能表示删除
+        optimized = set()
+        for group in optimized_groups:
+            for room, room_constraints in json.loads(json.dumps(group, ensure_ascii=False)).items():
+                if isinstance(room_constraints, dict):
+                    merged[room] = room_constraints
+                    optimized.add(room)
+        
+        for room, room_constraints in merged.items():
+            room_constraints.setdefault("area", {})
+            room_constraints.setdefault("orientation", "")
+            room_constraints.setdefault("window_access", False)
+            room_constraints.setdefault("aspect_ratio", {})
+        for relation in ("connection", "adjacency", "repulsion"):
+            for room, room_constraints in merged.items():
+                others = room_constraints.get(relation) or []
+                room_constraints[relation] = [other for other in dict.fromkeys(others) if other in merged and other != room]
+            # 优化前列出、优化后不再列出的关系视为删除，另一侧仍列出时也一并删除
+            removed = set()
+            for room in optimized:
+                for other in (original.get(room) or {}).get(relation) or []:
+                    if other not in merged[room][relation]:
+                        removed.add(frozenset((room, other)))
+            for room, room_constraints in merged.items():
+                room_constraints[relation] = [other for other in room_constraints[relation] if frozenset((room, other)) not in removed]
+            for room, room_constraints in merged.items():
+                for other in room_constraints[relation]:
+                    if room not in merged[other][relation]:
+                        merged[other][relation].append(room)
+        
+        result = {"rooms": merged}
+        if "special_spaces" in constraints_rooms:
+            result["special_spaces"] = constraints_rooms["special_spaces"]
+        return result
+    
+    def all_to_compact(self, constraints_all):
+        """将all格式的约束条件编码为紧凑的逐行文本，用于提示词和LLM的输出
+        
+        格式示例：
+            @room_list 客厅, 主卧, 厨房
+            @connection 0.8 | room1, room2, room_weight
+            客厅, 主卧, 0.9
+            @area 0.6 | room, min, max, room_weight
+            客厅, 20, 30, 0.7
+            @special_spaces {"path": true, "entrance": true}
+        每类软约束一行表头（类别、权重和列名），之后每行一条约束，单元格为空表示没有该字段。
+        不符合列定义的约束以"+ "加JSON的形式原样保留，其他字段放在"@extra"行，解码后与原约束条件一致。
+        
+        Args:
+            constraints_all (dict): all格式的约束条件
+        
+        Returns:
+            str: 紧凑格式的文本
+        """
+        lines = []
+        extra = {}
+        for key, value in constraints_all.items():
+            if key == "hard_constraints":
+                hard = dict(value) if isinstance(value, dict) else None
+                room_list = hard.pop("room_list", _MISSING) if hard is not None else _MISSING
+                if isinstance(room_list, list) and all(self._is_compact_scalar(room) for room in room_list):
+                    lines.append(("@room_list " + ", ".join(self._encode_cell(room) for room in room_list)).rstrip())
+                elif room_list is not _MISSING:
+                    hard["room_list"] = room_list
+                if hard is None or hard or room_list is _MISSING:
+                    extra[key] = value if hard is None else hard
+            elif key == "soft_constraints" and isinstance(value, dict) and value:
+                for constraint_type, category in value.items():
+                    category_extra = self._encode_category(constraint_type, category, lines)
+                    if category_extra is not None:
+                        extra.setdefault(key, {})[constraint_type] = category_extra
+            elif key == "special_spaces":
+                lines.append("@special_spaces " + json.dumps(value, ensure_ascii=False))
+            else:
+                extra[key] = value
+        if extra:
+            lines.append("@extra " + json.dumps(extra, ensure_ascii=False))
+        return "\n".join(lines)
+    
+    def compact_to_all(self, compact):
+        """将紧凑格式的文本解码为all格式的约束条件，是all_to_compact的逆过程
+        
+        Args:
+            compact (str | list): 紧凑格式的文本，或按行拆分的列表
+        
+        Returns:
+            dict: all格式的约束条件
+        
+        Raises:
+            CompactFormatError: 文本不符合紧凑格式
+        """
+        if isinstance(compact, list):
+            compact = "\n".join(str(line) for line in compact)
+        if not isinstance(compact, str):
+            raise CompactFormatError(f"紧凑格式的约束条件应为文本或文本列表: {type(compact).__name__}")
+        
+        result = {}
+        extras = []
+        section = None
+        for line_number, raw_line in enumerate(compact.splitlines(), 1):
+            line = raw_line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                if line.startswith("@"):
+                    keyword, _, rest = line[1:].partition(" ")
+                    rest = rest.strip()
+                    section = None
+                    if keyword == "room_list":
+                        rooms = [room for room in self._split_cells(rest) if room is not _MISSING] if rest else []
+                        result.setdefault("hard_constraints", {})["room_list"] = rooms
+                    elif keyword == "special_spaces":
+                        result["special_spaces"] = json.loads(rest)
+                    elif keyword == "extra":
+                        extras.append(json.loads(rest))
+                    elif keyword:
+                        section = self._decode_header(keyword, rest, result)
+                    else:
+                        raise CompactFormatError("缺少类别名")
+                elif section is None:
+                    raise CompactFormatError("约束条件之前缺少类别表头")
+                elif line.startswith("+"):
+                    section["entries"].append(json.loads(line[1:].strip()))
+                else:
+                    section["entries"].append(self._decode_row(section, line))
+            except (ValueError, TypeError) as e:
+                raise CompactFormatError(f"第{line_number}行无法解析: {raw_line.strip()} ({str(e)})")
+        
+        for extra in extras:
+            if not isinstance(extra, dict):
+                raise CompactFormatError("@extra的内容应为JSON对象")
+            self._merge_extra(result, extra)
+        return result
+    
+    def _encode_category(self, constraint_type, category, lines):
+        """编码一类软约束，返回需要放入@extra的部分，全部编码时返回None"""
+        if (not isinstance(category, dict) or not isinstance(category.get("constraints"), list)
+                or not self._is_compact_scalar(constraint_type) or " " in constraint_type):
+            return category
+        header = f"@{constraint_type} {self._encode_cell(category.get('weight', _MISSING))}".rstrip()
+        columns = COMPACT_COLUMNS.get(constraint_type)
+        if columns:
+            header += " | " + ", ".join(columns)
+        lines.append(header)
+        for entry in category["constraints"]:
+            row = self._entry_to_row(constraint_type, entry) if columns else None
+            lines.append(", ".join(self._encode_cell(cell) for cell in row).rstrip(", ") if row is not None
+                         else "+ " + json.dumps(entry, ensure_ascii=False))
+        remaining = {key: value for key, value in category.items() if key not in ("weight", "constraints")}
+        return remaining or None
+    
+    def _entry_to_row(self, constraint_type, entry):
+        """把一条约束转换为按列排列的单元格，不符合列定义时返回None"""
+        if not isinstance(entry, dict):
+            return None
+        columns = COMPACT_COLUMNS[constraint_type]
+        values = dict(entry)
+        if constraint_type in COMPACT_PAIR_TYPES:
+            pair = values.pop("room pair", None)
+            if not isinstance(pair, list) or len(pair) != 2:
+                return None
+            values["room1"], values["room2"] = pair
+        if not values or any(key not in columns for key in values) or not all(self._is_compact_scalar(value) for value in values.values()):
+            return None
+        return [values.get(column, _MISSING) for column in columns]
+    
+    def _decode_header(self, constraint_type, rest, result):
+        """解析软约束的表头行，返回当前类别的解析状态"""
+        weight_cell, _, column_text = rest.partition("|")
+        weight = self._split_cells(weight_cell)[0] if weight_cell.strip() else _MISSING
+        default_columns = COMPACT_COLUMNS.get(constraint_type)
+        columns = [column.strip() for column in column_text.split(",") if column.strip()] or default_columns
+        if columns and (not default_columns or sorted(columns) != sorted(default_columns)):
+            raise CompactFormatError(f"{constraint_type}的列应为: {', '.join(default_columns or [])}")
+        category = {} if weight is _MISSING else {"weight": weight}
+        category["constraints"] = []
+        result.setdefault("soft_constraints", {})[constraint_type] = category
+        return {"type": constraint_type, "columns": columns, "entries": category["constraints"]}
+    
+    def _decode_row(self, section, line):
+        """把一行单元格还原为一条约束"""
+        if not section["columns"]:
+            raise CompactFormatError(f"{section['type']}没有列定义，约束条件应以+加JSON的形式给出")
+        cells = self._split_cells(line)
+        if len(cells) > len(section["columns"]):
+            raise CompactFormatError(f"单元格数量超过{len(section['columns'])}列")
+        values = dict(zip(section["columns"], cells))
+        entry = {}
+        if section["type"] in COMPACT_PAIR_TYPES:
+            room1, room2 = values.pop("room1", _MISSING), values.pop("room2", _MISSING)
+            if room1 is _MISSING or room2 is _MISSING:
+                raise CompactFormatError("缺少房间")
+            entry["room pair"] = [room1, room2]
+        for column in COMPACT_COLUMNS[section["type"]]:
+            if values.get(column, _MISSING) is not _MISSING:
+                entry[column] = values[column]
+        return entry
+    
+    def _is_compact_scalar(self, value):
+        """单元格只能是字符串、数字、布尔值或null"""
+        return value is None or isinstance(value, (str, int, float, bool))
+    
+    def _encode_cell(self, value):
+        """编码一个单元格，不会被误解的字符串不加引号"""
+        if value is _MISSING:
+            return ""
+        if not isinstance(value, str):
+            return json.dumps(value, ensure_ascii=False)
+        if (value and value == value.strip() and not value.startswith(COMPACT_RESERVED_PREFIXES)
+                and not COMPACT_RESERVED_CHARS.intersection(value) and not self._is_json_literal(value)):
+            return value
+        return json.dumps(value, ensure_ascii=False)
+    
+    def _split_cells(self, text):
+        """按逗号拆分单元格，支持带引号的字符串"""
+        decoder = json.JSONDecoder()
+        cells = []
+        position = 0
+        while True:
+            while position < len(text) and text[position] in " \t":
+                position += 1
+            if position < len(text) and text[position] == '"':
+                value, position = decoder.raw_decode(text, position)
+                end = text.find(",", position)
+                if text[position:len(text) if end == -1 else end].strip():
+                    raise CompactFormatError("引号后有多余的内容")
+            else:
+                end = text.find(",", position)
+                cell = text[position:len(text) if end == -1 else end].strip()
+                value = _MISSING if not cell else (json.loads(cell) if self._is_json_literal(cell) else cell)
+            cells.append(value)
+            if end == -1:
+                return cells
+            position = end + 1
+    
+    def _is_json_literal(self, text):
+        """文本是否会被解析为数字、布尔值或null"""
+        try:
+            json.loads(text)
+        except ValueError:
+            return False
+        return True
+    
+    def _merge_extra(self, target, extra):
+        """把@extra中的字段合并到解码结果"""
+        for key, value in extra.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge_extra(target[key], value)
+            else:
+                target[key] = value
@@ -0,0 +1,173 @@
+"""
+会话事件总线，按会话频道向订阅者推送LLM输出片段、阶段变化等事件
+"""
+import time
+import queue
+import threading
+from collections import deque
+
+
+class EventBus:
+    """
+    进程内的发布/订阅事件总线。每个频道对应一个会话，保留最近的事件以便断线重连后补发
+    """
+    
+    def __init__(self, history_size=500, subscriber_queue_size=1000):
+        """初始化事件总线
+        
+        Args:
+            history_size (int): 每个频道保留的最近事件数量
+            subscriber_queue_size (int): 每个订阅者队列的最大长度，消费过慢时丢弃最旧的事件
+        """
+        self.history_size = history_size
+        self.subscriber_queue_size = subscriber_queue_size
+        self._lock = threading.Lock()
+        # 频道 -> 订阅者队列列表
+        self._subscribers = {}
+        # 频道 -> 最近事件
+        self._history = {}
+        # 频道 -> {事件类型: 最近的事件}，不受历史长度限制
+        self._last_events = {}
+        # 频道 -> 下一个事件编号
+        self._next_id = {}
+    
+    def publish(self, channel, event_type, data=None):
+        """向频道发布事件，发布方不会因订阅者消费过慢而阻塞
+        
+        Args:
+            channel (str): 频道（会话ID），为None时不发布
+            event_type (str): 事件类型，如token、stage、visualization
+            data (dict, optional): 事件数据
+        
+        Returns:
+            dict: 发布的事件，频道为None时返回None
+        """
+        if channel is None:
+            return None
+        
+        with self._lock:
+            event_id = self._next_id.get(channel, 1)
+            self._next_id[channel] = event_id + 1
+            event = {
+                'id': event_id,
+                'type': event_type,
+                'data': data if data is not None else {},
+                'timestamp': time.time()
+            }
+            history = self._history.get(channel)
+            if history is None:
+                history = self._history[channel] = deque(maxlen=self.history_size)
+            history.append(event)
+            self._last_events.setdefault(channel, {})[event_type] = event
+            subscribers = list(self._subscribers.get(channel, []))
+        
+        for q in subscribers:
+            self._offer(q, event)
+        return event
+    
+    def _offer(self, q, event):
+        """将事件放入订阅者队列，队列已满时丢弃最旧的事件"""
+        while True:
+            try:
+                q.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+    
+    def subscribe(self, channel, last_event_id=None):
+        """订阅频道
+        
+        Args:
+            channel (str): 频道（会话ID）
+            last_event_id (int, optional): 客户端已收到的最后一个事件编号，之后的历史事件会被补发
+        
+        Returns:
+            queue.Queue: 订阅者队列
+        """
+        q = queue.Queue(maxsize=self.subscriber_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(q)
+            if last_event_id is not None:
+                for event in self._history.get(channel, []):
+                    if event['id'] > last_event_id:
+                        self._offer(q, event)
+        return q
+    
+    def unsubscribe(self, channel, q):
+        """取消订阅
+        
+        Args:
+            channel (str): 频道（会话ID）
+            q (queue.Queue): subscribe返回的订阅者队列
+        """
+        with self._lock:
+            subscribers = self._subscribers.get(channel, [])
+            if q in subscribers:
+                subscribers.remove(q)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+    
+    def last_event(self, channel, event_type):
+        """获取频道中某类型的最近一个事件
+        
+        Args:
+            channel (str): 频道（会话ID）
+            event_type (str): 事件类型
+        
+        Returns:
+            dict: 最近的事件，不存在时返回None
+        """
+        with self._lock:
+            return self._last_events.get(channel, {}).get(event_type)
+    
+    def close_channel(self, channel):
+        """删除频道的历史事件和订阅者
+        
+        Args:
+            channel (str): 频道（会话ID）
+        """
+        with self._lock:
+            self._subscribers.pop(channel, None)
+            self._history.pop(channel, None)
+            self._last_events.pop(channel, None)
+            self._next_id.pop(channel, None)
+    
+    def close_channel_if_idle(self, channel):
+        """频道没有订阅者时删除频道，检查和删除在同一把锁内完成，不会删掉刚订阅的订阅者
+        
+        Args:
+            channel (str): 频道（会话ID）
+        
+        Returns:
+            bool: 是否删除了频道
+        """
+        with self._lock:
+            if self._subscribers.get(channel):
+                return False
+            self._subscribers.pop(channel, None)
+            self._history.pop(channel, None)
+            self._last_events.pop(channel, None)
+            self._next_id.pop(channel, None)
+            return True
+
+
+# 进程级共享实例
+_default_bus = None
+_default_bus_lock = threading.Lock()
+
+
+def get_event_bus():
+    """获取进程级共享的事件总线
+    
+    Returns:
+        EventBus: 共享的事件总线实例
+    """
+    global _default_bus
+    if _default_bus is None:
+        with _default_bus_lock:
+            if _default_bus is None:
+                _default_bus = EventBus()
+    return _default_bus
@@ -0,0 +1,143 @@
+"""
+对冲请求的竞速控制：多个模型同时处理同一请求时，先返回首token的一方获胜，其余被取消
+"""
+import threading
+
+
+class HedgeCancelled(Exception):
+    """对冲请求中落败的一方被取消"""
+    pass
+
+
+class HedgeRace:
+    """
+    一次对冲竞速，记录获胜的参与者，并通知等待方
+    """
+    
+    def __init__(self, async_event=None):
+        """初始化竞速
+        
+        Args:
+            async_event (asyncio.Event, optional): asyncio模式下用于唤醒等待方的事件，
+                claim只会在同一事件循环中被调用
+        """
+        self._lock = threading.Lock()
+        self.winner = None
+        # 参与者 -> 落败时调用的回调（如关闭流式响应），落败方不必等到下一个片段才中止
+        self._on_lost = {}
+        # 有参与者获胜或结束时触发，供同步模式的等待方使用
+        self.changed = threading.Event()
+        self.async_event = async_event
+    
+    def ticket(self, label):
+        """为参与者创建竞速凭证
+        
+        Args:
+            label (str): 参与者标识（模型名称）
+        
+        Returns:
+            HedgeTicket: 竞速凭证
+        """
+        return HedgeTicket(self, label)
+    
+    def claim(self, label):
+        """参与者收到首token时尝试获胜
+        
+        Args:
+            label (str): 参与者标识
+        
+        Returns:
+            bool: 该参与者是否为获胜方
+        """
+        with self._lock:
+            won = self.winner is None
+            if won:
+                self.winner = label
+                callbacks = [callback for other, items in self._on_lost.items() if other != label for callback in items]
+                self._on_lost = {}
+            is_winner = self.winner == label
+        if won:
+            for callback in callbacks:
+                self._run_callback(callback)
+            self.notify()
+        return is_winner
+    
+    def on_lost(self, label, callback):
+        """登记参与者落败时的回调，已经落败时立即调用
+        
+        Args:
+            label (str): 参与者标识
+            callback (callable): 回调，不接受参数
+        """
+        with self._lock:
+            if self.winner is None:
+                self._on_lost.setdefault(label, []).append(callback)
+                return
+            lost = self.winner != label
+        if lost:
+            self._run_callback(callback)
+    
+    def notify(self):
+        """唤醒等待方"""
+        self.changed.set()
+        if self.async_event is not None:
+            self.async_event.set()
+    
+    def _run_callback(self, callback):
+        """调用落败回调，回调出错不影响获胜方"""
+        try:
+            callback()
+        except Exception as e:
+            print(f"取消对冲中落败的请求时出错: {str(e)}")
+
+
+class HedgeTicket:
+    """
+    参与者的竞速凭证，在流式输出循环中检查是否应继续
+    """
+    
+    def __init__(self, race, label):
+        """初始化竞速凭证
+        
+        Args:
+            race (HedgeRace): 所属竞速
+            label (str): 参与者标识
+        """
+        self.race = race
+        self.label = label
+    
+    def claim(self):
+        """收到输出时调用：获胜方返回，落败方抛出HedgeCancelled以中止请求
+        
+        Raises:
+            HedgeCancelled: 其他参与者已获胜
+        """
+        if not self.race.claim(self.label):
+            raise HedgeCancelled(f"{self.label}的请求已被{self.race.winner}抢先，取消")
+    
+    def on_lost(self, callback):
+        """登记落败时的回调，如关闭流式响应以立即释放连接和限流配额
+        
+        Args:
+            callback (callable): 回调，不接受参数
+        """
+        self.race.on_lost(self.label, callback)
+    
+    def lost(self):
+        """是否已有其他参与者获胜
+        
+        Returns:
+            bool: 已落败时为True
+        """
+        winner = self.race.winner
+        return winner is not None and winner != self.label
+    
+    def check(self):
+        """检查是否已有其他参与者获胜
+        
+        Raises:
+            HedgeCancelled: 其他参与者已获胜
+        """
+        winner = self.race.winner
+        if winner is not None and winner != self.label:
+            raise HedgeCancelled(f"{self.label}的请求已被{winner}抢先，取消")
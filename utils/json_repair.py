@@ -0,0 +1,350 @@
+"""
+LLM输出的JSON修复：json.loads失败时在本地依次尝试去除代码块标记、提取JSON对象、删除注释和多余逗号、
+补全被截断的输出以及按预期字段恢复结构，尽量避免丢弃整个响应或重新调用LLM
+"""
+import re
+import json
+import threading
+
+# Markdown代码块（可带语言标识），取其中的内容
+CODE_FENCE_PATTERN = re.compile(r'```[a-zA-Z0-9_-]*[ \t]*\n?(.*?)(?:```|$)', re.S)
+
+# 对象末尾没有值的键（前面是左括号或逗号），截断补全时去掉
+TRAILING_KEY_PATTERN = re.compile(r'(?<=[{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$|,\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+# 修复步骤，按执行顺序排列
+REPAIR_STEPS = ["code_fence", "extract", "cleanup", "truncation", "drop_partial", "incomplete_key", "keys"]
+
+
+class JSONRepairError(ValueError):
+    """本地修复后仍无法解析为JSON"""
+    pass
+
+
+class JSONRepairer:
+    """
+    JSON修复工具，同时按来源统计直接解析成功、本地修复成功、本地修复失败和重新请求的次数
+    
+    统计在进程内所有会话间共享，通过get_json_repairer()获取共享实例。
+    """
+    
+    def __init__(self):
+        """初始化修复统计"""
+        self._lock = threading.Lock()
+        self._stats = {}
+    
+    def parse(self, text, expected_keys=None, source="default", complete_keys=None):
+        """解析LLM输出的JSON，失败时在本地修复
+        
+        Args:
+            text (str): LLM输出的文本
+            expected_keys (list, optional): 预期的顶层字段，用于在结构不符时恢复字段
+            source (str, optional): 统计来源，如模型名
+            complete_keys (list, optional): 必须完整的顶层字段，截断补全时其值未输出完的字段整个去掉
+        
+        Returns:
+            tuple: (解析结果, 使用的修复步骤列表)，直接解析成功时步骤列表为空
+        
+        Raises:
+            JSONRepairError: 修复后仍无法解析
+        """
+        try:
+            result, steps = self._parse(text, expected_keys, complete_keys)
+        except JSONRepairError:
+            self._record(source, "failed")
+            raise
+        self._record(source, "repaired" if steps else "parsed", steps)
+        return result, steps
+    
+    def parse_reask(self, text, expected_keys=None, source="default", complete_keys=None):
+        """解析本地修复失败后重新请求得到的响应，结果计入重新请求的统计而不是新的一次解析
+        
+        Args:
+            text (str): 重新请求返回的文本
+            expected_keys (list, optional): 预期的顶层字段
+            source (str, optional): 统计来源
+            complete_keys (list, optional): 必须完整的顶层字段
+        
+        Returns:
+            tuple: (解析结果, 使用的修复步骤列表)
+        
+        Raises:
+            JSONRepairError: 重新请求的响应仍无法解析
+        """
+        try:
+            result, steps = self._parse(text, expected_keys, complete_keys)
+        except JSONRepairError:
+            self._record(source, "reask_failed")
+            raise
+        self._record(source, "reask_succeeded", steps)
+        return result, steps
+    
+    def get_stats(self):
+        """获取修复统计
+        
+        Returns:
+            dict: 每个来源的调用数、各结果次数、各修复步骤次数以及直接解析率和修复后的成功率
+        """
+        with self._lock:
+            stats = {}
+            for source, counts in self._stats.items():
+                entry = dict(counts, steps=dict(counts["steps"]))
+                total = counts["total"]
+                entry["parse_rate"] = round(counts["parsed"] / total, 3) if total else None
+                entry["success_rate"] = round(
+                    (counts["parsed"] + counts["repaired"] + counts["reask_succeeded"]) / total, 3
+                ) if total else None
+                stats[source] = entry
+            return stats
+    
+    def _record(self, source, outcome, steps=None):
+        """累计一次解析结果"""
+        with self._lock:
+            counts = self._stats.setdefault(source, {
+                "total": 0, "parsed": 0, "repaired": 0, "failed": 0,
+                "reask_succeeded": 0, "reask_failed": 0, "steps": {}
+            })
+            if outcome in ("parsed", "repaired", "failed"):
+                counts["total"] += 1
+            counts[outcome] += 1
+            for step in steps or []:
+                counts["steps"][step] = counts["steps"].get(step, 0) + 1
+    
+    def _parse(self, text, expected_keys, complete_keys=None):
+        """依次尝试各个修复步骤"""
+        if not isinstance(text, str) or not text.strip():
+            raise JSONRepairError("响应为空")
+        try:
+            return self._recover_keys(json.loads(text), expected_keys, [])
+        except json.JSONDecodeError:
+            pass
+        
+        steps = []
+        candidate = text.strip()
+        fenced = self._strip_code_fences(candidate)
+        if fenced != candidate:
+            steps.append("code_fence")
+            candidate = fenced
+        
+        start = self._find_start(candidate)
+        if start == -1:
+            raise JSONRepairError("响应中没有JSON对象")
+        body, stack, cut_points, partial, changed, truncated, end = self._scan(candidate, start)
+        # JSON值之前或之后还有其他文本时才算提取，清理删除的注释和逗号不计入
+        if start > 0 or candidate[end:].strip():
+            steps.append("extract")
+        if changed:
+            steps.append("cleanup")
+        
+        if not truncated:
+            try:
+                return self._recover_keys(json.loads(body), expected_keys, steps)
+            except json.JSONDecodeError as e:
+                raise JSONRepairError(f"修复后仍无法解析: {str(e)}")
+        
+        # 输出被截断：先去掉最内层数组末尾不完整的元素再补全，避免留下残缺的元素；
+        # 仍无法解析时直接补全未闭合的括号，再退回到上一个完整的元素补全
+        steps.append("truncation")
+        attempts = [(body, stack, None)] + [(prefix, cut_stack, None) for prefix, cut_stack in reversed(cut_points)]
+        if partial is not None:
+            attempts.insert(0, partial + ("drop_partial",))
+        for prefix, open_stack, step in attempts:
+            completed = self._close(prefix, open_stack)
+            try:
+                result = json.loads(completed)
+            except json.JSONDecodeError:
+                continue
+            if step:
+                steps.append(step)
+            result, steps = self._drop_incomplete_key(result, open_stack, complete_keys, steps)
+            return self._recover_keys(result, expected_keys, steps)
+        raise JSONRepairError("无法补全被截断的JSON")
+    
+    def _strip_code_fences(self, text):
+        """去除Markdown代码块标记，有多个代码块时取第一个包含JSON的代码块"""
+        if '```' not in text:
+            return text
+        for block in CODE_FENCE_PATTERN.findall(text):
+            if '{' in block or '[' in block:
+                return block.strip()
+        return text
+    
+    def _find_start(self, text):
+        """查找第一个对象或数组的起始位置，优先使用对象"""
+        brace = text.find('{')
+        return brace if brace != -1 else text.find('[')
+    
+    def _scan(self, text, start):
+        """从起始位置扫描一个完整的JSON值，同时删除注释、多余的逗号并转义字符串中的换行
+        
+        Returns:
+            tuple: (清理后的文本, 未闭合的括号栈, 可截断的位置列表, 去掉不完整元素后的文本和括号栈, 是否做过清理, 是否被截断,
+                JSON值在原文本中的结束位置)
+                可截断的位置为逗号之前或左括号之后的已输出文本，以及该位置的括号栈；
+                最内层未闭合的数组末尾没有不完整的元素时，去掉不完整元素后的文本为None
+        """
+        out = []
+        stack = []
+        # 每层括号中最后一个逗号的位置，没有逗号时为左括号之后的位置
+        element_starts = []
+        cut_points = []
+        changed = False
+        in_string = False
+        escaped = False
+        i = start
+        length = len(text)
+        while i < length:
+            char = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                elif char in '\n\r':
+                    # 字符串中未转义的换行
+                    out.append('\\n' if char == '\n' else '')
+                    changed = True
+                    i += 1
+                    continue
+                out.append(char)
+                i += 1
+                continue
+            
+            if char == '"':
+                in_string = True
+            elif text.startswith('//', i):
+                # 行注释
+                end = text.find('\n', i)
+                i = length if end == -1 else end
+                changed = True
+                continue
+            elif text.startswith('/*', i):
+                end = text.find('*/', i + 2)
+                i = length if end == -1 else end + 2
+                changed = True
+                continue
+            elif char in '{[':
+                stack.append(char)
+                element_starts.append(len(out) + 1)
+                # 括号中的第一个元素或字段不完整时可退回到空的对象或数组
+                cut_points.append((len(out) + 1, list(stack)))
+            elif char in '}]':
+                # 删除右括号之前多余的逗号
+                while out and out[-1] in ' \t\r\n':
+                    out.pop()
+                if out and out[-1] == ',':
+                    out.pop()
+                    changed = True
+                out.append(char)
+                if stack:
+                    stack.pop()
+                    element_starts.pop()
+                if not stack:
+                    return ''.join(out), [], [], None, changed, False, i + 1
+                i += 1
+                continue
+            elif char == ',':
+                cut_points.append((len(out), list(stack)))
+                if element_starts:
+                    element_starts[-1] = len(out)
+            out.append(char)
+            i += 1
+        
+        body = ''.join(out)
+        if in_string:
+            body += '"'
+        cut_points = [(''.join(out[:index]), cut_stack) for index, cut_stack in cut_points[-20:]]
+        partial = self._partial_element(out, stack, element_starts, in_string)
+        return body, stack, cut_points, partial, changed, True, length
+    
+    def _partial_element(self, out, stack, element_starts, in_string):
+        """找出最内层未闭合的数组末尾被截断的元素，返回去掉该元素后的文本和括号栈
+        
+        元素内还有未闭合的括号或字符串，或者是可能不完整的数字和字面量时视为不完整；
+        已完整输出的对象、数组或字符串保留
+        """
+        if '[' not in stack:
+            return None
+        depth = len(stack) - 1 - stack[::-1].index('[')
+        start = element_starts[depth]
+        element = ''.join(out[start:]).strip().lstrip(',').strip()
+        if not element:
+            return None
+        if len(stack) == depth + 1 and not in_string and element[-1] in '}]"':
+            return None
+        return ''.join(out[:start]), stack[:depth + 1]
+    
+    def _close(self, prefix, stack):
+        """为被截断的文本补全括号，去掉末尾不完整的键或逗号"""
+        text = re.sub(r',\s*$', '', prefix.rstrip())
+        # 对象中末尾是没有值的键：去掉该键
+        if stack and stack[-1] == '{' and TRAILING_KEY_PATTERN.search(text):
+            text = TRAILING_KEY_PATTERN.sub('', text)
+        closers = ''.join('}' if bracket == '{' else ']' for bracket in reversed(stack))
+        return text + closers
+    
+    def _drop_incomplete_key(self, result, stack, complete_keys, steps):
+        """去掉截断时值还未输出完的必须完整的顶层字段
+        
+        截断位置在顶层对象的某个字段值内部（括号栈深度至少为2）时，补全后的最后一个字段就是被截断的字段，
+        其中的列表或对象可能只有一部分，对必须完整的字段按缺失处理比使用残缺的值更安全
+        """
+        if not complete_keys or not isinstance(result, dict) or not result:
+            return result, steps
+        if len(stack) < 2 or stack[0] != '{':
+            return result, steps
+        last_key = list(result)[-1]
+        if last_key not in complete_keys:
+            return result, steps
+        result = {key: value for key, value in result.items() if key != last_key}
+        return result, steps + ["incomplete_key"]
+    
+    def _recover_keys(self, result, expected_keys, steps):
+        """按预期的顶层字段恢复结构：统一字段名的大小写和分隔符，或取出包含预期字段的嵌套对象"""
+        if not expected_keys:
+            return result, steps
+        if isinstance(result, list):
+            dicts = [item for item in result if isinstance(item, dict)]
+            if len(dicts) == 1:
+                result = dicts[0]
+                steps = steps + ["keys"]
+        if not isinstance(result, dict) or all(key in result for key in expected_keys):
+            return result, steps
+        
+        normalized = {self._normalize_key(key): key for key in expected_keys}
+        renamed = {}
+        for key, value in result.items():
+            renamed[normalized.get(self._normalize_key(key), key)] = value
+        if any(key in renamed and key not in result for key in expected_keys):
+            return renamed, steps + ["keys"]
+        
+        # 多出一层包装，如{"result": {...}}
+        for value in result.values():
+            if isinstance(value, dict) and all(key in value for key in expected_keys):
+                return value, steps + ["keys"]
+        return result, steps
+    
+    def _normalize_key(self, key):
+        """统一字段名的大小写、空白和分隔符"""
+        return re.sub(r'[\s_\-]+', '_', str(key).strip().lower())
+
+
+# 进程级共享实例
+_default_repairer = None
+_default_repairer_lock = threading.Lock()
+
+
+def get_json_repairer():
+    """获取进程级共享的JSON修复工具
+    
+    Returns:
+        JSONRepairer: 共享的修复工具
+    """
+    global _default_repairer
+    if _default_repairer is None:
+        with _default_repairer_lock:
+            if _default_repairer is None:
+                _default_repairer = JSONRepairer()
+    return _default_repairer
@@ -0,0 +1,215 @@
+"""
+LLM调用延迟统计，按模型维护首token时间和总耗时的直方图，用于推导对冲请求的触发阈值
+"""
+import os
+import sys
+import math
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import HEDGE_SETTINGS
+
+
+class LatencyHistogram:
+    """
+    对数分桶的延迟直方图（10ms ~ 约10分钟），内存占用固定，可近似计算任意分位数
+    """
+    
+    # 每个数量级的桶数，相邻桶边界相差约12%
+    BUCKETS_PER_DECADE = 20
+    MIN_VALUE = 0.01
+    MAX_VALUE = 600.0
+    
+    def __init__(self):
+        """初始化直方图"""
+        decades = math.log10(self.MAX_VALUE / self.MIN_VALUE)
+        self.num_buckets = int(math.ceil(decades * self.BUCKETS_PER_DECADE)) + 1
+        self.counts = [0] * self.num_buckets
+        self.count = 0
+        # 删失样本数：只知道实际值不小于记录值（如对冲中被取消的请求）
+        self.censored = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def _bucket_index(self, value):
+        """计算值所在的桶"""
+        if value <= self.MIN_VALUE:
+            return 0
+        index = int(math.log10(value / self.MIN_VALUE) * self.BUCKETS_PER_DECADE) + 1
+        return min(index, self.num_buckets - 1)
+    
+    def _bucket_upper(self, index):
+        """桶的上边界"""
+        return self.MIN_VALUE * (10 ** (index / self.BUCKETS_PER_DECADE))
+    
+    def record(self, value, censored=False):
+        """记录一个延迟值
+        
+        Args:
+            value (float): 延迟（秒）
+            censored (bool, optional): 是否为删失样本（实际延迟不小于该值），按该值计入分位数
+        """
+        self.counts[self._bucket_index(value)] += 1
+        self.count += 1
+        if censored:
+            self.censored += 1
+        self.total += value
+        self.max = max(self.max, value)
+    
+    def percentile(self, q):
+        """计算分位数（取所在桶的上边界，偏保守）
+        
+        Args:
+            q (float): 分位数，0~100
+        
+        Returns:
+            float: 延迟（秒），没有数据时返回None
+        """
+        if self.count == 0:
+            return None
+        rank = max(1, int(math.ceil(self.count * q / 100.0)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(self._bucket_upper(index), self.max)
+        return self.max
+    
+    def summary(self):
+        """获取统计摘要
+        
+        Returns:
+            dict: 样本数、删失样本数、平均值、最大值及p50/p90/p95/p99
+        """
+        return {
+            'count': self.count,
+            'censored': self.censored,
+            'avg': self.total / self.count if self.count else None,
+            'max': self.max if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+
+
+class LatencyTracker:
+    """
+    按模型记录首token时间（ttft）和总耗时（latency）的直方图
+    """
+    
+    METRICS = ('ttft', 'latency')
+    
+    def __init__(self, settings=None):
+        """初始化延迟统计
+        
+        Args:
+            settings (dict, optional): 对冲设置，默认使用config.py中的HEDGE_SETTINGS
+        """
+        self.settings = dict(HEDGE_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self._lock = threading.Lock()
+        # 模型名称 -> {指标: 直方图}
+        self._histograms = {}
+    
+    def record(self, model_name, call_info):
+        """记录一次成功调用的延迟
+        
+        Args:
+            model_name (str): 模型名称
+            call_info (dict): 调用附加信息，包含ttft和latency
+        """
+        with self._lock:
+            histograms = self._histograms.get(model_name)
+            if histograms is None:
+                histograms = self._histograms[model_name] = {metric: LatencyHistogram() for metric in self.METRICS}
+            for metric in self.METRICS:
+                value = call_info.get(metric)
+                if value is not None:
+                    histograms[metric].record(value)
+    
+    def record_cancelled(self, model_name, elapsed):
+        """记录一次在首token之前被取消的对冲请求
+        
+        落败的请求没有完整的延迟，只知道首token时间不小于已等待的时间。只记录获胜方会使慢的样本
+        系统性缺失、对冲阈值越来越低，因此把已等待的时间作为首token时间的删失样本计入（偏低但不会丢失慢样本）
+        
+        Args:
+            model_name (str): 模型名称
+            elapsed (float): 发出请求到被取消的秒数
+        """
+        with self._lock:
+            histograms = self._histograms.get(model_name)
+            if histograms is None:
+                histograms = self._histograms[model_name] = {metric: LatencyHistogram() for metric in self.METRICS}
+            histograms['ttft'].record(elapsed, censored=True)
+    
+    def percentile(self, model_name, metric, q):
+        """获取模型某项指标的分位数
+        
+        Args:
+            model_name (str): 模型名称
+            metric (str): ttft或latency
+            q (float): 分位数，0~100
+        
+        Returns:
+            tuple: (分位数, 样本数)，没有数据时分位数为None
+        """
+        with self._lock:
+            histograms = self._histograms.get(model_name)
+            if histograms is None:
+                return None, 0
+            histogram = histograms[metric]
+            return histogram.percentile(q), histogram.count
+    
+    def hedge_delay(self, model_name):
+        """计算对冲阈值：主模型超过该时间仍未返回首token时，向备用模型发出相同请求
+        
+        样本足够时使用首token时间的p95（由设置中的percentile决定），否则使用默认值
+        
+        Args:
+            model_name (str): 主模型名称
+        
+        Returns:
+            float: 等待秒数
+        """
+        value, count = self.percentile(model_name, 'ttft', self.settings["percentile"])
+        if value is None or count < self.settings["min_samples"]:
+            value = self.settings["default_delay"]
+        return max(self.settings["min_delay"], min(self.settings["max_delay"], value))
+    
+    def get_stats(self):
+        """获取所有模型的延迟统计
+        
+        Returns:
+            dict: 模型名称 -> {指标: 统计摘要, hedge_delay: 当前对冲阈值}
+        """
+        with self._lock:
+            result = {
+                model_name: {metric: histogram.summary() for metric, histogram in histograms.items()}
+                for model_name, histograms in self._histograms.items()
+            }
+        for model_name in result:
+            result[model_name]['hedge_delay'] = self.hedge_delay(model_name)
+        return result
+
+
+# 进程级共享实例
+_default_tracker = None
+_default_tracker_lock = threading.Lock()
+
+
+def get_latency_tracker():
+    """获取进程级共享的延迟统计
+    
+    Returns:
+        LatencyTracker: 共享的延迟统计实例
+    """
+    global _default_tracker
+    if _default_tracker is None:
+        with _default_tracker_lock:
+            if _default_tracker is None:
+                _default_tracker = LatencyTracker()
+    return _default_tracker
@@ -0,0 +1,247 @@
+"""
+LLM响应缓存，按(模型, 温度, 最大令牌数, 系统消息, 提示词)的哈希值缓存模型输出
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import LLM_CACHE_SETTINGS
+
+
+class LLMResponseCache:
+    """
+    两级LLM响应缓存：内存中的LRU缓存 + 磁盘缓存（按总大小和TTL淘汰）
+    """
+    
+    def __init__(self, settings=None):
+        """初始化响应缓存
+        
+        Args:
+            settings (dict, optional): 缓存设置，默认使用config.py中的LLM_CACHE_SETTINGS
+        """
+        self.settings = dict(LLM_CACHE_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        
+        self.enabled = self.settings.get("enabled", True)
+        self.memory_max_entries = self.settings["memory_max_entries"]
+        self.ttl_seconds = self.settings["ttl_seconds"]
+        self.disk_max_bytes = self.settings["disk_max_bytes"]
+        
+        # 磁盘缓存目录，相对路径以项目根目录为基准
+        disk_dir = self.settings["disk_dir"]
+        if not os.path.isabs(disk_dir):
+            disk_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), disk_dir)
+        self.disk_dir = disk_dir
+        
+        self._lock = threading.Lock()
+        # key -> (写入时间, 响应文本)
+        self._memory = OrderedDict()
+        # 磁盘层总大小的估计值，超限或写入一定次数后才完整扫描目录
+        self._disk_bytes = None
+        self._puts_since_sweep = 0
+        # 命中统计
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def make_key(self, model_name, temperature, max_tokens, system_message, prompt):
+        """计算缓存键
+        
+        Args:
+            model_name (str): 模型名称
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            system_message (str): 系统消息
+            prompt (str): 提示词
+        
+        Returns:
+            str: SHA-256哈希值
+        """
+        payload = json.dumps(
+            [model_name, temperature, max_tokens, system_message or "", prompt],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _disk_path(self, key):
+        """获取缓存键对应的磁盘文件路径，按前两位分目录避免单目录文件过多"""
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+    
+    def _is_expired(self, created_at):
+        """判断缓存条目是否已过期"""
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+    
+    def get(self, key):
+        """读取缓存
+        
+        Args:
+            key (str): 缓存键
+        
+        Returns:
+            tuple: (响应文本, 命中层级'memory'/'disk')，未命中时返回(None, None)
+        """
+        if not self.enabled:
+            return None, None
+        
+        # 先查内存
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, response = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return response, 'memory'
+                del self._memory[key]
+        
+        # 再查磁盘
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            with self._lock:
+                self.stats['misses'] += 1
+            return None, None
+        
+        if self._is_expired(record.get('created_at', 0)):
+            self._remove_file(path)
+            with self._lock:
+                self.stats['misses'] += 1
+            return None, None
+        
+        # 更新访问时间，磁盘淘汰按最近访问时间进行
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        
+        response = record['response']
+        with self._lock:
+            self._put_memory(key, record['created_at'], response)
+            self.stats['disk_hits'] += 1
+        return response, 'disk'
+    
+    def put(self, key, response, model_name=None):
+        """写入缓存
+        
+        Args:
+            key (str): 缓存键
+            response (str): 响应文本
+            model_name (str, optional): 模型名称，仅用于记录
+        """
+        if not self.enabled or not response:
+            return
+        
+        created_at = time.time()
+        with self._lock:
+            self._put_memory(key, created_at, response)
+        
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {'created_at': created_at, 'model': model_name, 'response': response}
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        
+        with self._lock:
+            self._puts_since_sweep += 1
+            if self._disk_bytes is not None:
+                self._disk_bytes += os.path.getsize(path)
+            need_sweep = (
+                self._disk_bytes is None
+                or self._disk_bytes > self.disk_max_bytes
+                or self._puts_since_sweep >= self.settings["sweep_interval"]
+            )
+        if need_sweep:
+            self._evict_disk()
+    
+    def _put_memory(self, key, created_at, response):
+        """写入内存层并按LRU淘汰（调用方需持有锁）"""
+        self._memory[key] = (created_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+    
+    def _remove_file(self, path):
+        """删除磁盘缓存文件，忽略已被删除的情况"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _evict_disk(self):
+        """淘汰过期条目，并在总大小超限时按最近访问时间删除最旧的条目"""
+        if not os.path.isdir(self.disk_dir):
+            with self._lock:
+                self._disk_bytes = 0
+            return
+        
+        entries = []
+        total_bytes = 0
+        now = time.time()
+        for root, _, files in os.walk(self.disk_dir):
+            for filename in files:
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # 命中时会刷新修改时间，超过TTL未被访问的条目直接删除
+                if self.ttl_seconds is not None and now - st.st_mtime > self.ttl_seconds:
+                    self._remove_file(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total_bytes += st.st_size
+        
+        if total_bytes > self.disk_max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total_bytes <= self.disk_max_bytes:
+                    break
+                self._remove_file(path)
+                total_bytes -= size
+                with self._lock:
+                    self.stats['evictions'] += 1
+        
+        with self._lock:
+            self._disk_bytes = total_bytes
+            self._puts_since_sweep = 0
+    
+    def clear(self):
+        """清空内存和磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._disk_bytes = None
+        if os.path.isdir(self.disk_dir):
+            for root, _, files in os.walk(self.disk_dir):
+                for filename in files:
+                    self._remove_file(os.path.join(root, filename))
+
+
+# 进程级共享实例
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """获取进程级共享的LLM响应缓存
+    
+    Returns:
+        LLMResponseCache: 共享的缓存实例
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = LLMResponseCache()
+    return _default_cache
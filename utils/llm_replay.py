@@ -0,0 +1,297 @@
+"""
+LLM调用回放：从录制的会话（sessions/<id>/llm_outputs/llm_output.json）中按提示词返回响应，
+可选按录制的首token时间和总耗时模拟流式输出，用于无网络环境下复现、基准测试和压测整个流程
+"""
+import os
+import sys
+import json
+import hashlib
+import difflib
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import LLM_REPLAY_SETTINGS
+from utils.session_log import SegmentedLog
+from utils.session_store import FileSessionStore, SQLiteSessionStore
+from utils.prompt_segments import PromptSegments, split_prompt
+
+
+class LLMReplayStore:
+    """
+    录制的LLM调用集合，按(模型, 提示词)的哈希值精确匹配，找不到时按提示词相似度模糊匹配
+    
+    同一提示词录制了多次时按录制顺序依次返回，用完后重复返回最后一次的响应。
+    """
+    
+    def __init__(self, sources, settings=None):
+        """初始化回放记录并加载录制文件
+        
+        Args:
+            sources (list): 会话目录、sessions根目录、llm_output.json文件或SQLite会话数据库路径列表
+            settings (dict, optional): 回放设置，默认使用config.py中的LLM_REPLAY_SETTINGS
+        """
+        self.settings = dict(LLM_REPLAY_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self._lock = threading.Lock()
+        # 匹配键 -> 录制列表（按录制时间排序）
+        self._records = {}
+        # 匹配键 -> 下一次返回的录制下标
+        self._cursors = {}
+        # 模型 -> 匹配键列表，用于模糊匹配时缩小候选范围
+        self._keys_by_model = {}
+        # 匹配键 -> (提示词, 固定前缀长度, 固定前缀哈希值)，用于模糊匹配时筛选候选
+        self._prompts = {}
+        # 本次调用的匹配键 -> 模糊匹配结果(匹配键, 相似度)，同一提示词只计算一次
+        self._fuzzy_cache = {}
+        self.stats = {'records': 0, 'exact': 0, 'fuzzy': 0, 'misses': 0}
+        for source in sources:
+            self.load(source)
+    
+    def load(self, source):
+        """加载一个录制来源
+        
+        Args:
+            source (str): 会话目录、sessions根目录、llm_output.json文件或SQLite会话数据库路径
+        
+        Returns:
+            int: 加载的调用数
+        """
+        loaded = 0
+        if source.endswith('.db'):
+            # SQLite会话存储
+            store = SQLiteSessionStore(source)
+            segments = PromptSegments(store)
+            for origin, record in store.iter_api_calls():
+                record = segments.expand(record)
+                if record.get('prompt') and record.get('response'):
+                    self._add(record, origin)
+                    loaded += 1
+            print(f"从{source}加载了{loaded}条LLM调用录制")
+            return loaded
+        for file_path in self._find_output_files(source):
+            # 包括尚未合并到llm_output.json的追加记录（llm_output.jsonl）
+            records = SegmentedLog(file_path, compact_every=0).read()
+            # llm_outputs的上一级目录即会话目录，提示词的固定前缀保存在sessions根目录的prompt_segments中
+            session_dir = os.path.dirname(os.path.dirname(os.path.abspath(file_path)))
+            origin = os.path.basename(session_dir)
+            segments = PromptSegments(FileSessionStore(os.path.dirname(session_dir)))
+            for record in sorted(records, key=lambda r: r.get('timestamp', '')):
+                record = segments.expand(record)
+                if record.get('prompt') and record.get('response'):
+                    self._add(record, origin)
+                    loaded += 1
+        print(f"从{source}加载了{loaded}条LLM调用录制")
+        return loaded
+    
+    def _find_output_files(self, source):
+        """查找录制来源下的所有llm_output.json文件（或只有压缩记录的llm_output.json.gz、只有追加记录的llm_output.jsonl）"""
+        if os.path.isfile(source):
+            if source.endswith('.jsonl'):
+                return [source[:-1]]
+            return [source[:-3] if source.endswith('.gz') else source]
+        files = []
+        for root, _, names in os.walk(source):
+            if {'llm_output.json', 'llm_output.json.gz', 'llm_output.jsonl'} & set(names):
+                files.append(os.path.join(root, 'llm_output.json'))
+        return sorted(files)
+    
+    def _key(self, model, prompt):
+        """计算匹配键"""
+        payload = json.dumps([model if self.settings["match_model"] else "", prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _add(self, record, origin):
+        """添加一条录制"""
+        entry = dict(record, origin=origin)
+        key = self._key(record.get('model'), record['prompt'])
+        with self._lock:
+            if key not in self._records:
+                self._records[key] = []
+                model = record.get('model') if self.settings["match_model"] else ""
+                self._keys_by_model.setdefault(model, []).append(key)
+                self._prompts[key] = self._prompt_info(record['prompt'])
+                # 新的录制可能成为更好的模糊匹配
+                self._fuzzy_cache.clear()
+            self._records[key].append(entry)
+            self.stats['records'] += 1
+    
+    def lookup(self, model, prompt):
+        """查找与本次调用匹配的录制
+        
+        模糊匹配的相似度计算不持有锁，不阻塞其他并发的回放调用
+        
+        Args:
+            model (str): 模型（API中的模型名）
+            prompt (str): 提示词
+        
+        Returns:
+            tuple: (录制, 匹配信息)，没有匹配时录制为None
+        """
+        key = self._key(model, prompt)
+        match = {'replay_match': 'exact'}
+        with self._lock:
+            exact = key in self._records
+            fuzzy = None if exact else self._fuzzy_cache.get(key)
+            candidates = None if exact or fuzzy is not None else self._fuzzy_candidates(model, prompt)
+        if candidates is not None:
+            fuzzy = self._fuzzy_match(prompt, candidates)
+            with self._lock:
+                if len(self._fuzzy_cache) >= self.settings["fuzzy_cache_size"]:
+                    self._fuzzy_cache.pop(next(iter(self._fuzzy_cache)))
+                self._fuzzy_cache[key] = fuzzy
+        
+        with self._lock:
+            if not exact:
+                key, similarity = fuzzy
+                if key is None:
+                    self.stats['misses'] += 1
+                    return None, None
+                match = {'replay_match': 'fuzzy', 'replay_similarity': round(similarity, 3)}
+            self.stats[match['replay_match']] += 1
+            records = self._records[key]
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = min(index + 1, len(records) - 1)
+            record = records[index]
+        match['replay_origin'] = record['origin']
+        return record, match
+    
+    def _prompt_info(self, prompt):
+        """提示词的固定前缀长度和哈希值，没有固定前缀时哈希值为None"""
+        prefix, _ = split_prompt(prompt)
+        digest = hashlib.sha256(prefix.encode('utf-8')).hexdigest() if prefix else None
+        return prompt, len(prefix), digest
+    
+    def _fuzzy_candidates(self, model, prompt):
+        """按固定前缀和长度挑选最有可能匹配的录制（调用方持有锁）
+        
+        固定前缀相同的录制优先，其次是长度最接近的；长度差异使相似度上界低于阈值的录制直接排除，
+        最多保留fuzzy_candidates条
+        
+        Returns:
+            list: 每项为(匹配键, 录制的提示词, 录制的固定前缀长度, 固定前缀是否相同)，未开启模糊匹配时为空列表
+        """
+        threshold = self.settings["fuzzy_threshold"]
+        if threshold is None:
+            return []
+        model = model if self.settings["match_model"] else ""
+        _, prefix_length, digest = self._prompt_info(prompt)
+        ranked = []
+        for key in self._keys_by_model.get(model, []):
+            recorded, recorded_prefix_length, recorded_digest = self._prompts[key]
+            # 相似度的上界：较短的提示词全部匹配
+            if 2 * min(len(recorded), len(prompt)) < threshold * (len(recorded) + len(prompt)):
+                continue
+            same_prefix = digest is not None and recorded_digest == digest
+            ranked.append((not same_prefix, abs(len(recorded) - len(prompt)), key, recorded, recorded_prefix_length, same_prefix))
+        ranked.sort(key=lambda item: item[:2])
+        return [item[2:] for item in ranked[:self.settings["fuzzy_candidates"]]]
+    
+    def _fuzzy_match(self, prompt, candidates):
+        """计算候选录制与提示词的相似度，返回最接近的录制（不持有锁）
+        
+        固定前缀相同时只比较动态部分，再按前缀的长度换算为整个提示词的相似度
+        
+        Returns:
+            tuple: (匹配键, 相似度)，没有达到阈值的录制时匹配键为None
+        """
+        best_key, best_ratio = None, self.settings["fuzzy_threshold"]
+        if best_ratio is None:
+            return None, 0.0
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        for key, recorded, prefix_length, same_prefix in candidates:
+            if same_prefix:
+                seq1, seq2, shared = recorded[prefix_length:], prompt[prefix_length:], prefix_length
+            else:
+                seq1, seq2, shared = recorded, prompt, 0
+            matcher.set_seqs(seq1, seq2)
+            
+            def similarity(ratio):
+                return (2 * shared + ratio * (len(seq1) + len(seq2))) / (len(recorded) + len(prompt))
+            
+            # 先用上界快速排除，再计算精确相似度
+            if similarity(matcher.real_quick_ratio()) < best_ratio or similarity(matcher.quick_ratio()) < best_ratio:
+                continue
+            ratio = similarity(matcher.ratio())
+            if ratio >= best_ratio:
+                best_key, best_ratio = key, ratio
+        return best_key, best_ratio
+    
+    def plan(self, record):
+        """生成回放的流式片段及每个片段之前的等待时间
+        
+        模拟延迟时，第一个片段在录制的首token时间之后输出，其余片段按长度分摊录制的解码时间
+        
+        Args:
+            record (dict): 录制
+        
+        Returns:
+            list: 每项为(等待秒数, 片段)
+        """
+        content = record['response']
+        size = max(1, self.settings["chunk_chars"])
+        chunks = [content[i:i + size] for i in range(0, len(content), size)]
+        if not self.settings["simulate_latency"]:
+            return [(0.0, chunk) for chunk in chunks]
+        
+        scale = self.settings["time_scale"]
+        latency = record.get('latency') or 0.0
+        ttft = record.get('ttft')
+        ttft = latency if ttft is None else ttft
+        decode = max(0.0, latency - ttft)
+        steps = []
+        for index, chunk in enumerate(chunks):
+            delay = decode * len(chunk) / len(content)
+            if index == 0:
+                delay = ttft
+            steps.append((delay * scale, chunk))
+        return steps
+    
+    def get_stats(self):
+        """获取回放统计
+        
+        Returns:
+            dict: 录制数和精确匹配、模糊匹配、未匹配的次数
+        """
+        with self._lock:
+            return dict(self.stats)
+
+
+# 进程级共享实例，未配置录制来源时为None
+_default_store = None
+_default_store_loaded = False
+_default_store_lock = threading.Lock()
+
+
+def configure_replay(sources, settings=None):
+    """设置进程级共享的回放记录，之后创建的OpenAIClient都从录制中返回响应
+    
+    Args:
+        sources (list): 录制来源列表，为空时关闭回放
+        settings (dict, optional): 覆盖LLM_REPLAY_SETTINGS中的设置
+    
+    Returns:
+        LLMReplayStore: 共享的回放记录，关闭回放时返回None
+    """
+    global _default_store, _default_store_loaded
+    with _default_store_lock:
+        _default_store = LLMReplayStore(sources, settings) if sources else None
+        _default_store_loaded = True
+    return _default_store
+
+
+def get_replay_store():
+    """获取进程级共享的回放记录，首次调用时按LLM_REPLAY_SETTINGS中的sources加载
+    
+    Returns:
+        LLMReplayStore: 共享的回放记录，未配置录制来源时返回None
+    """
+    global _default_store, _default_store_loaded
+    if not _default_store_loaded:
+        with _default_store_lock:
+            if not _default_store_loaded:
+                sources = LLM_REPLAY_SETTINGS["sources"]
+                _default_store = LLMReplayStore(sources) if sources else None
+                _default_store_loaded = True
+    return _default_store
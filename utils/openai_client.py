@@ -3,20 +3,33 @@ LLM API客户端，封装各种模型的API调用
 """
 import os
 import sys
+import copy
 import time
+import asyncio
 import json
-import requests
-import openai
+from concurrent.futures import ThreadPoolExecutor
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config import AVAILABLE_MODELS
+from config import AVAILABLE_MODELS, HEDGE_SETTINGS, SYSTEM_PROMPT, PROMPT_CACHE_BOUNDARY, PROMPT_CACHE_ENABLED
+from config import JSON_REPAIR_SETTINGS, JSON_REPAIR_PROMPT
+from utils.client_pool import get_client_pool
+from utils.llm_cache import get_llm_cache
+from utils.token_counter import get_token_counter
+from utils.event_bus import get_event_bus
+from utils.rate_limiter import get_rate_limiter_registry, is_retryable_error
+from utils.latency_tracker import get_latency_tracker
+from utils.llm_replay import get_replay_store
+from utils.hedging import HedgeRace, HedgeCancelled
+from utils.streaming_json import StreamingJSONParser
+from utils.json_repair import get_json_repairer, JSONRepairError
 
 class OpenAIClient:
     """
     LLM API客户端类，封装不同模型的API调用
     """
     
+    # 发送给模型的系统消息
     def __init__(self):
         """初始化LLM API客户端
         
@@ -25,14 +38,39 @@ class OpenAIClient:
         # 检查环境变量中的API密钥
         self._check_api_keys()
         
-        # 初始化模型客户端
-        self.openai_client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY", ""))
+        # 使用进程级共享的客户端连接池，所有会话复用长连接
+        self.client_pool = get_client_pool()
+        
+        # 使用进程级共享的响应缓存，是否使用由调用处决定
+        self.response_cache = get_llm_cache()
+        
+        # 提供商未返回用量时，使用本地分词器统计token
+        self.token_counter = get_token_counter()
+        
+        # 按模型共享的限流器（RPM/TPM、并发数、熔断）
+        self.rate_limiters = get_rate_limiter_registry()
+        
+        # 按模型统计首token时间和总耗时，用于推导对冲阈值
+        self.latency_tracker = get_latency_tracker()
         
         # 缓存获取的访问令牌
         self.access_tokens = {}
         
         # 记录token使用量
         self.session_manager = None
+        
+        # 流式输出的事件频道，未设置时直接输出到终端
+        self.event_bus = get_event_bus()
+        self.event_channel = None
+        
+        # 批处理模式下的请求收集器，设置后支持批处理接口的模型通过提供商批次完成调用
+        self.batch_collector = None
+        
+        # 回放模式下的录制记录，设置后所有调用从录制中返回响应，不访问网络
+        self.replay_store = get_replay_store()
+        
+        # 按模型统计JSON直接解析、本地修复和重新请求的次数
+        self.json_repairer = get_json_repairer()
     
     def set_session_manager(self, session_manager):
         """设置会话记录管理器
@@ -42,7 +80,90 @@ class OpenAIClient:
         """
         self.session_manager = session_manager
     
-    def _record_api_call(self, model_name, prompt, response, tokens_used):
+    def set_event_channel(self, channel):
+        """设置流式输出的事件频道，设置后输出片段发布到事件总线而不是打印到终端
+        
+        Args:
+            channel (str): 事件频道（会话ID）
+        """
+        self.event_channel = channel
+    
+    def set_batch_collector(self, collector):
+        """设置批处理请求收集器（离线批处理模式）
+        
+        Args:
+            collector (BatchCollector): 请求收集器，为None时恢复逐个调用
+        """
+        self.batch_collector = collector
+    
+    def set_replay_store(self, store):
+        """设置回放记录
+        
+        Args:
+            store (LLMReplayStore): 录制的LLM调用，为None时恢复调用真实接口
+        """
+        self.replay_store = store
+    
+    def fork(self, event_channel):
+        """创建在后台调用LLM的客户端
+        
+        新客户端沿用当前的会话记录管理器和回放记录，调用记录和token用量计入同一会话；
+        流式输出发布到独立的事件频道，不混入当前会话的输出，也不经过批处理请求收集器。
+        连接池、缓存和限流器都是进程级共享的，复制的开销可以忽略
+        
+        Args:
+            event_channel (str): 新客户端的事件频道
+        
+        Returns:
+            OpenAIClient: 新的客户端
+        """
+        client = copy.copy(self)
+        client.event_channel = event_channel
+        client.batch_collector = None
+        return client
+    
+    def _publish(self, event_type, data):
+        """向当前会话的事件频道发布事件
+        
+        Args:
+            event_type (str): 事件类型
+            data (dict): 事件数据
+        """
+        if self.event_channel is not None:
+            self.event_bus.publish(self.event_channel, event_type, data)
+    
+    def _emit_chunk(self, text):
+        """输出一个流式片段：有事件频道时发布token事件，否则实时打印到终端
+        
+        Args:
+            text (str): 输出片段
+        """
+        if self.event_channel is not None:
+            self.event_bus.publish(self.event_channel, "token", {"text": text})
+        else:
+            print(text, end="", flush=True)
+    
+    def _field_parser(self, stream_fields, on_field=None):
+        """创建增量JSON解析器的工厂函数，每次API调用使用独立的解析器
+        
+        Args:
+            stream_fields (list): 需要提前获取的JSON字段路径
+            on_field (callable, optional): 字段完整时的回调
+        
+        Returns:
+            callable: 解析器工厂函数，没有关注的字段时返回None
+        """
+        if not stream_fields:
+            return None
+        
+        def handle(path, value):
+            self._publish("field", {"path": path, "value": value})
+            if on_field is not None:
+                on_field(path, value)
+        
+        return lambda: StreamingJSONParser(stream_fields, handle)
+    
+    def _record_api_call(self, model_name, prompt, response, tokens_used, call_info=None):
         """记录API调用信息
         
         Args:
@@ -50,9 +171,18 @@ class OpenAIClient:
             prompt (str): 发送的提示词
             response (str): 收到的回应
             tokens_used (dict): 使用的token数量
+            call_info (dict, optional): 调用的附加信息，如缓存命中情况
         """
         if self.session_manager:
-            self.session_manager.add_api_call(model_name, prompt, response, tokens_used)
+            self.session_manager.add_api_call(model_name, prompt, response, tokens_used, call_info)
+    
+    def get_pool_stats(self):
+        """获取共享客户端连接池的使用统计
+        
+        Returns:
+            dict: 连接池统计信息
+        """
+        return self.client_pool.get_stats()
     
     def _check_api_keys(self):
         """检查环境变量中的API密钥"""
@@ -82,19 +212,18 @@ class OpenAIClient:
             return AVAILABLE_MODELS[model_name]
         else:
             raise ValueError(f"不支持的模型: {model_name}，请在config.py的AVAILABLE_MODELS中添加配置")
-
     
-    def generate_completion(self, prompt, model_name=None, temperature=None, max_tokens=None):
-        """生成文本补全，根据不同模型调用不同的API
+    
+    def _resolve_model(self, model_name, temperature, max_tokens):
+        """解析模型名称及调用参数，未知模型回退到默认模型
         
         Args:
-            prompt (str): 提示词
-            model_name (str, optional): 使用的模型名称。如果为None，则使用默认模型。
-            temperature (float, optional): 温度参数，控制随机性。如果为None，则使用配置中的默认值。
-            max_tokens (int, optional): 最大生成令牌数。如果为None，则使用配置中的默认值。
+            model_name (str): 模型名称
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
         
         Returns:
-            str: 生成的文本，以JSON格式返回
+            tuple: (模型名称, 模型配置, 温度参数, 最大生成令牌数)
         """
         # 如果未指定模型，使用默认的OpenAI模型
         if not model_name:
@@ -113,165 +242,1082 @@ class OpenAIClient:
         temperature = temperature if temperature is not None else model_config.get("temperature", 0.7)
         max_tokens = max_tokens if max_tokens is not None else model_config.get("max_tokens", 2000)
         
-        # 根据模型类型选择不同的API调用方式
-        model_type = model_config.get("type", "openai")
+        return model_name, model_config, temperature, max_tokens
+    
+    def generate_completion(self, prompt, model_name=None, temperature=None, max_tokens=None, use_cache=False, hedge=False, stream_fields=None, on_field=None, json_keys=None, complete_keys=None):
+        """生成文本补全，根据不同模型调用不同的API
         
-        try:
-            if model_type == "openai":
-                return self._call_openai_api(prompt, model_config, temperature, max_tokens)
-            elif model_type == "anthropic":
-                return self._call_anthropic_api(prompt, model_config, temperature, max_tokens)
-            elif model_type == "zhipu":
-                return self._call_zhipu_api(prompt, model_config, temperature, max_tokens)
-            else:
-                raise ValueError(f"不支持的模型类型: {model_type}")
+        Args:
+            prompt (str): 提示词
+            model_name (str, optional): 使用的模型名称。如果为None，则使用默认模型。
+            temperature (float, optional): 温度参数，控制随机性。如果为None，则使用配置中的默认值。
+            max_tokens (int, optional): 最大生成令牌数。如果为None，则使用配置中的默认值。
+            use_cache (bool, optional): 是否使用响应缓存，相同的模型、参数和提示词直接返回缓存结果。
+            hedge (bool, optional): 是否启用对冲请求，主模型超过阈值仍无首token时同时请求备用模型。
+            stream_fields (list, optional): 需要提前获取的JSON字段路径，如["next_question"]，
+                字段在流式输出中完整后立即发布field事件，无需等待整个响应结束
+            on_field (callable, optional): 字段完整时的回调，参数为(路径, 值)；调用失败重试时可能再次触发
+            json_keys (list, optional): 响应预期的顶层字段，JSON修复时用于恢复字段名和去除多余的包装层
+            complete_keys (list, optional): 必须完整的顶层字段，输出被截断时未输出完的字段整个去掉而不是补全
         
-        except Exception as e:
-            print(f"调用{model_name} API时发生错误: {str(e)}")
+        Returns:
+            str: 生成的文本，以JSON格式返回；无法解析时先在本地修复，仍失败时重新请求一次
+        """
+        model_name = self._resolve_model(model_name, temperature, max_tokens)[0]
+        content, cache_key = self._generate_completion(prompt, model_name, temperature, max_tokens, use_cache, hedge, stream_fields, on_field)
+        
+        repaired, reask_prompt, valid = self._repair_json(content, model_name, json_keys, complete_keys)
+        # 只缓存能解析的响应（修复后的文本），截断或损坏的响应不进入缓存
+        if cache_key and valid:
+            self.response_cache.put(cache_key, repaired, model_name)
+        if reask_prompt is None:
+            return repaired
+        reask_content, _ = self._generate_completion(reask_prompt, model_name, temperature=0)
+        return self._finish_reask(content, reask_content, model_name, json_keys, complete_keys)
+    
+    def _generate_completion(self, prompt, model_name=None, temperature=None, max_tokens=None, use_cache=False, hedge=False, stream_fields=None, on_field=None):
+        """调用API生成文本补全，不检查返回的JSON，参数与generate_completion一致
+        
+        Returns:
+            tuple: (生成的文本, 缓存键)，调用失败时文本为空字符串；
+                只有新生成的主模型响应才返回缓存键，由调用处检查JSON后写入缓存
+        """
+        model_name, model_config, temperature, max_tokens = self._resolve_model(model_name, temperature, max_tokens)
+        field_parser = self._field_parser(stream_fields, on_field)
+        
+        # 回放模式：从录制中返回响应，不查询也不写入响应缓存，结果只取决于录制内容
+        if self.replay_store is not None:
+            return self._replay_completion(prompt, model_config, field_parser), None
+        
+        # 查询响应缓存
+        call_info = {}
+        cache_key = None
+        if use_cache:
+            cache_key = self._cache_key(model_config, temperature, max_tokens, prompt)
+            cached, cache_tier = self.response_cache.get(cache_key)
+            if cached is not None:
+                self._record_cache_hit(model_config, prompt, cached, cache_tier)
+                if field_parser:
+                    field_parser().feed(cached)
+                return cached, None
+            call_info["cache"] = "miss"
+        
+        # 离线批处理模式：通过提供商批处理接口完成调用（不限流、不对冲）
+        if self.batch_collector is not None and self.batch_collector.supports(model_config):
+            content = self._batch_completion(prompt, model_name, model_config, temperature, max_tokens, call_info, field_parser)
+            return content, cache_key
+        
+        limiter = self.rate_limiters.get(model_name, model_config)
+        hedge_model = self._pick_hedge_model(model_name) if hedge else None
+        max_retries = limiter.settings["max_retries"]
+        
+        for attempt in range(max_retries + 1):
+            try:
+                call_info["attempt"] = attempt + 1
+                if hedge_model:
+                    content, winner = self._hedged_completion(
+                        prompt, model_name, hedge_model, temperature, max_tokens, call_info, field_parser
+                    )
+                else:
+                    content = self._complete_once(
+                        prompt, model_name, model_config, temperature, max_tokens, call_info, field_parser=field_parser
+                    )
+                    winner = model_name
+                
+                # 备用模型的结果不写入主模型的缓存
+                return content, cache_key if winner == model_name else None
             
-            # 如果是速率限制错误，等待一段时间后重试
-            if "rate_limit" in str(e).lower():
-                print(f"达到API速率限制，等待10秒后重试...")
-                time.sleep(10)
-                return self.generate_completion(prompt, model_name, temperature, max_tokens)
+            except Exception as e:
+                print(f"调用{model_name} API时发生错误: {str(e)}")
+                
+                # 限流、服务端错误和超时按指数退避（带抖动）重试，其他错误返回空字符串
+                if not is_retryable_error(e) or attempt >= max_retries:
+                    return "", None
+                limiter.record_retry()
+                wait_time = limiter.backoff_delay(attempt)
+                print(f"第{attempt + 1}次调用失败，等待{wait_time:.1f}秒后重试...")
+                time.sleep(wait_time)
+    
+    async def agenerate_completion(self, prompt, model_name=None, temperature=None, max_tokens=None, use_cache=False, hedge=False, stream_fields=None, on_field=None, json_keys=None, complete_keys=None):
+        """generate_completion的asyncio版本，在事件循环中非阻塞地调用API
+        
+        限流、重试、对冲、缓存、JSON修复和记录逻辑与generate_completion一致，可在同一事件循环中并发服务大量会话。
+        
+        Args:
+            prompt (str): 提示词
+            model_name (str, optional): 使用的模型名称。如果为None，则使用默认模型。
+            temperature (float, optional): 温度参数，控制随机性。如果为None，则使用配置中的默认值。
+            max_tokens (int, optional): 最大生成令牌数。如果为None，则使用配置中的默认值。
+            use_cache (bool, optional): 是否使用响应缓存。
+            hedge (bool, optional): 是否启用对冲请求。
+            stream_fields (list, optional): 需要提前获取的JSON字段路径。
+            on_field (callable, optional): 字段完整时的回调，参数为(路径, 值)。
+            json_keys (list, optional): 响应预期的顶层字段。
+            complete_keys (list, optional): 必须完整的顶层字段。
+        
+        Returns:
+            str: 生成的文本，以JSON格式返回
+        """
+        model_name = self._resolve_model(model_name, temperature, max_tokens)[0]
+        content, cache_key = await self._agenerate_completion(prompt, model_name, temperature, max_tokens, use_cache, hedge, stream_fields, on_field)
+        
+        repaired, reask_prompt, valid = self._repair_json(content, model_name, json_keys, complete_keys)
+        if cache_key and valid:
+            await asyncio.to_thread(self.response_cache.put, cache_key, repaired, model_name)
+        if reask_prompt is None:
+            return repaired
+        reask_content, _ = await self._agenerate_completion(reask_prompt, model_name, temperature=0)
+        return self._finish_reask(content, reask_content, model_name, json_keys, complete_keys)
+    
+    async def _agenerate_completion(self, prompt, model_name=None, temperature=None, max_tokens=None, use_cache=False, hedge=False, stream_fields=None, on_field=None):
+        """_generate_completion的asyncio版本，参数和返回值与_generate_completion一致"""
+        model_name, model_config, temperature, max_tokens = self._resolve_model(model_name, temperature, max_tokens)
+        field_parser = self._field_parser(stream_fields, on_field)
+        
+        if self.replay_store is not None:
+            return await self._areplay_completion(prompt, model_config, field_parser), None
+        
+        # 查询响应缓存（磁盘层读写放到工作线程中执行）
+        call_info = {}
+        cache_key = None
+        if use_cache:
+            cache_key = self._cache_key(model_config, temperature, max_tokens, prompt)
+            cached, cache_tier = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if cached is not None:
+                await asyncio.to_thread(self._record_cache_hit, model_config, prompt, cached, cache_tier)
+                if field_parser:
+                    field_parser().feed(cached)
+                return cached, None
+            call_info["cache"] = "miss"
+        
+        if self.batch_collector is not None and self.batch_collector.supports(model_config):
+            content = await asyncio.to_thread(
+                self._batch_completion, prompt, model_name, model_config, temperature, max_tokens, call_info, field_parser
+            )
+            return content, cache_key
+        
+        limiter = self.rate_limiters.get(model_name, model_config)
+        hedge_model = self._pick_hedge_model(model_name) if hedge else None
+        max_retries = limiter.settings["max_retries"]
+        
+        for attempt in range(max_retries + 1):
+            try:
+                call_info["attempt"] = attempt + 1
+                if hedge_model:
+                    content, winner = await self._ahedged_completion(
+                        prompt, model_name, hedge_model, temperature, max_tokens, call_info, field_parser
+                    )
+                else:
+                    content = await self._acomplete_once(
+                        prompt, model_name, model_config, temperature, max_tokens, call_info, field_parser=field_parser
+                    )
+                    winner = model_name
+                
+                return content, cache_key if winner == model_name else None
             
-            # 其他错误，返回空字符串
+            except Exception as e:
+                print(f"调用{model_name} API时发生错误: {str(e)}")
+                
+                # 限流、服务端错误和超时按指数退避（带抖动）重试，其他错误返回空字符串
+                if not is_retryable_error(e) or attempt >= max_retries:
+                    return "", None
+                limiter.record_retry()
+                wait_time = limiter.backoff_delay(attempt)
+                print(f"第{attempt + 1}次调用失败，等待{wait_time:.1f}秒后重试...")
+                await asyncio.sleep(wait_time)
+    
+    def _repair_json(self, content, model_name, json_keys=None, complete_keys=None):
+        """检查响应能否解析为JSON，不能时在本地修复
+        
+        Args:
+            content (str): 模型返回的文本
+            model_name (str): 模型名称，用于分模型统计
+            json_keys (list, optional): 响应预期的顶层字段
+            complete_keys (list, optional): 必须完整的顶层字段
+        
+        Returns:
+            tuple: (返回给调用处的文本, 重新请求的提示词, 文本是否为合法的JSON)，不需要重新请求时提示词为None
+        """
+        # 调用失败返回的空字符串由调用处按失败处理，不计入统计也不重新请求
+        if not content:
+            return content, None, False
+        if not JSON_REPAIR_SETTINGS["enabled"]:
+            try:
+                json.loads(content)
+            except ValueError:
+                return content, None, False
+            return content, None, True
+        try:
+            result, steps = self.json_repairer.parse(content, json_keys, source=model_name, complete_keys=complete_keys)
+        except JSONRepairError as e:
+            print(f"{model_name}返回的JSON无法在本地修复: {str(e)}")
+            if not JSON_REPAIR_SETTINGS["reask"]:
+                return content, None, False
+            reask_prompt = JSON_REPAIR_PROMPT.format(
+                error=str(e),
+                expected_keys=f"顶层字段应为：{', '.join(json_keys)}\n" if json_keys else "",
+                response=content
+            )
+            return content, reask_prompt, False
+        
+        if not steps:
+            return content, None, True
+        print(f"已在本地修复{model_name}返回的JSON: {', '.join(steps)}")
+        self._record_json_repair(model_name, {"steps": steps})
+        return json.dumps(result, ensure_ascii=False), None, True
+    
+    def _finish_reask(self, content, reask_content, model_name, json_keys=None, complete_keys=None):
+        """处理重新请求的结果，仍无法解析时返回原响应，由调用处按解析失败处理
+        
+        Args:
+            content (str): 原响应
+            reask_content (str): 重新请求返回的文本
+            model_name (str): 模型名称
+            json_keys (list, optional): 响应预期的顶层字段
+            complete_keys (list, optional): 必须完整的顶层字段
+        
+        Returns:
+            str: 返回给调用处的文本
+        """
+        try:
+            result, steps = self.json_repairer.parse_reask(reask_content, json_keys, source=model_name, complete_keys=complete_keys)
+        except JSONRepairError as e:
+            print(f"重新请求后{model_name}返回的JSON仍无法解析: {str(e)}")
+            self._record_json_repair(model_name, {"reask": False})
+            return content
+        self._record_json_repair(model_name, {"reask": True, "steps": steps})
+        return json.dumps(result, ensure_ascii=False)
+    
+    def _record_json_repair(self, model_name, details):
+        """在会话记录中记录一次JSON修复"""
+        if self.session_manager:
+            self.session_manager.add_intermediate_state("json_repair", dict(details, model=model_name))
+    
+    def _batch_completion(self, prompt, model_name, model_config, temperature, max_tokens, call_info, field_parser=None):
+        """通过批处理收集器完成一次调用，阻塞直到所在批次完成
+        
+        Args:
+            prompt (str): 提示词
+            model_name (str): 模型名称
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            call_info (dict): 调用附加信息
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            str: 生成的文本，失败时返回空字符串
+        """
+        if model_config.get("type") == "anthropic":
+            _, _, _, body = self._build_anthropic_request(prompt, model_config, temperature, max_tokens)
+        else:
+            # 批处理接口不支持流式输出
+            body = self._build_openai_params(prompt, model_config, temperature, max_tokens)
+            body["stream"] = False
+            body.pop("stream_options", None)
+        
+        start_time = time.perf_counter()
+        try:
+            result, batch_id = self.batch_collector.submit(model_name, model_config, body)
+            if model_config.get("type") == "anthropic":
+                content, tokens_used = self._parse_anthropic_response(200, "", lambda: result)
+            else:
+                content = result["choices"][0]["message"]["content"]
+                usage = result.get("usage")
+                tokens_used = {
+                    "prompt": usage.get("prompt_tokens", 0),
+                    "completion": usage.get("completion_tokens", 0),
+                    "total": usage.get("total_tokens", 0),
+                    "cached": self._cached_prompt_tokens(usage)
+                } if usage else None
+        except Exception as e:
+            print(f"调用{model_name}批处理接口时发生错误: {str(e)}")
+            return ""
+        end_time = time.perf_counter()
+        
+        call_info["batch_id"] = batch_id
+        tokens_used, info = self._http_call_info(call_info, tokens_used, body, content, start_time, end_time)
+        if field_parser:
+            field_parser().feed(content)
+        self._record_api_call(body["model"], prompt, content, tokens_used, info)
+        
+        return self._strip_code_fence(content)
+    
+    def _replay_completion(self, prompt, model_config, field_parser=None):
+        """从录制中返回响应，按录制的节奏输出流式片段
+        
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            str: 录制的响应，没有匹配的录制时返回空字符串
+        """
+        model_name = model_config.get("model")
+        record, call_info = self.replay_store.lookup(model_name, prompt)
+        if record is None:
+            print(f"回放记录中没有与本次{model_name}调用匹配的录制")
             return ""
+        
+        parser = field_parser() if field_parser else None
+        if self.event_channel is None:
+            print("\n系统: ", end="", flush=True)
+        self._publish("llm_start", {"model": model_name})
+        start_time = time.perf_counter()
+        first_token_time = None
+        for delay, chunk in self.replay_store.plan(record):
+            if delay:
+                time.sleep(delay)
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            self._emit_chunk(chunk)
+            if parser:
+                parser.feed(chunk)
+        end_time = time.perf_counter()
+        if self.event_channel is None:
+            print()
+        
+        tokens_used, info = self._replay_call_info(record, call_info, start_time, first_token_time, end_time)
+        self._record_api_call(model_name, prompt, record["response"], tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(model_name, tokens_used, info))
+        return self._strip_code_fence(record["response"])
     
-    def _call_openai_api(self, prompt, model_config, temperature, max_tokens):
-        """调用OpenAI兼容API
+    async def _areplay_completion(self, prompt, model_config, field_parser=None):
+        """_replay_completion的asyncio版本，模拟延迟时不阻塞事件循环"""
+        model_name = model_config.get("model")
+        record, call_info = self.replay_store.lookup(model_name, prompt)
+        if record is None:
+            print(f"回放记录中没有与本次{model_name}调用匹配的录制")
+            return ""
+        
+        parser = field_parser() if field_parser else None
+        if self.event_channel is None:
+            print("\n系统: ", end="", flush=True)
+        self._publish("llm_start", {"model": model_name})
+        start_time = time.perf_counter()
+        first_token_time = None
+        for delay, chunk in self.replay_store.plan(record):
+            if delay:
+                await asyncio.sleep(delay)
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            self._emit_chunk(chunk)
+            if parser:
+                parser.feed(chunk)
+        end_time = time.perf_counter()
+        if self.event_channel is None:
+            print()
+        
+        tokens_used, info = self._replay_call_info(record, call_info, start_time, first_token_time, end_time)
+        await asyncio.to_thread(self._record_api_call, model_name, prompt, record["response"], tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(model_name, tokens_used, info))
+        return self._strip_code_fence(record["response"])
+    
+    def _replay_call_info(self, record, call_info, start_time, first_token_time, end_time):
+        """为回放的调用补全用量和耗时信息，用量沿用录制中的值
+        
+        Args:
+            record (dict): 录制
+            call_info (dict): 匹配信息（匹配方式、相似度、录制来源）
+            start_time (float): 开始回放的时间
+            first_token_time (float): 输出第一个片段的时间
+            end_time (float): 回放结束的时间
+        
+        Returns:
+            tuple: (token使用量, 附加信息)
+        """
+        tokens_used = record.get("tokens")
+        if not tokens_used:
+            messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": record["prompt"]}]
+            tokens_used = self._count_tokens(messages, record["response"], record.get("model"))
+        info = self._build_call_info(call_info, tokens_used, "replay", start_time, first_token_time, end_time)
+        return tokens_used, info
+    
+    def _dispatch(self, prompt, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        """根据模型类型选择不同的API调用方式
         
         Args:
             prompt (str): 提示词
             model_config (dict): 模型配置
             temperature (float): 温度参数
             max_tokens (int): 最大生成令牌数
+            call_info (dict): 调用附加信息
+            ticket (HedgeTicket, optional): 对冲竞速凭证
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
         
         Returns:
             str: 生成的文本
         """
-        # 设置自定义的API基础URL和API密钥
-        base_url = model_config.get("base_url")
-        api_key = os.environ.get(model_config.get("api_key_env", "OPENAI_API_KEY"), "")
+        model_type = model_config.get("type", "openai")
+        if model_type == "openai":
+            return self._call_openai_api(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+        elif model_type == "anthropic":
+            return self._call_anthropic_api(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+        elif model_type == "zhipu":
+            return self._call_zhipu_api(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+        else:
+            raise ValueError(f"不支持的模型类型: {model_type}")
+    
+    async def _adispatch(self, prompt, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        """_dispatch的asyncio版本"""
+        model_type = model_config.get("type", "openai")
+        if model_type == "openai":
+            return await self._acall_openai_api(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+        elif model_type == "anthropic":
+            return await self._acall_anthropic_api(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+        elif model_type == "zhipu":
+            return await self._acall_zhipu_api(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+        else:
+            raise ValueError(f"不支持的模型类型: {model_type}")
+    
+    def _complete_once(self, prompt, model_name, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        """在限流器配额内调用一次模型（不重试），成功后记录延迟
+        
+        Args:
+            prompt (str): 提示词
+            model_name (str): 模型名称
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            call_info (dict): 调用附加信息，调用结束后包含实际用量和耗时
+            ticket (HedgeTicket, optional): 对冲竞速凭证
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            str: 生成的文本
+        """
+        # 按模型限流：预估token用量 = 提示词token + 最大生成token，调用结束后按实际用量修正
+        limiter = self.rate_limiters.get(model_name, model_config)
+        estimated_tokens = self.token_counter.count(prompt, model_config.get("model")) + max_tokens
+        slot = None
+        dispatch_start = None
+        try:
+            with limiter.slot(estimated_tokens) as slot:
+                if ticket is not None:
+                    ticket.check()
+                call_info["queue_wait"] = round(slot["queue_wait"], 3)
+                dispatch_start = time.perf_counter()
+                content = self._dispatch(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+                slot["actual_tokens"] = call_info.get("tokens", {}).get("total")
+        except BaseException as e:
+            # 每条退出路径都要结束半开状态下的试探，否则熔断器会一直拒绝该模型
+            if isinstance(e, Exception) and is_retryable_error(e):
+                limiter.record_failure()
+            elif slot is not None and slot["probe"]:
+                limiter.cancel_probe()
+            if isinstance(e, HedgeCancelled):
+                self._record_hedge_loss(model_name, ticket, dispatch_start)
+            raise
+        limiter.record_success()
+        self.latency_tracker.record(model_name, call_info)
+        return content
+    
+    async def _acomplete_once(self, prompt, model_name, model_config, temperature, max_tokens, call_info, ticket=None, field_parser=None):
+        """_complete_once的asyncio版本，等待配额期间不阻塞事件循环"""
+        limiter = self.rate_limiters.get(model_name, model_config)
+        estimated_tokens = self.token_counter.count(prompt, model_config.get("model")) + max_tokens
+        slot = None
+        dispatch_start = None
+        try:
+            async with limiter.aslot(estimated_tokens) as slot:
+                if ticket is not None:
+                    ticket.check()
+                call_info["queue_wait"] = round(slot["queue_wait"], 3)
+                dispatch_start = time.perf_counter()
+                content = await self._adispatch(prompt, model_config, temperature, max_tokens, call_info, ticket, field_parser)
+                slot["actual_tokens"] = call_info.get("tokens", {}).get("total")
+        except BaseException as e:
+            # 每条退出路径都要结束半开状态下的试探，否则熔断器会一直拒绝该模型
+            if isinstance(e, Exception) and is_retryable_error(e):
+                limiter.record_failure()
+            elif slot is not None and slot["probe"]:
+                limiter.cancel_probe()
+            if isinstance(e, (HedgeCancelled, asyncio.CancelledError)):
+                self._record_hedge_loss(model_name, ticket, dispatch_start)
+            raise
+        limiter.record_success()
+        self.latency_tracker.record(model_name, call_info)
+        return content
+    
+    def _record_hedge_loss(self, model_name, ticket, dispatch_start):
+        """对冲中落败的请求把已等待的时间记为首token时间的删失样本，避免延迟统计只包含获胜方
+        
+        Args:
+            model_name (str): 模型名称
+            ticket (HedgeTicket): 竞速凭证，不是对冲中落败的请求时不记录
+            dispatch_start (float): 发出请求的时间，还在排队时为None
+        """
+        if ticket is None or dispatch_start is None or not ticket.lost():
+            return
+        self.latency_tracker.record_cancelled(model_name, time.perf_counter() - dispatch_start)
+    
+    def _pick_hedge_model(self, model_name):
+        """选择对冲用的备用模型
         
-        # 创建新的客户端实例（如果需要）
-        if base_url and base_url != "https://api.openai.com/v1" or api_key != os.environ.get("OPENAI_API_KEY", ""):
-            client = openai.OpenAI(
-                api_key=api_key,
-                base_url=base_url
+        优先使用HEDGE_SETTINGS中配置的备用模型；否则在已配置API密钥的其他模型中，
+        优先选择不同端点、首token中位时间最短的模型。熔断中的模型不参与对冲。
+        
+        Args:
+            model_name (str): 主模型名称
+        
+        Returns:
+            str: 备用模型名称，没有可用模型时返回None
+        """
+        configured = HEDGE_SETTINGS["secondary_models"].get(model_name)
+        candidates = [configured] if configured else [name for name in AVAILABLE_MODELS if name != model_name]
+        primary_base_url = AVAILABLE_MODELS[model_name].get("base_url")
+        
+        ranked = []
+        for order, name in enumerate(candidates):
+            model_config = AVAILABLE_MODELS.get(name)
+            if not model_config or name == model_name:
+                continue
+            if model_config.get("api_key_env") not in os.environ:
+                continue
+            if not self.rate_limiters.get(name, model_config).is_available():
+                continue
+            median_ttft, _ = self.latency_tracker.percentile(name, 'ttft', 50)
+            ranked.append((
+                model_config.get("base_url") == primary_base_url,
+                median_ttft if median_ttft is not None else float('inf'),
+                order,
+                name
+            ))
+        return min(ranked)[-1] if ranked else None
+    
+    def _hedged_completion(self, prompt, model_name, hedge_model, temperature, max_tokens, call_info, field_parser=None):
+        """对冲请求：先请求主模型，超过阈值仍无首token时再请求备用模型，先返回首token的一方获胜，另一方被取消
+        
+        Args:
+            prompt (str): 提示词
+            model_name (str): 主模型名称
+            hedge_model (str): 备用模型名称
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            call_info (dict): 调用附加信息，结束后更新为获胜方的信息
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            tuple: (生成的文本, 获胜的模型名称)
+        """
+        race = HedgeRace()
+        infos = {model_name: dict(call_info), hedge_model: dict(call_info)}
+        futures = {}
+        
+        def run(name):
+            return self._complete_once(
+                prompt, name, self._get_model_config(name), temperature, max_tokens,
+                infos[name], race.ticket(name), field_parser
             )
-        else:
-            client = self.openai_client
         
-        # 添加重试逻辑
-        max_retries = 3
-        retry_delay = 2
+        def submit(name):
+            # 在future标记为完成之后才唤醒等待方，等待方检查时一定能看到结束状态
+            futures[name] = executor.submit(run, name)
+            futures[name].add_done_callback(lambda future: race.notify())
         
+        # 每次对冲使用独立的线程，落败方的流式响应在竞速结束时被关闭
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            submit(model_name)
+            delay = self.latency_tracker.hedge_delay(model_name)
+            race.changed.wait(delay)
+            if race.winner is None and not futures[model_name].done():
+                print(f"{model_name}在{delay:.1f}秒内未返回首token，同时请求{hedge_model}")
+                infos[model_name]["hedged"] = True
+                infos[hedge_model].update({"hedged": True, "hedge_for": model_name})
+                submit(hedge_model)
+        finally:
+            executor.shutdown(wait=False)
+        
+        while True:
+            # 有一方输出了首token，等待它完成
+            if race.winner is not None:
+                winner = race.winner
+                content = futures[winner].result()
+                call_info.update(infos[winner])
+                return content, winner
+            race.changed.clear()
+            # 没有输出任何片段就结束的调用（如空响应）也可以获胜
+            for name, future in futures.items():
+                if future.done() and future.exception() is None and race.claim(name):
+                    break
+            else:
+                if all(future.done() for future in futures.values()):
+                    break
+                race.changed.wait()
+        
+        # 全部失败，抛出主模型的异常，交给重试逻辑处理
+        raise futures[model_name].exception()
+    
+    async def _ahedged_completion(self, prompt, model_name, hedge_model, temperature, max_tokens, call_info, field_parser=None):
+        """_hedged_completion的asyncio版本，落败方的任务被直接取消并关闭连接"""
+        race = HedgeRace(asyncio.Event())
+        infos = {model_name: dict(call_info), hedge_model: dict(call_info)}
+        tasks = {}
+        
+        async def run(name):
+            try:
+                return await self._acomplete_once(
+                    prompt, name, self._get_model_config(name), temperature, max_tokens,
+                    infos[name], race.ticket(name), field_parser
+                )
+            finally:
+                race.notify()
+        
+        def spawn(name):
+            # 落败方的异常不再被读取，提前消费以免事件循环报警
+            task = asyncio.create_task(run(name))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            tasks[name] = task
+        
+        spawn(model_name)
+        delay = self.latency_tracker.hedge_delay(model_name)
+        try:
+            await asyncio.wait_for(race.async_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        if race.winner is None and not tasks[model_name].done():
+            print(f"{model_name}在{delay:.1f}秒内未返回首token，同时请求{hedge_model}")
+            infos[model_name]["hedged"] = True
+            infos[hedge_model].update({"hedged": True, "hedge_for": model_name})
+            spawn(hedge_model)
+        
+        try:
+            while True:
+                if race.winner is not None:
+                    winner = race.winner
+                    for name, task in tasks.items():
+                        if name != winner:
+                            task.cancel()
+                    content = await tasks[winner]
+                    call_info.update(infos[winner])
+                    return content, winner
+                race.async_event.clear()
+                for name, task in tasks.items():
+                    if task.done() and task.exception() is None and race.claim(name):
+                        break
+                else:
+                    if all(task.done() for task in tasks.values()):
+                        break
+                    await race.async_event.wait()
+        except asyncio.CancelledError:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        
+        # 全部失败，抛出主模型的异常，交给重试逻辑处理
+        raise tasks[model_name].exception()
+    
+    def _cache_key(self, model_config, temperature, max_tokens, prompt):
+        """计算响应缓存键，覆盖所有会影响输出的参数
+        
+        Args:
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            prompt (str): 提示词
+        
+        Returns:
+            str: 缓存键
+        """
+        # Anthropic接口不发送系统消息
+        return self.response_cache.make_key(
+            model_config.get("model"), temperature, max_tokens, SYSTEM_PROMPT, prompt
+        )
+    
+    def _record_cache_hit(self, model_config, prompt, content, cache_tier):
+        """记录一次缓存命中，命中时不消耗token
+        
+        Args:
+            model_config (dict): 模型配置
+            prompt (str): 提示词
+            content (str): 缓存的响应
+            cache_tier (str): 命中的缓存层级（memory/disk）
+        """
+        tokens_used = {"prompt": 0, "completion": 0, "total": 0}
+        self._record_api_call(
+            model_config.get("model"), prompt, content, tokens_used,
+            {"cache": "hit", "cache_tier": cache_tier}
+        )
+    
+    def _build_openai_params(self, prompt, model_config, temperature, max_tokens):
+        """构建OpenAI兼容API的调用参数
+        
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+        
+        Returns:
+            dict: API调用参数
+        """
         # 导入配置参数，用于控制是否强制输出JSON格式
         from config import FORCE_JSON_OUTPUT, RESPONSE_FORMAT
         
-        for attempt in range(max_retries):
-            try:
-                # 创建API调用参数
-                api_params = {
-                    "model": model_config.get("model", "gpt-3.5-turbo"),
-                    "messages": [
-                        {"role": "system", "content": "你是一个专业的建筑设计师助手，帮助用户设计建筑布局。你的回答应该基于专业知识，并考虑用户的个性化需求。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                    "stream": True  # 启用流式输出
-                }
-                
-                # 如果需要强制输出JSON格式
-                # if FORCE_JSON_OUTPUT:
-                #     api_params["response_format"] = {"type": RESPONSE_FORMAT}
-                #     # 注意：启用流式输出时，JSON格式可能需要特殊处理
-                #     api_params["stream"] = False  # JSON格式时禁用流式输出
+        api_params = {
+            "model": model_config.get("model", "gpt-3.5-turbo"),
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True  # 启用流式输出
+        }
+        
+        # 请求在流式响应的最后一块中返回实际token用量，不支持该参数的兼容接口可在模型配置中关闭
+        if api_params["stream"] and model_config.get("stream_usage", True):
+            api_params["stream_options"] = {"include_usage": True}
+        
+        # 如果需要强制输出JSON格式
+        # if FORCE_JSON_OUTPUT:
+        #     api_params["response_format"] = {"type": RESPONSE_FORMAT}
+        #     # 注意：启用流式输出时，JSON格式可能需要特殊处理
+        #     api_params["stream"] = False  # JSON格式时禁用流式输出
+        
+        return api_params
+    
+    def _count_tokens(self, messages, content, model_name):
+        """提供商未返回用量时，使用本地分词器统计token数量
+        
+        Args:
+            messages (list): 发送的消息列表
+            content (str): 生成的文本
+            model_name (str): 模型名称
+        
+        Returns:
+            dict: token使用量
+        """
+        prompt_tokens = self.token_counter.count_messages(messages, model_name)
+        completion_tokens = self.token_counter.count(content, model_name)
+        return {
+            "prompt": prompt_tokens,
+            "completion": completion_tokens,
+            "total": prompt_tokens + completion_tokens
+        }
+    
+    def _openai_usage(self, usage, messages, content, model_name):
+        """从OpenAI兼容接口返回的用量对象中提取token使用量，缺失时在本地统计
+        
+        Args:
+            usage: 接口返回的usage对象，可能为None
+            messages (list): 发送的消息列表
+            content (str): 生成的文本
+            model_name (str): 模型名称
+        
+        Returns:
+            tuple: (token使用量, 用量来源)
+        """
+        if usage is not None and getattr(usage, "total_tokens", None):
+            return {
+                "prompt": usage.prompt_tokens,
+                "completion": usage.completion_tokens,
+                "total": usage.total_tokens,
+                "cached": self._cached_prompt_tokens(usage)
+            }, "provider"
+        return self._count_tokens(messages, content, model_name), "tokenizer"
+    
+    def _cached_prompt_tokens(self, usage):
+        """提取提示词中命中提供商前缀缓存的token数
+        
+        OpenAI和智谱在prompt_tokens_details.cached_tokens中返回，DeepSeek在prompt_cache_hit_tokens中返回
+        
+        Args:
+            usage: 接口返回的usage对象或字典
+        
+        Returns:
+            int: 命中缓存的提示词token数，未返回时为0
+        """
+        def field(obj, name):
+            return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+        
+        details = field(usage, "prompt_tokens_details")
+        cached = field(details, "cached_tokens") if details is not None else None
+        if cached is None:
+            cached = field(usage, "prompt_cache_hit_tokens")
+        return cached or 0
+    
+    def _build_call_info(self, call_info, tokens_used, usage_source, start_time, first_token_time, end_time):
+        """汇总一次调用的用量来源和耗时指标
+        
+        Args:
+            call_info (dict): 调用方传入的附加信息，会被原地更新以便调用方读取实际用量
+            tokens_used (dict): token使用量
+            usage_source (str): 用量来源，provider表示提供商返回，tokenizer表示本地统计
+            start_time (float): 发起请求的时间
+            first_token_time (float): 收到第一个token的时间，非流式调用为收到完整响应的时间
+            end_time (float): 收到完整响应的时间
+        
+        Returns:
+            dict: 附加信息，包含延迟、首token时间和生成速度
+        """
+        info = call_info if call_info is not None else {}
+        latency = end_time - start_time
+        first_token_time = first_token_time or end_time
+        # 生成速度按首token之后的解码时间计算，非流式调用只能按总耗时计算
+        decode_time = end_time - first_token_time if end_time > first_token_time else latency
+        info.update({
+            "tokens": tokens_used,
+            "usage_source": usage_source,
+            "latency": round(latency, 3),
+            "ttft": round(first_token_time - start_time, 3),
+            "tokens_per_sec": round(tokens_used["completion"] / decode_time, 2) if decode_time > 0 else None
+        })
+        return info
+    
+    def _llm_end_data(self, model_name, tokens_used, info):
+        """构建llm_end事件的数据
+        
+        Args:
+            model_name (str): 模型名称
+            tokens_used (dict): token使用量
+            info (dict): 调用附加信息
+        
+        Returns:
+            dict: 事件数据
+        """
+        return {
+            "model": model_name,
+            "tokens": tokens_used,
+            "ttft": info.get("ttft"),
+            "tokens_per_sec": info.get("tokens_per_sec")
+        }
+    
+    def _http_call_info(self, call_info, tokens_used, data, content, start_time, end_time):
+        """为非流式接口（Anthropic、智谱、批处理）补全用量和耗时信息
+        
+        Args:
+            call_info (dict): 调用方传入的附加信息
+            tokens_used (dict): 接口返回的token使用量，可能为None
+            data (dict): 请求体
+            content (str): 生成的文本
+            start_time (float): 发起请求的时间
+            end_time (float): 收到完整响应的时间
+        
+        Returns:
+            tuple: (token使用量, 附加信息)
+        """
+        usage_source = "provider"
+        if not tokens_used:
+            messages = data["messages"]
+            if data.get("system"):
+                messages = [{"role": "system", "content": data["system"]}] + messages
+            tokens_used = self._count_tokens(messages, content, data["model"])
+            usage_source = "tokenizer"
+        info = self._build_call_info(call_info, tokens_used, usage_source, start_time, None, end_time)
+        return tokens_used, info
+    
+    def _strip_code_fence(self, content):
+        """清理响应中可能存在的Markdown代码块标记
+        
+        Args:
+            content (str): 模型返回的文本
+        
+        Returns:
+            str: 去除代码块标记后的文本
+        """
+        if content.startswith('```'):
+            # 查找第一个代码块的结束位置
+            first_block_end = content.find('```', 3)
+            if first_block_end != -1:
+                # 提取代码块内容（去除语言标识符）
+                lang_end = content.find('\n', 3)
+                if lang_end != -1 and lang_end < first_block_end:
+                    content = content[lang_end+1:first_block_end].strip()
+                else:
+                    content = content[3:first_block_end].strip()
+        return content
+    
+    def _call_openai_api(self, prompt, model_config, temperature, max_tokens, call_info=None, ticket=None, field_parser=None):
+        """调用OpenAI兼容API
+        
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            call_info (dict, optional): 随调用记录一起保存的附加信息
+            ticket (HedgeTicket, optional): 对冲竞速凭证，其他模型抢先输出时中止本次调用
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            str: 生成的文本
+        """
+        # 设置自定义的API基础URL和API密钥
+        base_url = model_config.get("base_url", "https://api.openai.com/v1")
+        api_key = os.environ.get(model_config.get("api_key_env", "OPENAI_API_KEY"), "")
+        
+        # 从连接池获取共享客户端，复用已建立的连接
+        client, pool_key = self.client_pool.get_openai_client(base_url, api_key)
+        
+        # 创建API调用参数
+        api_params = self._build_openai_params(prompt, model_config, temperature, max_tokens)
+        
+        model_name = model_config.get("model", "gpt-3.5-turbo")
+        usage = None
+        start_time = time.perf_counter()
+        first_token_time = None
+        
+        # 根据是否启用流式输出选择不同的处理方式
+        if api_params.get("stream", False):
+            # 流式输出处理
+            content_chunks = []
+            parser = field_parser() if field_parser else None
+            if self.event_channel is None:
+                print("\n系统: ", end="", flush=True)  # 开始输出标记
+            self._publish("llm_start", {"model": model_name})
+            
+            with self.client_pool.track(pool_key):
+                # 创建流式响应
+                stream_resp = client.chat.completions.create(**api_params)
+                # 对冲竞速：其他模型获胜时立即关闭连接，不必等到下一个片段
+                if ticket is not None:
+                    ticket.on_lost(stream_resp.close)
                 
-                # 根据是否启用流式输出选择不同的处理方式
-                if api_params.get("stream", False):
-                    # 流式输出处理
-                    full_content = ""
-                    print("\n系统: ", end="", flush=True)  # 开始输出标记
-                    
-                    # 创建流式响应
-                    stream_resp = client.chat.completions.create(**api_params)
-                    
-                    # 逐块处理并输出响应
+                # 逐块处理并输出响应
+                try:
                     for chunk in stream_resp:
                         if chunk.choices and len(chunk.choices) > 0:
                             delta = chunk.choices[0].delta
                             if hasattr(delta, 'content') and delta.content:
+                                if first_token_time is None:
+                                    first_token_time = time.perf_counter()
+                                    # 对冲竞速：首token决定胜负，落败方在此中止
+                                    if ticket is not None:
+                                        ticket.claim()
                                 content_chunk = delta.content
-                                print(content_chunk, end="", flush=True)  # 实时输出到终端
-                                full_content += content_chunk
-                    
-                    print()  # 输出完成后换行
-                    content = full_content
-                else:
-                    # 非流式输出处理
-                    response = client.chat.completions.create(**api_params)
-                    content = response.choices[0].message.content
-                
-                # 计算token使用量（流式输出时可能需要额外处理）
-                if not api_params.get("stream", False):
-                    tokens_used = {
-                        "prompt": response.usage.prompt_tokens,
-                        "completion": response.usage.completion_tokens,
-                        "total": response.usage.total_tokens
-                    }
-                else:
-                    # 流式输出时无法直接获取token使用量，使用估算值
-                    # 这里使用简单估算，实际项目中可能需要更精确的计算方法
-                    tokens_used = {
-                        "prompt": len(prompt) // 4,  # 粗略估算
-                        "completion": len(content) // 4,  # 粗略估算
-                        "total": (len(prompt) + len(content)) // 4  # 粗略估算
-                    }
-                
-                # 记录API调用信息
-                model_name = model_config.get("model", "gpt-3.5-turbo")
-                self._record_api_call(model_name, prompt, content, tokens_used)
-                
-                # 清理响应中可能存在的Markdown代码块标记
-                if content.startswith('```'):
-                    # 查找第一个代码块的结束位置
-                    first_block_end = content.find('```', 3)
-                    if first_block_end != -1:
-                        # 提取代码块内容（去除语言标识符）
-                        lang_end = content.find('\n', 3)
-                        if lang_end != -1 and lang_end < first_block_end:
-                            content = content[lang_end+1:first_block_end].strip()
-                        else:
-                            content = content[3:first_block_end].strip()
-                
-                return content
-                
-            except Exception as e:
-                if "rate_limit" in str(e).lower() and attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)  # 指数退避
-                    print(f"达到API速率限制，等待{wait_time}秒后重试...")
-                    time.sleep(wait_time)
-                    continue
-                raise  # 重新抛出其他类型的异常
-    
-    def _call_anthropic_api(self, prompt, model_config, temperature, max_tokens):
-        """调用Anthropic API
+                                self._emit_chunk(content_chunk)  # 实时输出到终端或事件频道
+                                content_chunks.append(content_chunk)
+                                # 关注的字段一旦完整立即发布，不必等待整个响应
+                                if parser:
+                                    parser.feed(content_chunk)
+                        # 启用include_usage后，最后一块不含choices，只携带用量
+                        if getattr(chunk, 'usage', None):
+                            usage = chunk.usage
+                except Exception as e:
+                    # 连接被竞速关闭导致的读取错误按落败处理，不计入熔断器
+                    if ticket is not None and ticket.lost() and not isinstance(e, HedgeCancelled):
+                        raise HedgeCancelled(f"{ticket.label}的请求已被{ticket.race.winner}抢先，取消") from e
+                    raise
+                # 连接被关闭时迭代也可能正常结束，落败方不能返回不完整的响应
+                if ticket is not None:
+                    ticket.check()
+            
+            if self.event_channel is None:
+                print()  # 输出完成后换行
+            content = "".join(content_chunks)
+        else:
+            # 非流式输出处理
+            with self.client_pool.track(pool_key):
+                response = client.chat.completions.create(**api_params)
+            content = response.choices[0].message.content
+            usage = response.usage
+            if field_parser:
+                field_parser().feed(content)
+        end_time = time.perf_counter()
+        
+        tokens_used, usage_source = self._openai_usage(usage, api_params["messages"], content, model_name)
+        info = self._build_call_info(call_info, tokens_used, usage_source, start_time, first_token_time, end_time)
+        
+        # 记录API调用信息
+        self._record_api_call(model_name, prompt, content, tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(model_name, tokens_used, info))
+        
+        return self._strip_code_fence(content)
+    
+    async def _acall_openai_api(self, prompt, model_config, temperature, max_tokens, call_info=None, ticket=None, field_parser=None):
+        """异步调用OpenAI兼容API（AsyncOpenAI）
         
         Args:
             prompt (str): 提示词
             model_config (dict): 模型配置
             temperature (float): 温度参数
             max_tokens (int): 最大生成令牌数
+            call_info (dict, optional): 随调用记录一起保存的附加信息
+            ticket (HedgeTicket, optional): 对冲竞速凭证，其他模型抢先输出时中止本次调用
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
         
         Returns:
             str: 生成的文本
         """
+        base_url = model_config.get("base_url", "https://api.openai.com/v1")
+        api_key = os.environ.get(model_config.get("api_key_env", "OPENAI_API_KEY"), "")
+        
+        # 从连接池获取当前事件循环下的共享异步客户端
+        client, pool_key = self.client_pool.get_async_openai_client(base_url, api_key)
+        
+        api_params = self._build_openai_params(prompt, model_config, temperature, max_tokens)
+        
+        model_name = model_config.get("model", "gpt-3.5-turbo")
+        usage = None
+        start_time = time.perf_counter()
+        first_token_time = None
+        
+        if api_params.get("stream", False):
+            # 流式输出处理
+            content_chunks = []
+            parser = field_parser() if field_parser else None
+            if self.event_channel is None:
+                print("\n系统: ", end="", flush=True)  # 开始输出标记
+            self._publish("llm_start", {"model": model_name})
+            with self.client_pool.track(pool_key):
+                stream_resp = await client.chat.completions.create(**api_params)
+                async for chunk in stream_resp:
+                    if chunk.choices and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if hasattr(delta, 'content') and delta.content:
+                            if first_token_time is None:
+                                first_token_time = time.perf_counter()
+                                # 对冲竞速：首token决定胜负，落败方在此中止
+                                if ticket is not None:
+                                    ticket.claim()
+                            self._emit_chunk(delta.content)  # 实时输出到终端或事件频道
+                            content_chunks.append(delta.content)
+                            if parser:
+                                parser.feed(delta.content)
+                    # 启用include_usage后，最后一块不含choices，只携带用量
+                    if getattr(chunk, 'usage', None):
+                        usage = chunk.usage
+            if self.event_channel is None:
+                print()  # 输出完成后换行
+            content = "".join(content_chunks)
+        else:
+            # 非流式输出处理
+            with self.client_pool.track(pool_key):
+                response = await client.chat.completions.create(**api_params)
+            content = response.choices[0].message.content
+            usage = response.usage
+            if field_parser:
+                field_parser().feed(content)
+        end_time = time.perf_counter()
+        
+        tokens_used, usage_source = self._openai_usage(usage, api_params["messages"], content, model_name)
+        info = self._build_call_info(call_info, tokens_used, usage_source, start_time, first_token_time, end_time)
+        
+        # 记录API调用信息（会话记录涉及磁盘写入，放到工作线程中执行）
+        await asyncio.to_thread(self._record_api_call, model_name, prompt, content, tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(model_name, tokens_used, info))
+        
+        return self._strip_code_fence(content)
+    
+    def _build_anthropic_request(self, prompt, model_config, temperature, max_tokens):
+        """构建Anthropic API请求
+        
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+        
+        Returns:
+            tuple: (请求地址, API密钥, 请求头, 请求体)
+        """
         api_key = os.environ.get(model_config.get("api_key_env", "ANTHROPIC_API_KEY"))
         model = model_config.get("model", "claude-instant-1.2")
         api_version = model_config.get("api_version", "2023-06-01")
+        base_url = model_config.get("base_url", "https://api.anthropic.com/v1/messages")
         
         headers = {
             "x-api-key": api_key,
@@ -281,36 +1327,170 @@ class OpenAIClient:
         
         data = {
             "model": model,
+            "system": SYSTEM_PROMPT,
             "messages": [
-                {"role": "user", "content": prompt}
+                {"role": "user", "content": self._anthropic_content(prompt)}
             ],
             "max_tokens": max_tokens,
             "temperature": temperature
         }
         
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data
-        )
+        return base_url, api_key, headers, data
+    
+    def _anthropic_content(self, prompt):
+        """构建Anthropic用户消息内容，在提示词的固定前缀末尾标记cache_control
+        
+        固定前缀（连同系统消息）会被Anthropic缓存，之后相同前缀的请求按缓存价格计费且首token更快；
+        提示词中没有缓存边界或未启用提示词缓存时直接发送文本
         
-        if response.status_code == 200:
-            return response.json()["content"][0]["text"]
+        Args:
+            prompt (str): 提示词
+        
+        Returns:
+            str or list: 消息内容
+        """
+        boundary = prompt.find(PROMPT_CACHE_BOUNDARY)
+        if not PROMPT_CACHE_ENABLED or boundary == -1:
+            return prompt
+        split = boundary + len(PROMPT_CACHE_BOUNDARY)
+        return [
+            {"type": "text", "text": prompt[:split], "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": prompt[split:]}
+        ]
+    
+    def _parse_anthropic_response(self, status_code, body_text, body_json):
+        """解析Anthropic API响应
+        
+        Args:
+            status_code (int): HTTP状态码
+            body_text (str): 响应文本
+            body_json (callable): 获取响应JSON的函数
+        
+        Returns:
+            tuple: (生成的文本, token使用量)，响应中没有用量时token使用量为None
+        """
+        if status_code == 200:
+            result = body_json()
+            usage = result.get("usage")
+            tokens_used = None
+            if usage:
+                # input_tokens不含缓存读写的部分，提示词总量需要加上缓存读取和写入的token
+                cache_read = usage.get("cache_read_input_tokens") or 0
+                cache_write = usage.get("cache_creation_input_tokens") or 0
+                prompt_tokens = usage.get("input_tokens", 0) + cache_read + cache_write
+                tokens_used = {
+                    "prompt": prompt_tokens,
+                    "completion": usage.get("output_tokens", 0),
+                    "total": prompt_tokens + usage.get("output_tokens", 0),
+                    "cached": cache_read,
+                    "cache_write": cache_write
+                }
+            return result["content"][0]["text"], tokens_used
         else:
-            raise Exception(f"Anthropic API错误: {response.status_code}, {response.text}")
-
-    def _call_zhipu_api(self, prompt, model_config, temperature, max_tokens):
-        """调用智谱AI API
+            raise Exception(f"Anthropic API错误: {status_code}, {body_text}")
+    
+    def _call_anthropic_api(self, prompt, model_config, temperature, max_tokens, call_info=None, ticket=None, field_parser=None):
+        """调用Anthropic API
+        
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            call_info (dict, optional): 随调用记录一起保存的附加信息
+            ticket (HedgeTicket, optional): 对冲竞速凭证，其他模型抢先输出时中止本次调用
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            str: 生成的文本
+        """
+        base_url, api_key, headers, data = self._build_anthropic_request(prompt, model_config, temperature, max_tokens)
+        
+        # 从连接池获取共享会话，复用keep-alive连接
+        session, pool_key = self.client_pool.get_http_session("anthropic", base_url, api_key)
+        start_time = time.perf_counter()
+        with self.client_pool.track(pool_key):
+            response = session.post(
+                base_url,
+                headers=headers,
+                json=data,
+                timeout=self.client_pool.settings["timeout"]
+            )
+        end_time = time.perf_counter()
+        
+        content, tokens_used = self._parse_anthropic_response(response.status_code, response.text, response.json)
+        tokens_used, info = self._http_call_info(call_info, tokens_used, data, content, start_time, end_time)
+        
+        # 对冲竞速：非流式接口以完整响应作为首token
+        if ticket is not None:
+            ticket.claim()
+        if field_parser:
+            field_parser().feed(content)
+        
+        # 非流式接口一次性输出完整内容
+        self._publish("llm_start", {"model": data["model"]})
+        self._publish("token", {"text": content})
+        
+        # 记录API调用信息
+        self._record_api_call(data["model"], prompt, content, tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(data["model"], tokens_used, info))
+        
+        return content
+    
+    async def _acall_anthropic_api(self, prompt, model_config, temperature, max_tokens, call_info=None, ticket=None, field_parser=None):
+        """异步调用Anthropic API（httpx.AsyncClient）
         
         Args:
             prompt (str): 提示词
             model_config (dict): 模型配置
             temperature (float): 温度参数
             max_tokens (int): 最大生成令牌数
+            call_info (dict, optional): 随调用记录一起保存的附加信息
+            ticket (HedgeTicket, optional): 对冲竞速凭证，其他模型抢先输出时中止本次调用
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
         
         Returns:
             str: 生成的文本
         """
+        base_url, api_key, headers, data = self._build_anthropic_request(prompt, model_config, temperature, max_tokens)
+        
+        client, pool_key = self.client_pool.get_async_http_client("anthropic", base_url, api_key)
+        start_time = time.perf_counter()
+        with self.client_pool.track(pool_key):
+            response = await client.post(base_url, headers=headers, json=data)
+        end_time = time.perf_counter()
+        
+        content, tokens_used = self._parse_anthropic_response(response.status_code, response.text, response.json)
+        tokens_used, info = self._http_call_info(call_info, tokens_used, data, content, start_time, end_time)
+        
+        # 对冲竞速：非流式接口以完整响应作为首token
+        if ticket is not None:
+            ticket.claim()
+        if field_parser:
+            field_parser().feed(content)
+        
+        # 非流式接口一次性输出完整内容
+        self._publish("llm_start", {"model": data["model"]})
+        self._publish("token", {"text": content})
+        
+        # 记录API调用信息（会话记录写文件，放到工作线程中执行）
+        await asyncio.to_thread(self._record_api_call, data["model"], prompt, content, tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(data["model"], tokens_used, info))
+        
+        return content
+    
+    def _build_zhipu_request(self, prompt, model_config, temperature, max_tokens):
+        """构建智谱AI API请求
+        
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+        
+        Returns:
+            tuple: (请求地址, API密钥, 请求头, 请求体)
+        """
         api_key = os.environ.get(model_config.get("api_key_env", "ZHIPU_API_KEY"))
         model = model_config.get("model", "glm-4")
         base_url = model_config.get("base_url", "https://open.bigmodel.cn/api/paas/v4/chat/completions")
@@ -323,21 +1503,131 @@ class OpenAIClient:
         data = {
             "model": model,
             "messages": [
-                {"role": "system", "content": "你是一个专业的建筑设计师助手，帮助用户设计建筑布局。你的回答应该基于专业知识，并考虑用户的个性化需求。"},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
             "temperature": temperature,
             "max_tokens": max_tokens
         }
         
-        response = requests.post(base_url, headers=headers, json=data)
+        return base_url, api_key, headers, data
+    
+    def _parse_zhipu_response(self, status_code, body_text, body_json):
+        """解析智谱AI API响应
+        
+        Args:
+            status_code (int): HTTP状态码
+            body_text (str): 响应文本
+            body_json (callable): 获取响应JSON的函数
         
-        if response.status_code == 200:
-            result = response.json()
+        Returns:
+            tuple: (生成的文本, token使用量)，响应中没有用量时token使用量为None
+        """
+        if status_code == 200:
+            result = body_json()
             if "choices" in result and len(result["choices"]) > 0:
-                return result["choices"][0]["message"]["content"]
+                usage = result.get("usage")
+                tokens_used = None
+                if usage:
+                    tokens_used = {
+                        "prompt": usage.get("prompt_tokens", 0),
+                        "completion": usage.get("completion_tokens", 0),
+                        "total": usage.get("total_tokens", 0),
+                        "cached": self._cached_prompt_tokens(usage)
+                    }
+                return result["choices"][0]["message"]["content"], tokens_used
             else:
                 raise Exception(f"智谱AI API返回错误: {result}")
         else:
-            raise Exception(f"智谱AI API错误: {response.status_code}, {response.text}")
+            raise Exception(f"智谱AI API错误: {status_code}, {body_text}")
+    
+    def _call_zhipu_api(self, prompt, model_config, temperature, max_tokens, call_info=None, ticket=None, field_parser=None):
+        """调用智谱AI API
         
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            call_info (dict, optional): 随调用记录一起保存的附加信息
+            ticket (HedgeTicket, optional): 对冲竞速凭证，其他模型抢先输出时中止本次调用
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            str: 生成的文本
+        """
+        base_url, api_key, headers, data = self._build_zhipu_request(prompt, model_config, temperature, max_tokens)
+        
+        # 从连接池获取共享会话，复用keep-alive连接
+        session, pool_key = self.client_pool.get_http_session("zhipu", base_url, api_key)
+        start_time = time.perf_counter()
+        with self.client_pool.track(pool_key):
+            response = session.post(
+                base_url,
+                headers=headers,
+                json=data,
+                timeout=self.client_pool.settings["timeout"]
+            )
+        end_time = time.perf_counter()
+        
+        content, tokens_used = self._parse_zhipu_response(response.status_code, response.text, response.json)
+        tokens_used, info = self._http_call_info(call_info, tokens_used, data, content, start_time, end_time)
+        
+        # 对冲竞速：非流式接口以完整响应作为首token
+        if ticket is not None:
+            ticket.claim()
+        if field_parser:
+            field_parser().feed(content)
+        
+        # 非流式接口一次性输出完整内容
+        self._publish("llm_start", {"model": data["model"]})
+        self._publish("token", {"text": content})
+        
+        # 记录API调用信息
+        self._record_api_call(data["model"], prompt, content, tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(data["model"], tokens_used, info))
+        
+        return content
+    
+    async def _acall_zhipu_api(self, prompt, model_config, temperature, max_tokens, call_info=None, ticket=None, field_parser=None):
+        """异步调用智谱AI API（httpx.AsyncClient）
+        
+        Args:
+            prompt (str): 提示词
+            model_config (dict): 模型配置
+            temperature (float): 温度参数
+            max_tokens (int): 最大生成令牌数
+            call_info (dict, optional): 随调用记录一起保存的附加信息
+            ticket (HedgeTicket, optional): 对冲竞速凭证，其他模型抢先输出时中止本次调用
+            field_parser (callable, optional): 创建增量JSON解析器的工厂函数
+        
+        Returns:
+            str: 生成的文本
+        """
+        base_url, api_key, headers, data = self._build_zhipu_request(prompt, model_config, temperature, max_tokens)
+        
+        client, pool_key = self.client_pool.get_async_http_client("zhipu", base_url, api_key)
+        start_time = time.perf_counter()
+        with self.client_pool.track(pool_key):
+            response = await client.post(base_url, headers=headers, json=data)
+        end_time = time.perf_counter()
+        
+        content, tokens_used = self._parse_zhipu_response(response.status_code, response.text, response.json)
+        tokens_used, info = self._http_call_info(call_info, tokens_used, data, content, start_time, end_time)
+        
+        # 对冲竞速：非流式接口以完整响应作为首token
+        if ticket is not None:
+            ticket.claim()
+        if field_parser:
+            field_parser().feed(content)
+        
+        # 非流式接口一次性输出完整内容
+        self._publish("llm_start", {"model": data["model"]})
+        self._publish("token", {"text": content})
+        
+        # 记录API调用信息（会话记录写文件，放到工作线程中执行）
+        await asyncio.to_thread(self._record_api_call, data["model"], prompt, content, tokens_used, info)
+        self._publish("llm_end", self._llm_end_data(data["model"], tokens_used, info))
+        
+        return content
+
@@ -0,0 +1,256 @@
+"""
+提示词和模板资源注册表：每个进程只读取一次模板文件，并把提示词中固定的部分预先填入，
+每次调用只需拼接变化的字段，不再读文件或重复格式化整个提示词；文件修改后按修改时间自动重新加载
+"""
+import os
+import sys
+import json
+import time
+import string
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PROMPT_REGISTRY_SETTINGS
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PromptTemplate:
+    """
+    预编译的提示词：固定字段已经填入，剩余的字段按顺序保存为片段列表
+    
+    format()只格式化变化的字段，与对完整模板调用str.format的结果一致。
+    """
+    
+    _formatter = string.Formatter()
+    
+    def __init__(self, template, fixed):
+        """预编译提示词
+        
+        Args:
+            template (str): str.format格式的提示词模板
+            fixed (dict): 固定字段的值
+        """
+        self.segments = []
+        self.fields = []
+        literal = []
+        for text, field_name, format_spec, conversion in self._formatter.parse(template):
+            literal.append(text)
+            if field_name is None:
+                continue
+            if field_name.split('.')[0].split('[')[0] in fixed:
+                literal.append(self._format_field(field_name, format_spec, conversion, fixed))
+                continue
+            if literal:
+                self.segments.append(''.join(literal))
+                literal = []
+            self.segments.append((field_name, format_spec, conversion))
+            self.fields.append(field_name)
+        if literal:
+            self.segments.append(''.join(literal))
+        # 第一个变化字段之前的固定前缀
+        self.prefix = self.segments[0] if self.segments and isinstance(self.segments[0], str) else ""
+    
+    def format(self, **kwargs):
+        """填入变化的字段
+        
+        Args:
+            **kwargs: 变化字段的值
+        
+        Returns:
+            str: 完整的提示词
+        
+        Raises:
+            KeyError: 缺少字段
+        """
+        parts = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            else:
+                parts.append(self._format_field(*segment, kwargs))
+        return ''.join(parts)
+    
+    def _format_field(self, field_name, format_spec, conversion, values):
+        """按str.format的规则格式化一个字段"""
+        value = self._formatter.get_field(field_name, (), values)[0]
+        value = self._formatter.convert_field(value, conversion)
+        return self._formatter.format_field(value, format_spec or "")
+
+
+class PromptRegistry:
+    """
+    提示词和模板资源注册表，在进程内所有会话间共享，通过get_prompt_registry()获取共享实例
+    
+    文件路径兼容Windows风格的反斜杠，相对路径相对于项目根目录解析，与当前工作目录无关。
+    开启热加载时每隔check_interval秒最多检查一次文件的修改时间。
+    """
+    
+    def __init__(self, settings=None):
+        """初始化注册表
+        
+        Args:
+            settings (dict, optional): 注册表设置，默认使用config.py中的PROMPT_REGISTRY_SETTINGS
+        """
+        self.settings = dict(PROMPT_REGISTRY_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self._lock = threading.Lock()
+        # 路径 -> {"mtime", "checked", "version", "text", "json"}
+        self._assets = {}
+        # 名称 -> (资源版本, PromptTemplate)
+        self._templates = {}
+        self._stats = {"loads": 0, "reloads": 0, "compiles": 0}
+    
+    def resolve(self, path):
+        """把模板路径转换为当前系统的绝对路径
+        
+        Args:
+            path (str): 模板路径，可以使用/或\\分隔
+        
+        Returns:
+            str: 绝对路径
+        """
+        path = path.replace('\\', '/').replace('/', os.sep)
+        return path if os.path.isabs(path) else os.path.join(PROJECT_ROOT, path)
+    
+    def text(self, path, default=None):
+        """获取文本资源
+        
+        Args:
+            path (str): 文件路径
+            default (str, optional): 文件不存在时返回的内容，为None时抛出异常
+        
+        Returns:
+            str: 文件内容
+        
+        Raises:
+            FileNotFoundError: 文件不存在且没有提供默认内容
+        """
+        try:
+            return self._asset(path)["text"]
+        except FileNotFoundError:
+            if default is None:
+                raise
+            return default
+    
+    def json(self, path):
+        """获取JSON资源，解析结果只在文件变化时重新生成
+        
+        Args:
+            path (str): 文件路径
+        
+        Returns:
+            dict: 解析结果的副本，调用处可以随意修改
+        
+        Raises:
+            FileNotFoundError: 文件不存在
+            json.JSONDecodeError: 文件不是合法的JSON
+        """
+        asset = self._asset(path)
+        if asset["json"] is None:
+            parsed = json.loads(asset["text"])
+            with self._lock:
+                asset["json"] = parsed
+        return json.loads(json.dumps(asset["json"], ensure_ascii=False))
+    
+    def template(self, name, template, assets=None, **fixed):
+        """获取预编译的提示词，资源文件变化时重新编译
+        
+        Args:
+            name (str): 提示词名称，同一名称的模板和固定字段应保持不变
+            template (str): str.format格式的提示词模板
+            assets (dict, optional): 由文件内容填入的固定字段{字段名: 文件路径}，文件不存在时填入空字符串
+            **fixed: 其他固定字段的值
+        
+        Returns:
+            PromptTemplate: 预编译的提示词
+        """
+        assets = assets or {}
+        versions = tuple(self._version(path) for path in assets.values())
+        with self._lock:
+            cached = self._templates.get(name)
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+        
+        values = dict(fixed)
+        for field, path in assets.items():
+            values[field] = self.text(path, default="")
+        compiled = PromptTemplate(template, values)
+        with self._lock:
+            self._templates[name] = (versions, compiled)
+            self._stats["compiles"] += 1
+        return compiled
+    
+    def get_stats(self):
+        """获取加载统计
+        
+        Returns:
+            dict: 文件加载、重新加载和提示词编译次数，以及已加载的资源和提示词数量
+        """
+        with self._lock:
+            return dict(self._stats, assets=len(self._assets), templates=len(self._templates))
+    
+    def _version(self, path):
+        """资源的版本号，文件不存在时为None"""
+        try:
+            return self._asset(path)["version"]
+        except FileNotFoundError:
+            return None
+    
+    def _asset(self, path):
+        """获取资源记录，首次访问或文件修改后重新读取"""
+        full_path = self.resolve(path)
+        now = time.monotonic()
+        with self._lock:
+            asset = self._assets.get(full_path)
+            if asset is not None and (
+                not self.settings["hot_reload"] or now - asset["checked"] < self.settings["check_interval"]
+            ):
+                return asset
+        
+        mtime = os.path.getmtime(full_path)
+        with self._lock:
+            asset = self._assets.get(full_path)
+            if asset is not None and asset["mtime"] == mtime:
+                asset["checked"] = now
+                return asset
+        
+        with open(full_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        with self._lock:
+            previous = self._assets.get(full_path)
+            if previous is not None:
+                print(f"模板文件已修改，重新加载: {path}")
+                self._stats["reloads"] += 1
+            else:
+                self._stats["loads"] += 1
+            asset = {
+                "mtime": mtime,
+                "checked": now,
+                "version": (previous["version"] + 1) if previous else 1,
+                "text": text,
+                "json": None
+            }
+            self._assets[full_path] = asset
+            return asset
+
+
+# 进程级共享实例
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_prompt_registry():
+    """获取进程级共享的提示词注册表
+    
+    Returns:
+        PromptRegistry: 共享的注册表
+    """
+    global _default_registry
+    if _default_registry is None:
+        with _default_registry_lock:
+            if _default_registry is None:
+                _default_registry = PromptRegistry()
+    return _default_registry
@@ -0,0 +1,151 @@
+"""
+LLM调用记录中提示词的去重存储：提示词的固定前缀（PROMPT_CACHE_BOUNDARY之前的部分，多为数KB的说明和输出格式）
+按内容哈希压缩保存一次，调用记录中只保存前缀的哈希值和动态部分，需要完整提示词时再还原
+"""
+import os
+import sys
+import hashlib
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PROMPT_CACHE_BOUNDARY, PROMPT_STORAGE_SETTINGS
+
+
+def split_prompt(prompt):
+    """把提示词拆成固定前缀和动态部分，前缀包含缓存边界本身
+    
+    Args:
+        prompt (str): 提示词
+    
+    Returns:
+        tuple: (固定前缀, 动态部分)，没有缓存边界时固定前缀为空字符串
+    """
+    boundary = prompt.find(PROMPT_CACHE_BOUNDARY)
+    if boundary == -1:
+        return "", prompt
+    split = boundary + len(PROMPT_CACHE_BOUNDARY)
+    return prompt[:split], prompt[split:]
+
+
+class PromptSegments:
+    """
+    提示词片段存储，片段的持久化由会话存储后端（save_segment/load_segment）完成
+    
+    调用记录中的提示词保存为prompt_prefix（前缀的SHA-256哈希值）和prompt_suffix（动态部分）；
+    早期保存完整prompt字段的记录原样返回。已保存或读取过的片段缓存在内存中，同一前缀只写入一次。
+    """
+    
+    def __init__(self, store, settings=None):
+        """初始化片段存储
+        
+        Args:
+            store (FileSessionStore or SQLiteSessionStore): 保存片段的存储后端
+            settings (dict, optional): 存储设置，默认使用config.py中的PROMPT_STORAGE_SETTINGS
+        """
+        self.store = store
+        self.settings = dict(PROMPT_STORAGE_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        self._lock = threading.Lock()
+        # 哈希值 -> 片段内容
+        self._segments = {}
+        self.stats = {'packed': 0, 'new_segments': 0, 'saved_chars': 0}
+    
+    def pack(self, prompt):
+        """把提示词转换为调用记录中的字段
+        
+        Args:
+            prompt (str): 完整提示词
+        
+        Returns:
+            dict: {'prompt_prefix': 哈希值, 'prompt_suffix': 动态部分}，不拆分时为{'prompt': 提示词}
+        """
+        prefix, suffix = split_prompt(prompt)
+        if not self.settings["dedup"] or len(prefix) < self.settings["min_prefix_chars"]:
+            return {'prompt': prompt}
+        
+        digest = hashlib.sha256(prefix.encode('utf-8')).hexdigest()
+        with self._lock:
+            is_new = digest not in self._segments
+            self._segments[digest] = prefix
+            self.stats['packed'] += 1
+            self.stats['saved_chars'] += len(prefix)
+            if is_new:
+                self.stats['new_segments'] += 1
+        if is_new:
+            self.store.save_segment(digest, prefix)
+        return {'prompt_prefix': digest, 'prompt_suffix': suffix}
+    
+    def unpack(self, record):
+        """还原调用记录中的完整提示词
+        
+        Args:
+            record (dict): 调用记录
+        
+        Returns:
+            str: 完整提示词，前缀片段缺失时返回None
+        """
+        if 'prompt_prefix' not in record:
+            return record.get('prompt')
+        prefix = self._load(record['prompt_prefix'])
+        if prefix is None:
+            return None
+        return prefix + record.get('prompt_suffix', '')
+    
+    def expand(self, record):
+        """返回带完整prompt字段的调用记录副本，未拆分的记录原样返回
+        
+        Args:
+            record (dict): 调用记录
+        
+        Returns:
+            dict: 调用记录
+        """
+        if 'prompt_prefix' not in record:
+            return record
+        expanded = {k: v for k, v in record.items() if k not in ('prompt_prefix', 'prompt_suffix')}
+        expanded['prompt'] = self.unpack(record)
+        return expanded
+    
+    def get_stats(self):
+        """获取去重统计
+        
+        Returns:
+            dict: 拆分的提示词数、新保存的片段数和少保存的字符数
+        """
+        with self._lock:
+            return dict(self.stats)
+    
+    def _load(self, digest):
+        """读取片段，优先使用内存中的缓存"""
+        with self._lock:
+            if digest in self._segments:
+                return self._segments[digest]
+        text = self.store.load_segment(digest)
+        if text is not None:
+            with self._lock:
+                self._segments[digest] = text
+        return text
+
+
+# 每个存储后端一个共享实例
+_segments_by_store = {}
+_segments_lock = threading.Lock()
+
+
+def get_prompt_segments(store):
+    """获取存储后端共享的提示词片段存储
+    
+    Args:
+        store (FileSessionStore or SQLiteSessionStore): 存储后端
+    
+    Returns:
+        PromptSegments: 共享的片段存储
+    """
+    with _segments_lock:
+        segments = _segments_by_store.get(id(store))
+        if segments is None or segments.store is not store:
+            segments = PromptSegments(store)
+            _segments_by_store[id(store)] = segments
+        return segments
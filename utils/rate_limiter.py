@@ -0,0 +1,489 @@
+"""
+LLM调用限流器，按模型限制每分钟请求数/token数和并发数，并提供带抖动的指数退避和熔断
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RATE_LIMIT_SETTINGS
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+    pass
+
+
+class RateLimitTimeout(Exception):
+    """在限定时间内没有获取到调用配额"""
+    pass
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟的配额，按秒匀速补充
+    """
+    
+    def __init__(self, per_minute):
+        """初始化令牌桶
+        
+        Args:
+            per_minute (float): 每分钟的配额，为None或0时不限制
+        """
+        self.capacity = float(per_minute) if per_minute else None
+        self.refill_per_sec = self.capacity / 60.0 if self.capacity else None
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+    
+    def _refill(self, now):
+        """按流逝的时间补充令牌"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_sec)
+        self.updated_at = now
+    
+    def wait_time(self, amount, now):
+        """计算获取指定数量令牌需要等待的时间（调用方需持有锁）
+        
+        Args:
+            amount (float): 需要的令牌数量，超过容量时按容量计算
+            now (float): 当前时间
+        
+        Returns:
+            float: 需要等待的秒数，0表示可以立即获取
+        """
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_sec
+    
+    def consume(self, amount):
+        """扣除令牌（调用方需持有锁），允许为负以便事后按实际用量修正"""
+        if self.capacity is not None:
+            self.tokens -= min(amount, self.capacity)
+    
+    def refund(self, amount):
+        """返还令牌（调用方需持有锁），amount为负时表示补扣"""
+        if self.capacity is not None:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续失败达到阈值后打开，冷却期后放行一个试探请求（半开），成功则关闭
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold, recovery_timeout):
+        """初始化熔断器
+        
+        Args:
+            failure_threshold (int): 连续失败多少次后打开
+            recovery_timeout (float): 打开后经过多少秒进入半开状态
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+    
+    def allow(self, now):
+        """判断是否放行请求（调用方需持有锁）
+        
+        Args:
+            now (float): 当前时间
+        
+        Returns:
+            bool: 是否放行
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and now - self.opened_at >= self.recovery_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+    
+    def cancel_probe(self):
+        """半开状态下的试探请求未能发出时，释放试探名额（调用方需持有锁）"""
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = False
+    
+    def record_success(self):
+        """记录一次成功调用（调用方需持有锁）"""
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+    
+    def record_failure(self, now):
+        """记录一次失败调用（调用方需持有锁）
+        
+        Returns:
+            bool: 熔断器是否因此打开
+        """
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            newly_opened = self.state != self.OPEN
+            self.state = self.OPEN
+            self.opened_at = now
+            return newly_opened
+        return False
+
+
+class ModelRateLimiter:
+    """
+    单个模型（或提供商端点）的限流器，组合RPM/TPM令牌桶、并发上限和熔断器，
+    同一实例可同时用于线程和asyncio调用
+    """
+    
+    def __init__(self, name, settings):
+        """初始化限流器
+        
+        Args:
+            name (str): 限流器名称（模型名称）
+            settings (dict): 限流设置，包含rpm、tpm、max_concurrency及熔断参数
+        """
+        self.name = name
+        self.settings = settings
+        self._lock = threading.Lock()
+        self.request_bucket = TokenBucket(settings.get("rpm"))
+        self.token_bucket = TokenBucket(settings.get("tpm"))
+        self.max_concurrency = settings.get("max_concurrency")
+        self.in_flight = 0
+        self.breaker = CircuitBreaker(
+            settings["breaker_failure_threshold"],
+            settings["breaker_recovery_timeout"]
+        )
+        # 最近的排队等待时间，用于计算分位数
+        self._recent_waits = deque(maxlen=1000)
+        self.stats = {
+            'requests': 0,
+            'throttled': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'retries': 0,
+            'failures': 0,
+            'breaker_opens': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0
+        }
+    
+    def _try_acquire(self, estimated_tokens):
+        """尝试获取一次调用配额
+        
+        Args:
+            estimated_tokens (int): 预估的token用量
+        
+        Returns:
+            tuple: (等待秒数, 是否为半开状态下的试探请求)，等待秒数为0表示已获取，否则为建议的等待秒数
+        
+        Raises:
+            CircuitOpenError: 熔断器打开时抛出
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not self.breaker.allow(now):
+                self.stats['rejected'] += 1
+                retry_in = self.breaker.recovery_timeout - (now - self.breaker.opened_at)
+                raise CircuitOpenError(f"{self.name}熔断中，约{max(retry_in, 0):.0f}秒后重试")
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                wait = self.settings["poll_interval"]
+            else:
+                wait = max(
+                    self.request_bucket.wait_time(1, now),
+                    self.token_bucket.wait_time(estimated_tokens, now)
+                )
+            if wait > 0:
+                # 未获取到配额，释放半开状态下的试探名额
+                self.breaker.cancel_probe()
+                return wait, False
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(estimated_tokens)
+            self.in_flight += 1
+            return 0.0, self.breaker.state == CircuitBreaker.HALF_OPEN
+    
+    def _on_acquired(self, queue_wait, throttled):
+        """记录获取配额时的排队指标"""
+        with self._lock:
+            self.stats['requests'] += 1
+            if throttled:
+                self.stats['throttled'] += 1
+            self.stats['queue_wait_total'] += queue_wait
+            self.stats['queue_wait_max'] = max(self.stats['queue_wait_max'], queue_wait)
+            self._recent_waits.append(queue_wait)
+    
+    def _on_timeout(self):
+        """记录获取配额超时"""
+        with self._lock:
+            self.stats['timeouts'] += 1
+    
+    def acquire(self, estimated_tokens, timeout=None):
+        """阻塞直到获取调用配额
+        
+        Args:
+            estimated_tokens (int): 预估的token用量
+            timeout (float, optional): 最长等待秒数，默认使用设置中的acquire_timeout
+        
+        Returns:
+            tuple: (排队等待的秒数, 是否为半开状态下的试探请求)
+        """
+        timeout = self.settings["acquire_timeout"] if timeout is None else timeout
+        start = time.monotonic()
+        throttled = False
+        while True:
+            wait, probe = self._try_acquire(estimated_tokens)
+            if wait == 0:
+                queue_wait = time.monotonic() - start
+                self._on_acquired(queue_wait, throttled)
+                return queue_wait, probe
+            throttled = True
+            if time.monotonic() - start + wait > timeout:
+                self._on_timeout()
+                raise RateLimitTimeout(f"{self.name}等待调用配额超过{timeout}秒")
+            time.sleep(min(wait, self.settings["poll_interval"]))
+    
+    async def aacquire(self, estimated_tokens, timeout=None):
+        """acquire的asyncio版本，等待期间不阻塞事件循环
+        
+        Args:
+            estimated_tokens (int): 预估的token用量
+            timeout (float, optional): 最长等待秒数
+        
+        Returns:
+            tuple: (排队等待的秒数, 是否为半开状态下的试探请求)
+        """
+        timeout = self.settings["acquire_timeout"] if timeout is None else timeout
+        start = time.monotonic()
+        throttled = False
+        while True:
+            wait, probe = self._try_acquire(estimated_tokens)
+            if wait == 0:
+                queue_wait = time.monotonic() - start
+                self._on_acquired(queue_wait, throttled)
+                return queue_wait, probe
+            throttled = True
+            if time.monotonic() - start + wait > timeout:
+                self._on_timeout()
+                raise RateLimitTimeout(f"{self.name}等待调用配额超过{timeout}秒")
+            await asyncio.sleep(min(wait, self.settings["poll_interval"]))
+    
+    def release(self, estimated_tokens, actual_tokens=None):
+        """释放并发名额，并按实际token用量修正TPM令牌桶
+        
+        Args:
+            estimated_tokens (int): 获取配额时预估的token用量
+            actual_tokens (int, optional): 实际token用量，未知时不修正
+        """
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if actual_tokens is not None:
+                self.token_bucket.refund(estimated_tokens - actual_tokens)
+    
+    @contextmanager
+    def slot(self, estimated_tokens):
+        """获取一次调用配额的上下文管理器
+        
+        Args:
+            estimated_tokens (int): 预估的token用量
+        
+        Yields:
+            dict: 调用槽位信息，包含queue_wait和probe（是否为试探请求）；调用方可写入actual_tokens用于修正用量
+        """
+        queue_wait, probe = self.acquire(estimated_tokens)
+        slot = {'queue_wait': queue_wait, 'probe': probe, 'actual_tokens': None}
+        try:
+            yield slot
+        finally:
+            self.release(estimated_tokens, slot['actual_tokens'])
+    
+    @asynccontextmanager
+    async def aslot(self, estimated_tokens):
+        """slot的asyncio版本
+        
+        Args:
+            estimated_tokens (int): 预估的token用量
+        
+        Yields:
+            dict: 调用槽位信息
+        """
+        queue_wait, probe = await self.aacquire(estimated_tokens)
+        slot = {'queue_wait': queue_wait, 'probe': probe, 'actual_tokens': None}
+        try:
+            yield slot
+        finally:
+            self.release(estimated_tokens, slot['actual_tokens'])
+    
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self.breaker.record_success()
+    
+    def record_failure(self):
+        """记录一次可重试的失败（限流、服务端错误、超时）"""
+        with self._lock:
+            self.stats['failures'] += 1
+            if self.breaker.record_failure(time.monotonic()):
+                self.stats['breaker_opens'] += 1
+                print(f"{self.name}连续失败{self.breaker.consecutive_failures}次，熔断{self.breaker.recovery_timeout}秒")
+    
+    def cancel_probe(self):
+        """试探请求以不可重试的结果结束（请求错误、解析失败、对冲落败被取消）时释放试探名额，
+        下一次调用会重新试探；熔断器不在半开状态时没有影响"""
+        with self._lock:
+            self.breaker.cancel_probe()
+    
+    def record_retry(self):
+        """记录一次重试"""
+        with self._lock:
+            self.stats['retries'] += 1
+    
+    def is_available(self):
+        """熔断器是否允许发送请求（不占用试探名额）
+        
+        Returns:
+            bool: 熔断器未打开，或已过冷却期
+        """
+        with self._lock:
+            if self.breaker.state != CircuitBreaker.OPEN:
+                return True
+            return time.monotonic() - self.breaker.opened_at >= self.breaker.recovery_timeout
+    
+    def backoff_delay(self, attempt):
+        """计算第attempt次重试前的等待时间（指数退避 + 全抖动），避免并发会话同时重试
+        
+        Args:
+            attempt (int): 已失败的次数，从0开始
+        
+        Returns:
+            float: 等待秒数
+        """
+        ceiling = min(self.settings["backoff_max"], self.settings["backoff_base"] * (2 ** attempt))
+        return random.uniform(0, ceiling)
+    
+    def get_stats(self):
+        """获取限流统计
+        
+        Returns:
+            dict: 请求数、限流次数、排队等待时间分位数、熔断状态等
+        """
+        with self._lock:
+            result = dict(self.stats)
+            waits = sorted(self._recent_waits)
+            result.update({
+                'name': self.name,
+                'rpm': self.request_bucket.capacity,
+                'tpm': self.token_bucket.capacity,
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'breaker_state': self.breaker.state,
+                'queue_wait_avg': result['queue_wait_total'] / result['requests'] if result['requests'] else 0.0,
+                'queue_wait_p50': waits[len(waits) // 2] if waits else 0.0,
+                'queue_wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+            })
+        return result
+
+
+def is_retryable_error(error):
+    """判断异常是否值得重试：限流（429）、服务端错误（5xx）、超时和连接错误
+    
+    Args:
+        error (Exception): 调用时抛出的异常
+    
+    Returns:
+        bool: 是否可重试
+    """
+    # 限流器自身的拒绝不重试，否则会在熔断或排队超时后继续堆积请求
+    if isinstance(error, (CircuitOpenError, RateLimitTimeout)):
+        return False
+    
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        response = getattr(error, 'response', None)
+        status_code = getattr(response, 'status_code', None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    
+    name = type(error).__name__.lower()
+    if any(word in name for word in ('timeout', 'connection', 'ratelimit')):
+        return True
+    
+    # Anthropic/智谱接口的错误信息中包含状态码
+    message = str(error).lower()
+    if "rate_limit" in message or "rate limit" in message:
+        return True
+    return any(f"错误: {code}" in message for code in ('429', '500', '502', '503', '504', '529'))
+
+
+class RateLimiterRegistry:
+    """
+    按模型保存限流器，所有会话共享同一组配额
+    """
+    
+    def __init__(self):
+        """初始化限流器注册表"""
+        self._lock = threading.Lock()
+        self._limiters = {}
+    
+    def get(self, model_name, model_config):
+        """获取（或创建）模型的限流器，AVAILABLE_MODELS中的rpm/tpm/max_concurrency覆盖默认设置
+        
+        Args:
+            model_name (str): 模型名称
+            model_config (dict): 模型配置
+        
+        Returns:
+            ModelRateLimiter: 限流器
+        """
+        with self._lock:
+            limiter = self._limiters.get(model_name)
+            if limiter is None:
+                settings = dict(RATE_LIMIT_SETTINGS)
+                for key in ("rpm", "tpm", "max_concurrency"):
+                    if key in model_config:
+                        settings[key] = model_config[key]
+                limiter = ModelRateLimiter(model_name, settings)
+                self._limiters[model_name] = limiter
+        return limiter
+    
+    def get_stats(self):
+        """获取所有限流器的统计
+        
+        Returns:
+            dict: 模型名称 -> 统计信息
+        """
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.name: limiter.get_stats() for limiter in limiters}
+
+
+# 进程级共享实例
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_rate_limiter_registry():
+    """获取进程级共享的限流器注册表
+    
+    Returns:
+        RateLimiterRegistry: 共享的注册表实例
+    """
+    global _default_registry
+    if _default_registry is None:
+        with _default_registry_lock:
+            if _default_registry is None:
+                _default_registry = RateLimiterRegistry()
+    return _default_registry
@@ -0,0 +1,264 @@
+"""
+会话日志的追加写入：新记录逐行追加到.jsonl分段文件，每次写入的开销与已有记录数无关；
+追加一定数量后再整理（合并）回原有的可读JSON文件（或压缩的.json.gz文件），读取时依次读取整理后的文件和分段文件。
+追加和整理都交给延迟写入队列执行，不阻塞调用线程
+"""
+import os
+import sys
+import gzip
+import json
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SESSION_LOG_SETTINGS
+from utils.write_behind import get_write_behind
+
+
+def segment_path(json_path):
+    """可读JSON文件对应的分段文件路径，如conversation.json -> conversation.jsonl
+    
+    Args:
+        json_path (str): 可读JSON文件路径
+    
+    Returns:
+        str: 分段文件路径
+    """
+    return json_path + 'l'
+
+
+def write_json_atomic(path, data):
+    """先写临时文件再替换，写入中途出错时不会留下不完整的JSON
+    
+    Args:
+        path (str): 文件路径
+        data: 要保存的数据
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def iter_segment(path):
+    """逐行读取分段文件，跳过崩溃时可能留下的不完整的最后一行
+    
+    Args:
+        path (str): 分段文件路径
+    
+    Yields:
+        dict: 记录
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+class SegmentedLog:
+    """
+    追加写入的记录列表
+    
+    已整理的记录保存在可读的JSON数组文件中（与原有的文件布局一致），之后的记录逐行追加到同名的.jsonl分段文件；
+    分段文件中的记录数达到compact_every时合并回JSON文件并清空分段文件。
+    compress为True时整理后的记录改为压缩保存到同名的.json.gz文件，原JSON文件在第一次整理后删除，
+    较新的记录仍在分段文件中逐行可读。
+    追加和整理都通过延迟写入队列按提交顺序执行，读取前会先写入排队的操作。
+    """
+    
+    def __init__(self, json_path, compact_every=None, writer=None, compress=False):
+        """初始化记录列表
+        
+        Args:
+            json_path (str): 可读JSON文件路径
+            compact_every (int, optional): 追加多少条记录后整理一次，默认使用SESSION_LOG_SETTINGS，0表示只在显式调用时整理
+            writer (WriteBehindWriter, optional): 延迟写入队列，默认使用进程级共享实例
+            compress (bool): 整理后的记录是否压缩保存到.json.gz文件
+        """
+        self.json_path = json_path
+        self.segment_path = segment_path(json_path)
+        self.compressed_path = json_path + '.gz'
+        self.compress = compress
+        self.compact_every = SESSION_LOG_SETTINGS["compact_every"] if compact_every is None else compact_every
+        self.writer = writer or get_write_behind()
+        # 保护计数，以及读取与写入线程中的整理互不打断
+        self._lock = threading.RLock()
+        # 分段文件中尚未整理的记录数，首次追加时统计
+        self._pending = None
+    
+    def create(self):
+        """创建空的记录列表，已有的记录会被清空；直接写入，创建后文件立即存在"""
+        with self._lock:
+            write_json_atomic(self.json_path, [])
+            for path in (self.segment_path, self.compressed_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._pending = 0
+    
+    def append(self, record):
+        """追加一条记录
+        
+        Args:
+            record (dict): 记录
+        """
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._pending is None:
+                self._pending = sum(1 for _ in iter_segment(self.segment_path))
+            self.writer.append(self.json_path, self.segment_path, line)
+            self._pending += 1
+            if self.compact_every and self._pending >= self.compact_every:
+                self.compact()
+    
+    def __iter__(self):
+        """依次返回整理后的记录和分段文件中的记录，分段文件逐行解析"""
+        yield from self._read_compacted()
+        yield from iter_segment(self.segment_path)
+    
+    def read(self):
+        """读取全部记录，读取前先写入排队的操作，读取期间不会被整理打断
+        
+        Returns:
+            list: 记录列表
+        """
+        self.writer.flush()
+        with self._lock:
+            return list(self)
+    
+    def compact(self):
+        """把分段文件中的记录合并回可读JSON文件，在之前追加的记录写入后执行"""
+        with self._lock:
+            self.writer.submit(self.json_path, self._compact_files)
+            self._pending = 0
+    
+    def _compact_files(self):
+        """合并分段文件，由延迟写入队列调用"""
+        with self._lock:
+            pending = list(iter_segment(self.segment_path))
+            if not pending:
+                return
+            records = self._read_compacted() + pending
+            if self.compress:
+                # 压缩文件不需要缩进，写入后删除原JSON文件，读取时优先读取压缩文件
+                text = json.dumps(records, ensure_ascii=False)
+                self.writer.write_bytes_atomic(self.compressed_path, gzip.compress(text.encode('utf-8')))
+                if os.path.exists(self.json_path):
+                    os.remove(self.json_path)
+            else:
+                self.writer.write_text_atomic(self.json_path, json.dumps(records, ensure_ascii=False, indent=2))
+            # 合并后清空分段文件
+            open(self.segment_path, 'w', encoding='utf-8').close()
+    
+    def _read_compacted(self):
+        """读取已整理的记录，压缩文件存在时读取压缩文件"""
+        if os.path.exists(self.compressed_path):
+            with open(self.compressed_path, 'rb') as f:
+                return json.loads(gzip.decompress(f.read()).decode('utf-8'))
+        if not os.path.exists(self.json_path):
+            return []
+        with open(self.json_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+
+class RecordJournal:
+    """
+    会话记录的变更日志
+    
+    会话记录本身保存在内存中，每次变更只把变更内容追加到session_record.jsonl；
+    变更数达到compact_every时把完整的会话记录写入session_record.json并清空变更日志。
+    完整记录在整理时序列化，写入由延迟写入队列在之前的变更之后执行。
+    omit中列出的列表字段，其中每项的指定键不写入文件（这些内容已另外保存，如LLM调用的提示词和回应）。
+    """
+    
+    def __init__(self, json_path, compact_every=None, writer=None, omit=None):
+        """初始化变更日志
+        
+        Args:
+            json_path (str): 会话记录文件路径
+            compact_every (int, optional): 追加多少条变更后写一次完整记录，默认使用SESSION_LOG_SETTINGS
+            writer (WriteBehindWriter, optional): 延迟写入队列，默认使用进程级共享实例
+            omit (dict, optional): 列表字段 -> 该字段每项中不写入文件的键
+        """
+        self.json_path = json_path
+        self.segment_path = segment_path(json_path)
+        self.compact_every = SESSION_LOG_SETTINGS["compact_every"] if compact_every is None else compact_every
+        self.writer = writer or get_write_behind()
+        self.omit = omit or {}
+        self._lock = threading.Lock()
+        self._pending = 0
+    
+    def record(self, session_record, changes):
+        """追加一组变更，调用处需保证变更按发生顺序提交
+        
+        Args:
+            session_record (dict): 变更后的完整会话记录，整理时写入文件
+            changes (list): 变更列表，每项为(操作, 字段, 值)，操作为"set"或"append"
+        """
+        line = json.dumps(
+            [[op, field, self._slim(field, value) if op == "append" else value] for op, field, value in changes],
+            ensure_ascii=False
+        ) + '\n'
+        with self._lock:
+            self.writer.append(self.json_path, self.segment_path, line)
+            self._pending += 1
+            compact_due = self.compact_every and self._pending >= self.compact_every
+        if compact_due:
+            self.compact(session_record)
+    
+    def compact(self, session_record):
+        """写入完整的会话记录并清空变更日志
+        
+        Args:
+            session_record (dict): 完整的会话记录，在调用时序列化，之后的变更不会重复计入
+        """
+        if self.omit:
+            session_record = dict(session_record, **{
+                field: [self._slim(field, item) for item in session_record[field]]
+                for field in self.omit if isinstance(session_record.get(field), list)
+            })
+        text = json.dumps(session_record, ensure_ascii=False, indent=2)
+        
+        def write_snapshot():
+            self.writer.write_text_atomic(self.json_path, text)
+            open(self.segment_path, 'w', encoding='utf-8').close()
+        
+        with self._lock:
+            self.writer.submit(self.json_path, write_snapshot)
+            self._pending = 0
+    
+    def _slim(self, field, item):
+        """去掉列表字段中一项不写入文件的键"""
+        keys = self.omit.get(field)
+        if not keys or not isinstance(item, dict):
+            return item
+        return {k: v for k, v in item.items() if k not in keys}
+
+
+def load_session_record(session_dir):
+    """读取会话记录：最近一次完整记录加上之后的变更
+    
+    Args:
+        session_dir (str): 会话目录
+    
+    Returns:
+        dict: 会话记录，文件不存在时为None
+    """
+    json_path = os.path.join(session_dir, 'session_record.json')
+    if not os.path.exists(json_path):
+        return None
+    with open(json_path, 'r', encoding='utf-8') as f:
+        session_record = json.load(f)
+    for changes in iter_segment(segment_path(json_path)):
+        for op, field, value in changes:
+            if op == "append":
+                session_record.setdefault(field, []).append(value)
+            else:
+                session_record[field] = value
+    return session_record
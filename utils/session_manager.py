@@ -2,22 +2,52 @@
 import os
 import json
 import time
+import sys
+import threading
 from datetime import datetime
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.session_store import get_session_store, MODULE_NAMES
+from utils.prompt_segments import get_prompt_segments
+from utils.write_behind import get_write_behind
 
 class SessionManager:
     """会话记录管理器类，处理每次会话的记录保存"""
     
-    def __init__(self):
-        """初始化会话记录管理器"""
+    def __init__(self, session_id=None, store=None):
+        """初始化会话记录管理器
+        
+        Args:
+            session_id (str, optional): 会话ID，默认使用当前时间；同一秒内创建多个会话时需要指定以免目录冲突
+            store (FileSessionStore or SQLiteSessionStore, optional): 存储后端，默认使用config.py中SESSION_STORE_SETTINGS指定的后端
+        """
         # 创建sessions目录（如果不存在）
         self.sessions_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sessions')
         os.makedirs(self.sessions_dir, exist_ok=True)
         
         # 创建新的会话目录
-        self.session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.session_id = session_id or datetime.now().strftime('%Y%m%d_%H%M%S')
         self.session_dir = os.path.join(self.sessions_dir, self.session_id)
         os.makedirs(self.session_dir, exist_ok=True)
         
+        # 后台任务（如对话摘要）也会记录API调用，修改会话记录时加锁，保证变更按发生顺序写入
+        self._lock = threading.RLock()
+        
+        # 文件写入由进程级延迟写入队列在后台合并执行，不占用请求线程
+        self.writer = get_write_behind()
+        
+        # 会话数据的存储后端（文件或SQLite），会话目录仍用于保存可视化图片等文件
+        self.store = store or get_session_store()
+        # LLM调用记录中提示词的固定前缀按哈希值只保存一次
+        self.prompt_segments = get_prompt_segments(self.store)
+        
+        # 内存中的会话状态是权威数据，文件只用于持久化；每次变更递增版本号
+        self.version = 0
+        
+        # 恢复的会话（存储后端的只读视图），其对话和模块历史在首次读取时才从存储中加载
+        self.resumed_session = None
+        
         # 初始化会话记录
         self.session_record = {
             'session_id': self.session_id,
@@ -27,9 +57,15 @@ class SessionManager:
             'tokens_used': {
                 'total': 0,
                 'prompt': 0,
-                'completion': 0
+                'completion': 0,
+                'cached': 0
+            },
+            'cache_stats': {
+                'hits': 0,
+                'misses': 0
             },
             'intermediate_states': [],
+            'context_stats': [],
             'final_result': None
         }
         
@@ -55,14 +91,12 @@ class SessionManager:
             'timestamp': datetime.now().isoformat()
         }
         
-        # 添加到会话记录
-        self.session_record['conversation_history'].append(user_message)
-        
-        # 保存会话记录
-        self._save_session_record()
-        
-        # 保存到对话历史文件
-        self._append_to_conversation_file(user_message)
+        with self._lock:
+            # 添加到会话记录
+            self.session_record['conversation_history'].append(user_message)
+            
+            # 保存会话记录，新消息同时写入对话历史
+            self._save_session_record([('append', 'conversation_history', user_message)])
         
         # 记录到调试文件
         self._log_debug_info('用户输入', {'input': user_input})
@@ -91,19 +125,17 @@ class SessionManager:
                 'timestamp': datetime.now().isoformat()
             }
         
-        # 添加到会话记录
-        self.session_record['conversation_history'].append(system_message)
-        
-        # 保存会话记录
-        self._save_session_record()
-        
-        # 保存到对话历史文件
-        self._append_to_conversation_file(system_message)
+        with self._lock:
+            # 添加到会话记录
+            self.session_record['conversation_history'].append(system_message)
+            
+            # 保存会话记录，新消息同时写入对话历史
+            self._save_session_record([('append', 'conversation_history', system_message)])
         
         # 记录到调试文件
         self._log_debug_info('系统回应', {'response': response})
     
-    def add_api_call(self, model_name, prompt, response, tokens_used):
+    def add_api_call(self, model_name, prompt, response, tokens_used, call_info=None):
         """记录API调用信息
         
         Args:
@@ -111,39 +143,76 @@ class SessionManager:
             prompt (str): 发送的提示词
             response (str): 收到的回应
             tokens_used (dict): 使用的token数量
+            call_info (dict, optional): 调用的附加信息，如缓存命中情况
         """
-        # 创建API调用记录
-        api_call_record = {
-            'timestamp': datetime.now().isoformat(),
-            'model': model_name,
-            'prompt': prompt,
-            'response': response,
-            'tokens': tokens_used
-        }
-        
-        # 添加到会话记录
-        self.session_record['api_calls'].append(api_call_record)
-        
-        # 更新总token使用量
-        self.session_record['tokens_used']['prompt'] += tokens_used.get('prompt', 0)
-        self.session_record['tokens_used']['completion'] += tokens_used.get('completion', 0)
-        self.session_record['tokens_used']['total'] = (
-            self.session_record['tokens_used']['prompt'] +
-            self.session_record['tokens_used']['completion']
-        )
-        
-        # 保存API调用记录到单独的文件
-        self._save_llm_output(api_call_record)
+        with self._lock:
+            # 创建API调用记录
+            # 提示词保存为固定前缀的哈希值和动态部分，get_all_llm_outputs返回时还原
+            api_call_record = {
+                'timestamp': datetime.now().isoformat(),
+                'model': model_name,
+                **self.prompt_segments.pack(prompt),
+                'response': response,
+                'tokens': tokens_used
+            }
+            if call_info:
+                api_call_record.update(call_info)
+            
+            # 添加到会话记录
+            self.session_record['api_calls'].append(api_call_record)
+            
+            # 更新总token使用量
+            self.session_record['tokens_used']['prompt'] += tokens_used.get('prompt', 0)
+            self.session_record['tokens_used']['completion'] += tokens_used.get('completion', 0)
+            self.session_record['tokens_used']['total'] = (
+                self.session_record['tokens_used']['prompt'] +
+                self.session_record['tokens_used']['completion']
+            )
+            # 命中提供商前缀缓存的提示词token（计入prompt，单独统计以便观察缓存效果）
+            if tokens_used.get('cached'):
+                self.session_record['tokens_used']['cached'] = (
+                    self.session_record['tokens_used'].get('cached', 0) + tokens_used['cached']
+                )
+            
+            # 更新缓存命中统计
+            if call_info and 'cache' in call_info:
+                cache_stats = self.session_record.setdefault('cache_stats', {'hits': 0, 'misses': 0})
+                if call_info['cache'] == 'hit':
+                    cache_stats['hits'] += 1
+                else:
+                    cache_stats['misses'] += 1
+            
+            # 保存会话记录，API调用记录同时写入LLM输出记录
+            self._save_session_record([
+                ('append', 'api_calls', api_call_record),
+                ('set', 'tokens_used', self.session_record['tokens_used']),
+                ('set', 'cache_stats', self.session_record.get('cache_stats'))
+            ])
+            
+            # 记录到调试文件
+            self._log_debug_info('LLM调用', {
+                'model': model_name,
+                'tokens_used': tokens_used,
+                'cache': call_info.get('cache') if call_info else None,
+                'ttft': call_info.get('ttft') if call_info else None,
+                'tokens_per_sec': call_info.get('tokens_per_sec') if call_info else None,
+                'prompt_summary': self._summarize_prompt(api_call_record)
+            })
+    
+    def _summarize_prompt(self, api_call_record):
+        """调试日志中的提示词摘要：固定前缀只记录哈希值，动态部分截取前100个字符
         
-        # 保存会话记录
-        self._save_session_record()
+        Args:
+            api_call_record (dict): API调用记录
         
-        # 记录到调试文件
-        self._log_debug_info('LLM调用', {
-            'model': model_name,
-            'tokens_used': tokens_used,
-            'prompt_summary': prompt[:100] + '...' if len(prompt) > 100 else prompt
-        })
+        Returns:
+            str: 提示词摘要
+        """
+        text = api_call_record.get('prompt_suffix', api_call_record.get('prompt', ''))
+        summary = text[:100] + '...' if len(text) > 100 else text
+        if 'prompt_prefix' in api_call_record:
+            summary = f"[前缀 {api_call_record['prompt_prefix'][:12]}] {summary}"
+        return summary
     
     def add_intermediate_state(self, state_name, state_data, update_type=None):
         """记录中间状态
@@ -162,9 +231,10 @@ class SessionManager:
         # 如果提供了更新类型，则添加到记录中
         if update_type:
             state_record['update_type'] = update_type
-            
-        self.session_record['intermediate_states'].append(state_record)
-        self._save_session_record()
+        
+        with self._lock:
+            self.session_record['intermediate_states'].append(state_record)
+            self._save_session_record([('append', 'intermediate_states', state_record)])
         
         # 记录到调试文件
         self._log_debug_info('中间状态更新', {
@@ -173,6 +243,20 @@ class SessionManager:
             'data_summary': str(state_data)[:200] + '...' if len(str(state_data)) > 200 else str(state_data)
         })
     
+    def add_context_stats(self, stats):
+        """记录一轮统一处理中对话上下文的压缩情况
+        
+        Args:
+            stats (dict): 对话上下文统计，包含完整对话记录和实际使用的上下文的token数
+        """
+        with self._lock:
+            context_stats = dict(stats, timestamp=datetime.now().isoformat())
+            self.session_record.setdefault('context_stats', []).append(context_stats)
+            self._save_session_record([('append', 'context_stats', context_stats)])
+            
+            # 记录到调试文件
+            self._log_debug_info('对话上下文', stats)
+    
     def set_final_result(self, result):
         """设置最终结果
         
@@ -184,29 +268,45 @@ class SessionManager:
             'data': result
         }
         
-        # 更新会话记录
-        self.session_record['final_result'] = final_result
-        
-        # 保存会话记录
-        self._save_session_record()
-        
-        # 保存最终结果到单独文件
-        final_result_path = os.path.join(self.session_dir, 'final_result.json')
-        with open(final_result_path, 'w', encoding='utf-8') as f:
-            json.dump(final_result, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            # 更新会话记录
+            self.session_record['final_result'] = final_result
+            
+            # 保存会话记录
+            self._save_session_record([('set', 'final_result', final_result)])
+            
+            # 保存最终结果到单独文件
+            self.session.save_final_result(final_result)
+            
+            # 记录到调试文件
+            self._log_debug_info('最终结果', {'result_summary': '已生成最终结果'})
+            
+            # 会话结束，把追加的记录合并回可读的JSON文件
+            self.compact()
+    
+    def _save_session_record(self, changes):
+        """把会话记录的变更交给存储后端保存（文件后端追加到变更日志，定期写入完整的session_record.json）
         
-        # 记录到调试文件
-        self._log_debug_info('最终结果', {'result_summary': '已生成最终结果'})
+        Args:
+            changes (list): 变更列表，每项为(操作, 字段, 值)
+        """
+        with self._lock:
+            self.version += 1
+            # 更新结束时间
+            self.session_record['end_time'] = datetime.now().isoformat()
+            self.session.save_record(self.session_record, list(changes) + [('set', 'end_time', self.session_record['end_time'])])
     
-    def _save_session_record(self):
-        """保存会话记录到文件"""
-        # 更新结束时间
-        self.session_record['end_time'] = datetime.now().isoformat()
-        
-        # 保存完整的会话记录
-        record_path = os.path.join(self.session_dir, 'session_record.json')
-        with open(record_path, 'w', encoding='utf-8') as f:
-            json.dump(self.session_record, f, ensure_ascii=False, indent=2)
+    def compact(self):
+        """把所有追加写入的记录合并回可读的JSON文件，并写入完整的会话记录"""
+        with self._lock:
+            self.session.compact(self.session_record)
+    
+    def flush(self):
+        """立即写入所有排队的文件操作，返回时会话文件与内存中的记录一致；用于退出、恢复会话和测试
+        
+        不能在持有会话锁时调用，写入线程生成current_state.json时需要获取会话锁
+        """
+        self.writer.flush()
     
     def get_session_dir(self):
         """获取当前会话目录路径
@@ -218,44 +318,20 @@ class SessionManager:
     
     def _create_session_files(self):
         """创建会话所需的所有文件和目录"""
-        # 创建最终状态文件 - 记录最新版本的四个模块数据
-        self.current_state_path = os.path.join(self.session_dir, 'current_state.json')
-        current_state = {
+        # 最终状态 - 记录最新版本的四个模块数据
+        self.current_state = {
             'spatial_understanding': {},
             'user_requirements': {},
             'key_questions': {},
             'constraints': {},
             'last_updated': datetime.now().isoformat()
         }
-        with open(self.current_state_path, 'w', encoding='utf-8') as f:
-            json.dump(current_state, f, ensure_ascii=False, indent=2)
-        
-        # 创建四个模块的历史记录文件
-        self.history_files = {
-            'spatial_understanding': os.path.join(self.session_dir, 'spatial_understanding_history.json'),
-            'user_requirements': os.path.join(self.session_dir, 'user_requirements_history.json'),
-            'key_questions': os.path.join(self.session_dir, 'key_questions_history.json'),
-            'constraints': os.path.join(self.session_dir, 'constraints_history.json')
-        }
         
-        # 初始化历史记录文件
-        for file_path in self.history_files.values():
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
+        # 在存储后端中创建会话，初始的会话记录和最新状态直接写入，创建后会话即可被列出
+        self.session = self.store.open_session(self.session_id, self.session_dir, self.session_record, self.current_state)
         
-        # 创建LLM输出记录目录
-        self.llm_output_dir = os.path.join(self.session_dir, 'llm_outputs')
-        os.makedirs(self.llm_output_dir, exist_ok=True)
-        
-        # 创建对话历史文件
-        self.conversation_file_path = os.path.join(self.session_dir, 'conversation.json')
-        with open(self.conversation_file_path, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
-        
-        # 创建调试日志文件
-        self.debug_log_path = os.path.join(self.session_dir, 'debug_log.json')
-        with open(self.debug_log_path, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+        # 模块历史同时保存在内存中，读取时不再访问存储
+        self.module_histories = {module_name: [] for module_name in MODULE_NAMES}
     
     def update_spatial_understanding(self, content, user_input=None):
         """更新空间理解内容
@@ -352,17 +428,23 @@ class SessionManager:
             module_name (str): 模块名称
             content (dict): 模块内容
         """
-        # 读取当前最新状态
-        with open(self.current_state_path, 'r', encoding='utf-8') as f:
-            current_state = json.load(f)
-        
-        # 更新指定模块
-        current_state[module_name] = content
-        current_state['last_updated'] = datetime.now().isoformat()
+        with self._lock:
+            self.version += 1
+            # 更新内存中的最新状态
+            self.current_state[module_name] = content
+            self.current_state['last_updated'] = datetime.now().isoformat()
+            
+            # 同一轮中多个模块的更新合并为一次写入，写入时才序列化最新状态
+            self.session.save_current_state(self._dump_current_state)
+    
+    def _dump_current_state(self):
+        """序列化最新状态，由延迟写入队列调用
         
-        # 保存更新后的最新状态
-        with open(self.current_state_path, 'w', encoding='utf-8') as f:
-            json.dump(current_state, f, ensure_ascii=False, indent=2)
+        Returns:
+            str: current_state.json的内容
+        """
+        with self._lock:
+            return json.dumps(self.current_state, ensure_ascii=False, indent=2)
     
     def _add_to_history(self, module_name, content, user_input=None):
         """添加模块更新记录到历史文件
@@ -372,11 +454,6 @@ class SessionManager:
             content (dict): 模块内容
             user_input (str, optional): 触发更新的用户输入
         """
-        # 读取当前历史记录
-        history_path = self.history_files[module_name]
-        with open(history_path, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-        
         # 创建新的历史记录
         record = {
             'timestamp': datetime.now().isoformat(),
@@ -388,13 +465,11 @@ class SessionManager:
         if user_input:
             record['user_input'] = user_input
         
-        # 添加到历史记录
-        history.append(record)
+        # 追加到历史记录
+        with self._lock:
+            self.module_histories[module_name].append(record)
+            self.session.append_history(module_name, record)
         
-        # 保存更新后的历史记录
-        with open(history_path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-            
         # 同时添加到session_record的intermediate_states中
         self.add_intermediate_state(f"{module_name}_update", content, module_name)
     
@@ -403,72 +478,48 @@ class SessionManager:
         
         Args:
             module_name (str): 模块名称，可选值为'spatial_understanding', 'user_requirements', 'key_questions', 'constraints'
-            
+        
         Returns:
             dict: 模块的最新状态
         """
-        with open(self.current_state_path, 'r', encoding='utf-8') as f:
-            current_state = json.load(f)
-        return current_state.get(module_name, {})
+        with self._lock:
+            return self.current_state.get(module_name, {})
+    
+    def attach_resumed_session(self, resumed_session):
+        """关联恢复的会话，之后读取的对话和模块历史包含恢复的会话中的记录
+        
+        Args:
+            resumed_session (StoredSession or SQLiteStoredSession): 存储后端返回的会话只读视图
+        """
+        with self._lock:
+            self.resumed_session = resumed_session
     
     def get_module_history(self, module_name):
-        """获取指定模块的历史记录
+        """获取指定模块的历史记录，恢复的会话中的记录在前，首次读取时才从存储中加载
         
         Args:
             module_name (str): 模块名称，可选值为'spatial_understanding', 'user_requirements', 'key_questions', 'constraints'
-            
+        
         Returns:
             list: 模块的历史记录列表
         """
-        history_path = self.history_files.get(module_name)
-        if not history_path:
-            return []
-        
-        with open(history_path, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-        return history
+        with self._lock:
+            resumed_session = self.resumed_session
+            history = list(self.module_histories.get(module_name, []))
+        if resumed_session is None:
+            return history
+        return resumed_session.get_module_history(module_name) + history
     
-    def _save_llm_output(self, api_call_record):
-        """保存LLM输出到单个JSON文件
-        
-        Args:
-            api_call_record (dict): API调用记录
-        """
-        # 定义llm_output.json文件路径
-        file_path = os.path.join(self.llm_output_dir, 'llm_output.json')
-        
-        # 如果文件不存在，创建一个包含空列表的文件
-        if not os.path.exists(file_path):
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-        
-        # 读取现有的LLM输出记录
-        with open(file_path, 'r', encoding='utf-8') as f:
-            llm_outputs = json.load(f)
+    def get_snapshot(self):
+        """获取当前状态的快照
         
-        # 添加新的API调用记录
-        llm_outputs.append(api_call_record)
+        模块内容在更新时整体替换，快照中的模块内容不会被之后的更新修改
         
-        # 保存更新后的记录
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(llm_outputs, f, ensure_ascii=False, indent=2)
-    
-    def _append_to_conversation_file(self, message):
-        """将消息添加到对话历史文件
-        
-        Args:
-            message (dict): 消息记录
+        Returns:
+            dict: 包含version（版本号）和current_state（四个模块的最新状态）
         """
-        # 读取当前对话历史
-        with open(self.conversation_file_path, 'r', encoding='utf-8') as f:
-            conversation = json.load(f)
-        
-        # 添加新消息
-        conversation.append(message)
-        
-        # 保存更新后的对话历史
-        with open(self.conversation_file_path, 'w', encoding='utf-8') as f:
-            json.dump(conversation, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            return {'version': self.version, 'current_state': dict(self.current_state)}
     
     def _log_debug_info(self, action_type, details):
         """记录调试信息
@@ -477,10 +528,6 @@ class SessionManager:
             action_type (str): 操作类型
             details (dict): 详细信息
         """
-        # 读取当前调试日志
-        with open(self.debug_log_path, 'r', encoding='utf-8') as f:
-            debug_log = json.load(f)
-        
         # 创建新的调试记录
         debug_entry = {
             'timestamp': datetime.now().isoformat(),
@@ -488,20 +535,21 @@ class SessionManager:
             'details': details
         }
         
-        # 添加到调试日志
-        debug_log.append(debug_entry)
-        
-        # 保存更新后的调试日志
-        with open(self.debug_log_path, 'w', encoding='utf-8') as f:
-            json.dump(debug_log, f, ensure_ascii=False, indent=2)
+        # 追加到调试日志
+        self.session.append_debug(debug_entry)
     
     def get_conversation_history(self):
-        """获取对话历史
+        """获取对话历史，恢复的会话中的对话在前，首次读取时才从存储中加载
         
         Returns:
-            list: 对话历史列表
+            list: 对话历史列表的副本，其他线程之后追加的消息不会出现在其中
         """
-        return self.session_record['conversation_history']
+        with self._lock:
+            resumed_session = self.resumed_session
+            history = list(self.session_record['conversation_history'])
+        if resumed_session is None:
+            return history
+        return resumed_session.get_conversation_history() + history
     
     def get_debug_log(self):
         """获取调试日志
@@ -509,24 +557,16 @@ class SessionManager:
         Returns:
             list: 调试日志列表
         """
-        with open(self.debug_log_path, 'r', encoding='utf-8') as f:
-            debug_log = json.load(f)
-        return debug_log
+        return self.session.read_debug_log()
     
     def get_all_llm_outputs(self):
-        """获取所有LLM输出记录
+        """获取所有LLM输出记录，记录中的提示词还原为完整的prompt字段
         
         Returns:
             list: LLM输出记录列表
         """
-        llm_outputs = []
-        for filename in os.listdir(self.llm_output_dir):
-            if filename.startswith('llm_output_') and filename.endswith('.json'):
-                file_path = os.path.join(self.llm_output_dir, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    llm_output = json.load(f)
-                    llm_outputs.append(llm_output)
+        llm_outputs = [self.prompt_segments.expand(record) for record in self.session.read_llm_outputs()]
         
         # 按时间戳排序
         llm_outputs.sort(key=lambda x: x.get('timestamp', ''))
-        return llm_outputs
\ No newline at end of file
+        return llm_outputs
@@ -0,0 +1,776 @@
+"""
+会话存储后端：SessionManager把会话数据交给存储后端保存。
+FileSessionStore沿用sessions/<会话ID>/下的JSON文件布局；SQLiteSessionStore把所有会话保存在一个WAL模式的SQLite数据库中，
+列出会话、恢复会话和统计查询都是索引查询，不再遍历目录。两种后端的写入都交给延迟写入队列执行
+"""
+import os
+import sys
+import gzip
+import json
+import sqlite3
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import SESSION_STORE_SETTINGS, PROMPT_STORAGE_SETTINGS
+from utils.session_log import SegmentedLog, RecordJournal, write_json_atomic
+from utils.write_behind import get_write_behind
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULE_NAMES = ('spatial_understanding', 'user_requirements', 'key_questions', 'constraints')
+
+
+class FileSessionStore:
+    """
+    文件存储后端，每个会话一个目录：
+    current_state.json、session_record.json、conversation.json、debug_log.json、<模块>_history.json和llm_outputs/llm_output.json
+    （整理后可能压缩为llm_output.json.gz）
+    """
+    
+    name = "file"
+    
+    def __init__(self, sessions_dir, writer=None):
+        """初始化文件存储
+        
+        Args:
+            sessions_dir (str): sessions根目录
+            writer (WriteBehindWriter, optional): 延迟写入队列，默认使用进程级共享实例
+        """
+        self.sessions_dir = sessions_dir
+        self.writer = writer or get_write_behind()
+    
+    def open_session(self, session_id, session_dir, session_record, current_state):
+        """创建会话的文件结构
+        
+        Args:
+            session_id (str): 会话ID
+            session_dir (str): 会话目录
+            session_record (dict): 初始的会话记录
+            current_state (dict): 初始的最新状态
+        
+        Returns:
+            FileSession: 会话的写入接口
+        """
+        return FileSession(session_dir, session_record, current_state, self.writer)
+    
+    def load_session(self, session_path):
+        """打开已有的会话用于恢复
+        
+        Args:
+            session_path (str): 会话目录路径
+        
+        Returns:
+            StoredSession: 会话的只读视图，会话不存在时返回None
+        """
+        if not os.path.exists(os.path.join(session_path, 'current_state.json')):
+            return None
+        return StoredSession(session_path, self.writer)
+    
+    def list_sessions(self):
+        """列出所有会话，最新的在前
+        
+        Returns:
+            list: 会话ID列表
+        """
+        if not os.path.exists(self.sessions_dir):
+            return []
+        
+        session_dirs = []
+        for item in os.listdir(self.sessions_dir):
+            item_path = os.path.join(self.sessions_dir, item)
+            # 包含session_record.json的目录才是有效的会话
+            if os.path.isdir(item_path) and os.path.exists(os.path.join(item_path, 'session_record.json')):
+                try:
+                    creation_time = os.path.getctime(item_path)
+                except OSError:
+                    creation_time = 0
+                session_dirs.append((item, creation_time))
+        
+        session_dirs.sort(key=lambda x: x[1], reverse=True)
+        return [item for item, _ in session_dirs]
+    
+    def save_segment(self, digest, text):
+        """压缩保存一个提示词片段到sessions/prompt_segments，已存在时跳过
+        
+        Args:
+            digest (str): 片段内容的SHA-256哈希值
+            text (str): 片段内容
+        """
+        path = self._segment_path(digest)
+        
+        def write_segment():
+            if os.path.exists(path):
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.compress(text.encode('utf-8')))
+            os.replace(tmp_path, path)
+        
+        self.writer.submit(path, write_segment)
+    
+    def load_segment(self, digest):
+        """读取一个提示词片段
+        
+        Args:
+            digest (str): 片段内容的SHA-256哈希值
+        
+        Returns:
+            str: 片段内容，不存在时返回None
+        """
+        self.writer.flush()
+        try:
+            with open(self._segment_path(digest), 'rb') as f:
+                return gzip.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+    
+    def _segment_path(self, digest):
+        """提示词片段的文件路径，按前两位分目录避免单目录文件过多"""
+        return os.path.join(self.sessions_dir, 'prompt_segments', digest[:2], f"{digest}.txt.gz")
+
+
+class FileSession:
+    """单个会话在文件布局中的写入和读取"""
+    
+    def __init__(self, session_dir, session_record, current_state, writer):
+        """创建会话所需的所有文件和目录
+        
+        Args:
+            session_dir (str): 会话目录
+            session_record (dict): 初始的会话记录
+            current_state (dict): 初始的最新状态
+            writer (WriteBehindWriter): 延迟写入队列
+        """
+        self.session_dir = session_dir
+        self.writer = writer
+        
+        # 最终状态文件 - 记录最新版本的四个模块数据
+        self.current_state_path = os.path.join(session_dir, 'current_state.json')
+        write_json_atomic(self.current_state_path, current_state)
+        
+        # 四个模块的历史记录文件，新记录逐行追加到同名的.jsonl文件
+        self.history_logs = {
+            module_name: SegmentedLog(os.path.join(session_dir, f'{module_name}_history.json'), writer=writer)
+            for module_name in MODULE_NAMES
+        }
+        
+        # LLM输出记录目录，LLM调用的提示词动态部分和回应只完整保存在这里，整理后的记录按设置压缩保存
+        self.llm_output_dir = os.path.join(session_dir, 'llm_outputs')
+        os.makedirs(self.llm_output_dir, exist_ok=True)
+        self.llm_output_log = SegmentedLog(os.path.join(self.llm_output_dir, 'llm_output.json'), writer=writer,
+                                           compress=PROMPT_STORAGE_SETTINGS["compress_outputs"])
+        
+        # 对话历史文件和调试日志文件
+        self.conversation_log = SegmentedLog(os.path.join(session_dir, 'conversation.json'), writer=writer)
+        self.debug_log = SegmentedLog(os.path.join(session_dir, 'debug_log.json'), writer=writer)
+        
+        for log in self._logs():
+            log.create()
+        
+        # 会话记录：先直接写入初始的完整记录，创建后会话即可被列出，之后只追加变更；
+        # LLM调用记录中的提示词和回应已保存在llm_outputs中，会话记录文件只保存调用的其他信息
+        self.record_journal = RecordJournal(os.path.join(session_dir, 'session_record.json'), writer=writer,
+                                            omit={'api_calls': ('prompt', 'prompt_suffix', 'response')})
+        write_json_atomic(self.record_journal.json_path, session_record)
+    
+    def save_record(self, session_record, changes):
+        """追加会话记录的变更，新的对话和LLM调用同时追加到conversation.json和llm_outputs
+        
+        Args:
+            session_record (dict): 变更后的完整会话记录
+            changes (list): 变更列表，每项为(操作, 字段, 值)
+        """
+        self.record_journal.record(session_record, changes)
+        for op, field, value in changes:
+            if op == 'append' and field == 'conversation_history':
+                self.conversation_log.append(value)
+            elif op == 'append' and field == 'api_calls':
+                self.llm_output_log.append(value)
+    
+    def save_current_state(self, producer):
+        """保存最新状态，同一轮中多个模块的更新合并为一次写入
+        
+        Args:
+            producer (callable): 写入时调用，返回current_state.json的内容
+        """
+        self.writer.write(self.current_state_path, self.current_state_path, producer)
+    
+    def append_history(self, module_name, record):
+        """追加模块的历史记录
+        
+        Args:
+            module_name (str): 模块名称
+            record (dict): 历史记录
+        """
+        self.history_logs[module_name].append(record)
+    
+    def append_debug(self, entry):
+        """追加调试记录
+        
+        Args:
+            entry (dict): 调试记录
+        """
+        self.debug_log.append(entry)
+    
+    def save_final_result(self, final_result):
+        """把最终结果保存到final_result.json
+        
+        Args:
+            final_result (dict): 最终结果
+        """
+        final_result_path = os.path.join(self.session_dir, 'final_result.json')
+        final_result_text = json.dumps(final_result, ensure_ascii=False, indent=2)
+        self.writer.write(final_result_path, final_result_path, lambda: final_result_text)
+    
+    def compact(self, session_record):
+        """把所有追加写入的记录合并回可读的JSON文件，并写入完整的会话记录
+        
+        Args:
+            session_record (dict): 完整的会话记录
+        """
+        for log in self._logs():
+            log.compact()
+        self.record_journal.compact(session_record)
+    
+    def read_debug_log(self):
+        """读取调试日志
+        
+        Returns:
+            list: 调试日志列表
+        """
+        return self.debug_log.read()
+    
+    def read_llm_outputs(self):
+        """读取LLM输出记录，包括早期每次调用单独保存的文件
+        
+        Returns:
+            list: LLM输出记录列表
+        """
+        llm_outputs = self.llm_output_log.read()
+        for filename in os.listdir(self.llm_output_dir):
+            if filename.startswith('llm_output_') and filename.endswith('.json'):
+                with open(os.path.join(self.llm_output_dir, filename), 'r', encoding='utf-8') as f:
+                    llm_outputs.append(json.load(f))
+        return llm_outputs
+    
+    def _logs(self):
+        """所有追加写入的记录文件"""
+        return [self.conversation_log, self.debug_log, self.llm_output_log] + list(self.history_logs.values())
+
+
+class StoredSession:
+    """
+    磁盘上已有会话的只读视图，用于恢复会话
+    
+    创建时只读取current_state.json，模块历史和对话历史在第一次访问时才从文件读取，读取后保存在内存中。
+    """
+    
+    def __init__(self, session_dir, writer=None):
+        """读取会话的最新状态
+        
+        Args:
+            session_dir (str): 会话目录路径
+            writer (WriteBehindWriter, optional): 会话文件的延迟写入队列，默认使用进程级共享实例
+        
+        Raises:
+            FileNotFoundError: 会话目录中没有current_state.json
+        """
+        self.session_dir = session_dir
+        # 会话可能仍在本进程中进行，先写入排队的文件操作
+        (writer or get_write_behind()).flush()
+        with open(os.path.join(session_dir, 'current_state.json'), 'r', encoding='utf-8') as f:
+            self.current_state = json.load(f)
+        self._logs = {}
+    
+    def get_module_current_state(self, module_name):
+        """获取指定模块的最新状态
+        
+        Args:
+            module_name (str): 模块名称
+        
+        Returns:
+            dict: 模块的最新状态
+        """
+        return self.current_state.get(module_name, {})
+    
+    def get_module_history(self, module_name):
+        """获取指定模块的历史记录，首次访问时从文件读取
+        
+        Args:
+            module_name (str): 模块名称
+        
+        Returns:
+            list: 模块的历史记录列表
+        """
+        return list(self._load(f'{module_name}_history.json'))
+    
+    def get_conversation_history(self):
+        """获取对话历史，首次访问时从文件读取
+        
+        Returns:
+            list: 对话历史列表
+        """
+        return list(self._load('conversation.json'))
+    
+    def _load(self, filename):
+        """读取会话目录中的记录文件并缓存，文件不存在时返回空列表"""
+        if filename not in self._logs:
+            self._logs[filename] = SegmentedLog(os.path.join(self.session_dir, filename), compact_every=0).read()
+        return self._logs[filename]
+
+
+class SQLiteSessionStore:
+    """
+    SQLite存储后端，所有会话保存在一个WAL模式的数据库中
+    
+    对话、LLM调用、中间状态、模块历史和调试日志各有一张表，按(会话, 时间)建索引；会话的最新状态和其他字段保存在sessions表中。
+    写入语句先放入队列，由延迟写入线程在一个事务中提交，多个会话的写入不会互相等待文件系统。
+    """
+    
+    name = "sqlite"
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            start_time TEXT,
+            end_time TEXT,
+            current_state TEXT,
+            record TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_start ON sessions(start_time);
+        CREATE TABLE IF NOT EXISTS conversation (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            timestamp TEXT,
+            role TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversation_session ON conversation(session_id, timestamp);
+        CREATE TABLE IF NOT EXISTS api_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            timestamp TEXT,
+            model TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_api_calls_session ON api_calls(session_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_api_calls_time ON api_calls(timestamp, model);
+        CREATE TABLE IF NOT EXISTS intermediate_states (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            timestamp TEXT,
+            name TEXT,
+            update_type TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_intermediate_states_session ON intermediate_states(session_id, timestamp);
+        CREATE TABLE IF NOT EXISTS module_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            module TEXT NOT NULL,
+            timestamp TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_module_history_session ON module_history(session_id, module, timestamp);
+        CREATE TABLE IF NOT EXISTS debug_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            timestamp TEXT,
+            action_type TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_debug_log_session ON debug_log(session_id, timestamp);
+        CREATE TABLE IF NOT EXISTS prompt_segments (
+            digest TEXT PRIMARY KEY,
+            data BLOB NOT NULL
+        );
+    """
+    
+    # 会话记录中单独成表的列表字段
+    TABLE_FIELDS = ('conversation_history', 'api_calls', 'intermediate_states')
+    
+    def __init__(self, db_path, writer=None):
+        """打开（必要时创建）数据库
+        
+        Args:
+            db_path (str): 数据库文件路径
+            writer (WriteBehindWriter, optional): 延迟写入队列，默认使用进程级共享实例
+        """
+        self.db_path = db_path
+        self.writer = writer or get_write_behind()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 写入在延迟写入线程中执行，查询在请求线程中执行，连接由_conn_lock保护
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # 与延迟写入的fsync策略一致：batch时每次提交都同步到磁盘
+        self._conn.execute(f"PRAGMA synchronous={'FULL' if self.writer.settings['fsync'] == 'batch' else 'NORMAL'}")
+        self._conn.executescript(self.SCHEMA)
+        self._conn_lock = threading.Lock()
+        # 排队中的写入语句和各会话待写入的最新状态
+        self._lock = threading.RLock()
+        self._statements = []
+        self._states = {}
+        self._commit_queued = False
+    
+    def open_session(self, session_id, session_dir, session_record, current_state):
+        """在数据库中创建会话，已存在同ID的会话时清空其记录
+        
+        Args:
+            session_id (str): 会话ID
+            session_dir (str): 会话目录，只用于保存可视化图片等文件
+            session_record (dict): 初始的会话记录
+            current_state (dict): 初始的最新状态
+        
+        Returns:
+            SQLiteSession: 会话的写入接口
+        """
+        # 直接写入，创建后会话即可被列出
+        with self._conn_lock, self._conn:
+            for table in ('conversation', 'api_calls', 'intermediate_states', 'module_history', 'debug_log'):
+                self._conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, start_time, end_time, current_state, record) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, session_record.get('start_time'), session_record.get('end_time'),
+                 json.dumps(current_state, ensure_ascii=False), self._dump_record(session_record))
+            )
+        return SQLiteSession(self, session_id)
+    
+    def load_session(self, session_path):
+        """打开已有的会话用于恢复
+        
+        Args:
+            session_path (str): 会话ID或会话目录路径（取目录名作为会话ID）
+        
+        Returns:
+            SQLiteStoredSession: 会话的只读视图，会话不存在时返回None
+        """
+        session_id = os.path.basename(os.path.normpath(session_path))
+        rows = self._query("SELECT current_state FROM sessions WHERE session_id = ?", (session_id,))
+        if not rows:
+            return None
+        return SQLiteStoredSession(self, session_id, json.loads(rows[0][0]))
+    
+    def list_sessions(self):
+        """列出所有会话，最新的在前
+        
+        Returns:
+            list: 会话ID列表
+        """
+        return [row[0] for row in self._query("SELECT session_id FROM sessions ORDER BY start_time DESC")]
+    
+    def get_token_usage(self, since=None):
+        """按模型统计LLM调用次数和token用量
+        
+        Args:
+            since (str, optional): 只统计该时间（ISO格式）之后的调用
+        
+        Returns:
+            dict: 模型 -> {calls, prompt, completion}
+        """
+        rows = self._query(
+            "SELECT model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens) FROM api_calls "
+            "WHERE timestamp >= ? GROUP BY model",
+            (since or '',)
+        )
+        return {model: {'calls': calls, 'prompt': prompt or 0, 'completion': completion or 0}
+                for model, calls, prompt, completion in rows}
+    
+    def iter_api_calls(self, session_id=None):
+        """按时间顺序读取LLM调用记录
+        
+        Args:
+            session_id (str, optional): 只读取该会话的调用，默认读取所有会话
+        
+        Yields:
+            tuple: (会话ID, 调用记录)
+        """
+        if session_id is None:
+            rows = self._query("SELECT session_id, data FROM api_calls ORDER BY timestamp")
+        else:
+            rows = self._query("SELECT session_id, data FROM api_calls WHERE session_id = ? ORDER BY timestamp",
+                               (session_id,))
+        for sid, data in rows:
+            yield sid, json.loads(data)
+    
+    def save_segment(self, digest, text):
+        """压缩保存一个提示词片段，已存在时跳过
+        
+        Args:
+            digest (str): 片段内容的SHA-256哈希值
+            text (str): 片段内容
+        """
+        self.execute("INSERT OR IGNORE INTO prompt_segments (digest, data) VALUES (?, ?)",
+                     (digest, gzip.compress(text.encode('utf-8'))))
+    
+    def load_segment(self, digest):
+        """读取一个提示词片段
+        
+        Args:
+            digest (str): 片段内容的SHA-256哈希值
+        
+        Returns:
+            str: 片段内容，不存在时返回None
+        """
+        rows = self._query("SELECT data FROM prompt_segments WHERE digest = ?", (digest,))
+        return gzip.decompress(rows[0][0]).decode('utf-8') if rows else None
+    
+    def read_records(self, table, session_id, module_name=None):
+        """按时间顺序读取会话在某张表中的记录
+        
+        Args:
+            table (str): 表名，可选值为'conversation', 'api_calls', 'intermediate_states', 'module_history', 'debug_log'
+            session_id (str): 会话ID
+            module_name (str, optional): 读取module_history时的模块名称
+        
+        Returns:
+            list: 记录列表
+        """
+        if table == 'module_history':
+            rows = self._query("SELECT data FROM module_history WHERE session_id = ? AND module = ? ORDER BY id",
+                               (session_id, module_name))
+        else:
+            rows = self._query(f"SELECT data FROM {table} WHERE session_id = ? ORDER BY id", (session_id,))
+        return [json.loads(data) for (data,) in rows]
+    
+    def execute(self, sql, params):
+        """把写入语句放入队列，由延迟写入线程提交
+        
+        Args:
+            sql (str): SQL语句
+            params (tuple): 参数
+        """
+        with self._lock:
+            self._statements.append((sql, params))
+            self._queue_commit()
+    
+    def save_current_state(self, session_id, producer):
+        """保存会话的最新状态，提交前的多次更新只写入最后一次
+        
+        Args:
+            session_id (str): 会话ID
+            producer (callable): 提交时调用，返回最新状态的JSON文本
+        """
+        with self._lock:
+            self._states[session_id] = producer
+            self._queue_commit()
+    
+    def _queue_commit(self):
+        """提交任务尚未排队时放入延迟写入队列"""
+        if not self._commit_queued:
+            self._commit_queued = True
+            self.writer.submit(self.db_path, self._commit)
+    
+    def _commit(self):
+        """在一个事务中执行排队的写入语句，由延迟写入队列调用"""
+        with self._lock:
+            statements, self._statements = self._statements, []
+            states, self._states = self._states, {}
+            self._commit_queued = False
+        # 生成最新状态时需要获取会话锁，不能持有self._lock
+        state_rows = [(producer(), session_id) for session_id, producer in states.items()]
+        with self._conn_lock, self._conn:
+            for sql, params in statements:
+                self._conn.execute(sql, params)
+            self._conn.executemany("UPDATE sessions SET current_state = ? WHERE session_id = ?", state_rows)
+    
+    def _query(self, sql, params=()):
+        """先提交排队的写入再查询"""
+        self.writer.flush()
+        with self._conn_lock:
+            return self._conn.execute(sql, params).fetchall()
+    
+    def _dump_record(self, session_record):
+        """序列化会话记录中单独成表的字段以外的部分"""
+        return json.dumps({k: v for k, v in session_record.items() if k not in self.TABLE_FIELDS}, ensure_ascii=False)
+
+
+class SQLiteSession:
+    """单个会话在SQLite存储中的写入和读取"""
+    
+    def __init__(self, store, session_id):
+        """初始化会话的写入接口
+        
+        Args:
+            store (SQLiteSessionStore): 存储后端
+            session_id (str): 会话ID
+        """
+        self.store = store
+        self.session_id = session_id
+    
+    def save_record(self, session_record, changes):
+        """保存会话记录的变更：列表字段的新记录插入对应的表，其他字段写入sessions表
+        
+        Args:
+            session_record (dict): 变更后的完整会话记录
+            changes (list): 变更列表，每项为(操作, 字段, 值)
+        """
+        for op, field, value in changes:
+            if op != 'append' or field not in self.store.TABLE_FIELDS:
+                continue
+            data = json.dumps(value, ensure_ascii=False)
+            if field == 'conversation_history':
+                self.store.execute(
+                    "INSERT INTO conversation (session_id, timestamp, role, data) VALUES (?, ?, ?, ?)",
+                    (self.session_id, value.get('timestamp'), value.get('role'), data)
+                )
+            elif field == 'api_calls':
+                tokens = value.get('tokens') or {}
+                self.store.execute(
+                    "INSERT INTO api_calls (session_id, timestamp, model, prompt_tokens, completion_tokens, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.session_id, value.get('timestamp'), value.get('model'),
+                     tokens.get('prompt', 0), tokens.get('completion', 0), data)
+                )
+            else:
+                self.store.execute(
+                    "INSERT INTO intermediate_states (session_id, timestamp, name, update_type, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.session_id, value.get('timestamp'), value.get('name'), value.get('update_type'), data)
+                )
+        self.store.execute(
+            "UPDATE sessions SET end_time = ?, record = ? WHERE session_id = ?",
+            (session_record.get('end_time'), self.store._dump_record(session_record), self.session_id)
+        )
+    
+    def save_current_state(self, producer):
+        """保存最新状态
+        
+        Args:
+            producer (callable): 提交时调用，返回最新状态的JSON文本
+        """
+        self.store.save_current_state(self.session_id, producer)
+    
+    def append_history(self, module_name, record):
+        """追加模块的历史记录
+        
+        Args:
+            module_name (str): 模块名称
+            record (dict): 历史记录
+        """
+        self.store.execute(
+            "INSERT INTO module_history (session_id, module, timestamp, data) VALUES (?, ?, ?, ?)",
+            (self.session_id, module_name, record.get('timestamp'), json.dumps(record, ensure_ascii=False))
+        )
+    
+    def append_debug(self, entry):
+        """追加调试记录
+        
+        Args:
+            entry (dict): 调试记录
+        """
+        self.store.execute(
+            "INSERT INTO debug_log (session_id, timestamp, action_type, data) VALUES (?, ?, ?, ?)",
+            (self.session_id, entry.get('timestamp'), entry.get('action_type'), json.dumps(entry, ensure_ascii=False))
+        )
+    
+    def save_final_result(self, final_result):
+        """最终结果已随会话记录写入sessions表，不单独保存"""
+    
+    def compact(self, session_record):
+        """SQLite存储没有需要合并的追加记录"""
+    
+    def read_debug_log(self):
+        """读取调试日志
+        
+        Returns:
+            list: 调试日志列表
+        """
+        return self.store.read_records('debug_log', self.session_id)
+    
+    def read_llm_outputs(self):
+        """读取LLM输出记录
+        
+        Returns:
+            list: LLM输出记录列表
+        """
+        return self.store.read_records('api_calls', self.session_id)
+
+
+class SQLiteStoredSession:
+    """
+    SQLite存储中已有会话的只读视图，用于恢复会话
+    
+    创建时只读取最新状态，模块历史和对话历史在第一次访问时才查询，查询结果保存在内存中。
+    """
+    
+    def __init__(self, store, session_id, current_state):
+        """初始化只读视图
+        
+        Args:
+            store (SQLiteSessionStore): 存储后端
+            session_id (str): 会话ID
+            current_state (dict): 会话的最新状态
+        """
+        self.store = store
+        self.session_id = session_id
+        self.current_state = current_state
+        self._records = {}
+    
+    def get_module_current_state(self, module_name):
+        """获取指定模块的最新状态
+        
+        Args:
+            module_name (str): 模块名称
+        
+        Returns:
+            dict: 模块的最新状态
+        """
+        return self.current_state.get(module_name, {})
+    
+    def get_module_history(self, module_name):
+        """获取指定模块的历史记录，首次访问时查询
+        
+        Args:
+            module_name (str): 模块名称
+        
+        Returns:
+            list: 模块的历史记录列表
+        """
+        key = ('module_history', module_name)
+        if key not in self._records:
+            self._records[key] = self.store.read_records('module_history', self.session_id, module_name)
+        return list(self._records[key])
+    
+    def get_conversation_history(self):
+        """获取对话历史，首次访问时查询
+        
+        Returns:
+            list: 对话历史列表
+        """
+        key = ('conversation', None)
+        if key not in self._records:
+            self._records[key] = self.store.read_records('conversation', self.session_id)
+        return list(self._records[key])
+
+
+# 进程级共享实例
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """获取config.py中SESSION_STORE_SETTINGS指定的进程级共享存储后端
+    
+    Returns:
+        FileSessionStore or SQLiteSessionStore: 共享的存储后端
+    """
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                backend = SESSION_STORE_SETTINGS["backend"]
+                if backend == "sqlite":
+                    db_path = SESSION_STORE_SETTINGS["sqlite_path"]
+                    if not os.path.isabs(db_path):
+                        db_path = os.path.join(PROJECT_ROOT, db_path)
+                    _default_store = SQLiteSessionStore(db_path)
+                elif backend == "file":
+                    _default_store = FileSessionStore(os.path.join(PROJECT_ROOT, 'sessions'))
+                else:
+                    raise ValueError(f"不支持的会话存储后端: {backend}，可选值: file, sqlite")
+    return _default_store
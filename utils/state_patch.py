@@ -0,0 +1,155 @@
+"""
+状态增量更新：统一处理模块只返回需求猜测、空间理解的逐句修改和关键问题的逐项变化，由本地合并到当前状态，
+避免每轮重新生成完整内容
+"""
+import re
+
+# 句子切分：以句末标点或换行结尾，标点和换行保留在句子末尾，拼接后与原文完全一致
+SENTENCE_PATTERN = re.compile(r'[^。！？!?；;\n]*(?:[。！？!?；;]+[”’"\'）)]*\n*|\n+|$)')
+
+KEY_QUESTION_STATUSES = ["已知", "未知"]
+
+
+class StatePatchError(Exception):
+    """修改与当前状态不匹配，无法应用"""
+    pass
+
+
+class StatePatcher:
+    """
+    状态增量更新工具类：为提示词生成带编号的句子列表，并把LLM返回的修改应用到当前状态
+    
+    文本修改的格式：
+        {"op": "replace", "index": 2, "text": "替换后的句子"}
+        {"op": "insert", "after": 0, "text": "插入到开头的句子"}
+        {"op": "delete", "index": 3}
+    编号从1开始，都指向修改前的句子编号，同一句只能被替换或删除一次。
+    
+    关键问题变化的格式：
+        {"category": "生活方式", "status": "已知", "details": "..."}
+    只需列出有变化的类别，status和details可以只给其一。
+    """
+    
+    def split_sentences(self, text):
+        """把文本切分为句子
+        
+        Args:
+            text (str): 文本
+        
+        Returns:
+            list: 句子列表，每句保留末尾的标点和换行
+        """
+        if not text:
+            return []
+        return [sentence for sentence in SENTENCE_PATTERN.findall(text) if sentence]
+    
+    def format_numbered(self, text):
+        """生成带编号的句子列表，供LLM按编号引用
+        
+        Args:
+            text (str): 文本
+        
+        Returns:
+            str: 每行一句，形如"[1] 句子"，空白句子不编号但占用编号
+        """
+        lines = []
+        for index, sentence in enumerate(self.split_sentences(text), 1):
+            if sentence.strip():
+                lines.append(f"[{index}] {sentence.strip()}")
+        return "\n".join(lines)
+    
+    def apply_text_edits(self, text, edits):
+        """把逐句修改应用到文本
+        
+        Args:
+            text (str): 修改前的文本
+            edits (list): 修改列表
+        
+        Returns:
+            str: 修改后的文本
+        
+        Raises:
+            StatePatchError: 修改格式错误、编号越界或同一句被重复修改
+        """
+        if not isinstance(edits, list):
+            raise StatePatchError("edits必须是列表")
+        sentences = self.split_sentences(text)
+        # 编号 -> 替换后的句子
+        replaced = {}
+        # 编号 -> 插入到该句之后的句子列表，0表示开头
+        inserted = {}
+        for edit in edits:
+            if not isinstance(edit, dict):
+                raise StatePatchError(f"无法识别的修改: {edit}")
+            op = edit.get("op")
+            if op in ("replace", "delete"):
+                index = self._check_index(edit.get("index"), 1, len(sentences))
+                if index in replaced:
+                    raise StatePatchError(f"第{index}句被重复修改")
+                # 替换和删除都保留原句末尾的换行，不破坏段落结构
+                new_sentence = self._check_text(edit) if op == "replace" else ""
+                replaced[index] = new_sentence + self._line_break(sentences[index - 1])
+            elif op == "insert":
+                after = self._check_index(edit.get("after"), 0, len(sentences))
+                inserted.setdefault(after, []).append(self._check_text(edit))
+            else:
+                raise StatePatchError(f"不支持的修改类型: {op}")
+        
+        parts = list(inserted.get(0, []))
+        for index, sentence in enumerate(sentences, 1):
+            line_break = self._line_break(sentence)
+            sentence = replaced.get(index, sentence)
+            # 插入的句子接在原句之后、原句的换行之前，保持在同一段落
+            if index in inserted:
+                parts.append(sentence[:len(sentence) - len(line_break)])
+                parts.extend(inserted[index])
+                parts.append(line_break)
+            else:
+                parts.append(sentence)
+        return "".join(parts)
+    
+    def apply_key_question_changes(self, key_questions, changes):
+        """把关键问题的逐项变化应用到关键问题列表
+        
+        Args:
+            key_questions (list): 修改前的关键问题列表
+            changes (list): 有变化的关键问题
+        
+        Returns:
+            list: 修改后的关键问题列表（新列表，不修改原列表）
+        
+        Raises:
+            StatePatchError: 类别不存在或状态取值错误
+        """
+        if not isinstance(changes, list):
+            raise StatePatchError("changes必须是列表")
+        updated = [dict(question) for question in key_questions]
+        by_category = {question.get("category"): question for question in updated}
+        for change in changes:
+            if not isinstance(change, dict) or change.get("category") not in by_category:
+                raise StatePatchError(f"关键问题列表中没有该类别: {change}")
+            question = by_category[change["category"]]
+            if "status" in change:
+                if change["status"] not in KEY_QUESTION_STATUSES:
+                    raise StatePatchError(f"关键问题状态只能是已知或未知: {change['status']}")
+                question["status"] = change["status"]
+            if "details" in change:
+                question["details"] = str(change["details"])
+        return updated
+    
+    def _check_index(self, index, lower, upper):
+        """检查句子编号是否在范围内"""
+        if isinstance(index, bool) or not isinstance(index, int) or not lower <= index <= upper:
+            raise StatePatchError(f"句子编号{index}超出范围{lower}-{upper}")
+        return index
+    
+    def _check_text(self, edit):
+        """检查并返回修改中的句子"""
+        text = edit.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise StatePatchError(f"修改缺少句子内容: {edit}")
+        return text.strip()
+    
+    def _line_break(self, sentence):
+        """返回句子末尾的换行，替换句子时保留原有的段落结构"""
+        return sentence[len(sentence.rstrip("\n")):]
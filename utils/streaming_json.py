@@ -0,0 +1,184 @@
+"""
+增量JSON解析器，随LLM流式输出逐块解析，关注的字段一旦完整即触发事件，无需等待整个响应结束
+"""
+import re
+import json
+
+
+# 字符串内部只需关心引号和转义符
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = ' \t\r\n'
+
+
+class StreamingJSONParser:
+    """
+    流式JSON解析器：逐块喂入文本，按路径匹配关注的字段，字段值完整时回调
+    
+    路径用"."分隔，"*"匹配任意键或数组下标，例如"next_question"、"hard_constraints.room_list.*"。
+    JSON之前的内容（如```json代码块标记）会被跳过，根对象结束后的内容被忽略。
+    """
+    
+    def __init__(self, paths, on_field=None):
+        """初始化解析器
+        
+        Args:
+            paths (list): 关注的字段路径列表
+            on_field (callable, optional): 字段完整时的回调，参数为(路径, 值)，路径中的"*"替换为实际的键或下标
+        """
+        self.patterns = [tuple(path.split('.')) for path in paths]
+        self._depths = {len(pattern) for pattern in self.patterns}
+        self.on_field = on_field
+        # 已完整解析的字段：路径 -> 值
+        self.fields = {}
+        self.done = False
+        self._text = ''
+        self._pos = 0
+        self._started = False
+        # 打开的对象/数组，每项包含类型、起始位置、当前键或下标和期待的下一个记号
+        self._stack = []
+        # 当前字符串的起始位置，不在字符串中时为None
+        self._string_start = None
+        self._string_is_key = False
+        self._escape = False
+        # 当前数字/true/false/null的起始位置
+        self._literal_start = None
+    
+    def feed(self, chunk):
+        """喂入一块文本
+        
+        Args:
+            chunk (str): 流式输出的文本片段
+        
+        Returns:
+            list: 本次完整的关注字段，每项为(路径, 值)
+        """
+        events = []
+        if self.done or not chunk:
+            return events
+        
+        self._text += chunk
+        text = self._text
+        i = self._pos
+        n = len(text)
+        while i < n and not self.done:
+            # 字符串内部：直接跳到下一个引号或转义符
+            if self._string_start is not None:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(text, i)
+                if match is None:
+                    i = n
+                    break
+                i = match.start()
+                if text[i] == '\\':
+                    self._escape = True
+                    i += 1
+                    continue
+                i += 1
+                start = self._string_start
+                self._string_start = None
+                if self._string_is_key:
+                    frame = self._stack[-1]
+                    frame['key'] = json.loads(text[start:i])
+                    frame['expect'] = 'colon'
+                else:
+                    self._complete(start, i, events)
+                continue
+            
+            c = text[i]
+            
+            # 数字和字面量在遇到分隔符时结束，分隔符本身继续按普通字符处理
+            if self._literal_start is not None:
+                if c in ',}]' or c in _WHITESPACE:
+                    start = self._literal_start
+                    self._literal_start = None
+                    self._complete(start, i, events)
+                    continue
+                i += 1
+                continue
+            
+            # 跳过JSON之前的内容
+            if not self._started:
+                if c not in '{[':
+                    i += 1
+                    continue
+                self._started = True
+            
+            if c in _WHITESPACE:
+                i += 1
+                continue
+            
+            frame = self._stack[-1] if self._stack else None
+            if c == '{' or c == '[':
+                self._begin_value(frame)
+                self._stack.append({
+                    'kind': 'object' if c == '{' else 'array',
+                    'start': i,
+                    'key': None,
+                    'index': -1,
+                    'expect': 'key' if c == '{' else 'value'
+                })
+            elif c == '}' or c == ']':
+                if frame is not None:
+                    self._stack.pop()
+                    self._complete(frame['start'], i + 1, events)
+            elif c == '"':
+                self._string_start = i
+                self._string_is_key = frame is not None and frame['kind'] == 'object' and frame['expect'] == 'key'
+                if not self._string_is_key:
+                    self._begin_value(frame)
+            elif c == ':':
+                if frame is not None:
+                    frame['expect'] = 'value'
+            elif c == ',':
+                if frame is not None:
+                    frame['expect'] = 'key' if frame['kind'] == 'object' else 'value'
+            else:
+                self._begin_value(frame)
+                self._literal_start = i
+            i += 1
+        
+        self._pos = i
+        return events
+    
+    def _begin_value(self, frame):
+        """开始一个新的值，数组中的值递增下标"""
+        if frame is not None and frame['kind'] == 'array':
+            frame['index'] += 1
+    
+    def _complete(self, start, end, events):
+        """一个值解析完成，若路径匹配则解析该值并触发事件
+        
+        Args:
+            start (int): 值在文本中的起始位置
+            end (int): 值在文本中的结束位置（不含）
+            events (list): 本次喂入产生的事件列表
+        """
+        if not self._stack:
+            self.done = True
+            return
+        self._stack[-1]['expect'] = 'comma'
+        
+        if len(self._stack) not in self._depths:
+            return
+        path = tuple(frame['key'] if frame['kind'] == 'object' else frame['index'] for frame in self._stack)
+        if not any(self._match(pattern, path) for pattern in self.patterns):
+            return
+        
+        try:
+            value = json.loads(self._text[start:end])
+        except json.JSONDecodeError:
+            return
+        path_str = '.'.join(str(part) for part in path)
+        self.fields[path_str] = value
+        events.append((path_str, value))
+        if self.on_field is not None:
+            self.on_field(path_str, value)
+    
+    def _match(self, pattern, path):
+        """判断路径是否匹配关注的字段"""
+        if len(pattern) != len(path):
+            return False
+        return all(expected == '*' or expected == str(actual) for expected, actual in zip(pattern, path))
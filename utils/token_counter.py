@@ -0,0 +1,162 @@
+"""
+Token计数器，在提供商未返回用量时使用分词器在本地统计token数量
+"""
+import os
+import re
+import sys
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken为可选依赖，缺失时使用启发式估算
+    tiktoken = None
+
+
+# 中日韩字符及全角标点，大多数BPE分词器中每个字符约占一个token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+# 英文单词、数字和其他符号
+_WORD_PATTERN = re.compile(r'[A-Za-z]+|\d+|[^\sA-Za-z\d]')
+
+# 每条聊天消息的格式开销（角色标记等）
+_TOKENS_PER_MESSAGE = 4
+# 回复的起始标记开销
+_TOKENS_PER_REPLY = 3
+
+
+class TokenCounter:
+    """
+    本地token计数器，按模型缓存分词器编码，分词器不可用时回退到对中文友好的估算方法
+    """
+    
+    # 默认编码：未知模型（deepseek、claude、glm等）使用cl100k_base近似
+    DEFAULT_ENCODING = "cl100k_base"
+    
+    def __init__(self):
+        """初始化token计数器"""
+        self._lock = threading.Lock()
+        # 模型名称/编码名称 -> 编码对象（加载失败时为None，避免重复尝试下载）
+        self._encodings = {}
+    
+    def _get_encoding(self, model_name):
+        """获取模型对应的分词器编码，结果按模型缓存
+        
+        Args:
+            model_name (str): 模型名称
+        
+        Returns:
+            tiktoken.Encoding or None: 编码对象，不可用时返回None
+        """
+        if tiktoken is None:
+            return None
+        
+        with self._lock:
+            if model_name in self._encodings:
+                return self._encodings[model_name]
+        
+        try:
+            encoding_name = tiktoken.encoding_name_for_model(model_name)
+        except KeyError:
+            encoding_name = self.DEFAULT_ENCODING
+        
+        with self._lock:
+            loaded = encoding_name in self._encodings
+            encoding = self._encodings.get(encoding_name)
+        if not loaded:
+            try:
+                encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                # 编码文件需要联网下载，离线环境下直接使用估算，且不再重复尝试
+                print(f"加载分词器{encoding_name}失败，使用估算token数: {str(e)[:100]}")
+                encoding = None
+        
+        with self._lock:
+            self._encodings[encoding_name] = encoding
+            self._encodings[model_name] = encoding
+        return encoding
+    
+    def _heuristic_count(self, text):
+        """不依赖分词器的估算：中文字符按1个token计，其余按单词和符号计
+        
+        Args:
+            text (str): 文本
+        
+        Returns:
+            int: 估算的token数量
+        """
+        cjk_count = len(_CJK_PATTERN.findall(text))
+        rest = _CJK_PATTERN.sub(' ', text)
+        count = cjk_count
+        for piece in _WORD_PATTERN.findall(rest):
+            # 长英文单词通常被拆成多个token，按每4个字符一个token估算
+            count += max(1, (len(piece) + 3) // 4)
+        return count
+    
+    def count(self, text, model_name=None):
+        """统计文本的token数量
+        
+        Args:
+            text (str): 文本
+            model_name (str, optional): 模型名称，用于选择分词器
+        
+        Returns:
+            int: token数量
+        """
+        if not text:
+            return 0
+        encoding = self._get_encoding(model_name or "")
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return self._heuristic_count(text)
+    
+    def count_messages(self, messages, model_name=None):
+        """统计聊天消息列表的提示词token数量（包含消息格式开销）
+        
+        Args:
+            messages (list): 消息列表，每项包含role和content
+            model_name (str, optional): 模型名称
+        
+        Returns:
+            int: token数量
+        """
+        total = _TOKENS_PER_REPLY
+        for message in messages:
+            total += _TOKENS_PER_MESSAGE
+            total += self.count(message.get("role", ""), model_name)
+            content = message.get("content", "")
+            # Anthropic等接口的内容可以是文本块列表
+            if isinstance(content, list):
+                content = "".join(block.get("text", "") for block in content)
+            total += self.count(content, model_name)
+        return total
+    
+    def is_exact(self, model_name=None):
+        """判断对指定模型的计数是否来自分词器（而非估算）
+        
+        Args:
+            model_name (str, optional): 模型名称
+        
+        Returns:
+            bool: 是否使用分词器
+        """
+        return self._get_encoding(model_name or "") is not None
+
+
+# 进程级共享实例
+_default_counter = None
+_default_counter_lock = threading.Lock()
+
+
+def get_token_counter():
+    """获取进程级共享的token计数器
+    
+    Returns:
+        TokenCounter: 共享的计数器实例
+    """
+    global _default_counter
+    if _default_counter is None:
+        with _default_counter_lock:
+            if _default_counter is None:
+                _default_counter = TokenCounter()
+    return _default_counter
@@ -1,6 +1,7 @@
 """
 工作流程管理器，负责跟踪系统当前所处的阶段并指导流程转换
 """
+from utils.event_bus import get_event_bus
 
 class WorkflowManager:
     """
@@ -15,15 +16,17 @@ class WorkflowManager:
     STAGE_SOLUTION_GENERATION = "布局方案生成阶段"
     STAGE_SOLUTION_REFINEMENT = "布局方案优化阶段"
     
-    def __init__(self, session_manager=None):
+    def __init__(self, session_manager=None, event_channel=None):
         """初始化工作流程管理器
         
         Args:
             session_manager: 会话记录管理器，用于记录状态变化
+            event_channel (str, optional): 事件频道（会话ID），阶段变化时向该频道发布stage事件
         """
         # 初始阶段是需求收集
         self.current_stage = self.STAGE_REQUIREMENT_GATHERING
         self.session_manager = session_manager
+        self.event_channel = event_channel
         
         # 记录已解决的关键问题数量，用于判断是否可以进入下一阶段
         self.resolved_key_questions = 0
@@ -70,8 +73,19 @@ class WorkflowManager:
                  "iteration": self.current_iteration}
             )
         
+        self.publish_stage()
+        
         return self.current_stage
     
+    def publish_stage(self):
+        """向事件频道发布当前阶段，未设置频道时不发布"""
+        if self.event_channel is not None:
+            get_event_bus().publish(self.event_channel, "stage", {
+                "current_stage": self.current_stage,
+                "stage_description": self.get_stage_description(),
+                "iteration": self.current_iteration
+            })
+    
     def set_key_questions_status(self, resolved, total):
         """设置关键问题的解决状态
         
@@ -79,8 +93,13 @@ class WorkflowManager:
             resolved (int): 已解决的关键问题数量
             total (int): 总关键问题数量
         """
+        changed = (resolved, total) != (self.resolved_key_questions, self.total_key_questions)
         self.resolved_key_questions = resolved
         self.total_key_questions = total
+        
+        # 阶段描述中包含已解决数量，变化时通知前端
+        if changed:
+            self.publish_stage()
     
     def can_advance_to_constraint_generation(self):
         """判断是否可以进入约束条件生成阶段
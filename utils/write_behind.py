@@ -0,0 +1,194 @@
+"""
+会话文件的延迟写入：请求线程只把写操作放入队列，由后台线程在短时间窗口内合并后写入磁盘，
+磁盘延迟不再计入交互请求的响应时间
+"""
+import os
+import sys
+import time
+import atexit
+import threading
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import WRITE_BEHIND_SETTINGS
+
+FSYNC_POLICIES = ("never", "batch")
+
+
+class WriteBehindWriter:
+    """
+    延迟写入队列，在进程内所有会话间共享，通过get_write_behind()获取共享实例
+    
+    写操作按键（通常是一组相关文件中的主文件路径）分组，同一键的操作按提交顺序执行：
+    连续的追加合并为一次写入，连续的整文件写入只执行最后一次，其他任务（如日志整理）按顺序执行。
+    整文件写入先写临时文件再替换，崩溃时不会留下不完整的JSON。
+    """
+    
+    def __init__(self, settings=None):
+        """初始化写入队列
+        
+        Args:
+            settings (dict, optional): 写入设置，默认使用config.py中的WRITE_BEHIND_SETTINGS
+        """
+        self.settings = dict(WRITE_BEHIND_SETTINGS)
+        if settings:
+            self.settings.update(settings)
+        if self.settings["fsync"] not in FSYNC_POLICIES:
+            raise ValueError(f"不支持的fsync策略: {self.settings['fsync']}，可选值: {', '.join(FSYNC_POLICIES)}")
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # 键 -> 操作列表，按首次提交的顺序排列
+        self._pending = {}
+        self._thread = None
+        self.stats = {"operations": 0, "flushes": 0, "writes": 0, "coalesced": 0, "errors": 0}
+    
+    def append(self, key, path, text):
+        """追加文本到文件末尾
+        
+        Args:
+            key (str): 操作分组的键
+            path (str): 文件路径
+            text (str): 追加的文本
+        """
+        self._submit(key, ("append", path, text))
+    
+    def write(self, key, path, producer):
+        """整体替换文件内容，同一文件连续的多次替换只执行最后一次
+        
+        Args:
+            key (str): 操作分组的键
+            path (str): 文件路径
+            producer (callable): 写入时调用，返回文件内容的文本
+        """
+        self._submit(key, ("write", path, producer))
+    
+    def submit(self, key, task):
+        """提交一个任务，在同一键之前的写操作完成后执行
+        
+        Args:
+            key (str): 操作分组的键
+            task (callable): 任务，不接受参数
+        """
+        self._submit(key, ("task", None, task))
+    
+    def flush(self):
+        """立即写入所有排队的操作，返回时之前提交的操作都已写入磁盘；供读取文件前、测试和进程退出时调用"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            for ops in pending.values():
+                try:
+                    self._apply(ops)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print(f"写入会话文件时出错: {str(e)}")
+            self.stats["flushes"] += 1
+    
+    def write_text_atomic(self, path, text):
+        """先写临时文件再替换，按fsync策略同步到磁盘
+        
+        Args:
+            path (str): 文件路径
+            text (str): 文件内容
+        """
+        self.write_bytes_atomic(path, text.encode('utf-8'))
+    
+    def write_bytes_atomic(self, path, data):
+        """先写临时文件再替换二进制内容，按fsync策略同步到磁盘
+        
+        Args:
+            path (str): 文件路径
+            data (bytes): 文件内容
+        """
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            self._sync(f)
+        os.replace(tmp_path, path)
+    
+    def get_stats(self):
+        """获取写入统计
+        
+        Returns:
+            dict: 提交的操作数、批次数、实际写入次数、被合并的操作数、出错次数和排队中的操作数
+        """
+        with self._lock:
+            return dict(self.stats, pending=sum(len(ops) for ops in self._pending.values()))
+    
+    def _submit(self, key, op):
+        """把操作放入队列，未启用延迟写入时立即执行"""
+        if not self.settings["enabled"]:
+            with self._flush_lock:
+                self._apply([op])
+            return
+        with self._lock:
+            self._pending.setdefault(key, []).append(op)
+            self.stats["operations"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+    
+    def _run(self):
+        """后台写入线程：收到操作后再等待一个时间窗口，把窗口内的操作合并写入"""
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.settings["flush_interval"])
+            self._wakeup.clear()
+            self.flush()
+    
+    def _apply(self, ops):
+        """执行同一键下的操作，合并连续的追加和整文件写入"""
+        index = 0
+        while index < len(ops):
+            kind, path, payload = ops[index]
+            if kind == "append":
+                texts = [payload]
+                while index + 1 < len(ops) and ops[index + 1][0] == "append" and ops[index + 1][1] == path:
+                    index += 1
+                    texts.append(ops[index][2])
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(texts))
+                    self._sync(f)
+                self.stats["writes"] += 1
+                self.stats["coalesced"] += len(texts) - 1
+            elif kind == "write":
+                skipped = 0
+                while index + 1 < len(ops) and ops[index + 1][0] == "write" and ops[index + 1][1] == path:
+                    index += 1
+                    skipped += 1
+                self.write_text_atomic(path, ops[index][2]())
+                self.stats["writes"] += 1
+                self.stats["coalesced"] += skipped
+            else:
+                payload()
+            index += 1
+    
+    def _sync(self, f):
+        """按fsync策略把文件同步到磁盘"""
+        if self.settings["fsync"] == "batch":
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# 进程级共享实例
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+
+def get_write_behind():
+    """获取进程级共享的延迟写入队列，进程退出时自动写入排队的操作
+    
+    Returns:
+        WriteBehindWriter: 共享的写入队列
+    """
+    global _default_writer
+    if _default_writer is None:
+        with _default_writer_lock:
+            if _default_writer is None:
+                _default_writer = WriteBehindWriter()
+                atexit.register(_default_writer.flush)
+    return _default_writer